@@ -0,0 +1,230 @@
+# ai_answer_cache.py - Shared cache of LLM answers
+#
+# Org-level questions ("how many employees joined this week?") are asked again
+# and again, by many users. Answers are cached in one of two kinds of slot:
+#   - org questions: (role, scope, timezone). The prompt for them is built from
+#     org_view(): no asker name or id and none of the asker's own sections
+#     (current_user_profile, my_*), so one answer serves everyone with that role;
+#   - questions about the asker ("my", "I", ...), and every question from an L1
+#     employee (their context is their own data): (asker, role, scope,
+#     timezone), with the full context, never shared between users.
+# The key is (normalised question, slot, context version). The version is a
+# hash of the context the answer was built from, and each slot remembers the
+# version of its latest build, so a repeat is looked up *before*
+# build_ai_context: a hit skips the context build as well as the provider call.
+# A miss builds the context, records its version and checks again (another
+# worker may have answered it already). Changed data gives a new version and
+# new keys rather than a stale answer; a slot that only ever hits keeps its
+# version until the TTL runs out.
+#
+# Not cached: follow-ups that lean on the conversation ("what about last
+# week?", "and them?") and automation flows (those return before the model is
+# involved).
+#
+# Entries live in SQLite (WAL) so all gunicorn workers share them; each has a
+# TTL and the table is trimmed to AI_ANSWER_CACHE_MAX by least-recent use.
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+
+from sqlite_store import SQLiteStore, singleton
+
+AI_ANSWER_CACHE_ENABLED = os.getenv("AI_ANSWER_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+AI_ANSWER_CACHE_TTL = int(os.getenv("AI_ANSWER_CACHE_TTL", "600"))
+AI_ANSWER_CACHE_MAX = int(os.getenv("AI_ANSWER_CACHE_MAX", "500"))
+AI_ANSWER_CACHE_DB = os.getenv(
+    "AI_ANSWER_CACHE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "ai_answer_cache.db"),
+)
+
+_PERSONAL = re.compile(r"\b(i|i'm|im|i've|me|my|mine|myself)\b")
+_FOLLOW_UP = re.compile(
+    r"^(and|also|what about|how about|same|then)\b|\b(it|that|those|these|them|they|he|she|his|her|their)\b"
+)
+# user_meta fields an org answer may depend on (see ai_gemini.build_system_prompt)
+_ROLE_FIELDS = ("is_admin", "is_manager", "is_l3", "is_l2", "role", "access_level", "timezone",
+                "timezone_offset_minutes")
+# Context sections that are about the asker rather than the organisation
+_OWN_SECTIONS = ("current_user_profile",)
+
+
+def normalize_question(question: str) -> str:
+    q = (question or "").lower().strip()
+    q = re.sub(r"[^\w\s']", " ", q)
+    return re.sub(r"\s+", " ", q).strip()
+
+
+def _role(user_meta: dict) -> str:
+    meta = user_meta or {}
+    if meta.get("is_admin") or meta.get("is_l3"):
+        return "L3"
+    if meta.get("is_l2") or meta.get("is_manager"):
+        return "L2"
+    return str(meta.get("access_level") or meta.get("role") or "L1").upper()
+
+
+def question_kind(question: str, user_meta: dict = None):
+    """"org", "personal" (about the asker's own data) or None when the answer must not be cached."""
+    q = normalize_question(question)
+    if not q or _FOLLOW_UP.search(q):
+        return None
+    if _PERSONAL.search(q) or _role(user_meta) == "L1":
+        return "personal"
+    return "org"
+
+
+def is_cacheable(question: str) -> bool:
+    return question_kind(question) is not None
+
+
+def cache_slot(question: str, user_meta: dict, scope: str = None):
+    """Who may share this question's answers, or None when it is not cached."""
+    kind = question_kind(question, user_meta)
+    if kind is None:
+        return None
+    meta = user_meta or {}
+    parts = [kind, _role(meta), scope or "", str(meta.get("timezone") or "")]
+    if kind == "personal":
+        parts.append(str(meta.get("employee_id") or "").strip().upper())
+    return "\x1f".join(parts)
+
+
+def org_view(user_meta: dict, data_context: dict):
+    """user_meta and data_context for an org question's prompt: role only, no asker or own sections."""
+    meta = {k: (user_meta or {})[k] for k in _ROLE_FIELDS if k in (user_meta or {})}
+    meta.update(name="Team member", employee_id="not shown")
+    context = {k: v for k, v in (data_context or {}).items()
+               if not (k in _OWN_SECTIONS or k.startswith("my_"))}
+    return meta, context
+
+
+def context_version(data_context: dict) -> str:
+    """Hash of the data an answer is built from (the build time and the question's passages left out)."""
+    data = {k: v for k, v in (data_context or {}).items() if k not in ("timestamp", "policy_passages")}
+    raw = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def cache_key(question: str, slot: str, version: str):
+    """Cache key for the question in `slot` against context `version`, or None."""
+    if not slot or not version:
+        return None
+    raw = "\x1f".join([normalize_question(question), slot, version])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache(SQLiteStore):
+    def __init__(self, db_path=AI_ANSWER_CACHE_DB, ttl=AI_ANSWER_CACHE_TTL, max_entries=AI_ANSWER_CACHE_MAX):
+        super().__init__(db_path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                cache_key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS context_versions (
+                slot TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    # ---------- context versions ----------
+    def version(self, slot):
+        """Version of the slot's latest context build (within the TTL), or None."""
+        if not slot:
+            return None
+        try:
+            row = self._conn().execute(
+                "SELECT version FROM context_versions WHERE slot = ? AND updated_at >= ?",
+                (slot, time.time() - self.ttl),
+            ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"[AI_CACHE] Version lookup failed: {e}")
+            return None
+
+    def set_version(self, slot, version):
+        if not slot or not version:
+            return
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO context_versions (slot, version, updated_at) VALUES (?, ?, ?)",
+                (slot, version, time.time()),
+            )
+        except sqlite3.Error as e:
+            print(f"[AI_CACHE] Version store failed: {e}")
+
+    # ---------- answers ----------
+
+    def get(self, key):
+        if not key:
+            return None
+        now = time.time()
+        try:
+            row = self._conn().execute(
+                "SELECT answer FROM answers WHERE cache_key = ? AND created_at >= ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn().execute("UPDATE answers SET last_used = ? WHERE cache_key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+        except sqlite3.Error as e:
+            print(f"[AI_CACHE] Lookup failed: {e}")
+            return None
+
+    def put(self, key, answer):
+        if not key or not answer:
+            return
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (cache_key, answer, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, answer, now, now),
+            )
+            conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            conn.execute("DELETE FROM context_versions WHERE updated_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM answers WHERE cache_key IN ("
+                " SELECT cache_key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        except sqlite3.Error as e:
+            print(f"[AI_CACHE] Store failed: {e}")
+
+    def clear(self):
+        self._conn().execute("DELETE FROM answers")
+        self._conn().execute("DELETE FROM context_versions")
+
+    def stats(self):
+        try:
+            entries = self._conn().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {"entries": entries, "hits": self.hits, "misses": self.misses,
+                "ttl": self.ttl, "max_entries": self.max_entries}
+
+
+_answer_cache = singleton(AnswerCache)
+
+
+def get_answer_cache():
+    """Process-wide cache, or None when AI_ANSWER_CACHE_ENABLED is off."""
+    if not AI_ANSWER_CACHE_ENABLED:
+        return None
+    return _answer_cache()
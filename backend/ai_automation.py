@@ -4381,8 +4381,8 @@ def execute_automation_action(action: Dict[str, Any], token: str) -> Dict[str, A
     if action["type"] == "apply_leave":
         try:
             from unified_server import (
-                generate_leave_id, calculate_leave_days, format_employee_id,
-                create_record, LEAVE_ENTITY, BASE_URL, get_access_token,
+                generate_leave_id, calculate_leave_days, format_employee_id, business_calendar,
+                _leave_index_write, _ledger_consume, create_record, LEAVE_ENTITY, BASE_URL, get_access_token,
                 _fetch_leave_balance, _ensure_leave_balance_row,
                 _get_available_days, _decrement_leave_balance,
                 get_employee_name, send_email
@@ -4422,6 +4422,11 @@ def execute_automation_action(action: Dict[str, Any], token: str) -> Dict[str, A
             # Generate leave ID and calculate days
             leave_id = generate_leave_id()
             leave_days = calculate_leave_days(start_date, end_date)
+            if leave_days <= 0:
+                return {
+                    "success": False,
+                    "error": "The selected dates fall on weekends or holidays, so there are no working days to apply for."
+                }
             
             # Get leave balance
             balance_row = None
@@ -4447,11 +4452,13 @@ def execute_automation_action(action: Dict[str, Any], token: str) -> Dict[str, A
                 
                 start_dt = datetime.strptime(start_date, "%Y-%m-%d")
                 end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+                # Paid part covers the first paid_days working days; unpaid resumes on the next one
+                paid_end_day, unpaid_start_day = business_calendar.split_range(start_dt, int(paid_days))
                 
                 # Create paid leave record
                 if paid_days > 0:
                     paid_leave_id = leave_id
-                    paid_end_dt = start_dt + timedelta(days=int(paid_days) - 1)
+                    paid_end_dt = datetime.combine(paid_end_day, datetime.min.time())
                     record_data_paid = {
                         "crc6f_leaveid": paid_leave_id,
                         "crc6f_leavetype": leave_type,
@@ -4465,6 +4472,8 @@ def execute_automation_action(action: Dict[str, Any], token: str) -> Dict[str, A
                     }
                     print(f"📦 Creating Paid leave record: {record_data_paid}")
                     created_paid = create_record(LEAVE_ENTITY, record_data_paid)
+                    _leave_index_write(record_data_paid)
+                    _ledger_consume(record_data_paid)
                     created_records.append(created_paid)
                     primary_leave_id = paid_leave_id
                     
@@ -4478,7 +4487,7 @@ def execute_automation_action(action: Dict[str, Any], token: str) -> Dict[str, A
                 # Create unpaid leave record if needed
                 if unpaid_days > 0:
                     unpaid_leave_id = generate_leave_id()
-                    unpaid_start_dt = start_dt + timedelta(days=int(paid_days))
+                    unpaid_start_dt = datetime.combine(unpaid_start_day, datetime.min.time()) if paid_days > 0 else start_dt
                     record_data_unpaid = {
                         "crc6f_leaveid": unpaid_leave_id,
                         "crc6f_leavetype": leave_type,
@@ -4492,6 +4501,7 @@ def execute_automation_action(action: Dict[str, Any], token: str) -> Dict[str, A
                     }
                     print(f"📦 Creating Unpaid leave record: {record_data_unpaid}")
                     created_unpaid = create_record(LEAVE_ENTITY, record_data_unpaid)
+                    _leave_index_write(record_data_unpaid)
                     created_records.append(created_unpaid)
                     if primary_leave_id is None:
                         primary_leave_id = unpaid_leave_id
@@ -4577,6 +4587,8 @@ Please review in HR Tool.
             
             print(f"📦 Creating leave record: {record_data}")
             created_record = create_record(LEAVE_ENTITY, record_data)
+            _leave_index_write(record_data)
+            _ledger_consume(record_data)
             
             # Decrement balance if paid
             try:
@@ -0,0 +1,249 @@
+# ai_context_compactor.py - Token-budgeted prompt context for the AI assistant
+#
+# build_ai_context() returns nested summaries, some of which embed raw Dataverse
+# rows (holidays, projects, assets) full of nulls, @odata annotations and system
+# columns. Dumping that with json.dumps(indent=2) made admin prompts very large.
+#
+# compact_context() instead:
+#   - ranks sections by relevance to the question's scope and wording,
+#   - serialises compactly (no indentation; lists of records become a header
+#     row plus pipe-separated rows; nulls, annotations and system columns dropped),
+#   - fits sections into a token budget, trimming the rows of a section that
+#     does not fit whole before giving up on it,
+#   - returns size statistics for the response metadata.
+
+import json
+import math
+import os
+import re
+from datetime import date, datetime
+
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Sections that are always useful (who is asking, what they may see, and the
+# document passages already retrieved for this question)
+CORE_SECTIONS = {"current_user_profile", "user_access", "policy_passages"}
+
+# scope -> sections that answer it (mirrors build_ai_context's scope routing)
+SCOPE_SECTIONS = {
+    "attendance": {"attendance_summary", "checked_in_summary_today", "my_attendance",
+                   "login_activity_summary", "my_login_activity"},
+    "leave": {"leave_summary", "my_leaves", "my_leave_balance", "holidays"},
+    "holidays": {"holidays"},
+    "employee": {"employees_summary", "my_profile", "new_joiners_summary"},
+    "assets": {"assets_summary", "my_assets"},
+    "projects": {"projects_summary", "tasks_summary", "my_tasks_summary"},
+    "tasks": {"tasks_summary", "my_tasks_summary"},
+    "timesheets": {"timesheet_summary", "my_timesheets"},
+    "interns": {"interns_summary"},
+    "login": {"login_activity_summary", "my_login_activity"},
+}
+
+# Words in a question that point at a section even when the scope is broad
+SECTION_KEYWORDS = {
+    "holidays": ("holiday", "festival", "off day"),
+    "my_leave_balance": ("balance", "quota", "remaining", "available leave"),
+    "new_joiners_summary": ("joiner", "joined", "onboard", "new hire"),
+    "checked_in_summary_today": ("checked in", "check in", "checked out", "present", "today"),
+    "assets_summary": ("asset", "laptop", "device", "equipment"),
+    "projects_summary": ("project", "client"),
+    "tasks_summary": ("task",),
+    "my_tasks_summary": ("task",),
+    "timesheet_summary": ("timesheet", "logged", "hours"),
+    "my_timesheets": ("timesheet", "logged", "hours"),
+    "interns_summary": ("intern", "trainee"),
+    "login_activity_summary": ("login", "logged in", "sign in"),
+    "my_login_activity": ("login", "logged in", "sign in"),
+}
+
+_SYSTEM_FIELDS = {
+    "versionnumber", "timezoneruleversionnumber", "utcconversiontimezonecode",
+    "importsequencenumber", "overriddencreatedon", "statecode", "statuscode", "modifiedon",
+}
+_ROW_LIMIT_NOTE = "... ({} more rows)"
+_GUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: ~4 characters per token, never fewer than the word count."""
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), len(text.split()))
+
+
+def _keep_field(key: str, value) -> bool:
+    if value is None or value == "" or value == [] or value == {}:
+        return False
+    k = str(key)
+    if k.startswith("@") or "@odata." in k or "@OData." in k:
+        return False
+    if k.startswith("_") and k.endswith("_value"):
+        return False
+    if isinstance(value, str) and _GUID_RE.match(value):
+        return False  # record GUIDs mean nothing to the model
+    return k.lower() not in _SYSTEM_FIELDS
+
+
+def _short_key(key: str) -> str:
+    return re.sub(r"^crc6f_", "", str(key))
+
+
+def _scalar(value) -> str:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, float):
+        return f"{value:g}"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), default=str)
+    return str(value).replace("\n", " ").replace("|", "/")
+
+
+def _clean(value):
+    if isinstance(value, dict):
+        return {_short_key(k): _clean(v) for k, v in value.items() if _keep_field(k, v)}
+    if isinstance(value, list):
+        return [_clean(v) for v in value]
+    return value
+
+
+def _table(rows, max_rows=None):
+    """List of dicts -> 'a|b|c' header plus one line per row; empty columns dropped."""
+    columns = []
+    for row in rows:
+        for k in row:
+            if k not in columns:
+                columns.append(k)
+    shown = rows if max_rows is None else rows[:max_rows]
+    lines = ["|".join(columns)]
+    for row in shown:
+        lines.append("|".join("" if row.get(c) is None else _scalar(row.get(c)) for c in columns))
+    if len(shown) < len(rows):
+        lines.append(_ROW_LIMIT_NOTE.format(len(rows) - len(shown)))
+    return lines
+
+
+def _is_record_list(value) -> bool:
+    return isinstance(value, list) and value and all(isinstance(v, dict) for v in value)
+
+
+def _render(value, indent="", max_rows=None):
+    """Compact, line-oriented rendering of a cleaned section value."""
+    if _is_record_list(value):
+        return [indent + line for line in _table(value, max_rows)]
+    if isinstance(value, list):
+        return [indent + ", ".join(_scalar(v) for v in value)]
+    if not isinstance(value, dict):
+        return [indent + _scalar(value)]
+
+    lines, scalars = [], []
+    for k, v in value.items():
+        if isinstance(v, dict) and v and all(not isinstance(x, (dict, list)) for x in v.values()):
+            scalars.append(f"{k}={{" + ", ".join(f"{ik}:{_scalar(iv)}" for ik, iv in v.items()) + "}")
+        elif isinstance(v, (dict, list)):
+            lines.append(f"{indent}{k}:")
+            lines.extend(_render(v, indent + " ", max_rows))
+        else:
+            scalars.append(f"{k}={_scalar(v)}")
+    if scalars:
+        lines.insert(0, indent + "; ".join(scalars))
+    return lines
+
+
+def serialize_section(key: str, value, max_rows=None) -> str:
+    if not isinstance(value, (dict, list)):
+        return f"{key.upper()}: {_scalar(value)}"
+    body = "\n".join(_render(_clean(value), max_rows=max_rows))
+    return f"{key.upper()}:\n{body}"
+
+
+def detect_scope(question: str) -> str:
+    q = (question or "").lower()
+    for scope, words in (
+        ("attendance", ("attendance", "check-in", "checkin", "checked in", "checked out", "hours")),
+        ("leave", ("leave", "vacation", "sick", "pto", "time off")),
+        ("holidays", ("holiday",)),
+        ("employee", ("employee", "staff", "team", "people", "department")),
+        ("assets", ("asset", "laptop", "equipment", "device")),
+        ("projects", ("project", "client")),
+        ("interns", ("intern", "trainee")),
+    ):
+        if any(w in q for w in words):
+            return scope
+    return "general"
+
+
+def rank_sections(data_context: dict, question: str, scope: str = None):
+    """Section keys ordered most relevant first."""
+    q = (question or "").lower()
+    scope = scope or detect_scope(question)
+    wanted = SCOPE_SECTIONS.get(scope, set())
+
+    def score(item):
+        index, key = item
+        s = 0
+        if key in CORE_SECTIONS:
+            s += 100
+        if key in wanted:
+            s += 50
+        if any(w in q for w in SECTION_KEYWORDS.get(key, ())):
+            s += 30
+        if key.startswith("my_"):
+            s += 5  # the asker's own data before org-wide data
+        return (-s, index)  # stable: original order breaks ties
+
+    items = [(i, k) for i, k in enumerate(data_context) if k != "timestamp" and data_context[k]]
+    return [k for _, k in sorted(items, key=score)]
+
+
+def compact_context(data_context: dict, question: str = "", scope: str = None, budget: int = None) -> dict:
+    """
+    Returns {"text": <prompt context>, "stats": {...}}. stats reports estimated
+    tokens before/after and which sections were included, trimmed or dropped.
+    """
+    budget = AI_CONTEXT_TOKEN_BUDGET if budget is None else budget
+    data_context = data_context or {}
+    original_tokens = estimate_tokens(json.dumps(data_context, indent=2, default=str))
+
+    header = "=== AVAILABLE DATA ==="
+    if data_context.get("timestamp"):
+        header += f"\nAS_OF: {data_context['timestamp']}"
+    parts = [header]
+    used = estimate_tokens(header)
+    included, trimmed, dropped = [], [], []
+
+    for key in rank_sections(data_context, question, scope):
+        value = data_context[key]
+        text = serialize_section(key, value)
+        cost = estimate_tokens(text)
+        if used + cost <= budget:
+            parts.append(text)
+            used += cost
+            included.append(key)
+            continue
+
+        # Shrink the row tables of this section until it fits
+        fitted = None
+        for max_rows in (10, 5, 3, 1):
+            candidate = serialize_section(key, value, max_rows=max_rows)
+            if used + estimate_tokens(candidate) <= budget:
+                fitted = candidate
+                break
+        if fitted and fitted != text:
+            parts.append(fitted)
+            used += estimate_tokens(fitted)
+            trimmed.append(key)
+        else:
+            dropped.append(key)
+
+    text = "\n\n".join(parts) if len(parts) > 1 else "No specific data available."
+    return {
+        "text": text,
+        "stats": {
+            "context_tokens": estimate_tokens(text),
+            "uncompacted_tokens": original_tokens,
+            "budget": budget,
+            "sections_included": included,
+            "sections_trimmed": trimmed,
+            "sections_dropped": dropped,
+        },
+    }
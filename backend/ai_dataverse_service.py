@@ -1,9 +1,8 @@
 # ai_dataverse_service.py - Dataverse data layer for AI assistant
 import os
-import requests
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Any
-from dataverse_helper import get_access_token
+from dataverse_helper import get_access_token, get_dataverse_session
 
 # Load from environment
 RESOURCE = os.getenv("RESOURCE", "").rstrip("/")
@@ -84,7 +83,7 @@ def _fetch_entity(entity: str, token: str, select: str = "", filter_query: str =
         if params:
             url += "?" + "&".join(params)
         
-        resp = requests.get(url, headers=_get_headers(token), timeout=30)
+        resp = get_dataverse_session().get(url, headers=_get_headers(token), timeout=30)
         if resp.status_code == 200:
             return resp.json().get("value", [])
         print(f"[AI Service] Dataverse non-200 for {entity}: {resp.status_code} | {resp.text[:240]}")
@@ -422,6 +421,40 @@ def get_today_checked_in_summary(token: str) -> dict:
     }
 
 
+def get_on_leave_summary(token: str, on_date: Optional[str] = None) -> dict:
+    """Employees with an approved leave covering on_date (default today)."""
+    on_date = on_date or datetime.now().strftime("%Y-%m-%d")
+    records = _fetch_entity(
+        ENTITIES["leave"], token,
+        select="crc6f_employeeid,crc6f_leavetype,crc6f_startdate,crc6f_enddate",
+        filter_query=f"crc6f_startdate le '{on_date}' and crc6f_enddate ge '{on_date}' and crc6f_status eq 'Approved'",
+        top=500,
+    )
+    ids = sorted({_normalize_emp_id(r.get("crc6f_employeeid")) for r in records if r.get("crc6f_employeeid")})
+    names = {}
+    for i in range(0, len(ids), 50):
+        chunk = ids[i:i + 50]
+        id_filter = " or ".join(f"crc6f_employeeid eq '{e}'" for e in chunk)
+        for row in _fetch_entity(ENTITIES["employees"], token,
+                                 select="crc6f_employeeid,crc6f_firstname,crc6f_lastname",
+                                 filter_query=f"({id_filter})", top=len(chunk)):
+            emp_id = _normalize_emp_id(row.get("crc6f_employeeid"))
+            names[emp_id] = f"{row.get('crc6f_firstname', '')} {row.get('crc6f_lastname', '')}".strip() or emp_id
+
+    on_leave = []
+    for r in records:
+        emp_id = _normalize_emp_id(r.get("crc6f_employeeid"))
+        on_leave.append({
+            "employee_id": emp_id,
+            "name": names.get(emp_id) or emp_id,
+            "type": r.get("crc6f_leavetype"),
+            "start": r.get("crc6f_startdate"),
+            "end": r.get("crc6f_enddate"),
+        })
+    on_leave.sort(key=lambda x: x.get("employee_id") or "")
+    return {"date": on_date, "total_on_leave": len(on_leave), "employees": on_leave}
+
+
 def get_leave_balance_summary(token: str, emp_id: Optional[str]) -> dict:
     """Get deterministic leave balance for an employee (CL/SL/CO)."""
     entity = ENTITIES.get("leave_balance")
@@ -444,6 +477,7 @@ def get_leave_balance_summary(token: str, emp_id: Optional[str]) -> dict:
 
     return {
         "employee_id": normalized_emp_id,
+        "found": bool(records),
         "available": {
             "CL": round(cl, 2),
             "SL": round(sl, 2),
@@ -643,7 +677,7 @@ def get_login_activity_summary(token: str, emp_id: Optional[str] = None, days: i
     }
 
 
-def build_ai_context(token: str, user_meta: dict, scope: str = "general") -> dict:
+def build_ai_context(token: str, user_meta: dict, scope: str = "general", progress=None) -> dict:
     """
     Build comprehensive context for AI based on user role and scope.
     
@@ -651,6 +685,7 @@ def build_ai_context(token: str, user_meta: dict, scope: str = "general") -> dic
         token: Dataverse access token
         user_meta: User info (employee_id, is_admin, is_l3, etc.)
         scope: Query scope ('general', 'attendance', 'leave', 'employee', etc.)
+        progress: Optional callback, called with each section name once it has loaded
     
     Returns:
         Dict with relevant data summaries
@@ -665,71 +700,76 @@ def build_ai_context(token: str, user_meta: dict, scope: str = "general") -> dic
     is_admin = role_flags.get("is_admin")
     is_l3 = role_flags.get("is_l3")
     is_l2 = role_flags.get("is_l2")
+
+    def _put(key, value):
+        context[key] = value
+        if progress:
+            progress(key)
     
     try:
         # Always include basic employee info for the current user
         if emp_id:
-            context["current_user_profile"] = get_employee_overview(token, emp_id)
-            context["my_leave_balance"] = get_leave_balance_summary(token, emp_id)
+            _put("current_user_profile", get_employee_overview(token, emp_id))
+            _put("my_leave_balance", get_leave_balance_summary(token, emp_id))
         
         # Scope-based data fetching with L3 permissions
         if scope in ["general", "employee", "all"]:
             if is_admin or is_l3:  # L3/Admin access
-                context["employees_summary"] = get_all_employees_summary(token)
+                _put("employees_summary", get_all_employees_summary(token))
             elif emp_id:
-                context["my_profile"] = get_employee_overview(token, emp_id)
+                _put("my_profile", get_employee_overview(token, emp_id))
         
         if scope in ["general", "attendance", "all"]:
             if is_admin or is_l3:
-                context["attendance_summary"] = get_attendance_summary(token, days=30)
-                context["checked_in_summary_today"] = get_today_checked_in_summary(token)
+                _put("attendance_summary", get_attendance_summary(token, days=30))
+                _put("checked_in_summary_today", get_today_checked_in_summary(token))
             elif emp_id:
-                context["my_attendance"] = get_attendance_summary(token, emp_id=emp_id, days=30)
+                _put("my_attendance", get_attendance_summary(token, emp_id=emp_id, days=30))
         
         if scope in ["general", "leave", "all"]:
             if is_admin or is_l3:
-                context["leave_summary"] = get_leave_summary(token)
+                _put("leave_summary", get_leave_summary(token))
             elif emp_id:
-                context["my_leaves"] = get_leave_summary(token, emp_id=emp_id)
+                _put("my_leaves", get_leave_summary(token, emp_id=emp_id))
         
         if scope in ["general", "assets", "all"]:
             if is_admin or is_l3:
-                context["assets_summary"] = get_assets_summary(token)
+                _put("assets_summary", get_assets_summary(token))
             elif emp_id:
-                context["my_assets"] = context.get("my_assets") or {"total_assets": 0}
+                _put("my_assets", context.get("my_assets") or {"total_assets": 0})
         
         if scope in ["general", "holidays", "all"]:
-            context["holidays"] = get_holidays_list(token)
+            _put("holidays", get_holidays_list(token))
         
         if scope in ["general", "projects", "all"]:
             if is_admin or is_l3:
-                context["projects_summary"] = get_projects_summary(token)
+                _put("projects_summary", get_projects_summary(token))
         
         if scope in ["general", "interns", "all"]:
             if is_admin or is_l3:
-                context["interns_summary"] = get_interns_summary(token)
+                _put("interns_summary", get_interns_summary(token))
 
         if scope in ["general", "employee", "all"]:
             if is_admin or is_l3:
-                context["new_joiners_summary"] = get_new_joiners_summary(token, days=7)
+                _put("new_joiners_summary", get_new_joiners_summary(token, days=7))
         
         if scope in ["general", "tasks", "projects", "all"]:
             if is_admin or is_l3:
-                context["tasks_summary"] = get_tasks_summary(token)
+                _put("tasks_summary", get_tasks_summary(token))
             elif emp_id:
-                context["my_tasks_summary"] = get_tasks_summary(token, emp_id=emp_id)
+                _put("my_tasks_summary", get_tasks_summary(token, emp_id=emp_id))
         
         if scope in ["general", "timesheets", "time", "all"]:
             if is_admin or is_l3 or is_l2:
-                context["timesheet_summary"] = get_timesheet_summary(token)
+                _put("timesheet_summary", get_timesheet_summary(token))
             elif emp_id:
-                context["my_timesheets"] = get_timesheet_summary(token, emp_id=emp_id)
+                _put("my_timesheets", get_timesheet_summary(token, emp_id=emp_id))
         
         if scope in ["general", "login", "attendance", "all"]:
             if is_admin or is_l3:
-                context["login_activity_summary"] = get_login_activity_summary(token)
+                _put("login_activity_summary", get_login_activity_summary(token))
             elif emp_id:
-                context["my_login_activity"] = get_login_activity_summary(token, emp_id=emp_id)
+                _put("my_login_activity", get_login_activity_summary(token, emp_id=emp_id))
         
     except Exception as e:
         print(f"[AI Service] Error building context: {e}")
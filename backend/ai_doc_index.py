@@ -0,0 +1,323 @@
+# ai_doc_index.py - Local BM25 retrieval over the HR documents shipped with the backend
+#
+# The AI assistant only saw Dataverse summaries, so policy questions ("what is
+# the notice period for interns?", "how many casual leaves for Type 2?") were
+# answered from nothing. This module indexes the documents that already live in
+# backend/ (internship policy, offer letter templates, leave allocation types):
+#   - each document is reduced to plain text and cut into overlapping word chunks,
+#   - an inverted index (term -> postings of chunk id + term frequency) is kept
+#     as flat NumPy arrays and saved to storage/ai_doc_index.npz,
+#   - a question is scored with BM25 by gathering the postings of its terms and
+#     accumulating into a per-chunk score vector, so only the top-k passages go
+#     into the prompt.
+#
+# The index is rebuilt when any source file's size or mtime changes (checked at
+# most every AI_DOC_INDEX_CHECK_SECONDS).
+#
+# Rebuild by hand:  python ai_doc_index.py --rebuild
+# Try a query:      python ai_doc_index.py "notice period for interns"
+
+import html
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    from PyPDF2 import PdfReader
+except ImportError:  # PDF sources are skipped without PyPDF2
+    PdfReader = None
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+AI_DOC_INDEX_FILE = os.getenv(
+    "AI_DOC_INDEX_FILE", os.path.join(BACKEND_DIR, "storage", "ai_doc_index.npz")
+)
+AI_DOC_INDEX_CHECK_SECONDS = int(os.getenv("AI_DOC_INDEX_CHECK_SECONDS", "60"))
+AI_DOC_TOP_K = int(os.getenv("AI_DOC_TOP_K", "3"))
+# Passages scoring below this are noise for the question and are left out
+AI_DOC_MIN_SCORE = float(os.getenv("AI_DOC_MIN_SCORE", "3.0"))
+# ...and so are passages far behind the best match
+AI_DOC_RELATIVE_SCORE = 0.4
+
+# (path relative to backend/, title shown to the model)
+DOC_SOURCES = [
+    ("policy_template.html", "Internship policy"),
+    ("policy_static.pdf", "Internship policy (PDF)"),
+    ("offer_letter_template.html", "Offer letter"),
+    ("offer_letter_new_template.html", "Offer letter (new)"),
+    ("data/leave_allocation_types.json", "Leave allocation types"),
+]
+
+CHUNK_WORDS = 90
+CHUNK_OVERLAP = 30
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have if in into is it its of on or that the their then
+there these this to was were will with you your we our they them he she his her i me my do does
+""".split())
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_BOILERPLATE_RE = re.compile(
+    r"www\s?\.sirocotech\.com|sales@\S+|US:\s*\(\d+\)\s*[\d-]+|IND:\s*\(\d+\)\s*[\d-]+|NOW\s*P\s?ART\s*OF",
+    re.I,
+)
+
+
+def tokenize(text: str):
+    """Lowercase word tokens without stopwords; a trailing plural 's' is folded."""
+    tokens = []
+    for tok in _TOKEN_RE.findall((text or "").lower()):
+        if tok in _STOPWORDS:
+            continue
+        if len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+# ===== Text extraction =====
+
+def _html_text(raw: str) -> str:
+    raw = re.sub(r"<(style|script)\b.*?</\1>", " ", raw, flags=re.S | re.I)
+    raw = re.sub(r"<br\s*/?>|</(p|div|li|h\d|tr)>", "\n", raw, flags=re.I)
+    raw = re.sub(r"<[^>]+>", " ", raw)
+    raw = re.sub(r"\{\{\s*(\w+)\s*\}\}", lambda m: "[" + m.group(1).replace("_", " ") + "]", raw)
+    return html.unescape(raw)
+
+
+def _pdf_text(path: str) -> str:
+    if PdfReader is None:
+        return ""
+    reader = PdfReader(path)
+    return "\n".join((page.extract_text() or "") for page in reader.pages)
+
+
+def _json_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rows = data if isinstance(data, list) else [data]
+    lines = []
+    for row in rows:
+        if isinstance(row, dict):
+            lines.append("; ".join(
+                f"{re.sub(r'(?<!^)(?=[A-Z])', ' ', str(k)).lower()}: {v}" for k, v in row.items()
+            ) + ".")
+        else:
+            lines.append(str(row))
+    return "\n".join(lines)
+
+
+def extract_text(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        text = _pdf_text(path)
+    elif ext == ".json":
+        text = _json_text(path)
+    else:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+        if ext in (".html", ".htm"):
+            text = _html_text(text)
+    text = _BOILERPLATE_RE.sub(" ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def chunk_text(text: str, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, size - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + size]))
+        if start + size >= len(words):
+            break
+    return chunks
+
+
+# ===== Index =====
+
+class DocIndex:
+    """BM25 over chunk postings stored as flat arrays (CSR layout by term)."""
+
+    def __init__(self, vocab, term_offsets, post_chunks, post_tf, chunk_len, chunks, signature):
+        self.vocab = vocab                  # term -> term id
+        self.term_offsets = term_offsets    # int64[n_terms + 1]
+        self.post_chunks = post_chunks      # int32[n_postings], grouped by term
+        self.post_tf = post_tf              # float32[n_postings]
+        self.chunk_len = chunk_len          # float32[n_chunks]
+        self.chunks = chunks                # [{"source", "title", "text"}]
+        self.signature = signature
+        n = len(chunk_len)
+        df = np.diff(term_offsets).astype(np.float64)
+        self.idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5)) if n else np.zeros(0)
+        self.avg_len = float(chunk_len.mean()) if n else 0.0
+
+    @classmethod
+    def build(cls, sources=None, base_dir=None):
+        sources = DOC_SOURCES if sources is None else sources
+        base_dir = base_dir or BACKEND_DIR
+        chunks, chunk_tokens = [], []
+        for rel_path, title in sources:
+            path = os.path.join(base_dir, rel_path)
+            if not os.path.exists(path):
+                continue
+            try:
+                text = extract_text(path)
+            except Exception as e:
+                print(f"[AI_DOCS] Could not read {rel_path}: {e}")
+                continue
+            for piece in chunk_text(text):
+                tokens = tokenize(piece)
+                if tokens:
+                    chunks.append({"source": rel_path, "title": title, "text": piece})
+                    chunk_tokens.append(tokens)
+
+        vocab, postings = {}, []
+        for chunk_id, tokens in enumerate(chunk_tokens):
+            counts = {}
+            for tok in tokens:
+                counts[tok] = counts.get(tok, 0) + 1
+            for tok, tf in counts.items():
+                postings.append((vocab.setdefault(tok, len(vocab)), chunk_id, tf))
+
+        if postings:
+            arr = np.array(postings, dtype=np.int64)
+            arr = arr[np.lexsort((arr[:, 1], arr[:, 0]))]
+            term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(arr[:, 0], minlength=len(vocab)), out=term_offsets[1:])
+            post_chunks = arr[:, 1].astype(np.int32)
+            post_tf = arr[:, 2].astype(np.float32)
+        else:
+            term_offsets = np.zeros(1, dtype=np.int64)
+            post_chunks = np.zeros(0, dtype=np.int32)
+            post_tf = np.zeros(0, dtype=np.float32)
+        chunk_len = np.array([len(t) for t in chunk_tokens], dtype=np.float32)
+        return cls(vocab, term_offsets, post_chunks, post_tf, chunk_len, chunks,
+                   source_signature(sources, base_dir))
+
+    def search(self, question: str, k=None, min_score=None):
+        """Top-k passages as [{"source", "title", "text", "score"}], near-duplicates removed."""
+        k = AI_DOC_TOP_K if k is None else k
+        min_score = AI_DOC_MIN_SCORE if min_score is None else min_score
+        term_ids = sorted({self.vocab[t] for t in tokenize(question) if t in self.vocab})
+        if not term_ids or not len(self.chunk_len):
+            return []
+        scores = np.zeros(len(self.chunk_len), dtype=np.float64)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.chunk_len / (self.avg_len or 1.0))
+        for tid in term_ids:
+            lo, hi = self.term_offsets[tid], self.term_offsets[tid + 1]
+            ids = self.post_chunks[lo:hi]
+            tf = self.post_tf[lo:hi]
+            scores[ids] += self.idf[tid] * tf * (BM25_K1 + 1) / (tf + norm[ids])
+
+        hits, seen = [], []
+        floor = max(min_score, AI_DOC_RELATIVE_SCORE * float(scores.max()))
+        for idx in np.argsort(-scores, kind="stable"):
+            score = float(scores[idx])
+            if score < floor or len(hits) >= k:
+                break
+            tokens = set(tokenize(self.chunks[idx]["text"]))
+            # The PDF is a filled-in copy of the HTML policy; keep one of each passage
+            if any(len(tokens & s) / max(1, min(len(tokens), len(s))) >= 0.7 for s in seen):
+                continue
+            seen.append(tokens)
+            hits.append(dict(self.chunks[idx], score=round(score, 3)))
+        return hits
+
+    # ---------- persistence ----------
+    def save(self, path=None):
+        path = path or AI_DOC_INDEX_FILE
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = json.dumps({"vocab": self.vocab, "chunks": self.chunks, "signature": self.signature})
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(
+                f, term_offsets=self.term_offsets, post_chunks=self.post_chunks, post_tf=self.post_tf,
+                chunk_len=self.chunk_len, meta=np.frombuffer(meta.encode("utf-8"), dtype=np.uint8),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or AI_DOC_INDEX_FILE
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            return cls(meta["vocab"], data["term_offsets"], data["post_chunks"], data["post_tf"],
+                       data["chunk_len"], meta["chunks"], meta["signature"])
+
+
+def source_signature(sources=None, base_dir=None):
+    """{path: [size, mtime]} of the indexed documents; a change triggers a rebuild."""
+    base_dir = base_dir or BACKEND_DIR
+    sig = {}
+    for rel_path, _ in (DOC_SOURCES if sources is None else sources):
+        try:
+            st = os.stat(os.path.join(base_dir, rel_path))
+            sig[rel_path] = [st.st_size, int(st.st_mtime)]
+        except OSError:
+            continue
+    return sig
+
+
+_index = None
+_last_check = 0.0
+_index_lock = threading.Lock()
+
+
+def get_doc_index():
+    """Process-wide index: loaded from disk when current, rebuilt when sources changed."""
+    global _index, _last_check
+    now = time.time()
+    if _index is not None and now - _last_check < AI_DOC_INDEX_CHECK_SECONDS:
+        return _index
+    with _index_lock:
+        if _index is not None and now - _last_check < AI_DOC_INDEX_CHECK_SECONDS:
+            return _index
+        signature = source_signature()
+        if _index is None or _index.signature != signature:
+            index = None
+            if os.path.exists(AI_DOC_INDEX_FILE):
+                try:
+                    index = DocIndex.load()
+                except Exception as e:
+                    print(f"[AI_DOCS] Ignoring unreadable index file: {e}")
+                if index is not None and index.signature != signature:
+                    index = None
+            if index is None:
+                started = time.time()
+                index = DocIndex.build()
+                try:
+                    index.save()
+                except OSError as e:
+                    print(f"[AI_DOCS] Could not save index: {e}")
+                print(f"[AI_DOCS] Indexed {len(index.chunks)} passages from {len(signature)} documents "
+                      f"in {time.time() - started:.2f}s")
+            _index = index
+        _last_check = now
+        return _index
+
+
+def retrieve_passages(question: str, k=None):
+    """Passages for the prompt as [{"title", "text"}]; [] when nothing relevant or on error."""
+    try:
+        hits = get_doc_index().search(question, k=k)
+    except Exception as e:
+        print(f"[AI_DOCS] Retrieval failed: {e}")
+        return []
+    return [{"title": h["title"], "text": h["text"]} for h in hits]
+
+
+if __name__ == "__main__":
+    if "--rebuild" in sys.argv:
+        idx = DocIndex.build()
+        idx.save()
+        print(f"Indexed {len(idx.chunks)} passages, {len(idx.vocab)} terms -> {AI_DOC_INDEX_FILE}")
+    else:
+        for hit in get_doc_index().search(" ".join(sys.argv[1:]) or "notice period"):
+            print(f"{hit['score']:6.2f}  [{hit['title']}] {hit['text'][:160]}")
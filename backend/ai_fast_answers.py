@@ -0,0 +1,219 @@
+# ai_fast_answers.py - Template answers for common HR lookups, ahead of the LLM
+#
+# "What's my leave balance", "holidays this month", "who is on leave today" and
+# "my attendance this week" are lookups, not reasoning. /api/ai/query asks this
+# module first: keyword intents, matched with ai_automation's keyword rules,
+# pick the question class, a single ai_dataverse_service summary is fetched
+# (not the whole scope context), and the answer is rendered from a template.
+# Anything that looks like it needs explanation or comparison scores low
+# confidence and goes to the model.
+
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Optional
+
+from ai_automation import _keyword_matches_message
+from ai_dataverse_service import (
+    get_attendance_summary,
+    get_holidays_list,
+    get_leave_balance_summary,
+    get_on_leave_summary,
+)
+
+FAST_ANSWER_MIN_CONFIDENCE = float(os.getenv("FAST_ANSWER_MIN_CONFIDENCE", "0.8"))
+FAST_ANSWER_MAX_WORDS = 14
+
+# Same shape and matching rules as ai_automation.AUTOMATION_INTENTS. A keyword
+# given as a tuple matches when all of its parts do; an anchor makes the match
+# unambiguous (otherwise it is only a partial match).
+FAST_INTENTS = {
+    "leave_balance": {
+        "keywords": [
+            ("leave", "balance"), ("leaves", "balance"), ("leaves", "left"), ("leave", "left"),
+            ("leaves", "remaining"), ("leave", "remaining"), ("leaves", "available"), ("available", "leave"),
+            "how many leaves", "how many leave", "leave quota",
+        ],
+        "anchors": ["my", "i", "me"],
+        "description": "Leave balance of the current user",
+    },
+    "on_leave_today": {
+        "keywords": [("who", "on leave"), ("anyone", "on leave"), ("which", "on leave"), "on leave today"],
+        "anchors": ["today", "now", "currently"],
+        "description": "Employees on approved leave today",
+    },
+    "attendance_week": {
+        "keywords": [
+            ("attendance", "this week"), ("attendance", "current week"), ("hours", "this week"),
+            ("hours", "current week"), ("worked", "this week"), ("check-ins", "this week"), ("check ins", "this week"),
+        ],
+        "anchors": ["my", "i", "me"],
+        "description": "Attendance of the current user this week",
+    },
+    "holidays": {
+        "keywords": ["holiday", "holidays"],
+        "anchors": [
+            "this month", "next month", "coming month", "this year", "next year", "coming year",
+            "upcoming", "list", "show", "all", "next holiday", "remaining", "when is the next",
+        ],
+        "description": "Company holidays",
+    },
+}
+
+# Wording that asks for reasoning rather than a lookup
+NEEDS_MODEL_KEYWORDS = [
+    "why", "explain", "compare", "comparison", "trend", "policy", "policies", "should", "suggest",
+    "recommend", "analyse", "analyze", "predict", "forecast", "how do i", "how to", "can i", "apply",
+    "cancel", "encash", "carry forward",
+]
+
+
+def _matches(message_lower: str, keyword) -> bool:
+    if isinstance(keyword, tuple):
+        return all(_keyword_matches_message(message_lower, part) for part in keyword)
+    return _keyword_matches_message(message_lower, keyword)
+
+
+def match_fast_intent(question: str):
+    """Return (intent, confidence) for the best matching fast-path class, or (None, 0.0)."""
+    q = re.sub(r"\s+", " ", (question or "").lower()).strip()
+    if not q:
+        return None, 0.0
+    for intent, config in FAST_INTENTS.items():
+        if not any(_matches(q, keyword) for keyword in config["keywords"]):
+            continue
+        confidence = 1.0 if any(_matches(q, anchor) for anchor in config["anchors"]) else 0.6
+        if any(_matches(q, keyword) for keyword in NEEDS_MODEL_KEYWORDS):
+            confidence -= 0.5
+        if len(q.split()) > FAST_ANSWER_MAX_WORDS:
+            confidence -= 0.3
+        return intent, round(max(confidence, 0.0), 2)
+    return None, 0.0
+
+
+def _is_org_viewer(meta: dict) -> bool:
+    return bool(meta.get("is_admin") or meta.get("is_l3"))
+
+
+def _fmt_days(value) -> str:
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def format_leave_balance(balance: dict) -> str:
+    """The leave-balance answer, for the fast path and unified_server's deterministic answers."""
+    return (
+        "Here is your leave balance:\n\n"
+        f"* Casual Leave (CL): {_fmt_days(balance.get('CL', 0))}\n"
+        f"* Sick Leave (SL): {_fmt_days(balance.get('SL', 0))}\n"
+        f"* Comp Off (CO): {_fmt_days(balance.get('CO', 0))}\n"
+        f"* Total: {_fmt_days(balance.get('Total', 0))}"
+    )
+
+
+def _answer_leave_balance(token, meta, question):
+    if not meta.get("employee_id"):
+        return None
+    summary = get_leave_balance_summary(token, meta.get("employee_id"))
+    if not summary.get("found"):
+        return None
+    return format_leave_balance(summary.get("available") or {})
+
+
+def _answer_on_leave_today(token, meta, question):
+    if not _is_org_viewer(meta):
+        return "⚠️ You do not have access to organization-wide leave visibility."
+    summary = get_on_leave_summary(token)
+    people = summary.get("employees") or []
+    if not people:
+        return f"No one is on approved leave today ({summary.get('date')})."
+    lines = "\n".join(
+        f"* {p.get('name')} ({p.get('employee_id')}) - {p.get('type') or 'Leave'}, {p.get('start')} to {p.get('end')}"
+        for p in people[:50]
+    )
+    return f"Employees on leave today ({len(people)}) - {summary.get('date')}:\n\n{lines}"
+
+
+def _answer_attendance_week(token, meta, question):
+    if not meta.get("employee_id"):
+        return None
+    today = datetime.now()
+    monday = today - timedelta(days=today.weekday())
+    summary = get_attendance_summary(token, emp_id=meta.get("employee_id"), days=today.weekday())
+    entries = [e for e in summary.get("recent_entries") or [] if str(e.get("date") or "") >= monday.strftime("%Y-%m-%d")]
+    if not entries:
+        return f"No attendance records found for you this week (since {monday.strftime('%Y-%m-%d')})."
+    lines = "\n".join(
+        f"* {e.get('date')}: In {e.get('check_in') or '-'} | Out {e.get('check_out') or '-'} | Duration {e.get('duration') or '-'}"
+        for e in sorted(entries, key=lambda e: str(e.get("date") or ""))
+    )
+    return (
+        f"Your attendance this week (since {monday.strftime('%Y-%m-%d')}):\n\n"
+        f"{lines}\n\n"
+        f"* Days recorded: {summary.get('total_attendance_records', len(entries))}\n"
+        f"* Total hours: {summary.get('total_hours_logged', 0)}"
+    )
+
+
+def _answer_holidays(token, meta, question):
+    q = (question or "").lower()
+    rows = (get_holidays_list(token) or {}).get("holidays") or []
+    holidays = []
+    for r in rows:
+        day = str(r.get("crc6f_date") or "")[:10]
+        if day:
+            holidays.append((day, r.get("crc6f_holidayname") or "Holiday"))
+    if not holidays:
+        return None
+    holidays.sort()
+
+    today = datetime.now()
+    today_str = today.strftime("%Y-%m-%d")
+    if re.search(r"\bnext\s+month\b", q):
+        first = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+        label = f"in {first.strftime('%B %Y')}"
+        picked = [h for h in holidays if h[0][:7] == first.strftime("%Y-%m")]
+    elif re.search(r"\b(this|current)\s+month\b", q):
+        label = f"in {today.strftime('%B %Y')}"
+        picked = [h for h in holidays if h[0][:7] == today.strftime("%Y-%m")]
+    elif re.search(r"\bnext\s+holiday\b|\bwhen\s+is\s+the\s+next\b", q):
+        label = "coming up next"
+        picked = [h for h in holidays if h[0] >= today_str][:1]
+    elif re.search(r"\b(this|current)\s+year\b|\ball\b|\blist\b", q):
+        label = f"in {today.year}"
+        picked = [h for h in holidays if h[0][:4] == str(today.year)]
+    else:
+        label = "coming up"
+        picked = [h for h in holidays if h[0] >= today_str][:5]
+
+    if not picked:
+        return f"There are no company holidays {label}."
+    lines = "\n".join(
+        f"* {datetime.strptime(day, '%Y-%m-%d').strftime('%a, %d %b %Y')} - {name}" for day, name in picked
+    )
+    return f"Company holidays {label}:\n\n{lines}"
+
+
+_ANSWERERS = {
+    "leave_balance": _answer_leave_balance,
+    "on_leave_today": _answer_on_leave_today,
+    "attendance_week": _answer_attendance_week,
+    "holidays": _answer_holidays,
+}
+
+
+def answer_fast(question: str, token: str, user_meta: dict) -> Optional[dict]:
+    """
+    Answer without the LLM when the question is a confident match for a known
+    lookup. Returns {"intent", "confidence", "answer"} or None to fall back.
+    """
+    intent, confidence = match_fast_intent(question)
+    if not intent or confidence < FAST_ANSWER_MIN_CONFIDENCE:
+        return None
+    try:
+        answer = _ANSWERERS[intent](token, user_meta or {}, question)
+    except Exception as e:
+        print(f"[AI_FAST] {intent} lookup failed, falling back to model: {e}")
+        return None
+    if not answer:
+        return None
+    return {"intent": intent, "confidence": confidence, "answer": answer}
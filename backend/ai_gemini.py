@@ -3,17 +3,22 @@ import os
 import json
 import requests
 import re
-import time
 from typing import Optional
 from dotenv import load_dotenv
 
+from ai_context_compactor import compact_context, estimate_tokens
+from ai_http import TRANSIENT_STATUSES, provider_session
+
 load_dotenv("id.env")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     print("[AI_GEMINI] WARNING: GEMINI_API_KEY environment variable not set!")
 GEMINI_MODEL = "models/gemini-2.0-flash"
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1/{GEMINI_MODEL}:generateContent"
+# Base URL is overridable so the provider layer can be exercised against fake_llm_servers.py
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1").rstrip("/")
+GEMINI_API_URL = f"{GEMINI_API_BASE}/{GEMINI_MODEL}:generateContent"
+GEMINI_STREAM_URL = f"{GEMINI_API_BASE}/{GEMINI_MODEL}:streamGenerateContent"
 
 print(f"[AI_GEMINI] Loaded with model: {GEMINI_MODEL}, API Key present: {bool(GEMINI_API_KEY)}")
 
@@ -95,11 +100,82 @@ Guidelines:
 Remember: You only have access to the data provided in the context. Don't make up information."""
 
 
+class AIStreamError(Exception):
+    """Model call failed before or while streaming; message is safe to show users."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable   # transient (rate limit / 5xx): the router may try again
+
+
+def _clean_error(status_code: int) -> str:
+    if status_code == 429:
+        return "Gemini API rate limit reached (RESOURCE_EXHAUSTED)."
+    if 500 <= status_code < 600:
+        return f"Gemini service temporary server error ({status_code})."
+    return f"Gemini API request failed ({status_code})."
+
+
+def _build_gemini_payload(question: str, data_context: dict, user_meta: dict, history: Optional[list], scope: Optional[str] = None):
+    """Request body shared by ask_gemini and stream_gemini, plus prompt size stats."""
+    system_prompt = build_system_prompt(user_meta)
+    
+    # Build context from data (ranked + compacted to the token budget)
+    compacted = compact_context(data_context, question, scope)
+    context_str = compacted["text"]
+    
+    # Build conversation history
+    messages = []
+    if history:
+        for msg in history[-6:]:  # Keep last 6 messages for context
+            role = "user" if msg.get("role") == "user" else "model"
+            messages.append({
+                "role": role,
+                "parts": [{"text": msg.get("text", "")}]
+            })
+    
+    # Add current question with context
+    full_prompt = f"""{system_prompt}
+
+{context_str}
+
+User Question: {question}
+
+Please provide a helpful, accurate response based on the available data."""
+    
+    messages.append({
+        "role": "user",
+        "parts": [{"text": full_prompt}]
+    })
+    
+    payload = {
+        "contents": messages,
+        "generationConfig": {
+            "temperature": 0.7,
+            "topK": 40,
+            "topP": 0.95,
+            "maxOutputTokens": 1024,
+        },
+        "safetySettings": [
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        ]
+    }
+    prompt_stats = dict(compacted["stats"])
+    prompt_stats["prompt_tokens"] = sum(
+        estimate_tokens(part.get("text", "")) for msg in messages for part in msg["parts"]
+    )
+    return payload, prompt_stats
+
+
 def ask_gemini(
     question: str,
     data_context: dict,
     user_meta: dict,
-    history: Optional[list] = None
+    history: Optional[list] = None,
+    scope: Optional[str] = None
 ) -> dict:
     """
     Send a question to Gemini with context and get a response.
@@ -109,111 +185,39 @@ def ask_gemini(
         data_context: Dict containing relevant HR data
         user_meta: User information (name, role, permissions)
         history: Previous conversation turns
+        scope: Detected question scope, used to rank context sections
     
     Returns:
-        Dict with 'answer', 'success', and optional 'error'
+        Dict with 'answer', 'success', 'prompt_stats' and optional 'error'
     """
+    prompt_stats = None
     try:
-        system_prompt = build_system_prompt(user_meta)
-        
-        # Build context from data
-        context_parts = []
-        if data_context:
-            context_parts.append("=== AVAILABLE DATA ===")
-            for key, value in data_context.items():
-                if value:
-                    if isinstance(value, (dict, list)):
-                        context_parts.append(f"\n{key.upper()}:\n{json.dumps(value, indent=2, default=str)}")
-                    else:
-                        context_parts.append(f"\n{key.upper()}: {value}")
-        
-        context_str = "\n".join(context_parts) if context_parts else "No specific data available."
-        
-        # Build conversation history
-        messages = []
-        if history:
-            for msg in history[-6:]:  # Keep last 6 messages for context
-                role = "user" if msg.get("role") == "user" else "model"
-                messages.append({
-                    "role": role,
-                    "parts": [{"text": msg.get("text", "")}]
-                })
-        
-        # Add current question with context
-        full_prompt = f"""{system_prompt}
-
-{context_str}
-
-User Question: {question}
-
-Please provide a helpful, accurate response based on the available data."""
-        
-        messages.append({
-            "role": "user",
-            "parts": [{"text": full_prompt}]
-        })
-        
-        # Call Gemini API
+        payload, prompt_stats = _build_gemini_payload(question, data_context, user_meta, history, scope)
         headers = {
             "Content-Type": "application/json"
         }
         
-        payload = {
-            "contents": messages,
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 1024,
-            },
-            "safetySettings": [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ]
-        }
-        
         api_url = f"{GEMINI_API_URL}?key={GEMINI_API_KEY}"
         print(f"[AI_GEMINI] Calling API: {GEMINI_API_URL}")
         
-        response = None
-        retry_delays = [0.6, 1.2]
-        max_attempts = 1 + len(retry_delays)
-        for attempt in range(max_attempts):
-            response = requests.post(
-                api_url,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            if response.status_code == 200:
-                break
-
-            # Retry only for transient rate-limit/server errors
-            if response.status_code in (429, 500, 502, 503, 504) and attempt < max_attempts - 1:
-                delay = retry_delays[attempt]
-                print(f"[AI_GEMINI] Retry {attempt + 1}/{max_attempts - 1} after status {response.status_code} in {delay}s")
-                time.sleep(delay)
-                continue
-
-            break
+        # One attempt: retries and failover are left to ai_provider_router
+        response = provider_session("gemini").post(
+            api_url,
+            headers=headers,
+            json=payload,
+            timeout=30
+        )
         
         print(f"[AI_GEMINI] Response status: {response.status_code}")
         
         if response.status_code != 200:
             error_text = response.text[:500]
             print(f"[AI_GEMINI] Error response: {error_text}")
-            if response.status_code == 429:
-                clean_error = "Gemini API rate limit reached (RESOURCE_EXHAUSTED)."
-            elif 500 <= response.status_code < 600:
-                clean_error = f"Gemini service temporary server error ({response.status_code})."
-            else:
-                clean_error = f"Gemini API request failed ({response.status_code})."
             return {
                 "success": False,
                 "answer": None,
-                "error": clean_error
+                "error": _clean_error(response.status_code),
+                "retryable": response.status_code in TRANSIENT_STATUSES
             }
         
         result = response.json()
@@ -234,7 +238,8 @@ Please provide a helpful, accurate response based on the available data."""
         return {
             "success": True,
             "answer": answer,
-            "error": None
+            "error": None,
+            "prompt_stats": prompt_stats
         }
         
     except requests.Timeout:
@@ -251,6 +256,64 @@ Please provide a helpful, accurate response based on the available data."""
         }
 
 
+def stream_gemini(
+    question: str,
+    data_context: dict,
+    user_meta: dict,
+    history: Optional[list] = None,
+    scope: Optional[str] = None,
+    stats: Optional[dict] = None
+):
+    """
+    Same request as ask_gemini via streamGenerateContent (SSE); yields text chunks
+    as Gemini produces them. Raises AIStreamError on failure.
+    If stats is given it is filled with the prompt size stats before the call.
+    """
+    payload, prompt_stats = _build_gemini_payload(question, data_context, user_meta, history, scope)
+    if stats is not None:
+        stats.update(prompt_stats)
+    api_url = f"{GEMINI_STREAM_URL}?alt=sse&key={GEMINI_API_KEY}"
+    print(f"[AI_GEMINI] Streaming from API: {GEMINI_STREAM_URL}")
+
+    response = None
+    try:
+        response = provider_session("gemini").post(
+            api_url,
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            stream=True,
+            timeout=(10, 30),
+        )
+        if response.status_code != 200:
+            print(f"[AI_GEMINI] Stream error response: {response.text[:500]}")
+            raise AIStreamError(_clean_error(response.status_code),
+                                retryable=response.status_code in TRANSIENT_STATUSES)
+
+        produced = False
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            try:
+                event = json.loads(line[5:].strip())
+            except ValueError:
+                continue
+            for candidate in event.get("candidates") or []:
+                for part in (candidate.get("content") or {}).get("parts") or []:
+                    text = part.get("text")
+                    if text:
+                        produced = True
+                        yield text
+        if not produced:
+            raise AIStreamError("No response generated")
+    except requests.Timeout:
+        raise AIStreamError("Request timed out. Please try again.")
+    except requests.RequestException as e:
+        raise AIStreamError(f"Error: {e}")
+    finally:
+        if response is not None:
+            response.close()
+
+
 def quick_answer(question: str, user_name: str = "User") -> str:
     """Quick helper for simple questions without full context."""
     result = ask_gemini(
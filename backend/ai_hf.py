@@ -1,18 +1,20 @@
 # ai_hf.py - Hugging Face Inference AI integration for HR Office Tool
 import os
-import json
 from typing import Optional, List, Dict, Any
 
 import requests
 from dotenv import load_dotenv
 
+from ai_context_compactor import compact_context, estimate_tokens
+from ai_http import TRANSIENT_STATUSES, provider_session
+
 # Load local env file for dev (ignored in Render if not present)
 load_dotenv("id.env")
 
 HF_API_KEY = os.getenv("HF_API_KEY") or os.getenv("HUGGINGFACE_API_KEY")
 HF_MODEL_ID = os.getenv("HF_MODEL_ID", "mistralai/Mistral-7B-Instruct-v0.3")
 # Use the new router endpoint (api-inference.huggingface.co is deprecated)
-HF_API_URL = f"https://router.huggingface.co/hf-inference/models/{HF_MODEL_ID}"
+HF_API_URL = os.getenv("HF_API_URL") or f"https://router.huggingface.co/hf-inference/models/{HF_MODEL_ID}"
 
 
 def build_system_prompt(user_meta: Dict[str, Any]) -> str:
@@ -44,21 +46,13 @@ Guidelines:
 You only have access to the data provided in the context. Do not invent data."""
 
 
-def _build_full_prompt(question: str, data_context: Dict[str, Any], user_meta: Dict[str, Any], history: Optional[List[Dict[str, Any]]]) -> str:
+def _build_full_prompt(question: str, data_context: Dict[str, Any], user_meta: Dict[str, Any], history: Optional[List[Dict[str, Any]]], scope: Optional[str] = None):
+    """Returns (prompt, prompt_stats)."""
     system_prompt = build_system_prompt(user_meta)
 
-    # Build context from data
-    context_parts: List[str] = []
-    if data_context:
-        context_parts.append("=== AVAILABLE DATA (from Dataverse) ===")
-        for key, value in data_context.items():
-            if value:
-                if isinstance(value, (dict, list)):
-                    context_parts.append(f"\n{key.upper()}:\n{json.dumps(value, indent=2, default=str)}")
-                else:
-                    context_parts.append(f"\n{key.upper()}: {value}")
-
-    context_str = "\n".join(context_parts) if context_parts else "No specific data available."
+    # Build context from data (ranked + compacted to the token budget)
+    compacted = compact_context(data_context, question, scope)
+    context_str = compacted["text"]
 
     # Optional short conversation history
     history_lines: List[str] = []
@@ -79,7 +73,9 @@ User Question: {question}
 {history_block}
 
 Please provide a clear, concise, and accurate answer based only on the information above. If something is unknown, say so explicitly."""
-    return full_prompt
+    prompt_stats = dict(compacted["stats"])
+    prompt_stats["prompt_tokens"] = estimate_tokens(full_prompt)
+    return full_prompt, prompt_stats
 
 
 def ask_hf(
@@ -87,10 +83,12 @@ def ask_hf(
     data_context: Dict[str, Any],
     user_meta: Dict[str, Any],
     history: Optional[List[Dict[str, Any]]] = None,
+    scope: Optional[str] = None,
 ) -> Dict[str, Any]:
     """Send a question to a Hugging Face text-generation model and get a response.
 
-    Returns a dict with keys: success (bool), answer (str|None), error (str|None).
+    Returns a dict with keys: success (bool), answer (str|None), error (str|None),
+    prompt_stats (dict).
     """
     if not HF_API_KEY:
         return {
@@ -99,7 +97,7 @@ def ask_hf(
             "error": "HF_API_KEY is not configured on the server. Please set it in the environment.",
         }
 
-    full_prompt = _build_full_prompt(question, data_context, user_meta, history)
+    full_prompt, prompt_stats = _build_full_prompt(question, data_context, user_meta, history, scope)
 
     headers = {
         "Authorization": f"Bearer {HF_API_KEY}",
@@ -117,7 +115,7 @@ def ask_hf(
     }
 
     try:
-        resp = requests.post(HF_API_URL, headers=headers, json=payload, timeout=60)
+        resp = provider_session("huggingface").post(HF_API_URL, headers=headers, json=payload, timeout=60)
 
         if resp.status_code != 200:
             # HF often returns {"error": "..."} JSON; include a short snippet for debugging
@@ -126,6 +124,7 @@ def ask_hf(
                 "success": False,
                 "answer": None,
                 "error": f"Hugging Face API error {resp.status_code}: {text_snippet}",
+                "retryable": resp.status_code in TRANSIENT_STATUSES,
             }
 
         result = resp.json()
@@ -157,6 +156,7 @@ def ask_hf(
             "success": True,
             "answer": answer.strip(),
             "error": None,
+            "prompt_stats": prompt_stats,
         }
 
     except requests.Timeout:
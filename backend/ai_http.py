@@ -0,0 +1,34 @@
+# ai_http.py - Pooled HTTP sessions for the LLM providers
+#
+# ai_gemini and ai_hf each built the same pooled requests.Session. They now ask
+# for one here, one session per provider so a slow provider cannot use up the
+# other's connections. Sessions never retry on their own (max_retries=0):
+# retries and failover are ai_provider_router's job, which sees every attempt.
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+AI_PROVIDER_POOL_SIZE = int(os.getenv("AI_PROVIDER_POOL_SIZE", "8"))
+# Statuses worth another attempt (rate limit / transient server errors)
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def provider_session(name):
+    """Pooled session for one provider (keeps TLS connections warm between questions)."""
+    session = _sessions.get(name)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=AI_PROVIDER_POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[name] = session
+    return session
@@ -0,0 +1,331 @@
+# ai_provider_router.py - Hedged dispatch across the configured LLM providers
+#
+# ask_gemini and ask_hf used to be separate code paths. The router treats them
+# as interchangeable providers:
+#   - each provider keeps a rolling window of latencies and outcomes;
+#   - the provider with the lowest recent error rate (then lowest p90) goes first;
+#   - if it has not answered by its own p90 latency, a hedged request goes to the
+#     next provider and whichever answers successfully first wins;
+#   - if the primary fails outright, the alternate is tried immediately;
+#   - retries live here too (the providers make one attempt each): once every
+#     provider has failed, the last one to fail with a transient error (rate
+#     limit, 5xx) is tried again after AI_RETRY_DELAYS.
+# stream() does the same for /api/ai/query/stream: the race is to the first
+# chunk, and only the winner's chunks are relayed. Providers that cannot stream
+# (Hugging Face) answer in full and their answer is relayed as one chunk. Once a
+# chunk has been relayed the answer cannot switch providers, so a failure after
+# that raises AIStreamError.
+#
+# The losing request is not cancelled (requests cannot be interrupted), it just
+# finishes in the background and still feeds the provider's statistics.
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import ai_gemini
+import ai_hf
+
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "1.5"))
+AI_HEDGE_MAX_DELAY = float(os.getenv("AI_HEDGE_MAX_DELAY", "12"))
+# Used until a provider has enough samples for a meaningful p90
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv("AI_HEDGE_DEFAULT_DELAY", "6"))
+AI_PROVIDER_WINDOW = int(os.getenv("AI_PROVIDER_WINDOW", "50"))
+AI_PROVIDER_MIN_SAMPLES = 5
+# Back-off before each retry once every provider has failed transiently
+AI_RETRY_DELAYS = [float(d) for d in os.getenv("AI_RETRY_DELAYS", "0.6,1.2").split(",") if d.strip()]
+
+
+class ProviderStats:
+    def __init__(self, window=AI_PROVIDER_WINDOW):
+        self._samples = deque(maxlen=window)   # (latency_seconds, ok)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, latency, ok):
+        with self._lock:
+            self._samples.append((latency, bool(ok)))
+
+    def p90(self):
+        with self._lock:
+            latencies = sorted(lat for lat, ok in self._samples if ok)
+        if len(latencies) < AI_PROVIDER_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(round(0.9 * (len(latencies) - 1))))]
+
+    def error_rate(self):
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def snapshot(self):
+        with self._lock:
+            count = len(self._samples)
+            in_flight = self.in_flight
+        p90 = self.p90()
+        return {
+            "samples": count,
+            "error_rate": round(self.error_rate(), 3),
+            "p90_seconds": round(p90, 3) if p90 is not None else None,
+            "in_flight": in_flight,
+        }
+
+
+class Provider:
+    def __init__(self, name, ask, is_configured, stream=None):
+        self.name = name
+        self.ask = ask                      # ask(question, data_context, user_meta, history, scope) -> result dict
+        self.is_configured = is_configured  # () -> bool
+        self.stream = stream                # stream(..., stats) -> text chunks, raises AIStreamError; None: ask only
+        self.stats = ProviderStats()
+
+    def open_stream(self, kwargs, prompt_stats):
+        if self.stream is not None:
+            yield from self.stream(stats=prompt_stats, **kwargs)
+            return
+        result = self.ask(**kwargs)
+        if not result.get("success"):
+            raise ai_gemini.AIStreamError(result.get("error") or "Failed to get AI response",
+                                          retryable=bool(result.get("retryable")))
+        prompt_stats.update(result.get("prompt_stats") or {})
+        if result.get("answer"):
+            yield result["answer"]
+
+
+class LLMRouter:
+    def __init__(self, providers, max_workers=8):
+        self.providers = list(providers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def _ranked(self):
+        configured = [p for p in self.providers if p.is_configured()]
+
+        def rank(item):
+            index, p = item
+            p90 = p.stats.p90()
+            return (round(p.stats.error_rate(), 1), p90 if p90 is not None else float("inf"), index)
+
+        return [p for _, p in sorted(enumerate(configured), key=rank)]
+
+    def _hedge_delay(self, provider):
+        p90 = provider.stats.p90()
+        if p90 is None:
+            return AI_HEDGE_DEFAULT_DELAY
+        return min(max(p90, AI_HEDGE_MIN_DELAY), AI_HEDGE_MAX_DELAY)
+
+    def _run(self, provider, kwargs):
+        provider.stats.begin()
+        started = time.time()
+        try:
+            result = provider.ask(**kwargs)
+        except Exception as e:
+            result = {"success": False, "answer": None, "error": f"Error: {e}"}
+        finally:
+            provider.stats.end()
+        latency = time.time() - started
+        ok = bool(result.get("success"))
+        provider.stats.record(latency, ok)
+        result = dict(result)
+        result["provider"] = provider.name
+        result["latency_seconds"] = round(latency, 3)
+        return result
+
+    def ask(self, question, data_context, user_meta, history=None, scope=None):
+        kwargs = {"question": question, "data_context": data_context, "user_meta": user_meta,
+                  "history": history, "scope": scope}
+        ranked = self._ranked()
+        if not ranked:
+            return {"success": False, "answer": None, "error": "No AI provider is configured on the server."}
+
+        primary = ranked[0]
+        pending = {self._executor.submit(self._run, primary, kwargs): primary}
+        alternates = ranked[1:]
+        last_error = None
+        hedged = False
+        retries = list(AI_RETRY_DELAYS)
+        deadline_for_hedge = time.time() + self._hedge_delay(primary)
+
+        while pending:
+            timeout = None
+            if alternates:
+                timeout = max(0.0, deadline_for_hedge - time.time())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                provider = pending.pop(future)
+                result = future.result()
+                if result.get("success"):
+                    result["hedged"] = hedged
+                    if hedged and provider is not primary:
+                        self.hedges_won += 1
+                    return result
+                last_error = result
+                print(f"[AI_ROUTER] {provider.name} failed: {result.get('error')}")
+                if not pending and not alternates and result.get("retryable") and retries:
+                    delay = retries.pop(0)
+                    print(f"[AI_ROUTER] Retrying {provider.name} in {delay}s")
+                    time.sleep(delay)
+                    pending[self._executor.submit(self._run, provider, kwargs)] = provider
+
+            # Primary slower than its p90, or a provider failed: bring in the next one
+            if alternates and (not done or not pending):
+                nxt = alternates.pop(0)
+                if pending:
+                    hedged = True
+                    self.hedges_sent += 1
+                    print(f"[AI_ROUTER] {primary.name} exceeded {self._hedge_delay(primary):.1f}s; hedging to {nxt.name}")
+                pending[self._executor.submit(self._run, nxt, kwargs)] = nxt
+                deadline_for_hedge = time.time() + self._hedge_delay(nxt)
+
+        result = dict(last_error or {"success": False, "answer": None, "error": "Failed to get AI response"})
+        result["hedged"] = hedged
+        return result
+
+    def _pump(self, provider, kwargs, events, prompt_stats):
+        """Run one provider's stream, reporting ("chunk" | "done" | "error", value) events.
+
+        An error's value is (message, retryable)."""
+        provider.stats.begin()
+        started = time.time()
+        ok = False
+        last = (provider, "error", ("Failed to get AI response", False))
+        try:
+            for chunk in provider.open_stream(kwargs, prompt_stats):
+                events.put((provider, "chunk", chunk))
+            ok = True
+            last = (provider, "done", None)
+        except ai_gemini.AIStreamError as e:
+            last = (provider, "error", (str(e), getattr(e, "retryable", False)))
+        except Exception as e:
+            last = (provider, "error", (f"Error: {e}", False))
+        finally:
+            # Stats first, so they are settled by the time the caller sees the outcome
+            provider.stats.end()
+            provider.stats.record(time.time() - started, ok)
+            events.put(last)
+
+    def stream(self, question, data_context, user_meta, history=None, scope=None, info=None):
+        """Yield answer chunks from the first provider to start answering.
+
+        info, if given, is filled with prompt_stats, provider and hedged once a
+        provider has won. Raises AIStreamError when no provider can answer.
+        """
+        kwargs = {"question": question, "data_context": data_context, "user_meta": user_meta,
+                  "history": history, "scope": scope}
+        info = {} if info is None else info
+        ranked = self._ranked()
+        if not ranked:
+            raise ai_gemini.AIStreamError("No AI provider is configured on the server.")
+
+        events = queue.Queue()
+        prompt_stats = {}
+
+        def start(provider):
+            prompt_stats[provider] = {}
+            running.add(provider)
+            self._executor.submit(self._pump, provider, kwargs, events, prompt_stats[provider])
+
+        primary = ranked[0]
+        alternates = ranked[1:]
+        running = set()
+        start(primary)
+        winner = None
+        last_error = None
+        retryable = False
+        hedged = False
+        retries = list(AI_RETRY_DELAYS)
+        deadline_for_hedge = time.time() + self._hedge_delay(primary)
+
+        while True:
+            timeout = None
+            if winner is None and alternates:
+                timeout = max(0.0, deadline_for_hedge - time.time())
+            try:
+                provider, kind, value = events.get(timeout=timeout)
+            except queue.Empty:
+                # No first chunk within the primary's p90: bring in the next one
+                nxt = alternates.pop(0)
+                hedged = True
+                self.hedges_sent += 1
+                print(f"[AI_ROUTER] {primary.name} exceeded {self._hedge_delay(primary):.1f}s; hedging stream to {nxt.name}")
+                start(nxt)
+                deadline_for_hedge = time.time() + self._hedge_delay(nxt)
+                continue
+
+            if winner is None:
+                if kind == "error":
+                    running.discard(provider)
+                    last_error, retryable = value
+                    print(f"[AI_ROUTER] {provider.name} failed: {last_error}")
+                    if not running:
+                        if not alternates:
+                            if not (retryable and retries):
+                                raise ai_gemini.AIStreamError(last_error or "Failed to get AI response", retryable=retryable)
+                            delay = retries.pop(0)
+                            print(f"[AI_ROUTER] Retrying {provider.name} stream in {delay}s")
+                            time.sleep(delay)
+                            start(provider)
+                            continue
+                        nxt = alternates.pop(0)
+                        start(nxt)
+                        deadline_for_hedge = time.time() + self._hedge_delay(nxt)
+                    continue
+                winner = provider
+                if hedged and provider is not primary:
+                    self.hedges_won += 1
+                info.update(prompt_stats=prompt_stats[provider], provider=provider.name, hedged=hedged)
+
+            if provider is not winner:
+                continue  # the loser finishes in the background
+            if kind == "chunk":
+                yield value
+            elif kind == "done":
+                return
+            else:
+                raise ai_gemini.AIStreamError(value[0])
+
+    def stats(self):
+        return {
+            "providers": {p.name: dict(p.stats.snapshot(), configured=p.is_configured()) for p in self.providers},
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+        }
+
+
+def _ask_gemini(**kwargs):
+    return ai_gemini.ask_gemini(**kwargs)
+
+
+def _stream_gemini(**kwargs):
+    return ai_gemini.stream_gemini(**kwargs)
+
+
+def _ask_hf(**kwargs):
+    return ai_hf.ask_hf(**kwargs)
+
+
+_router = None
+
+
+def get_llm_router():
+    global _router
+    if _router is None:
+        _router = LLMRouter([
+            Provider("gemini", _ask_gemini, lambda: bool(ai_gemini.GEMINI_API_KEY), stream=_stream_gemini),
+            Provider("huggingface", _ask_hf, lambda: bool(ai_hf.HF_API_KEY)),
+        ])
+    return _router
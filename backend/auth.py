@@ -1,7 +1,6 @@
 # auth.py
 import os
 from dotenv import load_dotenv
-import msal
 
 load_dotenv("id.env")
 
@@ -13,15 +12,5 @@ RESOURCE = os.getenv("RESOURCE")
 AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
 SCOPE = [f"{RESOURCE}/.default"]
 
-app = msal.ConfidentialClientApplication(
-    client_id=CLIENT_ID,
-    client_credential=CLIENT_SECRET,
-    authority=AUTHORITY
-)
-
-def get_access_token():
-    result = app.acquire_token_for_client(scopes=SCOPE)
-    if "access_token" in result:
-        return result["access_token"]
-    else:
-        raise Exception(f"Authentication failed: {result}")
+# Token acquisition is shared with every other module (see token_provider.py)
+from dataverse_helper import get_access_token  # noqa: E402,F401
@@ -0,0 +1,249 @@
+# auth_events.py - Append-only auth session event log with indexed, paged queries
+#
+# _append_auth_session_event loaded the whole storage/auth_session_events.json
+# list, appended one event and rewrote the file (indent=2) on every login,
+# logout and force-logout; /api/auth-events loaded it all again to filter. The
+# cost of a login grew with the history, and two workers appending at once
+# could lose each other's events.
+#
+# AuthEventLog keeps events in a SQLite db shared by all workers:
+#   - append() is a single INSERT - no read of earlier events, so a login costs
+#     the same with ten events or ten million;
+#   - employee ID, username (email), event type and time are indexed columns;
+#     the full event is stored as JSON next to them;
+#   - query() pages newest-first with a cursor (the seq of the last item), so
+#     a page is an index range scan, never a scan of the whole log;
+#   - each process keeps the newest AUTH_EVENTS_TAIL events in memory, caught
+#     up from other workers with one range read; pages that fall inside it are
+#     answered without a query;
+#   - retention is by size: every AUTH_EVENTS_CHECK_EVERY appends the db size
+#     is checked and past AUTH_EVENTS_MAX_BYTES the oldest events are dropped
+#     down to about 3/4 of it (freed pages are reused, so the file stops
+#     growing).
+# An existing auth_session_events.json is imported once and renamed to
+# *.migrated.
+
+import json
+import os
+import threading
+from collections import deque
+
+from sqlite_store import SQLiteStore, singleton
+
+_STORAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage")
+AUTH_EVENTS_DB = os.getenv("AUTH_EVENTS_DB", os.path.join(_STORAGE_DIR, "auth_events.db"))
+AUTH_EVENTS_LEGACY_FILE = os.path.join(_STORAGE_DIR, "auth_session_events.json")
+AUTH_EVENTS_MAX_BYTES = int(os.getenv("AUTH_EVENTS_MAX_BYTES", str(64 * 1024 * 1024)))
+AUTH_EVENTS_CHECK_EVERY = int(os.getenv("AUTH_EVENTS_CHECK_EVERY", "500"))
+AUTH_EVENTS_TAIL = int(os.getenv("AUTH_EVENTS_TAIL", "1000"))
+
+_FILTERS = ("employee_id", "username", "event_type")
+
+
+def _normalise(event):
+    return {
+        "employee_id": str(event.get("employee_id") or "").strip().upper(),
+        "username": str(event.get("username") or "").strip().lower(),
+        "event_type": str(event.get("event_type") or "").strip().lower(),
+        "occurred_at": str(event.get("occurred_at_utc") or ""),
+    }
+
+
+class AuthEventLog(SQLiteStore):
+    def __init__(self, db_path=AUTH_EVENTS_DB, legacy_path=AUTH_EVENTS_LEGACY_FILE,
+                 max_bytes=AUTH_EVENTS_MAX_BYTES, check_every=AUTH_EVENTS_CHECK_EVERY, tail_size=AUTH_EVENTS_TAIL):
+        super().__init__(db_path)
+        self.max_bytes = max_bytes
+        self.check_every = max(1, check_every)
+        self.tail_size = tail_size
+        self._lock = threading.Lock()
+        self._tail = deque(maxlen=tail_size)   # newest last: (seq, event)
+        self._tail_floor = None                # every event with seq >= floor is in _tail
+        self._appends = 0
+        self.pruned = 0
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS auth_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id TEXT,
+                event_type TEXT NOT NULL,
+                employee_id TEXT NOT NULL,
+                username TEXT NOT NULL,
+                occurred_at TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_auth_events_employee ON auth_events(employee_id, seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_auth_events_username ON auth_events(username, seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_auth_events_time ON auth_events(occurred_at)")
+        if legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    @staticmethod
+    def _row(event):
+        keys = _normalise(event)
+        return (event.get("id"), keys["event_type"], keys["employee_id"], keys["username"],
+                keys["occurred_at"], json.dumps(event, ensure_ascii=False))
+
+    def _import_legacy(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                events = json.load(f)
+        except Exception as e:
+            print(f"[AUTH EVENTS] Could not read {os.path.basename(path)}: {e}")
+            return
+        events = [e for e in events if isinstance(e, dict)] if isinstance(events, list) else []
+
+        def apply(conn):
+            # Another worker may have imported it first
+            if not os.path.exists(path) or conn.execute("SELECT 1 FROM auth_events LIMIT 1").fetchone():
+                return 0
+            conn.executemany(
+                "INSERT INTO auth_events (event_id, event_type, employee_id, username, occurred_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)", [self._row(e) for e in events])
+            return len(events)
+
+        imported = self._transaction(apply)
+        try:
+            os.replace(path, path + ".migrated")
+        except OSError:
+            pass
+        if imported:
+            print(f"[AUTH EVENTS] Imported {imported} events from {os.path.basename(path)}")
+
+    # ---------- writes ----------
+    def append(self, event):
+        """Store one event (the dict built by the caller). O(1) in the size of the log."""
+        cur = self._conn().execute(
+            "INSERT INTO auth_events (event_id, event_type, employee_id, username, occurred_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)", self._row(event))
+        with self._lock:
+            self._appends += 1
+            check = self._appends % self.check_every == 0
+        if check:
+            self.enforce_size()
+        return cur.lastrowid
+
+    def size_bytes(self):
+        conn = self._conn()
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * conn.execute("PRAGMA page_size").fetchone()[0]
+
+    def enforce_size(self):
+        """Drop the oldest events if the log is over max_bytes, down to about 3/4 of it. Returns events dropped."""
+        size = self.size_bytes()
+        if size <= self.max_bytes:
+            return 0
+        share = max(0.25, 1 - 0.75 * self.max_bytes / size)
+
+        def apply(conn):
+            total = conn.execute("SELECT COUNT(*) FROM auth_events").fetchone()[0]
+            cut = conn.execute("SELECT seq FROM auth_events ORDER BY seq LIMIT 1 OFFSET ?",
+                               (max(1, int(total * share)) - 1,)).fetchone()
+            return conn.execute("DELETE FROM auth_events WHERE seq <= ?", (cut[0],)).rowcount if cut else 0
+
+        dropped = self._transaction(apply)
+        self.pruned += dropped
+        print(f"[AUTH EVENTS] Log over {self.max_bytes} bytes, dropped {dropped} oldest events")
+        return dropped
+
+    # ---------- tail buffer ----------
+    def _catch_up(self):
+        """Bring the in-memory tail up to date with events appended by any worker."""
+        conn = self._conn()
+        with self._lock:
+            top = self._tail[-1][0] if self._tail else None
+            floor = self._tail_floor
+        if floor is not None:
+            rows = conn.execute("SELECT seq, data FROM auth_events WHERE seq > ? ORDER BY seq LIMIT ?",
+                                (top if top is not None else floor - 1, self.tail_size + 1)).fetchall()
+            if len(rows) <= self.tail_size:
+                with self._lock:
+                    self._tail.extend((seq, json.loads(data)) for seq, data in rows)
+                    if len(self._tail) == self.tail_size:
+                        self._tail_floor = self._tail[0][0]
+                return
+        rows = conn.execute("SELECT seq, data FROM auth_events ORDER BY seq DESC LIMIT ?", (self.tail_size,)).fetchall()
+        with self._lock:
+            self._tail.clear()
+            self._tail.extend((seq, json.loads(data)) for seq, data in reversed(rows))
+            # A short read means the tail holds the whole log
+            self._tail_floor = rows[-1][0] if len(rows) == self.tail_size else 0
+
+    def _from_tail(self, filters, since, until, before, limit):
+        """A page served from the tail, or None when it may extend past the tail."""
+        with self._lock:
+            tail = list(self._tail)
+            floor = self._tail_floor
+        if floor is None:
+            return None
+        items = []
+        for seq, event in reversed(tail):
+            if before is not None and seq >= before:
+                continue
+            keys = _normalise(event)
+            if any(value and keys[name] != value for name, value in filters.items()):
+                continue
+            if (since and keys["occurred_at"] < since) or (until and keys["occurred_at"] > until):
+                continue
+            items.append((seq, event))
+            if len(items) > limit:
+                return items
+        # Not a full page: fine only if nothing older than the tail is left
+        if floor == 0:
+            return items
+        oldest = self._conn().execute("SELECT MIN(seq) FROM auth_events").fetchone()[0]
+        return items if oldest is None or floor <= oldest else None
+
+    # ---------- queries ----------
+    def query(self, employee_id=None, username=None, event_type=None, since=None, until=None, before=None, limit=200):
+        """Newest-first page of events. Returns (events, next_cursor); next_cursor is None on the last page.
+
+        since/until compare against occurred_at_utc (ISO 8601, UTC); before is a
+        cursor from a previous page.
+        """
+        filters = _normalise({"employee_id": employee_id, "username": username, "event_type": event_type})
+        filters = {name: filters[name] for name in _FILTERS}
+        self._catch_up()
+        rows = self._from_tail(filters, since, until, before, limit)
+        if rows is None:
+            clauses, params = [], []
+            for name, value in filters.items():
+                if value:
+                    clauses.append(f"{name} = ?")
+                    params.append(value)
+            if since:
+                clauses.append("occurred_at >= ?")
+                params.append(since)
+            if until:
+                clauses.append("occurred_at <= ?")
+                params.append(until)
+            if before is not None:
+                clauses.append("seq < ?")
+                params.append(int(before))
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            rows = [(seq, json.loads(data)) for seq, data in self._conn().execute(
+                f"SELECT seq, data FROM auth_events {where} ORDER BY seq DESC LIMIT ?", (*params, limit + 1))]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return [event for _, event in rows], (rows[-1][0] if more else None)
+
+    def stats(self):
+        conn = self._conn()
+        count, oldest, newest = conn.execute(
+            "SELECT COUNT(*), MIN(occurred_at), MAX(occurred_at) FROM auth_events").fetchone()
+        with self._lock:
+            tail = len(self._tail)
+        return {
+            "events": count,
+            "oldest": oldest,
+            "newest": newest,
+            "size_bytes": self.size_bytes(),
+            "max_bytes": self.max_bytes,
+            "tail_events": tail,
+            "pruned": self.pruned,
+        }
+
+
+get_auth_event_log = singleton(AuthEventLog)
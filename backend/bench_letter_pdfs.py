@@ -0,0 +1,128 @@
+"""
+Benchmark: offer/policy letter generation, old in-request rendering vs the
+cached pipeline in letter_pdfs.py.
+
+Uses the same sample inputs as test_pdf_overlay.py (Sammer K, Data Analyst,
+DOJ 15-11-2025) plus a handful of other candidates. Writes nothing into the
+backend directory; the pipeline cache lives in a temp directory.
+
+Run: python bench_letter_pdfs.py [candidates]
+"""
+
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from letter_pdfs import (BACKEND_DIR, IMAGE_ASSETS, LETTER_RENDER_PROCESSES, OFFER_TEMPLATE, POLICY_STATIC_FILE,
+                         POLICY_TERMS, POLICY_TEMPLATE, LetterPipeline, fill)
+
+# Test data (as in test_pdf_overlay.py)
+firstname = "Sammer"
+lastname = "K"
+designation = "Data Analyst"
+doj = "15-11-2025"
+
+
+def candidates(count):
+    names = [f"{firstname} {lastname}", "Asha Raman", "Ravi Kumar", "Meera Iyer", "John Mathew", "Priya S"]
+    for n in range(count):
+        yield {
+            "current_date": "19-10-2026",
+            "candidate_name": names[n % len(names)] + ("" if n < len(names) else f" {n}"),
+            "candidate_address": "Chennai",
+            "designation": designation,
+            "date_of_joining": doj,
+        }
+
+
+def legacy_letters(fields):
+    """What send_policy_letter did per request: full renders of both templates, static PDFs re-read."""
+    from PyPDF2 import PdfReader, PdfWriter
+    from xhtml2pdf import pisa
+
+    with open(os.path.join(BACKEND_DIR, OFFER_TEMPLATE), encoding="utf-8") as f:
+        offer_html = fill(f.read(), {**fields, **{key: "" for key in IMAGE_ASSETS}})
+    with open(os.path.join(BACKEND_DIR, POLICY_TEMPLATE), encoding="utf-8") as f:
+        policy_html = fill(f.read(), {"candidate_name": fields["candidate_name"], **POLICY_TERMS})
+    offer_pdf, policy_pdf = BytesIO(), BytesIO()
+    if pisa.CreatePDF(offer_html, dest=offer_pdf).err or pisa.CreatePDF(policy_html, dest=policy_pdf).err:
+        raise RuntimeError("PDF generation failed")
+    offer_reader = PdfReader(BytesIO(offer_pdf.getvalue()))
+    writer = PdfWriter()
+    for page in offer_reader.pages[:2]:
+        writer.add_page(page)
+    writer.write(BytesIO())
+    writer = PdfWriter()
+    for page in PdfReader(os.path.join(BACKEND_DIR, POLICY_STATIC_FILE)).pages:
+        writer.add_page(page)
+    writer.write(BytesIO())
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+def report(label, samples):
+    if not samples:
+        print(f"{label:<38} n/a")
+        return
+    print(f"{label:<38} median {statistics.median(samples):8.1f} ms   max {max(samples):8.1f} ms   (n={len(samples)})")
+
+
+def main():
+    logging.disable(logging.CRITICAL)           # xhtml2pdf warns about unsupported CSS on every render
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    people = list(candidates(count))
+    print("=" * 78)
+    print(f"Letter generation benchmark: {count} candidates, render processes={LETTER_RENDER_PROCESSES}")
+    print("=" * 78)
+
+    legacy = []
+    import_ms = timed(lambda: __import__("xhtml2pdf.pisa"))
+    try:
+        for fields in people[:4]:
+            legacy.append(timed(legacy_letters, fields))
+    except Exception as e:
+        print(f"[legacy] full-document render failed: {type(e).__name__}: {e}")
+    print(f"{'xhtml2pdf import (paid by the first request)':<38} {import_ms:8.1f} ms")
+    report("legacy: full render in request", legacy)
+
+    cache_dir = tempfile.mkdtemp(prefix="letter_bench_")
+    try:
+        pipeline = LetterPipeline(cache_dir=cache_dir)
+        started = time.perf_counter()
+        pipeline.warm()
+        first = timed(pipeline.build, people[0])
+        print(f"{'pipeline: warm-up + first letter':<38} {(time.perf_counter() - started) * 1000:8.1f} ms")
+        report("pipeline: first letter (cold blocks)", [first])
+        report("pipeline: new candidate", [timed(pipeline.build, fields) for fields in people[1:]])
+        report("pipeline: repeat (memory cache)", [timed(pipeline.build, fields) for fields in people])
+        restarted = LetterPipeline(cache_dir=cache_dir, processes=0)
+        report("pipeline: after restart (disk cache)", [timed(restarted.build, fields) for fields in people])
+
+        fresh = [dict(fields, designation="Analyst II") for fields in people]
+        started = time.perf_counter()
+        futures = [pipeline.submit(fields) for fields in fresh]
+        submit_ms = (time.perf_counter() - started) * 1000
+        for future in futures:
+            future.result()
+        total_ms = (time.perf_counter() - started) * 1000
+        print(f"{'pipeline: burst submit (request thread)':<38} {submit_ms:8.1f} ms for {count}")
+        print(f"{'pipeline: burst rendered':<38} {total_ms:8.1f} ms for {count}")
+        print("-" * 78)
+        print(pipeline.stats())
+        pipeline.shutdown()
+        restarted.shutdown()
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
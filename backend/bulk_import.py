@@ -0,0 +1,432 @@
+# bulk_import.py - Resumable background import jobs (bulk employee upload)
+#
+# /api/employees/bulk used to create every employee, login and leave-balance
+# row with sequential Dataverse calls inside the HTTP request, so a few hundred
+# rows ran into the gunicorn timeout and a worker restart lost track of what
+# had been written. The import is now split:
+#   - the request streams the CSV (or JSON array) through iter_csv_employees /
+#     validate_employee(), persists every row in ImportJobStore and returns a
+#     job id straight away;
+#   - ImportRunner sends pending rows in batches (one Dataverse $batch per
+#     batch, one changeset per row) from a bounded thread pool and records a
+#     per-row result;
+#   - a job is leased by the worker running it; a heartbeat thread renews the
+#     lease while batches are out, and a worker that loses it sends nothing
+#     more. Rows are marked "sending"
+#     before their batch goes out; when a lease expires (worker restart) any
+#     worker's ImportRunner picks the job up, asks recover() which "sending"
+#     rows already reached Dataverse and re-queues the rest.
+# Job state lives in SQLite (WAL) shared by all gunicorn workers.
+
+import csv
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlite_store import SQLiteStore
+
+IMPORT_JOBS_DB = os.getenv(
+    "IMPORT_JOBS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "import_jobs.db"),
+)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "25"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "4"))
+IMPORT_LEASE_SECONDS = int(os.getenv("IMPORT_LEASE_SECONDS", "60"))
+
+# Column order of the documented CSV format (also used for header-less files)
+EMPLOYEE_CSV_FIELDS = ("employee_id", "first_name", "last_name", "email", "address",
+                       "contact_number", "department", "designation", "doj", "active")
+_HEADER_ALIASES = {
+    "employeeid": "employee_id", "empid": "employee_id", "id": "employee_id",
+    "firstname": "first_name", "lastname": "last_name",
+    "email": "email", "emailid": "email", "mail": "email",
+    "address": "address",
+    "contactnumber": "contact_number", "contact": "contact_number", "phone": "contact_number",
+    "mobile": "contact_number", "contactno": "contact_number",
+    "department": "department", "dept": "department",
+    "designation": "designation", "role": "designation",
+    "doj": "doj", "dateofjoining": "doj", "joiningdate": "doj",
+    "active": "active", "status": "active",
+}
+DOJ_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d")
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+# ---------- parsing & validation ----------
+def _canonical(header):
+    return _HEADER_ALIASES.get(re.sub(r"[^a-z]", "", str(header or "").lower()))
+
+
+def iter_csv_employees(lines):
+    """
+    Yield (row_no, employee dict) from CSV lines (file object or iterable),
+    one row at a time. Files without a recognised header row are read
+    positionally, with or without the leading employee_id column.
+    """
+    reader = csv.reader(lines)
+    first = next(reader, None)
+    if first is None:
+        return
+    columns = [_canonical(h) for h in first]
+    has_header = sum(1 for c in columns if c) >= 2
+    row_no = 0
+    if not has_header:
+        reader = itertools.chain([first], reader)
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        row_no += 1
+        if has_header:
+            emp = {c: v.strip() for c, v in zip(columns, values) if c}
+        else:
+            fields = EMPLOYEE_CSV_FIELDS if len(values) >= len(EMPLOYEE_CSV_FIELDS) else EMPLOYEE_CSV_FIELDS[1:]
+            emp = {c: v.strip() for c, v in zip(fields, values)}
+        yield row_no, emp
+
+
+def parse_doj(value):
+    for fmt in DOJ_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_active(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in ("true", "1", "active", "yes")
+
+
+def validate_employee(emp, seen_ids, seen_emails, existing_ids=(), existing_emails=()):
+    """
+    Errors for one employee row (empty list when valid). seen_* collect the
+    IDs/emails of earlier rows so duplicates inside the file are caught too.
+    """
+    errors = []
+    emp_id = str(emp.get("employee_id") or "").strip().upper()
+    email = str(emp.get("email") or "").strip().lower()
+    if not str(emp.get("first_name") or "").strip():
+        errors.append("first_name is required")
+    if emp_id:
+        if emp_id in existing_ids:
+            errors.append(f"employee_id {emp_id} already exists")
+        elif emp_id in seen_ids:
+            errors.append(f"employee_id {emp_id} appears more than once")
+        seen_ids.add(emp_id)
+    if email:
+        if not _EMAIL_RE.match(email):
+            errors.append(f"invalid email: {email}")
+        elif email in existing_emails:
+            errors.append(f"email {email} already exists")
+        elif email in seen_emails:
+            errors.append(f"email {email} appears more than once")
+        seen_emails.add(email)
+    doj = emp.get("doj")
+    if doj and parse_doj(doj) is None:
+        errors.append(f"unrecognised doj: {doj} (use YYYY-MM-DD or DD/MM/YYYY)")
+    return errors
+
+
+# ---------- job store ----------
+class ImportJobStore(SQLiteStore):
+    def __init__(self, db_path=IMPORT_JOBS_DB):
+        super().__init__(db_path)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                lease_until REAL,
+                created_by TEXT,
+                created_at REAL NOT NULL,
+                finished_at REAL,
+                error TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS import_rows (
+                job_id TEXT NOT NULL,
+                row_no INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                record_key TEXT,
+                data TEXT NOT NULL,
+                error TEXT,
+                updated_at REAL,
+                PRIMARY KEY (job_id, row_no)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS import_rows_status ON import_rows (job_id, status)")
+
+    def create_job(self, kind, rows, created_by=None, key="employee_id"):
+        """Persist a job with rows [(row_no, data)]; every row starts as pending."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        def apply(conn):
+            total = 0
+            for row_no, data in rows:
+                conn.execute(
+                    "INSERT INTO import_rows (job_id, row_no, status, record_key, data, updated_at)"
+                    " VALUES (?, ?, 'pending', ?, ?, ?)",
+                    (job_id, row_no, data.get(key), json.dumps(data), now),
+                )
+                total += 1
+            conn.execute(
+                "INSERT INTO import_jobs (job_id, kind, status, total, created_by, created_at)"
+                " VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, total, created_by, now),
+            )
+        self._transaction(apply)
+        return job_id
+
+    # ---------- leases ----------
+    def acquire(self, job_id, owner, lease_seconds=IMPORT_LEASE_SECONDS):
+        """Take (or renew) the job's lease. False when another live worker holds it."""
+        now = time.time()
+
+        def apply(conn):
+            return conn.execute(
+                "UPDATE import_jobs SET owner = ?, lease_until = ?, status = 'running'"
+                " WHERE job_id = ? AND status IN ('queued', 'running')"
+                " AND (owner IS NULL OR owner = ? OR lease_until < ?)",
+                (owner, now + lease_seconds, job_id, owner, now),
+            ).rowcount > 0
+        return self._transaction(apply)
+
+    def abandoned_jobs(self):
+        """Unfinished jobs nobody holds a live lease on."""
+        rows = self._conn().execute(
+            "SELECT job_id FROM import_jobs WHERE status IN ('queued', 'running')"
+            " AND (owner IS NULL OR lease_until < ?) ORDER BY created_at",
+            (time.time(),),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def finish(self, job_id, status="done", error=None):
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE import_jobs SET status = ?, error = ?, finished_at = ?, owner = NULL, lease_until = NULL"
+            " WHERE job_id = ?",
+            (status, error, time.time(), job_id),
+        ))
+
+    # ---------- rows ----------
+    def claim(self, job_id, limit):
+        """Mark up to `limit` pending rows as sending and return them [(row_no, data)]."""
+        def apply(conn):
+            rows = conn.execute(
+                "SELECT row_no, data FROM import_rows WHERE job_id = ? AND status = 'pending'"
+                " ORDER BY row_no LIMIT ?",
+                (job_id, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE import_rows SET status = 'sending', updated_at = ? WHERE job_id = ? AND row_no = ?",
+                [(time.time(), job_id, r[0]) for r in rows],
+            )
+            return [(r[0], json.loads(r[1])) for r in rows]
+        return self._transaction(apply)
+
+    def in_flight(self, job_id):
+        rows = self._conn().execute(
+            "SELECT row_no, data FROM import_rows WHERE job_id = ? AND status = 'sending'", (job_id,)
+        ).fetchall()
+        return [(r[0], json.loads(r[1])) for r in rows]
+
+    def mark(self, job_id, results):
+        """results: {row_no: (status, error)} with status created / failed / pending."""
+        now = time.time()
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE import_rows SET status = ?, error = ?, updated_at = ? WHERE job_id = ? AND row_no = ?",
+            [(status, error, now, job_id, row_no) for row_no, (status, error) in results.items()],
+        ))
+
+    # ---------- reporting ----------
+    def progress(self, job_id):
+        conn = self._conn()
+        job = conn.execute(
+            "SELECT kind, status, total, created_by, created_at, finished_at, error FROM import_jobs WHERE job_id = ?",
+            (job_id,),
+        ).fetchone()
+        if job is None:
+            return None
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM import_rows WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        total = job[2]
+        processed = counts.get("created", 0) + counts.get("failed", 0)
+        return {
+            "job_id": job_id,
+            "kind": job[0],
+            "status": job[1],
+            "total": total,
+            "processed": processed,
+            "created": counts.get("created", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0) + counts.get("sending", 0),
+            "percent": round(100.0 * processed / total, 1) if total else 100.0,
+            "created_by": job[3],
+            "created_at": job[4],
+            "finished_at": job[5],
+            "error": job[6],
+        }
+
+    def report(self, job_id):
+        """Per-row results in file order."""
+        rows = self._conn().execute(
+            "SELECT row_no, status, record_key, error FROM import_rows WHERE job_id = ? ORDER BY row_no", (job_id,)
+        ).fetchall()
+        return [{"row": r[0], "status": r[1], "employee_id": r[2], "error": r[3]} for r in rows]
+
+
+# ---------- runner ----------
+class ImportRunner:
+    def __init__(self, store, process_batch, recover=None, on_finish=None,
+                 batch_size=IMPORT_BATCH_SIZE, workers=IMPORT_WORKERS, lease_seconds=IMPORT_LEASE_SECONDS):
+        """
+        process_batch([(row_no, data)]) -> {row_no: (status, error)}.
+        recover([(row_no, data)]) -> set of row_nos that already reached
+        Dataverse; used for rows a dead worker was sending and for batches
+        that raised before Dataverse answered.
+        """
+        self.store = store
+        self.process_batch = process_batch
+        self.recover = recover
+        self.on_finish = on_finish
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._running = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def submit(self, job_id):
+        """Run the job in a background thread (no-op when this worker already runs it)."""
+        with self._lock:
+            if job_id in self._running:
+                return False
+            self._running.add(job_id)
+        threading.Thread(target=self._run_guarded, args=(job_id,), name=f"import-{job_id[:8]}", daemon=True).start()
+        return True
+
+    def _run_guarded(self, job_id):
+        try:
+            self.run(job_id)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+
+    def run(self, job_id):
+        """Process the job to completion in the calling thread. False when another worker holds it."""
+        if not self.store.acquire(job_id, self.owner, self.lease_seconds):
+            return False
+        lost = threading.Event()
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, lost, done),
+                                     name=f"import-lease-{job_id[:8]}", daemon=True)
+        heartbeat.start()
+        try:
+            self._recover(job_id)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="import-batch") as pool:
+                while not self._stop.is_set() and not lost.is_set():
+                    rows = self.store.claim(job_id, self.batch_size * self.workers)
+                    if not rows:
+                        break
+                    batches = [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
+                    for results in pool.map(lambda batch: self._process(batch, lost), batches):
+                        # After a lost lease the rows stay "sending"; the new owner's recover() settles them
+                        if results is not None and not lost.is_set():
+                            self.store.mark(job_id, results)
+            if lost.is_set():
+                print(f"[IMPORT] Lost the lease on job {job_id}; stopping")
+                return False
+            if self._stop.is_set():
+                return False
+            self.store.finish(job_id)
+            progress = self.store.progress(job_id)
+            print(f"[IMPORT] Job {job_id} done: {progress['created']} created, {progress['failed']} failed")
+        except Exception as e:
+            print(f"[IMPORT] Job {job_id} stopped: {e}")
+            self.store.finish(job_id, status="failed", error=str(e))
+            return False
+        finally:
+            done.set()
+            heartbeat.join()
+        if self.on_finish:
+            try:
+                self.on_finish(job_id)
+            except Exception as e:
+                print(f"[IMPORT] on_finish failed for {job_id}: {e}")
+        return True
+
+    def _heartbeat(self, job_id, lost, done):
+        """Renew the lease while batches run: a slow $batch (or limiter wait) can outlast it."""
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                if not self.store.acquire(job_id, self.owner, self.lease_seconds):
+                    lost.set()
+                    return
+            except Exception as e:
+                # Keep trying; the lease only lapses if renewals fail for a whole lease period
+                print(f"[IMPORT] Could not renew the lease on job {job_id}: {e}")
+
+    def _process(self, batch, lost=None):
+        # Another worker may own the job now; anything sent from here would be sent twice
+        if lost is not None and lost.is_set():
+            return None
+        try:
+            results = dict(self.process_batch(batch) or {})
+        except Exception as e:
+            # No per-row answer (e.g. connection dropped): only Dataverse knows what was written
+            print(f"[IMPORT] Batch of {len(batch)} rows failed: {e}")
+            try:
+                done = set(self.recover(batch)) if self.recover else set()
+            except Exception as recover_err:
+                print(f"[IMPORT] Could not check which rows were written: {recover_err}")
+                done = set()
+            return {row_no: ("created", None) if row_no in done else ("failed", str(e)) for row_no, _ in batch}
+        for row_no, _ in batch:
+            results.setdefault(row_no, ("failed", "no result for this row"))
+        return results
+
+    def _recover(self, job_id):
+        rows = self.store.in_flight(job_id)
+        if not rows:
+            return
+        done = set(self.recover(rows)) if self.recover else set()
+        self.store.mark(job_id, {
+            row_no: ("created", None) if row_no in done else ("pending", None) for row_no, _ in rows
+        })
+        print(f"[IMPORT] Job {job_id}: recovered {len(rows)} in-flight rows ({len(done)} already written)")
+
+    # ---------- resuming abandoned jobs ----------
+    def start(self, interval=None):
+        """Periodically pick up jobs whose worker died (idempotent)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        interval = interval or max(5, self.lease_seconds // 2)
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    for job_id in self.store.abandoned_jobs():
+                        self.submit(job_id)
+                except Exception as e:
+                    print(f"[IMPORT] Resume check failed: {e}")
+
+        self._thread = threading.Thread(target=loop, name="import-resume", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
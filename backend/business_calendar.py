@@ -0,0 +1,141 @@
+# business_calendar.py - Working-day arithmetic over weekends and company holidays
+#
+# calculate_leave_days() used to return (end - start).days + 1, so a Friday to
+# Monday leave cost four days and a leave over Diwali counted the holiday.
+# BusinessCalendar wraps numpy's business-day functions with:
+#   - the company holiday set (loaded through a caller-supplied loader and
+#     cached for HOLIDAY_CACHE_SECONDS, or until invalidate() after a holiday
+#     is created/edited/deleted),
+#   - a configurable week mask (WORKWEEK_MASK, Mon..Sun, default Mon-Fri).
+#
+# Single ranges and batches go through the same np.busday_count call, so
+# org-wide reports compute every row's working days in one vectorised pass.
+# All ranges are inclusive of both ends, like leave start/end dates.
+
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+WORKWEEK_MASK = os.getenv("WORKWEEK_MASK", "1111100")
+# Short by default: the loader reads the local replica, and other workers only
+# see holiday edits once their cached set expires
+HOLIDAY_CACHE_SECONDS = int(os.getenv("HOLIDAY_CACHE_SECONDS", "300"))
+
+
+def to_datetime64(values):
+    """Dates, datetimes or 'YYYY-MM-DD...' strings (scalar or sequence) -> datetime64[D]."""
+    if isinstance(values, (str, date)):
+        return _one(values)
+    return np.array([_one(v) for v in values], dtype="datetime64[D]")
+
+
+def _one(value):
+    if value is None or value == "":
+        return np.datetime64("NaT", "D")
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return np.datetime64(value, "D")
+    return np.datetime64(str(value)[:10], "D")
+
+
+class BusinessCalendar:
+    def __init__(self, holiday_loader, weekmask=WORKWEEK_MASK, ttl=HOLIDAY_CACHE_SECONDS):
+        """holiday_loader() returns [(date or 'YYYY-MM-DD', name), ...]."""
+        self.holiday_loader = holiday_loader
+        self.weekmask = weekmask
+        self.ttl = ttl
+        self._cal = None
+        self._names = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- holiday cache ----------
+    def _calendar(self):
+        cal = self._cal
+        if cal is not None and time.time() - self._loaded_at < self.ttl:
+            return cal
+        with self._lock:
+            if self._cal is not None and time.time() - self._loaded_at < self.ttl:
+                return self._cal
+            names = {}
+            try:
+                for day, name in self.holiday_loader() or []:
+                    d64 = _one(day)
+                    if not np.isnat(d64):
+                        names[d64] = name or "Holiday"
+            except Exception as e:
+                if self._cal is not None:
+                    print(f"[CALENDAR] Holiday load failed, keeping the last loaded set: {e}")
+                    self._loaded_at = time.time()  # retry after the next ttl, not on every call
+                    return self._cal
+                print(f"[CALENDAR] Holiday load failed, using weekends only: {e}")
+            holidays = np.array(sorted(names), dtype="datetime64[D]")
+            self._cal = np.busdaycalendar(weekmask=self.weekmask, holidays=holidays)
+            self._names = names
+            self._loaded_at = time.time()
+            return self._cal
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def holidays(self, start=None, end=None):
+        """{date: name} for holidays in [start, end] (all when unbounded)."""
+        self._calendar()
+        lo = _one(start) if start is not None else None
+        hi = _one(end) if end is not None else None
+        return {
+            d.astype(date): name for d, name in sorted(self._names.items())
+            if (lo is None or d >= lo) and (hi is None or d <= hi)
+        }
+
+    # ---------- working days ----------
+    def working_days_batch(self, starts, ends):
+        """Inclusive working days for each (start, end) pair; 0 for missing or inverted ranges."""
+        s = to_datetime64(starts)
+        e = to_datetime64(ends)
+        valid = ~(np.isnat(s) | np.isnat(e)) & (e >= s)
+        out = np.zeros(s.shape, dtype=np.int64)
+        if valid.any():
+            out[valid] = np.busday_count(s[valid], e[valid] + np.timedelta64(1, "D"), busdaycal=self._calendar())
+        return out
+
+    def working_days(self, start, end) -> int:
+        return int(self.working_days_batch([start], [end])[0])
+
+    def is_working_day(self, days):
+        d = to_datetime64(days)
+        return np.is_busday(d, busdaycal=self._calendar())
+
+    def add_working_days(self, start, n) -> date:
+        """Date of the n-th working day counting from start (start itself is the 1st if it is one)."""
+        d = np.busday_offset(_one(start), max(int(n), 1) - 1, roll="forward", busdaycal=self._calendar())
+        return d.astype(date)
+
+    def next_working_day(self, day) -> date:
+        d = np.busday_offset(_one(day) + np.timedelta64(1, "D"), 0, roll="forward", busdaycal=self._calendar())
+        return d.astype(date)
+
+    def split_range(self, start, n):
+        """
+        Split a leave starting at `start` after its first n working days:
+        returns (end of the first part, start of the remainder).
+        """
+        first_end = self.add_working_days(start, n)
+        return first_end, self.next_working_day(first_end)
+
+    def month_grid(self, year, month):
+        """Working-day flags for a calendar month: {"days", "working", "working_days", "holidays"}."""
+        first = np.datetime64(f"{year:04d}-{month:02d}", "M")
+        days = np.arange(first.astype("datetime64[D]"), (first + 1).astype("datetime64[D]"))
+        working = np.is_busday(days, busdaycal=self._calendar())
+        return {
+            "days": [d.astype(date) for d in days],
+            "working": working,
+            "working_days": int(working.sum()),
+            "holidays": self.holidays(days[0], days[-1]),
+        }
@@ -11,7 +11,7 @@ import requests
 import datetime
 from flask import Blueprint, request, jsonify, Response, current_app,send_file, make_response
 import logging
-from dataverse_helper import get_dataverse_session
+from dataverse_helper import get_dataverse_session, get_access_token
 
 # --------------------------------------------------------------
 # BLUEPRINT
@@ -599,31 +599,11 @@ if not RESOURCE:
     raise RuntimeError("RESOURCE environment variable is required")
 
 # --------------------------------------------------------------
-# TOKEN CACHE
+# TOKEN (shared provider in dataverse_helper / token_provider.py)
 # --------------------------------------------------------------
 
-_token_cache = {"access_token": None, "expires_at": 0}
-
-
 def _get_oauth_token():
-    now = int(time.time())
-    if _token_cache.get("access_token") and _token_cache["expires_at"] - 60 > now:
-        return _token_cache["access_token"]
-
-    url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
-    data = {
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "scope": f"{RESOURCE.rstrip('/')}/.default",
-        "grant_type": "client_credentials",
-    }
-    r = requests.post(url, data=data, timeout=10)
-    r.raise_for_status()
-    j = r.json()
-
-    _token_cache["access_token"] = j["access_token"]
-    _token_cache["expires_at"] = now + int(j.get("expires_in", 3600))
-    return j["access_token"]
+    return get_access_token()
 
 SOCKET_SERVER_URL = os.getenv("SOCKET_SERVER_URL", "http://localhost:4001")
 
@@ -838,7 +818,7 @@ def dataverse_upload_file(entity_set, row_guid, file_column, binary):
         "Authorization": f"Bearer {_get_oauth_token()}",
         "Content-Type": "application/octet-stream"
     }
-    r = requests.put(url, headers=headers, data=binary, timeout=60)
+    r = get_dataverse_session().put(url, headers=headers, data=binary, timeout=60)
     r.raise_for_status()
 
 
@@ -1,9 +1,18 @@
+import json
 import os
+import random
+import threading
 import time
+import uuid
+from email.utils import parsedate_to_datetime
+
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import msal
 
+from token_provider import TokenProvider
+
 # Load environment variables from id.env
 load_dotenv("id.env")
 
@@ -18,8 +27,12 @@ EMPLOYEE_ENTITY="crc6f_table12s"
 
 # ================== PERFORMANCE: Singleton MSAL app (reuses internal token cache) ==================
 _msal_app = None
-_token_cache = {"access_token": None, "expires_at": 0}
 _TOKEN_REFRESH_MARGIN = 300  # refresh 5 min before expiry
+# Shared by all gunicorn workers (see token_provider.py); empty string disables the file
+DATAVERSE_TOKEN_CACHE = os.getenv(
+    "DATAVERSE_TOKEN_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", ".dataverse_token.json"),
+)
 
 def _get_msal_app():
     global _msal_app
@@ -31,32 +44,225 @@ def _get_msal_app():
         )
     return _msal_app
 
-def get_access_token():
-    global _token_cache
-    now = time.time()
-    if _token_cache["access_token"] and now < _token_cache["expires_at"] - _TOKEN_REFRESH_MARGIN:
-        return _token_cache["access_token"]
-
+def _fetch_access_token():
     app = _get_msal_app()
+    # MSAL would hand back its cached token; the provider decides when to renew
+    for cached in app.token_cache.find(msal.TokenCache.CredentialType.ACCESS_TOKEN):
+        app.token_cache.remove_at(cached)
     result = app.acquire_token_for_client(scopes=SCOPE)
-
     if "access_token" in result:
-        expires_in = result.get("expires_in", 3600)
-        _token_cache["access_token"] = result["access_token"]
-        _token_cache["expires_at"] = now + expires_in
-        return result["access_token"]
-    else:
-        raise Exception(f"Failed to get token: {result}")
+        return result["access_token"], result.get("expires_in", 3600)
+    raise Exception(f"Failed to get token: {result}")
+
+_token_provider = TokenProvider(
+    _fetch_access_token,
+    cache_path=DATAVERSE_TOKEN_CACHE or None,
+    refresh_margin=_TOKEN_REFRESH_MARGIN,
+)
+
+def get_access_token():
+    return _token_provider.get_token()
+
+def invalidate_access_token():
+    _token_provider.invalidate()
 
 # ================== PERFORMANCE: Shared requests.Session (TCP + TLS reuse) ==================
+# Dataverse service-protection limits answer 429 + Retry-After. The shared session
+# retries those (the request was not executed), backs off with jitter on transient
+# 5xx/connection errors for idempotent calls, and caps in-flight requests with an
+# AIMD limiter: +1 slot per window of successes, halved on a throttle response.
 _dataverse_session = None
 _DEFAULT_TIMEOUT = 15
 
+DATAVERSE_MAX_CONCURRENCY = int(os.getenv("DATAVERSE_MAX_CONCURRENCY", "16"))
+DATAVERSE_MIN_CONCURRENCY = int(os.getenv("DATAVERSE_MIN_CONCURRENCY", "2"))
+DATAVERSE_POOL_SIZE = int(os.getenv("DATAVERSE_POOL_SIZE", str(DATAVERSE_MAX_CONCURRENCY)))
+DATAVERSE_MAX_RETRIES = int(os.getenv("DATAVERSE_MAX_RETRIES", "5"))
+# Total time one call may spend waiting on retries; keeps requests under the gunicorn timeout
+DATAVERSE_RETRY_BUDGET = float(os.getenv("DATAVERSE_RETRY_BUDGET", "30"))
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+_TRANSIENT_STATUS = {502, 503, 504}
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit shared by every thread using the Dataverse session."""
+
+    def __init__(self, initial, min_limit, max_limit, decrease_cooldown=1.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.decrease_cooldown = decrease_cooldown
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            before = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            if int(self.limit) > before:
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        # One burst of 429s from the same window should only halve the limit once
+        with self._cond:
+            now = time.time()
+            if now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            self.limit = max(self.min_limit, self.limit / 2.0)
+
+
+_dataverse_limiter = AdaptiveLimiter(
+    initial=DATAVERSE_MAX_CONCURRENCY,
+    min_limit=DATAVERSE_MIN_CONCURRENCY,
+    max_limit=DATAVERSE_MAX_CONCURRENCY,
+)
+_dataverse_stats_lock = threading.Lock()
+_dataverse_stats = {
+    "requests": 0,
+    "throttled": 0,
+    "transient_errors": 0,
+    "retries": 0,
+    "retry_wait_seconds": 0.0,
+    "gave_up": 0,
+    "limiter_timeouts": 0,
+}
+
+
+def _bump_stat(key, amount=1):
+    with _dataverse_stats_lock:
+        _dataverse_stats[key] += amount
+
+
+def get_dataverse_stats():
+    """Throttle/retry counters for this worker plus the current concurrency limit."""
+    with _dataverse_stats_lock:
+        stats = dict(_dataverse_stats)
+    stats["retry_wait_seconds"] = round(stats["retry_wait_seconds"], 3)
+    stats["concurrency_limit"] = int(_dataverse_limiter.limit)
+    stats["in_flight"] = _dataverse_limiter.in_flight
+    stats["max_concurrency"] = _dataverse_limiter.max_limit
+    return stats
+
+
+def _retry_after_seconds(response):
+    value = (response.headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _backoff_seconds(attempt):
+    # Full jitter: uniform(0, base * 2^attempt), capped
+    return random.uniform(0, min(20.0, 0.5 * (2 ** attempt)))
+
+
+class DataverseSession(requests.Session):
+    """requests.Session that cooperates with Dataverse service-protection limits."""
+
+    def request(self, method, url, *args, **kwargs):
+        method_upper = str(method).upper()
+        body = kwargs.get("data")
+        replayable = not hasattr(body, "read")
+        idempotent = method_upper in _IDEMPOTENT_METHODS
+        started = time.time()
+        attempt = 0
+        auth_retried = False
+
+        while True:
+            # Past the budget, send without a slot rather than block the request thread further
+            holding = _dataverse_limiter.acquire(timeout=DATAVERSE_RETRY_BUDGET)
+            if not holding:
+                _bump_stat("limiter_timeouts")
+                print(f"[DATAVERSE] Concurrency limiter wait exceeded {DATAVERSE_RETRY_BUDGET}s; sending anyway")
+            _bump_stat("requests")
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if holding:
+                    _dataverse_limiter.release()
+                wait = _backoff_seconds(attempt)
+                if not (idempotent and replayable) or attempt >= DATAVERSE_MAX_RETRIES \
+                        or time.time() - started + wait > DATAVERSE_RETRY_BUDGET:
+                    _bump_stat("gave_up")
+                    raise
+                _bump_stat("transient_errors")
+            else:
+                if holding:
+                    _dataverse_limiter.release()
+                status = response.status_code
+                if status == 429:
+                    # Service protection rejects before executing, so any method is safe to resend
+                    _bump_stat("throttled")
+                    _dataverse_limiter.on_throttle()
+                    retry_after = _retry_after_seconds(response)
+                    wait = retry_after if retry_after is not None else _backoff_seconds(attempt)
+                    wait += random.uniform(0, 0.25)
+                    can_retry = replayable
+                elif status in _TRANSIENT_STATUS:
+                    _bump_stat("transient_errors")
+                    retry_after = _retry_after_seconds(response)
+                    if retry_after is not None:
+                        _dataverse_limiter.on_throttle()
+                    wait = retry_after if retry_after is not None else _backoff_seconds(attempt)
+                    can_retry = idempotent and replayable
+                elif status == 401 and not auth_retried and replayable \
+                        and str((kwargs.get("headers") or {}).get("Authorization", "")).startswith("Bearer "):
+                    # Token rejected before its expiry (revoked/rotated): renew once and resend
+                    auth_retried = True
+                    response.close()
+                    invalidate_access_token()
+                    kwargs["headers"] = {**kwargs["headers"], "Authorization": f"Bearer {get_access_token()}"}
+                    continue
+                else:
+                    _dataverse_limiter.on_success()
+                    return response
+
+                if not can_retry or attempt >= DATAVERSE_MAX_RETRIES \
+                        or time.time() - started + wait > DATAVERSE_RETRY_BUDGET:
+                    _bump_stat("gave_up")
+                    print(f"[DATAVERSE] Giving up on {method_upper} after {attempt + 1} attempt(s): HTTP {status}")
+                    return response
+                response.close()
+
+            attempt += 1
+            _bump_stat("retries")
+            _bump_stat("retry_wait_seconds", wait)
+            time.sleep(wait)
+
+
 def get_dataverse_session():
     """Return a shared requests.Session for Dataverse calls. Reuses TCP connections."""
     global _dataverse_session
     if _dataverse_session is None:
-        _dataverse_session = requests.Session()
+        _dataverse_session = DataverseSession()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=DATAVERSE_POOL_SIZE, max_retries=0)
+        _dataverse_session.mount("https://", adapter)
+        _dataverse_session.mount("http://", adapter)
         _dataverse_session.headers.update({
             "Accept": "application/json",
             "OData-MaxVersion": "4.0",
@@ -122,6 +328,158 @@ def fetch_record_by_id(entity_name, leave_id, id_field="crc6f_leaveid"):
         raise Exception(f"Error fetching record by {id_field}: {response.status_code} - {response.text}")
 
 
+def fetch_column_values(entity_name, field, filter_expr=None):
+    """Every value of one column across all pages (used to seed ID sequences)."""
+    token = get_access_token()
+    url = f"{RESOURCE}/api/data/v9.2/{entity_name}?$select={field}"
+    if filter_expr:
+        url += f"&$filter={filter_expr}"
+    s = get_dataverse_session()
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Prefer": "odata.maxpagesize=5000",
+    }
+    values = []
+    while url:
+        response = s.get(url, headers=headers, timeout=30)
+        if response.status_code != 200:
+            raise Exception(f"Error fetching {entity_name}.{field}: {response.status_code} - {response.text}")
+        data = response.json()
+        values.extend(row.get(field) for row in data.get("value", []))
+        url = data.get("@odata.nextLink")
+    return values
+
+
+# -------------------- $batch --------------------
+
+def _batch_part(method, url, body, content_id):
+    lines = [
+        "Content-Type: application/http",
+        "Content-Transfer-Encoding: binary",
+        f"Content-ID: {content_id}",
+        "",
+        f"{method} {url} HTTP/1.1",
+        "Content-Type: application/json; type=entry",
+        "",
+        json.dumps(body) if body is not None else "",
+    ]
+    return "\r\n".join(lines)
+
+
+def build_batch_body(changesets, base_url, boundary):
+    """multipart/mixed $batch body with one changeset per entry of changesets."""
+    chunks = []
+    content_id = 0
+    for i, operations in enumerate(changesets):
+        cs_boundary = f"changeset_{boundary}_{i}"
+        parts = []
+        for method, entity_set, body in operations:
+            content_id += 1
+            parts.append(f"--{cs_boundary}\r\n" + _batch_part(method, f"{base_url}/{entity_set}", body, content_id))
+        chunks.append(
+            f"--batch_{boundary}\r\nContent-Type: multipart/mixed; boundary={cs_boundary}\r\n\r\n"
+            + "\r\n".join(parts) + f"\r\n--{cs_boundary}--\r\n"
+        )
+    return "".join(chunks) + f"--batch_{boundary}--\r\n"
+
+
+def _split_multipart(text, boundary):
+    """Bodies of the parts between --boundary delimiters (headers included)."""
+    parts = []
+    for chunk in text.split(f"--{boundary}")[1:]:
+        if chunk.startswith("--"):
+            break
+        parts.append(chunk.strip("\r\n"))
+    return parts
+
+
+def _headers_and_body(text):
+    head, _, body = text.replace("\r\n", "\n").partition("\n\n")
+    headers = {}
+    for line in head.split("\n"):
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return headers, body
+
+
+def _boundary_of(content_type):
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            return value.strip('"')
+    return None
+
+
+def _parse_http_part(text):
+    """One application/http part -> {"status", "entity_id", "body"}."""
+    _, http = _headers_and_body(text)
+    status_line, _, rest = http.partition("\n")
+    headers, body = _headers_and_body(rest) if rest else ({}, "")
+    try:
+        status = int(status_line.split()[1])
+    except (IndexError, ValueError):
+        status = 0
+    try:
+        parsed = json.loads(body) if body.strip() else None
+    except ValueError:
+        parsed = body.strip()
+    return {"status": status, "entity_id": headers.get("odata-entityid"), "body": parsed}
+
+
+def parse_batch_response(text, content_type, expected):
+    """
+    Per-changeset results of a $batch response:
+    [{"ok", "status", "responses": [...], "error"}] (length `expected`).
+    A failed changeset comes back as a single error part; changesets after a
+    failure without odata.continue-on-error are reported as not executed.
+    """
+    results = []
+    for part in _split_multipart(text, _boundary_of(content_type) or ""):
+        headers, body = _headers_and_body(part)
+        inner = _boundary_of(headers.get("content-type", ""))
+        if inner:
+            responses = [_parse_http_part(p) for p in _split_multipart(body, inner)]
+            results.append({"ok": all(r["status"] < 400 for r in responses), "responses": responses,
+                            "status": max((r["status"] for r in responses), default=0), "error": None})
+        else:
+            response = _parse_http_part(part)
+            error = response["body"]
+            if isinstance(error, dict):
+                error = (error.get("error") or {}).get("message") or json.dumps(error)
+            results.append({"ok": response["status"] < 400, "responses": [response],
+                            "status": response["status"], "error": None if response["status"] < 400 else error})
+    while len(results) < expected:
+        results.append({"ok": False, "responses": [], "status": 0, "error": "not executed"})
+    return results[:expected]
+
+
+def execute_batch(changesets, continue_on_error=True, base_url=None, token=None, timeout=120):
+    """
+    Send changesets ([[(method, entity_set, body), ...], ...]) in one $batch
+    request. Each changeset commits or rolls back as a unit; with
+    continue_on_error a failed changeset does not stop the ones after it.
+    Returns parse_batch_response() results in changeset order.
+    """
+    if not changesets:
+        return []
+    base_url = base_url or f"{RESOURCE}/api/data/v9.2"
+    token = token or get_access_token()
+    boundary = uuid.uuid4().hex
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": f"multipart/mixed; boundary=batch_{boundary}",
+        "Accept": "application/json",
+    }
+    if continue_on_error:
+        headers["Prefer"] = "odata.continue-on-error"
+    body = build_batch_body(changesets, base_url, boundary).encode("utf-8")
+    response = get_dataverse_session().post(f"{base_url}/$batch", data=body, headers=headers, timeout=timeout)
+    if response.status_code not in (200, 202):
+        raise Exception(f"Error executing batch: {response.status_code} - {response.text[:500]}")
+    return parse_batch_response(response.text, response.headers.get("Content-Type", ""), len(changesets))
+
+
 def update_record(entity_name, record_id, data):
     """Update a record"""
     token = get_access_token()
@@ -0,0 +1,204 @@
+# dataverse_metadata.py - Entity-set catalogue from Dataverse metadata, persisted across restarts
+#
+# Entity sets whose name differs between orgs (employees, hierarchy, inbox,
+# comp-off requests, clients, projects, login details, onboarding) were each
+# resolved by probing candidates with $top=1 GETs the first time they were used
+# in each worker; comp-off resolution could also pull EntityDefinitions and
+# probe every plausible match. After a deploy the first requests in every
+# worker paid that cascade of round trips.
+#
+# EntitySetCatalogue holds the EntitySetName -> LogicalName list from one
+# EntityDefinitions call:
+#   - the snapshot is stored per org (RESOURCE) in the "dataverse_metadata"
+#     namespace of storage_kv with a version stamp (snapshot format + hash of
+#     the entity sets); a new worker loads it from disk, so resolving an
+#     entity set is a set lookup with no request at all;
+#   - a snapshot older than DATAVERSE_METADATA_TTL is still used and refreshed
+#     in the background; concurrent first lookups share one fetch;
+#   - a name missing from a snapshot older than DATAVERSE_METADATA_RECHECK
+#     triggers one shared refetch before exists() says False, so a table
+#     created after the snapshot is still found;
+#   - when metadata cannot be read (no privilege, Dataverse down) exists()
+#     returns None and callers fall back to probing; failed fetches are not
+#     retried for DATAVERSE_METADATA_RETRY seconds.
+# unified_server registers the fetch with configure() and warms the catalogue
+# (and its resolved entity sets) in a daemon thread at boot.
+
+import hashlib
+import os
+import threading
+import time
+
+from storage_kv import get_kv_store
+
+DATAVERSE_METADATA_TTL = int(os.getenv("DATAVERSE_METADATA_TTL", str(24 * 3600)))
+DATAVERSE_METADATA_RETRY = int(os.getenv("DATAVERSE_METADATA_RETRY", "300"))
+DATAVERSE_METADATA_RECHECK = int(os.getenv("DATAVERSE_METADATA_RECHECK", "300"))
+DATAVERSE_METADATA_ENABLED = os.getenv("DATAVERSE_METADATA_ENABLED", "true").lower() != "false"
+
+# Bump when the stored snapshot layout changes; older snapshots are refetched
+METADATA_FORMAT = 1
+
+
+def version_stamp(entity_sets):
+    digest = hashlib.sha1()
+    for name in sorted(entity_sets):
+        digest.update(f"{name}={entity_sets[name]}\n".encode("utf-8"))
+    return f"{METADATA_FORMAT}:{digest.hexdigest()[:16]}"
+
+
+class EntitySetCatalogue:
+    def __init__(self, store=None, ttl=DATAVERSE_METADATA_TTL, retry_seconds=DATAVERSE_METADATA_RETRY,
+                 recheck_seconds=DATAVERSE_METADATA_RECHECK, enabled=DATAVERSE_METADATA_ENABLED):
+        self.store = store
+        self.ttl = ttl
+        self.recheck_seconds = recheck_seconds
+        self.retry_seconds = retry_seconds
+        self.enabled = enabled
+        self._fetch = None
+        self._scope = None
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._refreshing = False
+        self._entity_sets = None        # EntitySetName -> LogicalName
+        self.stamp = None
+        self.fetched_at = 0.0
+        self._failed_at = 0.0
+        self.fetches = 0
+        self.last_error = None
+
+    def configure(self, fetch, scope):
+        """fetch(token) returns {EntitySetName: LogicalName}; scope (the org URL) keys the stored snapshot."""
+        self._fetch = fetch
+        self._scope = scope
+
+    # ---------- snapshot ----------
+    def _store(self):
+        if self.store is None:
+            self.store = get_kv_store("dataverse_metadata")
+        return self.store
+
+    def _install(self, entity_sets, stamp, fetched_at):
+        self._entity_sets = dict(entity_sets)
+        self.stamp = stamp
+        self.fetched_at = fetched_at
+
+    def load_persisted(self):
+        """Use the stored snapshot for this org, if any. Returns True when one was loaded."""
+        if not self.enabled or not self._scope:
+            return False
+        try:
+            snapshot = self._store().get(self._scope)
+        except Exception as e:
+            print(f"[METADATA] Could not read stored metadata: {e}")
+            return False
+        if not isinstance(snapshot, dict) or not isinstance(snapshot.get("entity_sets"), dict) \
+                or not snapshot["entity_sets"]:
+            return False
+        if not str(snapshot.get("stamp") or "").startswith(f"{METADATA_FORMAT}:"):
+            return False
+        fetched_at = snapshot.get("fetched_at")
+        if not isinstance(fetched_at, (int, float)):
+            return False
+        with self._lock:
+            if self._entity_sets is None or fetched_at > self.fetched_at:
+                self._install(snapshot["entity_sets"], snapshot["stamp"], fetched_at)
+        return True
+
+    def refresh(self, token):
+        """Fetch EntityDefinitions now and persist it. Returns True on success."""
+        if not self.enabled or self._fetch is None:
+            return False
+        try:
+            entity_sets = self._fetch(token)
+            if not entity_sets:
+                raise ValueError("no entity sets in metadata")
+        except Exception as e:
+            self.last_error = str(e)
+            self._failed_at = time.time()
+            print(f"[METADATA] EntityDefinitions fetch failed: {e}")
+            return False
+        stamp = version_stamp(entity_sets)
+        now = time.time()
+        with self._lock:
+            changed = self.stamp is not None and stamp != self.stamp
+            self._install(entity_sets, stamp, now)
+            self.fetches += 1
+            self.last_error = None
+        try:
+            self._store().put(self._scope, {"stamp": stamp, "fetched_at": now, "entity_sets": entity_sets})
+        except Exception as e:
+            print(f"[METADATA] Could not persist metadata: {e}")
+        print(f"[METADATA] {len(entity_sets)} entity sets loaded (stamp {stamp}{', changed' if changed else ''})")
+        return True
+
+    def _refresh_in_background(self, token):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh(token)
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="dataverse-metadata", daemon=True).start()
+
+    def _ensure(self, token):
+        """The current catalogue, loading or fetching it if needed; None when metadata is unavailable."""
+        if not self.enabled:
+            return None
+        if self._entity_sets is None and not self.load_persisted():
+            # One fetch for all first lookups; the others wait for it
+            with self._fetch_lock:
+                if self._entity_sets is None and token and time.time() - self._failed_at >= self.retry_seconds:
+                    self.refresh(token)
+            return self._entity_sets
+        if token and time.time() - self.fetched_at > self.ttl and time.time() - self._failed_at >= self.retry_seconds:
+            self._refresh_in_background(token)
+        return self._entity_sets
+
+    # ---------- lookups ----------
+    def exists(self, entity_set, token=None):
+        """True/False from metadata, or None when metadata is unavailable (callers then probe)."""
+        if not entity_set or self._ensure(token) is None:
+            return None
+        if entity_set in self._entity_sets:
+            return True
+        # Maybe created after the snapshot: refetch (shared, at most once per recheck window) before saying no
+        if time.time() - self.fetched_at > self.recheck_seconds:
+            with self._fetch_lock:
+                if time.time() - self.fetched_at > self.recheck_seconds:
+                    if not token or time.time() - self._failed_at < self.retry_seconds or not self.refresh(token):
+                        return None
+        return entity_set in self._entity_sets
+
+    def entity_sets(self, token=None):
+        """{EntitySetName: LogicalName}, or {} when metadata is unavailable."""
+        return dict(self._ensure(token) or {})
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "entity_sets": len(self._entity_sets or {}),
+            "stamp": self.stamp,
+            "fetched_at": self.fetched_at or None,
+            "fetches": self.fetches,
+            "last_error": self.last_error,
+        }
+
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+
+def get_entity_set_catalogue():
+    global _catalogue
+    if _catalogue is None:
+        with _catalogue_lock:
+            if _catalogue is None:
+                _catalogue = EntitySetCatalogue()
+    return _catalogue
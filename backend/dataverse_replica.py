@@ -0,0 +1,342 @@
+# dataverse_replica.py - Local SQLite read replica of hot Dataverse tables
+#
+# Read-heavy endpoints (holidays, employee master, clients, projects) used to hit
+# Dataverse on every page load. This module mirrors selected entity sets into a
+# SQLite file using Dataverse change tracking:
+#   - first sync: GET with `Prefer: odata.track-changes`, follow @odata.nextLink,
+#     keep the @odata.deltaLink from the last page
+#   - later syncs: GET the deltaLink, upsert changed rows, drop $deletedEntity rows
+#   - expired/invalid delta token (or change tracking disabled): full resync
+#
+# Every table carries staleness metadata (last successful sync, last error) and a
+# per-table refresh cadence. read() is the query router: it returns replica rows
+# only when they are fresh enough, otherwise None so the caller falls back to its
+# existing Dataverse query. Writes always go to Dataverse; the writer calls
+# invalidate() and the next read() runs a (cheap) delta sync first.
+#
+# A daemon thread keeps registered tables warm; workers coordinate through the
+# last_attempt column so only one of them syncs a table per cadence window.
+# odata_stub.py provides an offline Dataverse stand-in for exercising the loop.
+
+import json
+import os
+import threading
+import time
+
+from dataverse_helper import get_access_token, get_dataverse_session
+from sqlite_store import SQLiteStore, immediate, singleton
+
+RESOURCE = os.getenv("RESOURCE")
+STORAGE_DIR = os.path.join(os.path.dirname(__file__), "storage")
+REPLICA_DB = os.getenv("DATAVERSE_REPLICA_DB", os.path.join(STORAGE_DIR, "dataverse_replica.db"))
+REPLICA_ENABLED = os.getenv("DATAVERSE_REPLICA_ENABLED", "true").lower() == "true"
+REPLICA_DEFAULT_REFRESH = int(os.getenv("DATAVERSE_REPLICA_REFRESH", "120"))
+REPLICA_LOOP_INTERVAL = int(os.getenv("DATAVERSE_REPLICA_LOOP_INTERVAL", "15"))
+
+
+class ReplicaTable:
+    """Configuration for one mirrored entity set.
+
+    entity_set / primary_key / select may be strings or callables taking the access token,
+    so tables resolved at runtime (employee master, clients) can be mirrored.
+    max_staleness defaults to 3x the refresh cadence.
+    """
+
+    def __init__(self, name, entity_set, primary_key, select, refresh_seconds=None,
+                 max_staleness=None, annotations=False, page_size=5000):
+        self.name = name
+        self.entity_set = entity_set
+        self.primary_key = primary_key
+        self.select = select
+        env_refresh = os.getenv(f"DATAVERSE_REPLICA_REFRESH_{name.upper()}")
+        self.refresh_seconds = int(env_refresh or refresh_seconds or REPLICA_DEFAULT_REFRESH)
+        self.max_staleness = int(max_staleness or self.refresh_seconds * 3)
+        self.annotations = annotations
+        self.page_size = page_size
+
+    def resolve(self, value, token):
+        return value(token) if callable(value) else value
+
+
+class DataverseReplica(SQLiteStore):
+    timeout = 30
+
+    def __init__(self, db_path=REPLICA_DB, base_url=None, token_provider=None, session_provider=None):
+        super().__init__(db_path)
+        self.base_url = (base_url or f"{RESOURCE}/api/data/v9.2").rstrip("/")
+        self.token_provider = token_provider or get_access_token
+        self.session_provider = session_provider or get_dataverse_session
+        self.tables = {}
+        self._sync_locks = {}
+        self._loop_thread = None
+        self._loop_stop = threading.Event()
+        self._init_schema()
+
+    # ---------- storage ----------
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS replica_rows (
+                table_name TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (table_name, record_id)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS replica_meta (
+                table_name TEXT PRIMARY KEY,
+                entity_set TEXT,
+                select_clause TEXT,
+                delta_link TEXT,
+                last_full_sync REAL,
+                last_sync REAL,
+                last_attempt REAL,
+                last_error TEXT,
+                dirty_at REAL,
+                row_count INTEGER DEFAULT 0
+            )
+        """)
+
+    def register(self, table):
+        self.tables[table.name] = table
+        self._sync_locks.setdefault(table.name, threading.Lock())
+        self._conn().execute("INSERT OR IGNORE INTO replica_meta (table_name) VALUES (?)", (table.name,))
+        return table
+
+    def _meta(self, name):
+        keys = ["entity_set", "select_clause", "delta_link", "last_full_sync", "last_sync", "last_attempt", "last_error", "dirty_at", "row_count"]
+        row = self._conn().execute(
+            f"SELECT {', '.join(keys)} FROM replica_meta WHERE table_name = ?", (name,)
+        ).fetchone()
+        return dict(zip(keys, row)) if row else {}
+
+    # ---------- sync ----------
+    def _headers(self, table, token, track_changes):
+        prefer = [f"odata.maxpagesize={table.page_size}"]
+        if track_changes:
+            prefer.insert(0, "odata.track-changes")
+        if table.annotations:
+            prefer.append('odata.include-annotations="*"')
+        return {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json",
+            "OData-MaxVersion": "4.0",
+            "OData-Version": "4.0",
+            "Prefer": ",".join(prefer),
+        }
+
+    def _fetch_pages(self, url, headers):
+        """Yield (rows, delta_link) per page; raises on HTTP errors."""
+        session = self.session_provider()
+        while url:
+            resp = session.get(url, headers=headers, timeout=30)
+            if resp.status_code != 200:
+                err = Exception(f"{resp.status_code} {resp.text[:300]}")
+                err.status_code = resp.status_code
+                raise err
+            data = resp.json()
+            yield data.get("value", []), data.get("@odata.deltaLink")
+            url = data.get("@odata.nextLink")
+
+    def _full_sync(self, table, token, entity_set, select, primary_key):
+        url = f"{self.base_url}/{entity_set}?$select={select}"
+        rows = {}
+        delta_link = None
+        for page, link in self._fetch_pages(url, self._headers(table, token, True)):
+            for rec in page:
+                rid = str(rec.get(primary_key) or "").strip("{}")
+                if rid:
+                    rows[rid] = rec
+            delta_link = link or delta_link
+
+        now = time.time()
+        with immediate(self._conn()) as conn:
+            conn.execute("DELETE FROM replica_rows WHERE table_name = ?", (table.name,))
+            conn.executemany(
+                "INSERT INTO replica_rows (table_name, record_id, data) VALUES (?, ?, ?)",
+                [(table.name, rid, json.dumps(rec)) for rid, rec in rows.items()],
+            )
+            conn.execute(
+                "UPDATE replica_meta SET entity_set = ?, select_clause = ?, delta_link = ?, last_full_sync = ?, "
+                "last_sync = ?, last_error = NULL, row_count = ? WHERE table_name = ?",
+                (entity_set, select, delta_link, now, now, len(rows), table.name),
+            )
+        return {"mode": "full", "rows": len(rows), "delta": bool(delta_link)}
+
+    def _delta_sync(self, table, token, delta_link, primary_key):
+        upserts = {}
+        deletes = set()
+        next_delta = None
+        for page, link in self._fetch_pages(delta_link, self._headers(table, token, True)):
+            for rec in page:
+                context = str(rec.get("@odata.context") or "")
+                if "$deletedEntity" in context or rec.get("reason") == "deleted":
+                    rid = str(rec.get("id") or "").strip("{}")
+                    if rid:
+                        deletes.add(rid)
+                        upserts.pop(rid, None)
+                    continue
+                rid = str(rec.get(primary_key) or "").strip("{}")
+                if rid:
+                    upserts[rid] = rec
+                    deletes.discard(rid)
+            next_delta = link or next_delta
+
+        now = time.time()
+        with immediate(self._conn()) as conn:
+            for rid, rec in upserts.items():
+                existing = conn.execute(
+                    "SELECT data FROM replica_rows WHERE table_name = ? AND record_id = ?", (table.name, rid)
+                ).fetchone()
+                merged = json.loads(existing[0]) if existing else {}
+                merged.update({k: v for k, v in rec.items() if k != "@odata.etag"})
+                conn.execute(
+                    "INSERT OR REPLACE INTO replica_rows (table_name, record_id, data) VALUES (?, ?, ?)",
+                    (table.name, rid, json.dumps(merged)),
+                )
+            conn.executemany(
+                "DELETE FROM replica_rows WHERE table_name = ? AND record_id = ?",
+                [(table.name, rid) for rid in deletes],
+            )
+            count = conn.execute("SELECT COUNT(*) FROM replica_rows WHERE table_name = ?", (table.name,)).fetchone()[0]
+            conn.execute(
+                "UPDATE replica_meta SET delta_link = ?, last_sync = ?, last_error = NULL, row_count = ? WHERE table_name = ?",
+                (next_delta or delta_link, now, count, table.name),
+            )
+        return {"mode": "delta", "upserts": len(upserts), "deletes": len(deletes)}
+
+    def _claim(self, name, force):
+        """Cross-worker claim: only sync when no worker attempted within the cadence."""
+        table = self.tables[name]
+        now = time.time()
+        with immediate(self._conn()) as conn:
+            row = conn.execute("SELECT last_attempt FROM replica_meta WHERE table_name = ?", (name,)).fetchone()
+            last_attempt = (row[0] if row else None) or 0
+            if not force and now - last_attempt < table.refresh_seconds:
+                return False
+            conn.execute("UPDATE replica_meta SET last_attempt = ? WHERE table_name = ?", (now, name))
+        return True
+
+    def sync(self, name, force=False):
+        """Bring one table up to date. Returns a summary dict or None when skipped."""
+        table = self.tables[name]
+        lock = self._sync_locks[name]
+        if not lock.acquire(blocking=force):
+            return None
+        try:
+            if not self._claim(name, force):
+                return None
+            token = self.token_provider()
+            entity_set = table.resolve(table.entity_set, token)
+            select = table.resolve(table.select, token)
+            primary_key = table.resolve(table.primary_key, token)
+            if isinstance(select, (list, tuple)):
+                select = ",".join(dict.fromkeys(f for f in select if f))
+            meta = self._meta(name)
+            started = time.time()
+            try:
+                same_shape = meta.get("entity_set") == entity_set and meta.get("select_clause") == select
+                if meta.get("delta_link") and same_shape:
+                    try:
+                        result = self._delta_sync(table, token, meta["delta_link"], primary_key)
+                    except Exception as delta_err:
+                        # 410 Gone / invalid token: start over with a full snapshot.
+                        # Anything else (throttling, 5xx) is retried on the next cycle.
+                        if getattr(delta_err, "status_code", None) not in (400, 404, 410):
+                            raise
+                        print(f"[REPLICA] Delta link for {name} rejected ({delta_err}); resyncing")
+                        result = self._full_sync(table, token, entity_set, select, primary_key)
+                else:
+                    result = self._full_sync(table, token, entity_set, select, primary_key)
+                # Writes that landed after this sync started keep the table dirty
+                self._conn().execute(
+                    "UPDATE replica_meta SET dirty_at = NULL WHERE table_name = ? AND dirty_at <= ?", (name, started)
+                )
+                print(f"[REPLICA] {name}: {result}")
+                return result
+            except Exception as e:
+                self._conn().execute(
+                    "UPDATE replica_meta SET last_error = ? WHERE table_name = ?", (str(e)[:500], name)
+                )
+                print(f"[REPLICA] Sync failed for {name}: {e}")
+                return {"mode": "error", "error": str(e)}
+        finally:
+            lock.release()
+
+    # ---------- router ----------
+    def invalidate(self, name):
+        """Mark a table as changed by a write; visible to every worker sharing the db."""
+        if name not in self.tables:
+            return
+        try:
+            self._conn().execute("UPDATE replica_meta SET dirty_at = ? WHERE table_name = ?", (time.time(), name))
+        except Exception as e:
+            print(f"[REPLICA] Could not mark {name} dirty: {e}")
+
+    def read(self, name, max_age=None):
+        """Replica rows for name, or None when the replica is disabled, missing or stale."""
+        if not REPLICA_ENABLED or name not in self.tables:
+            return None
+        table = self.tables[name]
+        try:
+            if self._meta(name).get("dirty_at"):
+                self.sync(name, force=True)
+            meta = self._meta(name)
+            last_sync = meta.get("last_sync")
+            if not last_sync or meta.get("last_full_sync") is None or meta.get("dirty_at"):
+                return None
+            if time.time() - last_sync > (max_age or table.max_staleness):
+                return None
+            rows = self._conn().execute(
+                "SELECT data FROM replica_rows WHERE table_name = ?", (name,)
+            ).fetchall()
+            return [json.loads(r[0]) for r in rows]
+        except Exception as e:
+            print(f"[REPLICA] Read failed for {name}, falling back to Dataverse: {e}")
+            return None
+
+    def status(self):
+        now = time.time()
+        out = {}
+        for name, table in self.tables.items():
+            meta = self._meta(name)
+            age = now - meta["last_sync"] if meta.get("last_sync") else None
+            out[name] = {
+                "entity_set": meta.get("entity_set"),
+                "rows": meta.get("row_count") or 0,
+                "refresh_seconds": table.refresh_seconds,
+                "max_staleness": table.max_staleness,
+                "last_sync": meta.get("last_sync"),
+                "last_full_sync": meta.get("last_full_sync"),
+                "age_seconds": round(age, 1) if age is not None else None,
+                "stale": age is None or age > table.max_staleness,
+                "delta_tracking": bool(meta.get("delta_link")),
+                "dirty": bool(meta.get("dirty_at")),
+                "last_error": meta.get("last_error"),
+            }
+        return out
+
+    # ---------- background loop ----------
+    def _loop(self):
+        while not self._loop_stop.wait(REPLICA_LOOP_INTERVAL):
+            for name in list(self.tables):
+                try:
+                    self.sync(name)
+                except Exception as e:
+                    print(f"[REPLICA] Loop error for {name}: {e}")
+
+    def start(self):
+        """Start the background refresh thread (idempotent)."""
+        if not REPLICA_ENABLED or (self._loop_thread and self._loop_thread.is_alive()):
+            return
+        self._loop_stop.clear()
+        self._loop_thread = threading.Thread(target=self._loop, name="dataverse-replica", daemon=True)
+        self._loop_thread.start()
+        print(f"[REPLICA] Background sync started for {', '.join(self.tables) or 'no tables'}")
+
+    def stop(self):
+        self._loop_stop.set()
+
+
+get_replica = singleton(DataverseReplica)
@@ -0,0 +1,253 @@
+# document_uploads.py - Staging, image compression and dedup for onboarding documents
+#
+# upload_onboarding_documents read every file into memory with f.read() and
+# PATCHed them one after another to crc6f_documentsuploaded. That column is a
+# single Dataverse File column, so each PATCH replaced the previous file: only
+# the last document survived, after N full uploads (plus a second full send
+# whenever the first one hit 412).
+#
+# The upload path is now:
+#   - stage_documents() streams each upload into a spooled temp file (memory up
+#     to DOC_SPOOL_BYTES, disk beyond) while hashing it, and downscales and
+#     recompresses large JPEG/PNG scans. Files are staged concurrently on a
+#     small thread pool; identical files in one submission are kept once;
+#   - a single document is sent as is; several are bundled into one zip, so the
+#     column keeps all of them and Dataverse gets one streamed PATCH;
+#   - UploadLedger remembers the content key of what each record's column
+#     holds. Re-submitting the same documents skips the upload, and a column
+#     known to be filled is PATCHed with If-Match straight away.
+# Every staged file reports its own timings (stage/compress) and sizes.
+
+import hashlib
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite_store import SQLiteStore, singleton
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # compression is skipped without Pillow
+    Image = None
+
+DOC_SPOOL_BYTES = int(os.getenv("DOC_SPOOL_BYTES", str(1024 * 1024)))
+DOC_IMAGE_MAX_EDGE = int(os.getenv("DOC_IMAGE_MAX_EDGE", "2000"))
+DOC_IMAGE_MIN_BYTES = int(os.getenv("DOC_IMAGE_MIN_BYTES", str(300 * 1024)))
+DOC_JPEG_QUALITY = int(os.getenv("DOC_JPEG_QUALITY", "80"))
+DOC_STAGE_WORKERS = int(os.getenv("DOC_STAGE_WORKERS", "4"))
+DOCUMENT_UPLOADS_DB = os.getenv(
+    "DOCUMENT_UPLOADS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "document_uploads.db"),
+)
+ALLOWED_DOCUMENT_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png")
+_CHUNK = 64 * 1024
+
+
+class StagedDocument:
+    def __init__(self, name):
+        self.name = name
+        self.ext = os.path.splitext(name)[1].lower()
+        self.file = tempfile.SpooledTemporaryFile(max_size=DOC_SPOOL_BYTES)
+        self.sha256 = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compressed = False
+        self.duplicate_of = None
+        self.stage_ms = 0.0
+        self.compress_ms = 0.0
+        self.error = None
+
+    def body(self):
+        """Request body: bytes while small, the spooled file (streamed by requests) once on disk."""
+        self.file.seek(0)
+        if self.bytes_out <= DOC_SPOOL_BYTES:
+            return self.file.read()
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+    def report(self):
+        return {
+            "name": self.name,
+            "sha256": self.sha256,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "compressed": self.compressed,
+            "duplicate_of": self.duplicate_of,
+            "stage_ms": round(self.stage_ms, 1),
+            "compress_ms": round(self.compress_ms, 1),
+            "error": self.error,
+        }
+
+
+# ---------- staging ----------
+def _stage_one(name, stream):
+    doc = StagedDocument(name)
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+    try:
+        while True:
+            chunk = stream.read(_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            doc.file.write(chunk)
+            doc.bytes_in += len(chunk)
+        doc.sha256 = digest.hexdigest()
+        doc.bytes_out = doc.bytes_in
+        doc.stage_ms = (time.perf_counter() - started) * 1000
+        compress_image(doc)
+    except Exception as e:
+        doc.error = str(e)
+    return doc
+
+
+def compress_image(doc, max_edge=None, quality=None, min_bytes=None):
+    """Downscale/recompress a large JPEG/PNG in place; keeps the original when that is smaller."""
+    max_edge = max_edge or DOC_IMAGE_MAX_EDGE
+    quality = quality or DOC_JPEG_QUALITY
+    min_bytes = DOC_IMAGE_MIN_BYTES if min_bytes is None else min_bytes
+    if Image is None or doc.ext not in (".jpg", ".jpeg", ".png") or doc.bytes_in < min_bytes:
+        return False
+    started = time.perf_counter()
+    try:
+        doc.file.seek(0)
+        with Image.open(doc.file) as img:
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            out = tempfile.SpooledTemporaryFile(max_size=DOC_SPOOL_BYTES)
+            has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            if has_alpha:
+                img.save(out, "PNG", optimize=True)
+                ext = ".png"
+            else:
+                # Scans without transparency are far smaller as JPEG
+                img.convert("RGB").save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+                ext = ".jpg"
+        size = out.tell()
+        if size >= doc.bytes_in:
+            out.close()
+            return False
+        doc.file.close()
+        doc.file = out
+        doc.bytes_out = size
+        doc.compressed = True
+        if ext != doc.ext and not (ext == ".jpg" and doc.ext == ".jpeg"):
+            doc.name = os.path.splitext(doc.name)[0] + ext
+            doc.ext = ext
+        return True
+    except Exception as e:
+        print(f"[DOCS] Could not compress {doc.name}, sending original: {e}")
+        return False
+    finally:
+        doc.compress_ms = (time.perf_counter() - started) * 1000
+
+
+def stage_documents(files, workers=DOC_STAGE_WORKERS):
+    """
+    Stage uploads [(name, stream)] concurrently, in order. Later copies of the
+    same content are marked duplicate_of and released.
+    """
+    files = list(files)
+    if not files:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(files))), thread_name_prefix="doc-stage") as pool:
+        docs = list(pool.map(lambda item: _stage_one(*item), files))
+    first_by_hash = {}
+    for doc in docs:
+        if doc.error or doc.sha256 is None:
+            continue
+        if doc.sha256 in first_by_hash:
+            doc.duplicate_of = first_by_hash[doc.sha256].name
+            doc.close()
+        else:
+            first_by_hash[doc.sha256] = doc
+    return docs
+
+
+# ---------- payload ----------
+def content_key(docs):
+    """Stable key for a set of documents (zip bytes carry timestamps, so hash names + contents)."""
+    digest = hashlib.sha256()
+    for doc in sorted(docs, key=lambda d: (d.name, d.sha256)):
+        digest.update(f"{doc.name}\0{doc.sha256}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_payload(docs, bundle_name):
+    """
+    (file name, StagedDocument) to upload: the document itself when there is
+    one, otherwise a zip of all of them (images/PDFs are stored, not deflated).
+    """
+    if len(docs) == 1:
+        return docs[0].name, docs[0]
+    bundle = StagedDocument(bundle_name)
+    names = set()
+    with zipfile.ZipFile(bundle.file, "w", compression=zipfile.ZIP_STORED) as zf:
+        for doc in docs:
+            arcname = doc.name
+            n = 1
+            while arcname in names:
+                stem, ext = os.path.splitext(doc.name)
+                arcname = f"{stem} ({n}){ext}"
+                n += 1
+            names.add(arcname)
+            doc.file.seek(0)
+            with zf.open(arcname, "w") as dest:
+                while True:
+                    chunk = doc.file.read(_CHUNK)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+    bundle.bytes_in = bundle.bytes_out = bundle.file.tell()
+    bundle.sha256 = content_key(docs)
+    return bundle.name, bundle
+
+
+# ---------- dedup ledger ----------
+class UploadLedger(SQLiteStore):
+    """Content key of the file each (record, column) currently holds, shared by all workers."""
+
+    def __init__(self, db_path=DOCUMENT_UPLOADS_DB):
+        super().__init__(db_path)
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS uploaded_files (
+                record_id TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                content_key TEXT NOT NULL,
+                file_name TEXT,
+                size INTEGER,
+                uploaded_at REAL,
+                PRIMARY KEY (record_id, column_name)
+            )
+        """)
+
+    def current(self, record_id, column):
+        row = self._conn().execute(
+            "SELECT content_key, file_name, size, uploaded_at FROM uploaded_files WHERE record_id = ? AND column_name = ?",
+            (str(record_id), column),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"content_key": row[0], "file_name": row[1], "size": row[2], "uploaded_at": row[3]}
+
+    def remember(self, record_id, column, key, file_name, size):
+        self._conn().execute(
+            "INSERT INTO uploaded_files (record_id, column_name, content_key, file_name, size, uploaded_at)"
+            " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (record_id, column_name) DO UPDATE SET"
+            " content_key = excluded.content_key, file_name = excluded.file_name,"
+            " size = excluded.size, uploaded_at = excluded.uploaded_at",
+            (str(record_id), column, key, file_name, size, time.time()),
+        )
+
+    def forget(self, record_id, column):
+        self._conn().execute(
+            "DELETE FROM uploaded_files WHERE record_id = ? AND column_name = ?", (str(record_id), column)
+        )
+
+
+get_upload_ledger = singleton(UploadLedger)
@@ -0,0 +1,207 @@
+# employee_archive.py - Deleted-employee archive keyed by employee ID
+#
+# Deleted employees were kept in Deleted_employees.csv, opened relative to the
+# process's working directory (so starting the server from the repo root or
+# from backend/ gave two different archives). Listing read the whole file,
+# restore read it, created the employees one POST at a time and rewrote the
+# file, and appending the same employee twice left two rows.
+#
+# EmployeeArchive keeps one row per employee ID in a SQLite db next to the
+# other stores:
+#   - archive() upserts, so re-deleting an employee replaces the old snapshot;
+#   - page() lists in employee ID order with a cursor and an optional search
+#     (ID or name), without loading the rest of the archive;
+#   - restores claim their rows first (restoring_until, a lease), so two
+#     restores of the same employee cannot both recreate it; the caller
+#     creates the employees and then complete() deletes the rows, or release()
+#     hands them back when the Dataverse write failed;
+#   - the db uses incremental auto-vacuum: pages freed by restores and clears
+#     are returned to the filesystem, so the file stays compact.
+# A legacy Deleted_employees.csv (backend/ or the working directory) is
+# imported when first seen; its size and mtime are recorded so it is not
+# imported again.
+
+import json
+import os
+import time
+
+from sqlite_store import SQLiteStore, singleton
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+EMPLOYEE_ARCHIVE_DB = os.getenv(
+    "EMPLOYEE_ARCHIVE_DB",
+    os.path.join(_BACKEND_DIR, "storage", "deleted_employees.db"),
+)
+EMPLOYEE_ARCHIVE_LEGACY_CSV = "Deleted_employees.csv"
+RESTORE_LEASE_SECONDS = float(os.getenv("EMPLOYEE_RESTORE_LEASE_SECONDS", "300"))
+
+ARCHIVE_FIELDS = ("employee_id", "first_name", "last_name", "email", "contact_number",
+                  "address", "department", "designation", "doj", "active")
+
+
+def archive_record(emp):
+    """The archived snapshot of an employee dict (same fields and rules as the old CSV rows)."""
+    record = {field: str(emp.get(field) or "") for field in ARCHIVE_FIELDS if field != "active"}
+    record["employee_id"] = record["employee_id"].strip()
+    record["active"] = str(emp.get("active", "false")).lower() == "true"
+    return record
+
+
+class EmployeeArchive(SQLiteStore):
+    # Only takes effect on a new db, so connect() runs it before journal_mode
+    pragmas = ("auto_vacuum=INCREMENTAL",)
+
+    def __init__(self, db_path=EMPLOYEE_ARCHIVE_DB, legacy_csv_paths=None):
+        super().__init__(db_path)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS deleted_employees (
+                employee_id TEXT PRIMARY KEY,
+                search TEXT NOT NULL,
+                data TEXT NOT NULL,
+                archived_at REAL NOT NULL,
+                restoring_until REAL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive_imports (
+                path TEXT PRIMARY KEY,
+                signature TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                imported_at REAL NOT NULL
+            )
+        """)
+        if legacy_csv_paths is None:
+            legacy_csv_paths = [os.path.join(_BACKEND_DIR, EMPLOYEE_ARCHIVE_LEGACY_CSV),
+                                os.path.abspath(EMPLOYEE_ARCHIVE_LEGACY_CSV)]
+        for path in dict.fromkeys(os.path.abspath(p) for p in legacy_csv_paths):
+            if os.path.isfile(path):
+                self._import_csv(path)
+
+    @staticmethod
+    def _upsert(conn, records, now):
+        conn.executemany(
+            "INSERT INTO deleted_employees (employee_id, search, data, archived_at, restoring_until) "
+            "VALUES (?, ?, ?, ?, NULL) "
+            "ON CONFLICT(employee_id) DO UPDATE SET search = excluded.search, data = excluded.data, "
+            "archived_at = excluded.archived_at, restoring_until = NULL",
+            [(r["employee_id"],
+              f"{r['employee_id']} {r['first_name']} {r['last_name']}".strip().lower(),
+              json.dumps(r, ensure_ascii=False, separators=(",", ":")), now) for r in records])
+
+    def _import_csv(self, path):
+        import csv
+
+        st = os.stat(path)
+        signature = f"{st.st_size}:{st.st_mtime_ns}"
+        row = self._conn().execute("SELECT signature FROM archive_imports WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == signature:
+            return 0
+        try:
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                records = [archive_record(r) for r in csv.DictReader(f)]
+        except Exception as e:
+            print(f"[EMP ARCHIVE] Could not read {path}: {e}")
+            return 0
+        records = list({r["employee_id"]: r for r in records if r["employee_id"]}.values())
+
+        def apply(conn):
+            self._upsert(conn, records, time.time())
+            conn.execute("INSERT OR REPLACE INTO archive_imports (path, signature, rows, imported_at) VALUES (?, ?, ?, ?)",
+                         (path, signature, len(records), time.time()))
+
+        self._transaction(apply)
+        print(f"[EMP ARCHIVE] Imported {len(records)} deleted employees from {path}")
+        return len(records)
+
+    # ---------- writes ----------
+    def archive(self, employees):
+        """Upsert snapshots of deleted employees. Returns how many were stored."""
+        records = [archive_record(e) for e in employees]
+        records = list({r["employee_id"]: r for r in records if r["employee_id"]}.values())
+        if records:
+            self._transaction(lambda conn: self._upsert(conn, records, time.time()))
+        return len(records)
+
+    def claim(self, employee_ids, lease_seconds=RESTORE_LEASE_SECONDS):
+        """Take archived rows for a restore. Returns (records, missing_ids); rows held by another restore count as missing."""
+        ids = list(dict.fromkeys(str(i).strip() for i in employee_ids if str(i or "").strip()))
+
+        def apply(conn):
+            now = time.time()
+            records = []
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT employee_id, data FROM deleted_employees WHERE employee_id IN ({marks}) "
+                    "AND (restoring_until IS NULL OR restoring_until < ?)", (*chunk, now)).fetchall()
+                conn.executemany("UPDATE deleted_employees SET restoring_until = ? WHERE employee_id = ?",
+                                 [(now + lease_seconds, emp_id) for emp_id, _ in rows])
+                records.extend(json.loads(data) for _, data in rows)
+            return records
+
+        records = self._transaction(apply)
+        found = {r["employee_id"] for r in records}
+        order = {emp_id: n for n, emp_id in enumerate(ids)}
+        records.sort(key=lambda r: order[r["employee_id"]])
+        return records, [i for i in ids if i not in found]
+
+    def _delete(self, where, params):
+        self._transaction(lambda conn: conn.execute(f"DELETE FROM deleted_employees {where}", params))
+        conn = self._conn()
+        # Some SQLite builds free one page per step of the pragma; repeat until the freelist is empty
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free:
+            conn.execute(f"PRAGMA incremental_vacuum({free})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free:
+                break
+            free = remaining
+
+    def complete(self, employee_ids):
+        """Drop rows whose employees were recreated."""
+        ids = list(employee_ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            self._delete(f"WHERE employee_id IN ({','.join('?' * len(chunk))})", chunk)
+
+    def release(self, employee_ids):
+        """Give claimed rows back after a failed restore."""
+        ids = list(employee_ids)
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE deleted_employees SET restoring_until = NULL WHERE employee_id = ?", [(i,) for i in ids]))
+
+    def clear(self):
+        count = self.count()
+        self._delete("", ())
+        return count
+
+    # ---------- reads ----------
+    def count(self, query=None):
+        if query:
+            return self._conn().execute("SELECT COUNT(*) FROM deleted_employees WHERE search LIKE ?",
+                                        (f"%{query.strip().lower()}%",)).fetchone()[0]
+        return self._conn().execute("SELECT COUNT(*) FROM deleted_employees").fetchone()[0]
+
+    def page(self, limit=None, after=None, query=None):
+        """Archived employees in ID order: (records, total, next_cursor). limit=None returns the rest."""
+        clauses, params = [], []
+        if query:
+            clauses.append("search LIKE ?")
+            params.append(f"%{query.strip().lower()}%")
+        if after:
+            clauses.append("employee_id > ?")
+            params.append(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT data FROM deleted_employees {where} ORDER BY employee_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        records = [json.loads(data) for (data,) in self._conn().execute(sql, params)]
+        more = limit is not None and len(records) > limit
+        records = records[:limit] if more else records
+        return records, self.count(query), (records[-1]["employee_id"] if more else None)
+
+
+get_employee_archive = singleton(EmployeeArchive)
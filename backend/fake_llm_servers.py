@@ -0,0 +1,124 @@
+"""
+Minimal offline stand-ins for the Gemini and Hugging Face inference APIs, used
+to exercise ai_provider_router.py (hedging, failover, latency stats) without
+network access or API keys.
+
+Supports what ask_gemini / ask_hf need:
+  - Gemini: POST <base>/models/<model>:generateContent  -> {"candidates": [...]}
+            POST <base>/models/<model>:streamGenerateContent?alt=sse -> one SSE
+            event per word of the answer
+  - Hugging Face: POST <base>/                          -> [{"generated_text": ...}]
+  - per-server `latency` (seconds before answering), `status` (non-200 answers
+    with an error body) and `answer`
+
+Usage:
+    gemini = FakeGeminiServer(answer="from gemini", latency=0.5)
+    base = gemini.start()            # http://127.0.0.1:<port>/v1  -> GEMINI_API_BASE
+    hf = FakeHFServer(answer="from hf")
+    url = hf.start()                 # http://127.0.0.1:<port>/    -> HF_API_URL
+    ...
+    gemini.stop(); hf.stop()
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _FakeLLMServer:
+    path_prefix = "/"
+
+    def __init__(self, answer="ok", latency=0.0, status=200):
+        self.answer = answer
+        self.latency = latency
+        self.status = status
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = None
+        self.base_url = None
+
+    def body(self, request_json):
+        raise NotImplementedError
+
+    # ---------- http ----------
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    request_json = json.loads(raw or b"{}")
+                except ValueError:
+                    request_json = {}
+                with fake._lock:
+                    fake.requests.append({"path": self.path, "json": request_json})
+                    latency, status = fake.latency, fake.status
+
+                if latency:
+                    time.sleep(latency)
+                if status == 200 and ":streamGenerateContent" in self.path:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    try:
+                        for event in fake.stream_events(request_json):
+                            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+                            self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass
+                    return
+                if status != 200:
+                    payload = {"error": {"code": status, "message": "fake failure"}}
+                else:
+                    payload = fake.body(request_json)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}{self.path_prefix}"
+        return self.base_url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class FakeGeminiServer(_FakeLLMServer):
+    path_prefix = "/v1"
+
+    def stream_events(self, request_json):
+        words = self.answer.split(" ")
+        for n, word in enumerate(words):
+            text = word if n == len(words) - 1 else word + " "
+            yield {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+    def body(self, request_json):
+        return {"candidates": [{"content": {"parts": [{"text": self.answer}], "role": "model"},
+                                "finishReason": "STOP"}]}
+
+
+class FakeHFServer(_FakeLLMServer):
+    path_prefix = "/"
+
+    def body(self, request_json):
+        return [{"generated_text": self.answer}]
@@ -0,0 +1,171 @@
+# google_calendar_client.py - Process-wide Google Calendar service for /api/meet/start
+#
+# get_google_calendar_service() used to reload the OAuth token from the
+# SQLAlchemy store, maybe refresh it, and call discovery.build() on every
+# meeting start. Here:
+#   - credentials are loaded once per process and kept fresh by a daemon
+#     renewer that refreshes RENEW_MARGIN seconds before expiry (under a lock,
+#     so a request thread and the renewer never refresh at the same time);
+#   - the calendar v3 discovery document is the static copy bundled with
+#     google-api-python-client, parsed once; no discovery HTTP call is made;
+#   - the built service is cached per thread (httplib2 connections are not
+#     thread-safe) and rebuilt only when the credentials object changes.
+
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+GOOGLE_TOKEN_REFRESH_MARGIN = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "120"))
+GOOGLE_TOKEN_RENEW_MARGIN = int(os.getenv("GOOGLE_TOKEN_RENEW_MARGIN", "600"))
+
+
+class GoogleCredentialsMissing(RuntimeError):
+    pass
+
+
+class GoogleCalendarClient:
+    def __init__(self, load_token, save_token, scopes,
+                 refresh_margin=GOOGLE_TOKEN_REFRESH_MARGIN, renew_margin=GOOGLE_TOKEN_RENEW_MARGIN,
+                 transport=None, clock=None):
+        """
+        load_token() -> token JSON string or None; save_token(token_json) persists a
+        refreshed token. transport is the google.auth Request used for refreshes.
+        clock() returns the current time as a naive UTC datetime (tests pin it).
+        """
+        self.load_token = load_token
+        self.save_token = save_token
+        self.scopes = scopes
+        self.transport = transport or Request()
+        self.clock = clock or (lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+        self.refresh_margin = refresh_margin
+        self.renew_margin = max(renew_margin, refresh_margin)
+        self._creds = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._discovery_doc = None
+        self._renewer = None
+        self._stop = threading.Event()
+        self.renewed = threading.Event()    # set after each pass of the background renewer
+        self.refresh_count = 0
+        self.build_count = 0
+
+    # ---------- credentials ----------
+    def _seconds_left(self, creds):
+        if creds.expiry is None:
+            return float("inf") if creds.token else 0.0
+        # google-auth keeps expiry as a naive UTC datetime
+        return (creds.expiry - self.clock()).total_seconds()
+
+    def _load(self):
+        token_json = self.load_token()
+        if not token_json:
+            return None
+        return Credentials.from_authorized_user_info(json.loads(token_json), self.scopes)
+
+    def _refresh_locked(self, margin):
+        """Caller holds self._lock."""
+        if self._creds is None:
+            self._creds = self._load()
+            if self._creds is None:
+                return None
+        creds = self._creds
+        if creds.refresh_token and (not creds.token or self._seconds_left(creds) <= margin):
+            creds.refresh(self.transport)
+            self.refresh_count += 1
+            try:
+                self.save_token(creds.to_json())
+            except Exception as e:
+                print(f"[GOOGLE] Failed to persist refreshed credentials: {e}")
+            print(f"[GOOGLE] Refreshed OAuth credentials (valid until {creds.expiry})")
+        return creds
+
+    def get_credentials(self):
+        creds = self._creds
+        if creds is not None and creds.token and self._seconds_left(creds) > self.refresh_margin:
+            return creds
+        with self._lock:
+            creds = self._refresh_locked(self.refresh_margin)
+        if creds is None:
+            raise GoogleCredentialsMissing(
+                "Google OAuth credentials not found. Please authorize via /google/authorize."
+            )
+        self.start_renewer()
+        return creds
+
+    def set_credentials(self, creds):
+        """Adopt credentials from the OAuth callback (already persisted by the caller)."""
+        with self._lock:
+            self._creds = creds
+        self.start_renewer()
+
+    def invalidate(self):
+        """Forget the cached credentials; the next call reloads them from the token store."""
+        with self._lock:
+            self._creds = None
+
+    # ---------- service ----------
+    def _discovery(self):
+        if self._discovery_doc is None:
+            doc = get_static_doc("calendar", "v3")
+            if doc is None:
+                raise RuntimeError("Bundled calendar v3 discovery document not found in google-api-python-client")
+            self._discovery_doc = json.loads(doc)
+        return self._discovery_doc
+
+    def service(self):
+        creds = self.get_credentials()
+        cached = getattr(self._local, "service", None)
+        if cached is not None and self._local.creds is creds:
+            return cached
+        service = build_from_document(self._discovery(), credentials=creds)
+        self.build_count += 1
+        self._local.service = service
+        self._local.creds = creds
+        return service
+
+    # ---------- background renewal ----------
+    def start_renewer(self):
+        if self._renewer is not None and self._renewer.is_alive():
+            return
+        with self._lock:
+            if self._renewer is not None and self._renewer.is_alive():
+                return
+            self._stop.clear()
+            self._renewer = threading.Thread(target=self._renew_loop, name="google-token-renewer", daemon=True)
+            self._renewer.start()
+
+    def _next_delay(self):
+        creds = self._creds
+        if creds is None or not creds.refresh_token:
+            return None
+        return max(1.0, self._seconds_left(creds) - self.renew_margin)
+
+    def _renew_loop(self):
+        delay = self._next_delay()
+        while delay is not None and not self._stop.wait(delay):
+            try:
+                with self._lock:
+                    self._refresh_locked(self.renew_margin)
+                delay = self._next_delay()
+            except Exception as e:
+                print(f"[GOOGLE] Background credential renewal failed: {e}")
+                delay = 60.0
+            self.renewed.set()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        creds = self._creds
+        return {
+            "loaded": creds is not None,
+            "seconds_left": round(self._seconds_left(creds)) if creds is not None and creds.expiry else None,
+            "refresh_count": self.refresh_count,
+            "build_count": self.build_count,
+        }
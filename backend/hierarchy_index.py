@@ -0,0 +1,247 @@
+# hierarchy_index.py - Materialised closure of the team hierarchy (crc6f_hierarchy)
+#
+# Each hierarchy row is an edge employee -> manager. The index keeps, for every
+# employee, the full ancestor map {manager: depth} and, for every manager, the
+# descendant map {employee: depth}, so "all reports of X" and "management chain
+# of Y" are dictionary lookups instead of repeated Dataverse scans.
+#
+# Rows can give an employee more than one manager, so the closure is over a DAG.
+# Inserts apply the closure-table rule (ancestors(manager) x descendants(employee));
+# deletes recompute ancestors only for the affected subtree. Edges that would
+# close a cycle are rejected (HierarchyCycleError) or, when loading existing
+# data, skipped and reported via .cycles.
+#
+# unified_server registers a loader with configure(); the index reloads itself
+# every HIERARCHY_INDEX_TTL seconds so changes made by other workers converge.
+
+import os
+import threading
+import time
+
+HIERARCHY_INDEX_TTL = int(os.getenv("HIERARCHY_INDEX_TTL", "300"))
+
+# Dataverse caps URL length; keep In(...) value lists comfortably below it
+ODATA_IN_CHUNK = 200
+
+
+class HierarchyCycleError(ValueError):
+    pass
+
+
+def _norm(value):
+    return str(value or "").strip().upper()
+
+
+class HierarchyIndex:
+    def __init__(self, ttl=HIERARCHY_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._loader = None
+        self._loaded_at = 0.0
+        self._clear()
+
+    def _clear(self):
+        self._records = {}      # record_id -> (employee, manager)
+        self._parents = {}      # employee -> {manager: edge_count}
+        self._children = {}     # manager -> {employee: edge_count}
+        self._anc = {}          # employee -> {ancestor: depth}
+        self._desc = {}         # ancestor -> {employee: depth}
+        self.cycles = []
+
+    def configure(self, loader):
+        """loader() returns an iterable of (record_id, employee_id, manager_id)."""
+        self._loader = loader
+
+    # ---------- loading ----------
+    def load(self, rows):
+        with self._lock:
+            self._clear()
+            for record_id, employee_id, manager_id in rows or []:
+                try:
+                    self._add_edge(record_id, employee_id, manager_id)
+                except HierarchyCycleError as e:
+                    self.cycles.append({"id": record_id, "employeeId": _norm(employee_id), "managerId": _norm(manager_id)})
+                    print(f"[HIERARCHY] Skipping cyclic row {record_id}: {e}")
+            self._loaded_at = time.time()
+            if self.cycles:
+                print(f"[HIERARCHY] {len(self.cycles)} cyclic row(s) ignored while building index")
+
+    def _ensure_fresh(self):
+        if not self._loader:
+            return
+        if self._loaded_at and time.time() - self._loaded_at < self.ttl:
+            return
+        try:
+            rows = list(self._loader())
+        except Exception as e:
+            print(f"[HIERARCHY] Index reload failed, keeping previous closure: {e}")
+            self._loaded_at = time.time()
+            return
+        self.load(rows)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+    # ---------- closure maintenance ----------
+    def _ancestors_with_self(self, node):
+        out = {node: 0}
+        out.update(self._anc.get(node, {}))
+        return out
+
+    def _descendants_with_self(self, node):
+        out = {node: 0}
+        out.update(self._desc.get(node, {}))
+        return out
+
+    def would_create_cycle(self, employee_id, manager_id):
+        emp, mgr = _norm(employee_id), _norm(manager_id)
+        if not emp or not mgr:
+            return False
+        with self._lock:
+            self._ensure_fresh()
+            return emp == mgr or mgr in self._desc.get(emp, {})
+
+    def _add_edge(self, record_id, employee_id, manager_id):
+        emp, mgr = _norm(employee_id), _norm(manager_id)
+        if not emp or not mgr:
+            return
+        if emp == mgr or mgr in self._desc.get(emp, {}):
+            raise HierarchyCycleError(f"{mgr} reports (directly or indirectly) to {emp}")
+        if record_id:
+            self._records[str(record_id)] = (emp, mgr)
+        self._parents.setdefault(emp, {})
+        self._parents[emp][mgr] = self._parents[emp].get(mgr, 0) + 1
+        self._children.setdefault(mgr, {})
+        self._children[mgr][emp] = self._children[mgr].get(emp, 0) + 1
+
+        for a, da in self._ancestors_with_self(mgr).items():
+            for d, dd in self._descendants_with_self(emp).items():
+                depth = da + 1 + dd
+                cur = self._anc.setdefault(d, {}).get(a)
+                if cur is None or depth < cur:
+                    self._anc[d][a] = depth
+                    self._desc.setdefault(a, {})[d] = depth
+
+    def _remove_edge(self, emp, mgr):
+        counts = self._parents.get(emp, {})
+        if mgr not in counts:
+            return
+        counts[mgr] -= 1
+        if counts[mgr] > 0:
+            return  # a duplicate row still holds this edge
+        del counts[mgr]
+        del self._children[mgr][emp]
+
+        # Recompute ancestors for the employee's subtree, parents before children
+        subtree = self._descendants_with_self(emp)
+        for node in subtree:
+            for a in self._anc.pop(node, {}):
+                self._desc.get(a, {}).pop(node, None)
+        for node in self._topological(subtree):
+            anc = {}
+            for parent in self._parents.get(node, {}):
+                for a, da in self._ancestors_with_self(parent).items():
+                    depth = da + 1
+                    if a not in anc or depth < anc[a]:
+                        anc[a] = depth
+            if anc:
+                self._anc[node] = anc
+                for a, depth in anc.items():
+                    self._desc.setdefault(a, {})[node] = depth
+
+    def _topological(self, nodes):
+        """Order nodes so every node comes after its parents inside the same set."""
+        pending = {n: sum(1 for p in self._parents.get(n, {}) if p in nodes) for n in nodes}
+        ready = [n for n, c in pending.items() if c == 0]
+        out = []
+        while ready:
+            node = ready.pop()
+            out.append(node)
+            for child in self._children.get(node, {}):
+                if child in pending:
+                    pending[child] -= 1
+                    if pending[child] == 0:
+                        ready.append(child)
+        return out
+
+    # ---------- incremental writers (called from the hierarchy endpoints) ----------
+    def add(self, record_id, employee_id, manager_id):
+        with self._lock:
+            self._ensure_fresh()
+            if record_id and str(record_id) in self._records:
+                return  # already picked up by the reload
+            self._add_edge(record_id, employee_id, manager_id)
+
+    def update(self, record_id, manager_id, employee_id=None):
+        """Move an existing row to a new manager; raises HierarchyCycleError and leaves the index untouched."""
+        with self._lock:
+            self._ensure_fresh()
+            old = self._records.get(str(record_id))
+            emp = _norm(employee_id) or (old[0] if old else "")
+            if not emp:
+                self.invalidate()
+                return
+            if old == (emp, _norm(manager_id)):
+                return
+            if self.would_create_cycle(emp, manager_id):
+                raise HierarchyCycleError(f"{_norm(manager_id)} reports (directly or indirectly) to {emp}")
+            if old:
+                self._remove_edge(*old)
+                self._records.pop(str(record_id), None)
+            self._add_edge(record_id, emp, manager_id)
+
+    def remove(self, record_id):
+        with self._lock:
+            self._ensure_fresh()
+            old = self._records.pop(str(record_id), None)
+            if old:
+                self._remove_edge(*old)
+
+    def employee_of(self, record_id):
+        with self._lock:
+            self._ensure_fresh()
+            old = self._records.get(str(record_id))
+            return old[0] if old else None
+
+    # ---------- queries ----------
+    def reports_of(self, manager_id, depth=None):
+        """Employees reporting to manager_id, transitively. depth=1 gives direct reports only."""
+        with self._lock:
+            self._ensure_fresh()
+            desc = self._desc.get(_norm(manager_id), {})
+            if depth is None:
+                return sorted(desc)
+            return sorted(e for e, d in desc.items() if d <= depth)
+
+    def chain_of(self, employee_id):
+        """Management chain of employee_id ordered nearest manager first."""
+        with self._lock:
+            self._ensure_fresh()
+            anc = self._anc.get(_norm(employee_id), {})
+            return [a for a, _ in sorted(anc.items(), key=lambda kv: (kv[1], kv[0]))]
+
+    def depth_between(self, manager_id, employee_id):
+        with self._lock:
+            self._ensure_fresh()
+            return self._desc.get(_norm(manager_id), {}).get(_norm(employee_id))
+
+
+def odata_in_filters(field, values, chunk_size=ODATA_IN_CHUNK):
+    """Build Dataverse In() filter clauses for field, chunked to stay under URL limits."""
+    vals = [str(v).replace("'", "''") for v in dict.fromkeys(values or []) if v]
+    out = []
+    for i in range(0, len(vals), chunk_size):
+        quoted = ",".join(f"'{v}'" for v in vals[i:i + chunk_size])
+        out.append(f"Microsoft.Dynamics.CRM.In(PropertyName='{field}',PropertyValues=[{quoted}])")
+    return out
+
+
+_index = None
+
+
+def get_hierarchy_index():
+    global _index
+    if _index is None:
+        _index = HierarchyIndex()
+    return _index
@@ -0,0 +1,176 @@
+# id_sequences.py - Shared high-water marks for generated record IDs
+#
+# generate_employee_id, generate_project_id, /api/clients/next-id and the
+# board/contributor/task generators each queried Dataverse for the newest row
+# and added one, so every create paid an extra round trip and two gunicorn
+# workers creating at the same time handed out the same ID. Leave IDs were
+# random strings.
+#
+# IdSequences keeps one row per namespace (employee, project, ...) in a SQLite
+# db shared by all workers:
+#   - next() bumps the high-water mark inside BEGIN IMMEDIATE, so allocation is
+#     atomic across workers and costs one local write, no network;
+#   - reserve(n) takes a contiguous block in the same single write (bulk import);
+#   - observe() raises the mark past IDs supplied by the caller (CSV columns,
+#     client IDs typed in the form) so later allocations do not reuse them;
+#   - a namespace is seeded once from Dataverse (its registered seeder returns
+#     the highest number in use); seeded_at is persisted, so restarts and other
+#     workers skip it. seed_all() runs at startup in the background.
+# Until a namespace is seeded, next()/reserve() seed it inline; if that fails
+# they raise SequenceUnavailable instead of guessing a number.
+
+import os
+import re
+import threading
+import time
+
+from sqlite_store import SQLiteStore, singleton
+
+ID_SEQUENCES_DB = os.getenv(
+    "ID_SEQUENCES_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "id_sequences.db"),
+)
+
+
+class SequenceUnavailable(RuntimeError):
+    """The namespace has never been seeded and seeding failed."""
+
+
+class IdSequences(SQLiteStore):
+    def __init__(self, db_path=ID_SEQUENCES_DB):
+        super().__init__(db_path)
+        self._formats = {}
+        self._seeders = {}
+        self._seed_lock = threading.Lock()
+        self._seed_locks = {}
+        self.last_error = None
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS sequences (
+                namespace TEXT PRIMARY KEY,
+                high_water INTEGER NOT NULL DEFAULT 0,
+                seeded_at REAL,
+                updated_at REAL
+            )
+        """)
+
+    # ---------- namespaces ----------
+    def register(self, namespace, prefix, width=3, seeder=None):
+        """Declare how a namespace formats (prefix + zero-padded number) and how it seeds."""
+        self._formats[namespace] = (prefix, width)
+        if seeder is not None:
+            self._seeders[namespace] = seeder
+
+    def format(self, namespace, number):
+        prefix, width = self._formats[namespace]
+        return f"{prefix}{int(number):0{width}d}"
+
+    def parse(self, namespace, value):
+        """Number of an ID in this namespace ('EMP012' -> 12), or None."""
+        prefix, _ = self._formats[namespace]
+        match = re.fullmatch(rf"{re.escape(prefix)}(\d+)", str(value or "").strip().upper())
+        return int(match.group(1)) if match else None
+
+    def max_number(self, namespace, values):
+        """Highest number among IDs of this namespace in values (0 when none) - for seeders."""
+        numbers = (self.parse(namespace, v) for v in values)
+        return max((n for n in numbers if n is not None), default=0)
+
+    # ---------- seeding ----------
+    def is_seeded(self, namespace):
+        row = self._conn().execute("SELECT seeded_at FROM sequences WHERE namespace = ?", (namespace,)).fetchone()
+        return bool(row and row[0])
+
+    def seed(self, namespace, force=False):
+        """Raise the mark to the seeder's highest number in use. Returns False when the seeder failed."""
+        if not force and self.is_seeded(namespace):
+            return True
+        seeder = self._seeders.get(namespace)
+        if seeder is None:
+            raise SequenceUnavailable(f"no seeder registered for {namespace}")
+        # Per namespace: a slow seeder must not hold up the others
+        with self._seed_lock:
+            namespace_lock = self._seed_locks.setdefault(namespace, threading.Lock())
+        with namespace_lock:
+            if not force and self.is_seeded(namespace):
+                return True
+            try:
+                highest = int(seeder() or 0)
+            except Exception as e:
+                self.last_error = f"{namespace}: {e}"
+                print(f"[ID SEQ] Seeding {namespace} failed: {e}")
+                return False
+            now = time.time()
+            # MAX(): another worker may have seeded and allocated meanwhile
+            self._transaction(lambda conn: conn.execute(
+                "INSERT INTO sequences (namespace, high_water, seeded_at, updated_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (namespace) DO UPDATE SET high_water = MAX(high_water, excluded.high_water),"
+                " seeded_at = excluded.seeded_at, updated_at = excluded.updated_at",
+                (namespace, highest, now, now),
+            ))
+        print(f"[ID SEQ] Seeded {namespace} at {highest}")
+        return True
+
+    def seed_all(self):
+        """Seed every registered namespace that has not been seeded yet."""
+        return {ns: self.seed(ns) for ns in list(self._seeders)}
+
+    def start(self):
+        """Seed unseeded namespaces in a daemon thread so startup does not wait on Dataverse."""
+        threading.Thread(target=self.seed_all, name="id-sequences-seed", daemon=True).start()
+
+    def _ensure_seeded(self, namespace):
+        if not self.is_seeded(namespace) and not self.seed(namespace):
+            raise SequenceUnavailable(f"{namespace} sequence is not seeded: {self.last_error}")
+
+    # ---------- allocation ----------
+    def _bump(self, namespace, count):
+        def apply(conn):
+            conn.execute(
+                "UPDATE sequences SET high_water = high_water + ?, updated_at = ? WHERE namespace = ?",
+                (count, time.time(), namespace),
+            )
+            return conn.execute("SELECT high_water FROM sequences WHERE namespace = ?", (namespace,)).fetchone()[0]
+        last = self._transaction(apply)
+        return range(last - count + 1, last + 1)
+
+    def next(self, namespace):
+        """Allocate the next ID of the namespace (e.g. 'EMP043')."""
+        self._ensure_seeded(namespace)
+        return self.format(namespace, self._bump(namespace, 1)[0])
+
+    def reserve(self, namespace, count):
+        """Allocate `count` consecutive IDs in one write."""
+        if count <= 0:
+            return []
+        self._ensure_seeded(namespace)
+        return [self.format(namespace, n) for n in self._bump(namespace, int(count))]
+
+    def peek(self, namespace):
+        """The ID next() would return now, without allocating it (form pre-fill)."""
+        self._ensure_seeded(namespace)
+        row = self._conn().execute("SELECT high_water FROM sequences WHERE namespace = ?", (namespace,)).fetchone()
+        return self.format(namespace, row[0] + 1)
+
+    def observe(self, namespace, value):
+        """Record that an ID was used outside next(); returns True when the mark moved."""
+        number = value if isinstance(value, int) else self.parse(namespace, value)
+        if number is None:
+            return False
+
+        def apply(conn):
+            return conn.execute(
+                "UPDATE sequences SET high_water = ?, updated_at = ? WHERE namespace = ? AND high_water < ?",
+                (number, time.time(), namespace, number),
+            ).rowcount > 0
+        return self._transaction(apply)
+
+    def stats(self):
+        rows = self._conn().execute("SELECT namespace, high_water, seeded_at FROM sequences").fetchall()
+        return {
+            "namespaces": {ns: {"high_water": hw, "seeded": bool(seeded)} for ns, hw, seeded in rows},
+            "registered": sorted(self._formats),
+            "last_error": self.last_error,
+        }
+
+
+get_id_sequences = singleton(IdSequences)
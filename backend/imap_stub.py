@@ -0,0 +1,216 @@
+"""
+Minimal offline stand-in for an IMAP server, used to exercise the mail reply
+ingester (mail_ingest.py) without a real mailbox. Plain TCP, no TLS.
+
+Supports what the ingester needs:
+  - LOGIN, CAPABILITY, NOOP, LOGOUT
+  - SELECT / EXAMINE (reports EXISTS, UIDVALIDITY, UIDNEXT)
+  - UID SEARCH with `UID a:b`, `SINCE dd-Mon-yyyy` or ALL
+  - UID FETCH with UID, RFC822.SIZE, RFC822, BODY[.PEEK][HEADER.FIELDS (...)]
+    and BODY[.PEEK][TEXT]<offset.count>
+  - reset_uidvalidity() renumbers the mailbox like a server rebuilding it
+Counters: logins, commands (every command name received), fetched (the item
+lists of every UID FETCH).
+
+Usage:
+    stub = ImapStub(username="hr@example.com", password="secret")
+    host, port = stub.start()
+    stub.add_message("Asha <asha@example.com>", "Re: Offer", "Yes, I accept")
+    ...
+    stub.stop()
+"""
+
+import re
+import socketserver
+import threading
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+_MONTHS = {m: i for i, m in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], start=1)}
+
+
+class ImapStub:
+    def __init__(self, username="hr@example.com", password="secret"):
+        self.username = username
+        self.password = password
+        self.uidvalidity = 1000
+        self.messages = []              # [{"uid", "raw", "date"}]
+        self.next_uid = 1
+        self.logins = 0
+        self.commands = []
+        self.fetched = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    # ---------- mailbox ----------
+    def add_message(self, sender, subject, body, date=None, attachment=None):
+        date = date or datetime.now(timezone.utc)
+        msg = EmailMessage()
+        msg["From"] = sender
+        msg["To"] = self.username
+        msg["Subject"] = subject
+        msg["Date"] = format_datetime(date)
+        msg["Message-ID"] = f"<stub-{self.next_uid}-{self.uidvalidity}@example.com>"
+        msg.set_content(body)
+        if attachment is not None:
+            msg.add_attachment(attachment, maintype="application", subtype="pdf", filename="scan.pdf")
+        with self._lock:
+            uid = self.next_uid
+            self.next_uid += 1
+            self.messages.append({"uid": uid, "raw": msg.as_bytes().replace(b"\n", b"\r\n"), "date": date})
+        return uid
+
+    def reset_uidvalidity(self):
+        with self._lock:
+            self.uidvalidity += 1
+            for n, m in enumerate(self.messages, start=1):
+                m["uid"] = n
+            self.next_uid = len(self.messages) + 1
+
+    # ---------- commands ----------
+    def _search(self, criteria):
+        criteria = criteria.strip()
+        with self._lock:
+            msgs = list(self.messages)
+        match = re.fullmatch(r"UID (\d+):(\d+|\*)", criteria, re.I)
+        if match:
+            low = int(match.group(1))
+            high = int(match.group(2)) if match.group(2) != "*" else None
+            # Like real servers, n:* always includes the newest message
+            hits = [m["uid"] for m in msgs if m["uid"] >= low and (high is None or m["uid"] <= high)]
+            if high is None and not hits and msgs:
+                hits = [msgs[-1]["uid"]]
+            return hits
+        match = re.fullmatch(r"SINCE (\d{1,2})-(\w{3})-(\d{4})", criteria, re.I)
+        if match:
+            since = (int(match.group(3)), _MONTHS[match.group(2).title()], int(match.group(1)))
+            return [m["uid"] for m in msgs if (m["date"].year, m["date"].month, m["date"].day) >= since]
+        return [m["uid"] for m in msgs]
+
+    def _uid_set(self, spec):
+        with self._lock:
+            msgs = list(self.messages)
+        wanted = set()
+        last = msgs[-1]["uid"] if msgs else 0
+        for part in spec.split(","):
+            if ":" in part:
+                a, b = part.split(":")
+                a = int(a)
+                b = last if b == "*" else int(b)
+                wanted.update(range(min(a, b), max(a, b) + 1))
+            else:
+                wanted.add(int(part))
+        return [(seq, m) for seq, m in enumerate(msgs, start=1) if m["uid"] in wanted]
+
+    @staticmethod
+    def _section(raw, section):
+        head, _, text = raw.partition(b"\r\n\r\n")
+        match = re.fullmatch(r"HEADER\.FIELDS \(([^)]*)\)", section, re.I)
+        if match:
+            names = {n.upper() for n in match.group(1).split()}
+            lines, keep = [], False
+            for line in head.split(b"\r\n"):
+                if line[:1] in (b" ", b"\t"):
+                    if keep:
+                        lines.append(line)
+                    continue
+                keep = line.split(b":", 1)[0].decode("ascii", "ignore").upper() in names
+                if keep:
+                    lines.append(line)
+            return b"\r\n".join(lines) + b"\r\n\r\n"
+        if section.upper() == "TEXT":
+            return text
+        return raw
+
+    def _fetch(self, seq, msg, items):
+        parts = []
+        for match in re.finditer(r"UID|RFC822\.SIZE|RFC822|BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", items, re.I):
+            token = match.group(0).upper()
+            if token == "UID":
+                parts.append(f"UID {msg['uid']}".encode())
+            elif token == "RFC822.SIZE":
+                parts.append(f"RFC822.SIZE {len(msg['raw'])}".encode())
+            elif token == "RFC822":
+                parts.append(f"RFC822 {{{len(msg['raw'])}}}\r\n".encode() + msg["raw"])
+            else:
+                section = match.group(1)
+                data = self._section(msg["raw"], section)
+                label = f"BODY[{section}]"
+                if match.group(2) is not None:
+                    start, count = int(match.group(2)), int(match.group(3))
+                    data = data[start:start + count]
+                    label += f"<{start}>"
+                parts.append(f"{label} {{{len(data)}}}\r\n".encode() + data)
+        return f"* {seq} FETCH (".encode() + b" ".join(parts) + b")\r\n"
+
+    def start(self, host="127.0.0.1", port=0):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.wfile.write(b"* OK [CAPABILITY IMAP4rev1] stub ready\r\n")
+                authed = False
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    tag, _, rest = line.decode("utf-8", "ignore").strip().partition(" ")
+                    command, _, args = rest.partition(" ")
+                    command = command.upper()
+                    if command == "UID":
+                        sub, _, args = args.partition(" ")
+                        command = f"UID {sub.upper()}"
+                    stub.commands.append(command)
+                    out = b""
+                    if command == "CAPABILITY":
+                        out = b"* CAPABILITY IMAP4rev1\r\n"
+                        status = "OK CAPABILITY completed"
+                    elif command == "LOGIN":
+                        user, password = [a.strip('"') for a in args.split(" ", 1)]
+                        if user == stub.username and password == stub.password:
+                            authed = True
+                            stub.logins += 1
+                            status = "OK LOGIN completed"
+                        else:
+                            status = "NO [AUTHENTICATIONFAILED] Invalid credentials"
+                    elif command == "LOGOUT":
+                        self.wfile.write(f"* BYE\r\n{tag} OK LOGOUT completed\r\n".encode())
+                        return
+                    elif command == "NOOP":
+                        status = "OK NOOP completed"
+                    elif not authed:
+                        status = "BAD not authenticated"
+                    elif command in ("SELECT", "EXAMINE"):
+                        with stub._lock:
+                            out = (f"* {len(stub.messages)} EXISTS\r\n"
+                                   f"* OK [UIDVALIDITY {stub.uidvalidity}] UIDs valid\r\n"
+                                   f"* OK [UIDNEXT {stub.next_uid}] Predicted next UID\r\n").encode()
+                        status = f"OK [READ-ONLY] {command} completed" if command == "EXAMINE" else f"OK [READ-WRITE] {command} completed"
+                    elif command == "UID SEARCH":
+                        out = ("* SEARCH " + " ".join(str(u) for u in stub._search(args))).rstrip().encode() + b"\r\n"
+                        status = "OK SEARCH completed"
+                    elif command == "UID FETCH":
+                        spec, _, items = args.partition(" ")
+                        stub.fetched.append(items)
+                        out = b"".join(stub._fetch(seq, msg, items) for seq, msg in stub._uid_set(spec))
+                        status = "OK FETCH completed"
+                    else:
+                        status = f"BAD unknown command {command}"
+                    self.wfile.write(out + f"{tag} {status}\r\n".encode())
+                    self.wfile.flush()
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return host, self._server.server_address[1]
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,284 @@
+# leave_interval_index.py - In-memory interval index over leave requests
+#
+# /api/leaves/on-leave-today, /api/leaves/upcoming and the leave overlay in
+# monthly attendance each scanned crc6f_table14s and filtered dates in Python.
+# LeaveIntervalIndex keeps every live (approved/pending) leave in memory:
+#   - records are keyed by crc6f_leaveid and kept as the Dataverse row dicts,
+#     so callers format them exactly as before;
+#   - queries run on numpy arrays sorted by start date. A leave overlapping
+#     [a, b] must start in [a - longest_leave, b], so a point/range query is two
+#     searchsorted calls plus a vectorised end/status filter on that window;
+#   - approve/reject/cancel/update/apply call upsert() after their Dataverse
+#     write, and touch a marker file so other gunicorn workers reload; a
+#     worker that sees the marker reloads in a background thread and keeps
+#     answering from its current index meanwhile;
+#   - a daemon thread reconciles against Dataverse every
+#     LEAVE_INDEX_RECONCILE_SECONDS to pick up edits made elsewhere;
+#   - upserts/removes are stamped with a version, and those made while a
+#     reload was running are applied again on top of what it loaded, so a
+#     reload that started before a write cannot undo it.
+# Until the first load succeeds loaded is False and callers keep their
+# Dataverse queries.
+
+import os
+import threading
+import time
+
+import numpy as np
+
+STORAGE_DIR = os.path.join(os.path.dirname(__file__), "storage")
+LEAVE_INDEX_MARKER = os.getenv("LEAVE_INDEX_MARKER", os.path.join(STORAGE_DIR, "leave_index.changed"))
+LEAVE_INDEX_RECONCILE_SECONDS = int(os.getenv("LEAVE_INDEX_RECONCILE_SECONDS", "300"))
+
+# Cancelled/rejected leaves never occupy a day, so they are not indexed
+INDEXED_STATUSES = ("approved", "pending")
+_STATUS_CODES = {s: i for i, s in enumerate(INDEXED_STATUSES)}
+
+
+def _day(value):
+    if not value:
+        return None
+    try:
+        return np.datetime64(str(value)[:10], "D")
+    except ValueError:
+        return None
+
+
+def normalize_status(value):
+    return str(value or "").strip().lower()
+
+
+class LeaveIntervalIndex:
+    def __init__(self, loader, reconcile_seconds=LEAVE_INDEX_RECONCILE_SECONDS, marker_path=LEAVE_INDEX_MARKER):
+        """loader() returns every leave row (crc6f_leaveid, crc6f_employeeid, crc6f_startdate, ...)."""
+        self.loader = loader
+        self.reconcile_seconds = reconcile_seconds
+        self.marker_path = marker_path
+        self._records = {}
+        self._arrays = None
+        self._lock = threading.RLock()
+        self._reconcile_lock = threading.Lock()
+        self._version = 0
+        self._changes = {}          # leave_id -> (version, row or None) not yet covered by a finished load
+        self._reloader = None
+        self._reload_failed_at = 0.0
+        self._loaded_at = 0.0
+        self._marker_seen = 0.0
+        self._reload_pending = False
+        self._thread = None
+        self._stop = threading.Event()
+        self.reconcile_count = 0
+        self.last_error = None
+
+    @property
+    def loaded(self):
+        return self._loaded_at > 0
+
+    # ---------- maintenance ----------
+    def _accept(self, row):
+        status = normalize_status(row.get("crc6f_status"))
+        start = _day(row.get("crc6f_startdate"))
+        return status in _STATUS_CODES and start is not None and row.get("crc6f_leaveid")
+
+    def reconcile(self):
+        """Replace the index with a fresh load. Keeps the current one if the loader fails."""
+        with self._reconcile_lock:
+            marker = self._marker_mtime()
+            with self._lock:
+                stamp = self._version
+            try:
+                rows = self.loader() or []
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[LEAVE INDEX] Reconcile failed, keeping {len(self._records)} indexed leaves: {e}")
+                return False
+            records = {row["crc6f_leaveid"]: row for row in rows if self._accept(row)}
+            with self._lock:
+                # Writes made while the loader ran may be missing from what it returned
+                for leave_id, (version, row) in self._changes.items():
+                    if version > stamp:
+                        if row is None:
+                            records.pop(leave_id, None)
+                        else:
+                            records[leave_id] = row
+                self._changes = {k: v for k, v in self._changes.items() if v[0] > stamp}
+                self._records = records
+                self._arrays = None
+                self._loaded_at = time.time()
+                self._marker_seen = max(self._marker_seen, marker)
+        self.reconcile_count += 1
+        self.last_error = None
+        print(f"[LEAVE INDEX] Indexed {len(records)} approved/pending leaves")
+        return True
+
+    def upsert(self, row):
+        """Apply a created or updated leave row; drops it when it is no longer approved/pending."""
+        leave_id = (row or {}).get("crc6f_leaveid")
+        if not leave_id:
+            return
+        with self._lock:
+            if self._accept(row):
+                self._records[leave_id] = dict(row)
+            else:
+                self._records.pop(leave_id, None)
+            self._note_change(leave_id, self._records.get(leave_id))
+            self._arrays = None
+        self._touch_marker()
+
+    def remove(self, leave_id):
+        with self._lock:
+            if self._records.pop(leave_id, None) is not None:
+                self._arrays = None
+            self._note_change(leave_id, None)
+        self._touch_marker()
+
+    def _note_change(self, leave_id, row):
+        """Caller holds self._lock."""
+        self._version += 1
+        self._changes[leave_id] = (self._version, row)
+
+    # ---------- cross-worker marker ----------
+    def _marker_mtime(self):
+        try:
+            return os.stat(self.marker_path).st_mtime
+        except OSError:
+            return 0.0
+
+    def _touch_marker(self):
+        try:
+            # Another worker wrote since we last looked: our touch would hide that
+            if self._marker_mtime() > self._marker_seen:
+                self._reload_pending = True
+            os.makedirs(os.path.dirname(self.marker_path), exist_ok=True)
+            with open(self.marker_path, "a"):
+                os.utime(self.marker_path, None)
+            self._marker_seen = max(self._marker_seen, self._marker_mtime())
+        except OSError as e:
+            print(f"[LEAVE INDEX] Could not touch change marker: {e}")
+
+    def _ensure_current(self):
+        """Start a background reload when another worker wrote a leave since our last load/upsert.
+
+        Queries keep using the current index until the reload finishes.
+        """
+        if not self.loaded or not (self._reload_pending or self._marker_mtime() > self._marker_seen):
+            return
+        if time.time() - self._reload_failed_at < min(60, self.reconcile_seconds):
+            return
+        with self._lock:
+            if self._reloader is not None and self._reloader.is_alive():
+                return
+            self._reload_pending = False
+            self._reloader = threading.Thread(target=self._reload, name="leave-interval-reload", daemon=True)
+            self._reloader.start()
+
+    def _reload(self):
+        if self.reconcile():
+            self._reload_failed_at = 0.0
+        else:
+            self._reload_failed_at = time.time()
+            self._reload_pending = True
+
+    # ---------- arrays ----------
+    def _build(self):
+        with self._lock:
+            arrays = self._arrays
+            if arrays is not None:
+                return arrays
+            rows = list(self._records.values())
+            starts = np.array([_day(r.get("crc6f_startdate")) for r in rows], dtype="datetime64[D]")
+            ends = np.array([_day(r.get("crc6f_enddate")) for r in rows], dtype="datetime64[D]")
+            # Missing end date means a single-day leave
+            ends = np.where(np.isnat(ends), starts, np.maximum(ends, starts))
+            order = np.argsort(starts, kind="stable")
+            arrays = {
+                "rows": [rows[i] for i in order],
+                "starts": starts[order],
+                "ends": ends[order],
+                "status": np.array([_STATUS_CODES[normalize_status(rows[i].get("crc6f_status"))] for i in order],
+                                   dtype=np.int8),
+                "employees": np.array([str(rows[i].get("crc6f_employeeid") or "").upper() for i in order],
+                                      dtype=object),
+                "longest": (ends - starts).max() if rows else np.timedelta64(0, "D"),
+            }
+            self._arrays = arrays
+            return arrays
+
+    def _select(self, lo, hi, overlap, statuses, employee_ids):
+        """Rows starting in [lo, hi]; with overlap, any leave touching [lo, hi]."""
+        self._ensure_current()
+        a = self._build()
+        first = lo - a["longest"] if overlap else lo
+        i = np.searchsorted(a["starts"], first, side="left")
+        j = np.searchsorted(a["starts"], hi, side="right")
+        if i >= j:
+            return []
+        mask = a["ends"][i:j] >= lo if overlap else np.ones(j - i, dtype=bool)
+        if statuses:
+            codes = [_STATUS_CODES[s] for s in (normalize_status(s) for s in statuses) if s in _STATUS_CODES]
+            mask &= np.isin(a["status"][i:j], codes)
+        if employee_ids:
+            wanted = {str(e).strip().upper() for e in employee_ids}
+            mask &= np.fromiter((e in wanted for e in a["employees"][i:j]), dtype=bool, count=j - i)
+        return [a["rows"][i + k] for k in np.flatnonzero(mask)]
+
+    # ---------- queries ----------
+    def overlapping(self, start, end, statuses=("approved",), employee_ids=None):
+        """Leaves covering at least one day of [start, end] (inclusive)."""
+        lo, hi = _day(start), _day(end)
+        if lo is None or hi is None or hi < lo:
+            return []
+        return self._select(lo, hi, True, statuses, employee_ids)
+
+    def on_date(self, day, statuses=("approved",), employee_ids=None):
+        """Leaves covering `day`."""
+        return self.overlapping(day, day, statuses, employee_ids)
+
+    def starting_between(self, start, end, statuses=("approved",), employee_ids=None):
+        """Leaves whose first day falls in [start, end] (inclusive)."""
+        lo, hi = _day(start), _day(end)
+        if lo is None or hi is None or hi < lo:
+            return []
+        return self._select(lo, hi, False, statuses, employee_ids)
+
+    def records(self):
+        """Every indexed (approved/pending) leave row."""
+        self._ensure_current()
+        with self._lock:
+            return list(self._records.values())
+
+    def by_employee(self, employee_id, statuses=INDEXED_STATUSES):
+        """Every indexed leave of one employee, ordered by start date."""
+        self._ensure_current()
+        a = self._build()
+        codes = {_STATUS_CODES[normalize_status(s)] for s in statuses}
+        wanted = str(employee_id or "").strip().upper()
+        idx = np.flatnonzero(a["employees"] == wanted)
+        return [a["rows"][k] for k in idx if a["status"][k] in codes]
+
+    # ---------- background reconciliation ----------
+    def start(self):
+        """Load once in the background and reconcile every reconcile_seconds (idempotent)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="leave-interval-index", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        delay = 0
+        while not self._stop.wait(delay):
+            ok = self.reconcile()
+            delay = self.reconcile_seconds if ok else min(60, self.reconcile_seconds)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "leaves": len(self._records),
+            "age_seconds": round(time.time() - self._loaded_at, 1) if self.loaded else None,
+            "reconcile_count": self.reconcile_count,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,239 @@
+# leave_ledger.py - Append-only leave ledger with materialised balances
+#
+# get_all_leave_balances used to derive the annual quota from DOJ, sum the
+# approved paid leaves, then override everything with the crc6f_hr_leavemangements
+# row on every call, while _decrement_leave_balance patched that row separately.
+# The ledger records each balance-changing event once:
+#   accrual  +days   annual CL/SL quota (and top-ups when experience grows)
+#   consume  -days   paid leave applied/approved
+#   release  +days   reversal of a consume (rejected / cancelled leave)
+#   grant    +days   approved comp-off request
+#   adjust   +/-days manual edit or reconciliation to the Dataverse row
+# Entries are keyed by a caller-chosen event_id (e.g. "leave:LVE-1:consume"), so
+# replaying an endpoint or applying the same event from two workers is a no-op.
+# Each entry updates ledger_balances (employee, type, year) in the same SQLite
+# transaction, so a balance read is a primary-key lookup.
+#
+# CL/SL are tracked per calendar year; comp-off does not reset and lives under
+# year 0. rebuild() replaces an (employee, year) slice with events replayed from
+# history. The db is shared by all gunicorn workers (WAL).
+
+import os
+import time
+
+from sqlite_store import SQLiteStore, singleton
+
+LEAVE_LEDGER_DB = os.getenv(
+    "LEAVE_LEDGER_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "leave_ledger.db"),
+)
+
+LEAVE_CODES = ("CL", "SL", "CO")
+CARRY_FORWARD = {"CO"}
+# Sign applied to `days` for each kind; adjust carries its own sign
+_SIGN = {"accrual": 1, "grant": 1, "release": 1, "consume": -1, "adjust": 1}
+
+
+def ledger_year(leave_type, year):
+    """Bucket year for a leave type: comp-off balances carry across years."""
+    return 0 if leave_type in CARRY_FORWARD else int(year)
+
+
+class LeaveLedger(SQLiteStore):
+    def __init__(self, db_path=LEAVE_LEDGER_DB):
+        super().__init__(db_path)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_entries (
+                event_id TEXT PRIMARY KEY,
+                employee_id TEXT NOT NULL,
+                leave_type TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                days REAL NOT NULL,
+                ref TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS ledger_entries_emp ON ledger_entries (employee_id, year)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_balances (
+                employee_id TEXT NOT NULL,
+                leave_type TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                accrued REAL NOT NULL DEFAULT 0,
+                consumed REAL NOT NULL DEFAULT 0,
+                available REAL NOT NULL DEFAULT 0,
+                updated_at REAL,
+                PRIMARY KEY (employee_id, year, leave_type)
+            )
+        """)
+
+    # ---------- events ----------
+    def _insert(self, conn, event_id, employee_id, leave_type, year, kind, days, ref):
+        if kind not in _SIGN:
+            raise ValueError(f"unknown ledger entry kind: {kind}")
+        if leave_type not in LEAVE_CODES:
+            raise ValueError(f"unknown leave type code: {leave_type}")
+        employee_id = str(employee_id).strip().upper()
+        year = ledger_year(leave_type, year)
+        days = float(days)
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO ledger_entries (event_id, employee_id, leave_type, year, kind, days, ref, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (event_id, employee_id, leave_type, year, kind, days, ref, time.time()),
+        )
+        if cur.rowcount == 0:
+            return False
+        delta = _SIGN[kind] * days
+        accrued = days if kind in ("accrual", "grant") else 0.0
+        consumed = days if kind == "consume" else (-days if kind == "release" else 0.0)
+        conn.execute(
+            "INSERT INTO ledger_balances (employee_id, leave_type, year, accrued, consumed, available, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (employee_id, year, leave_type) DO UPDATE SET"
+            " accrued = accrued + excluded.accrued, consumed = consumed + excluded.consumed,"
+            " available = available + excluded.available, updated_at = excluded.updated_at",
+            (employee_id, leave_type, year, accrued, consumed, delta, time.time()),
+        )
+        return True
+
+    def record(self, event_id, employee_id, leave_type, year, kind, days, ref=None):
+        """Apply one event. Returns False when event_id was already applied."""
+        return self._transaction(
+            lambda conn: self._insert(conn, event_id, employee_id, leave_type, year, kind, days, ref)
+        )
+
+    def reverse(self, event_id, reversal_id, ref=None):
+        """Release a consume entry (once). Returns False when there is nothing to reverse."""
+        def apply(conn):
+            row = conn.execute(
+                "SELECT employee_id, leave_type, year, kind, days FROM ledger_entries WHERE event_id = ?", (event_id,)
+            ).fetchone()
+            if row is None or row[3] != "consume":
+                return False
+            return self._insert(conn, reversal_id, row[0], row[1], row[2], "release", row[4], ref)
+        return self._transaction(apply)
+
+    def set_quota(self, employee_id, leave_type, year, quota):
+        """Top the year's accrual up (or down) to quota. Returns the delta applied."""
+        employee_id = str(employee_id).strip().upper()
+
+        def apply(conn):
+            row = conn.execute(
+                "SELECT accrued FROM ledger_balances WHERE employee_id = ? AND year = ? AND leave_type = ?",
+                (employee_id, ledger_year(leave_type, year), leave_type),
+            ).fetchone()
+            accrued = row[0] if row else 0.0
+            delta = float(quota) - accrued
+            if abs(delta) < 1e-9:
+                return 0.0
+            # Idempotent through the read above (same transaction), not through the id
+            event_id = f"accrual:{employee_id}:{leave_type}:{year}:{accrued:g}->{float(quota):g}@{time.time_ns()}"
+            self._insert(conn, event_id, employee_id, leave_type, year, "accrual", delta, "quota")
+            return delta
+        return self._transaction(apply)
+
+    def adjust_to(self, employee_id, leave_type, year, available, event_id, ref=None):
+        """Record the adjustment that brings `available` to the given value. Returns the delta."""
+        employee_id = str(employee_id).strip().upper()
+
+        def apply(conn):
+            row = conn.execute(
+                "SELECT available FROM ledger_balances WHERE employee_id = ? AND year = ? AND leave_type = ?",
+                (employee_id, ledger_year(leave_type, year), leave_type),
+            ).fetchone()
+            delta = float(available) - (row[0] if row else 0.0)
+            if abs(delta) < 1e-9:
+                return 0.0
+            self._insert(conn, event_id, employee_id, leave_type, year, "adjust", delta, ref)
+            return delta
+        return self._transaction(apply)
+
+    # ---------- reads ----------
+    def balance(self, employee_id, year):
+        """{code: {"accrued", "consumed", "available"}} for the year (comp-off from year 0)."""
+        rows = self._conn().execute(
+            "SELECT leave_type, accrued, consumed, available FROM ledger_balances"
+            " WHERE employee_id = ? AND (year = ? OR year = 0)",
+            (str(employee_id).strip().upper(), int(year)),
+        ).fetchall()
+        return {
+            code: {"accrued": accrued, "consumed": consumed, "available": available}
+            for code, accrued, consumed, available in rows
+        }
+
+    def has_employee(self, employee_id):
+        return self._conn().execute(
+            "SELECT 1 FROM ledger_entries WHERE employee_id = ? LIMIT 1", (str(employee_id).strip().upper(),)
+        ).fetchone() is not None
+
+    def is_accrued(self, employee_id, year):
+        """True once the year's CL/SL quota has been accrued. A consume posted for a
+        year ahead creates that year's balance rows, but not this marker."""
+        return self._conn().execute(
+            "SELECT 1 FROM ledger_entries WHERE employee_id = ? AND year = ? AND kind = 'accrual'"
+            " AND leave_type IN ('CL', 'SL') LIMIT 1",
+            (str(employee_id).strip().upper(), int(year)),
+        ).fetchone() is not None
+
+    def has_event(self, event_id):
+        return self._conn().execute(
+            "SELECT 1 FROM ledger_entries WHERE event_id = ?", (event_id,)
+        ).fetchone() is not None
+
+    def entries(self, employee_id, year=None):
+        sql = "SELECT event_id, leave_type, year, kind, days, ref, created_at FROM ledger_entries WHERE employee_id = ?"
+        args = [str(employee_id).strip().upper()]
+        if year is not None:
+            sql += " AND (year = ? OR year = 0)"
+            args.append(int(year))
+        keys = ["event_id", "leave_type", "year", "kind", "days", "ref", "created_at"]
+        return [dict(zip(keys, r)) for r in self._conn().execute(sql + " ORDER BY created_at, event_id", args)]
+
+    # ---------- rebuild ----------
+    def rebuild(self, employee_id, year, events, include_carry_forward=True, keep_adjustments=False):
+        """
+        Replace the employee's ledger for `year` (and the comp-off bucket when
+        include_carry_forward) with `events`: [{"event_id", "leave_type", "kind", "days", "year"?, "ref"?}].
+        keep_adjustments re-applies the replaced slice's adjust entries (manual
+        edits, opening balances) after the events, since history cannot replay
+        them. Returns the number of entries applied.
+        """
+        employee_id = str(employee_id).strip().upper()
+        years = (int(year), 0) if include_carry_forward else (int(year),)
+
+        def apply(conn):
+            marks = ",".join("?" * len(years))
+            kept = []
+            if keep_adjustments:
+                kept = conn.execute(
+                    f"SELECT event_id, leave_type, year, days, ref FROM ledger_entries WHERE employee_id = ?"
+                    f" AND year IN ({marks}) AND kind = 'adjust' ORDER BY created_at, event_id",
+                    (employee_id, *years),
+                ).fetchall()
+            conn.execute(f"DELETE FROM ledger_entries WHERE employee_id = ? AND year IN ({marks})", (employee_id, *years))
+            conn.execute(f"DELETE FROM ledger_balances WHERE employee_id = ? AND year IN ({marks})", (employee_id, *years))
+            applied = 0
+            for ev in events:
+                if ledger_year(ev["leave_type"], ev.get("year", year)) not in years:
+                    continue
+                if self._insert(conn, ev["event_id"], employee_id, ev["leave_type"], ev.get("year", year),
+                                ev["kind"], ev["days"], ev.get("ref")):
+                    applied += 1
+            for event_id, leave_type, entry_year, days, ref in kept:
+                if self._insert(conn, event_id, employee_id, leave_type, entry_year, "adjust", days, ref):
+                    applied += 1
+            return applied
+        return self._transaction(apply)
+
+    def stats(self):
+        conn = self._conn()
+        return {
+            "entries": conn.execute("SELECT COUNT(*) FROM ledger_entries").fetchone()[0],
+            "balances": conn.execute("SELECT COUNT(*) FROM ledger_balances").fetchone()[0],
+            "employees": conn.execute("SELECT COUNT(DISTINCT employee_id) FROM ledger_balances").fetchone()[0],
+        }
+
+
+get_leave_ledger = singleton(LeaveLedger)
@@ -0,0 +1,507 @@
+# letter_pdfs.py - Cached offer/policy letter PDFs rendered off the request thread
+#
+# send_policy_letter read both HTML templates, filled them and ran the whole
+# documents through xhtml2pdf inside the request, then re-opened the static
+# PDFs (policy_static.pdf, an offer pack or cover if present) with PdfReader
+# and merged pages - on every click, in the web worker. The policy render was
+# thrown away whenever policy_static.pdf exists, and only the first two offer
+# pages are ever sent.
+#
+# LetterPipeline keeps everything that does not depend on the candidate:
+#   - templates are compiled once per version: split on their
+#     "<!-- PAGE n -->" markers into page blocks, each knowing its placeholders;
+#   - blocks that only use fixed values (logos, policy terms) are rendered once
+#     per version and reused as PDF bytes;
+#   - static PDFs are read and normalised once per version;
+#   - the version is a hash of the templates, images and static PDFs, checked
+#     by mtime/size on each call, so editing a template invalidates everything.
+# Per candidate only the personalised blocks are rendered, in a bounded process
+# pool (LETTER_RENDER_PROCESSES) so the GIL-bound xhtml2pdf work never runs in
+# the web worker. The pool forks: a spawned child would re-import
+# unified_server as __main__ when the server is started with
+# `python unified_server.py`. warm() is called while the server module is
+# still loading, before its background threads start, so the render processes
+# are forked from a single-threaded parent. Without fork (Windows) rendering
+# falls back to one background thread. Results are cached by (template version, candidate
+# fields hash) in memory and under storage/letter_cache/<version>/, and
+# concurrent requests for the same letter share one render.
+
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+LETTER_CACHE_DIR = os.getenv("LETTER_CACHE_DIR", os.path.join(BACKEND_DIR, "storage", "letter_cache"))
+_CAN_FORK = "fork" in multiprocessing.get_all_start_methods()
+LETTER_RENDER_PROCESSES = int(os.getenv("LETTER_RENDER_PROCESSES", "2" if _CAN_FORK else "0"))
+LETTER_CACHE_ENTRIES = int(os.getenv("LETTER_CACHE_ENTRIES", "64"))
+LETTER_RENDER_WAIT_SECONDS = float(os.getenv("LETTER_RENDER_WAIT_SECONDS", "20"))
+
+OFFER_TEMPLATE = "offer_letter_new_template.html"
+POLICY_TEMPLATE = "policy_template.html"
+OFFER_PACK_FILES = ("Offer Letter.pdf", "Offer_Letter.pdf", "offer_letter.pdf", "OfferLetter.pdf")
+OFFER_COVER_FILE = "offer_cover_static.pdf"
+POLICY_STATIC_FILE = "policy_static.pdf"
+OFFER_PAGES = 2
+IMAGE_ASSETS = {
+    "logo_main": ("LOGO_MAIN_URL", "vtab_logo.png"),
+    "logo_sub": ("LOGO_SUB_URL", "siroco_logo.png"),
+    "sign_img": ("SIGN_IMG_URL", "signature.png"),
+}
+POLICY_TERMS = {
+    "unpaid_duration": "3",
+    "training_duration": "3",
+    "training_salary": "₹10,000",
+    "probation_duration": "6",
+    "probation_salary": "₹15,000",
+    "postprobation_salary": "₹20,000",
+    "postprobation_duration": "12",
+    "work_hours_start": "9:00 AM",
+    "work_hours_end": "6:00 PM",
+}
+CANDIDATE_FIELDS = ("current_date", "candidate_name", "candidate_address", "designation", "date_of_joining")
+
+_PAGE_MARKER = re.compile(r"<!--\s*PAGE\s+\d+[^>]*-->", re.I)
+_PLACEHOLDER = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+Letters = namedtuple("Letters", "offer policy version key source")
+
+
+# ---------- rendering (runs in the pool processes) ----------
+def render_html(html):
+    from xhtml2pdf import pisa
+
+    out = BytesIO()
+    status = pisa.CreatePDF(html, dest=out)
+    if status.err:
+        raise RuntimeError("PDF generation failed")
+    return out.getvalue()
+
+
+def _write_pages(pages):
+    from PyPDF2 import PdfWriter
+
+    writer = PdfWriter()
+    for page in pages:
+        writer.add_page(page)
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _read_pages(data):
+    from PyPDF2 import PdfReader
+
+    return list(PdfReader(BytesIO(data)).pages)
+
+
+def _render_parts(parts, rendered, max_pages=None):
+    """Pages of a list of ("pdf", bytes) / ("html", html, slot) parts, in order.
+
+    Every rendered block is recorded in `rendered` under its slot (None for
+    personalised blocks) so the caller can cache the fixed ones. Stops once
+    max_pages pages are collected.
+    """
+    pages = []
+    for part in parts:
+        if max_pages is not None and len(pages) >= max_pages:
+            break
+        if part[0] == "pdf":
+            data = part[1]
+        else:
+            data = render_html(part[1])
+            rendered.append((part[2], data))
+        pages.extend(_read_pages(data))
+    return pages
+
+
+def build_letters(job):
+    """Assemble the offer and policy PDFs described by a job from LetterPipeline._job()."""
+    started = time.perf_counter()
+    rendered = []
+    offer = job["offer"]
+    if offer["pack"] is not None:
+        offer_bytes = offer["pack"]
+    else:
+        generated = _render_parts(offer["parts"], rendered, max_pages=OFFER_PAGES)
+        pages = []
+        if generated:
+            pages.extend(_read_pages(offer["cover"]) if offer["cover"] is not None else generated[:1])
+        pages.extend(generated[1:OFFER_PAGES])
+        offer_bytes = _write_pages(pages)
+    policy = job["policy"]
+    policy_bytes = policy["static"] if policy["static"] is not None else _write_pages(_render_parts(policy["parts"], rendered))
+    return {
+        "offer": offer_bytes,
+        "policy": policy_bytes,
+        "rendered": [(slot, data) for slot, data in rendered if slot is not None],
+        "blocks": len(rendered),
+        "render_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _warm(_=None):
+    # Pays the xhtml2pdf/reportlab import in the pool process before the first letter
+    from xhtml2pdf import pisa  # noqa: F401
+    from PyPDF2 import PdfReader  # noqa: F401
+
+    return os.getpid()
+
+
+# ---------- templates ----------
+def fill(html, context):
+    return _PLACEHOLDER.sub(lambda m: str(context[m.group(1)]) if m.group(1) in context else m.group(0), html)
+
+
+class CompiledTemplate:
+    """An HTML letter template split into page blocks sharing one <head>."""
+
+    def __init__(self, text):
+        start = text.find("<body")
+        start = text.find(">", start) + 1 if start >= 0 else 0
+        end = text.rfind("</body>")
+        end = end if end >= start else len(text)
+        self.head = text[:start]
+        self.tail = text[end:]
+        body = text[start:end]
+        marks = [m.start() for m in _PAGE_MARKER.finditer(body)]
+        cuts = [0] + marks[1:] + [len(body)] if marks else [0, len(body)]
+        self.blocks = [body[a:b] for a, b in zip(cuts, cuts[1:])]
+        self.fields = [set(_PLACEHOLDER.findall(block)) for block in self.blocks]
+
+    def page_html(self, index, context):
+        return fill(self.head, context) + fill(self.blocks[index], context) + fill(self.tail, context)
+
+    def is_personal(self, index, fixed):
+        return not self.fields[index] <= set(fixed)
+
+
+def _image_data_uri(path):
+    try:
+        with open(path, "rb") as f:
+            return "data:image/png;base64," + base64.b64encode(f.read()).decode("ascii")
+    except OSError:
+        return ""
+
+
+def _normalised_pdf(path, first_pages=None):
+    from PyPDF2 import PdfReader
+
+    pages = list(PdfReader(path).pages)
+    return _write_pages(pages[:first_pages] if first_pages else pages)
+
+
+# ---------- pipeline ----------
+class LetterPipeline:
+    def __init__(self, backend_dir=BACKEND_DIR, cache_dir=LETTER_CACHE_DIR,
+                 processes=LETTER_RENDER_PROCESSES, cache_entries=LETTER_CACHE_ENTRIES):
+        self.backend_dir = backend_dir
+        self.cache_dir = cache_dir
+        self.processes = processes
+        self.cache_entries = cache_entries
+        self._lock = threading.Lock()
+        self._signature = None
+        self._state = None
+        self._static_blocks = {}          # (template, block index) -> PDF bytes, current version only
+        self._results = OrderedDict()     # (version, fields hash) -> Letters
+        self._inflight = {}               # (version, fields hash) -> Future
+        self._pool = None
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "renders": 0, "blocks_rendered": 0, "failures": 0}
+
+    # ---------- versioned static state ----------
+    def _path(self, name):
+        return os.path.join(self.backend_dir, name)
+
+    def _sources(self):
+        names = [OFFER_TEMPLATE, POLICY_TEMPLATE, OFFER_COVER_FILE, POLICY_STATIC_FILE, *OFFER_PACK_FILES]
+        names += [filename for _, filename in IMAGE_ASSETS.values()]
+        signature = []
+        for name in names:
+            try:
+                st = os.stat(self._path(name))
+                signature.append((name, st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((name, None, None))
+        signature += [(env, os.getenv(env)) for env, _ in IMAGE_ASSETS.values()]
+        return tuple(signature)
+
+    def _load_state(self):
+        digest = hashlib.sha256()
+
+        def read(name):
+            with open(self._path(name), "rb") as f:
+                data = f.read()
+            digest.update(name.encode("utf-8") + b"\0" + hashlib.sha256(data).digest())
+            return data
+
+        offer = CompiledTemplate(read(OFFER_TEMPLATE).decode("utf-8"))
+        policy = CompiledTemplate(read(POLICY_TEMPLATE).decode("utf-8"))
+        assets = {}
+        for key, (env, filename) in IMAGE_ASSETS.items():
+            assets[key] = os.getenv(env) or _image_data_uri(self._path(filename))
+            digest.update(f"{key}\0{assets[key]}\0".encode("utf-8"))
+
+        # Same precedence as before: an offer pack is sent as is (first two
+        # pages), a cover replaces the generated first page, and
+        # policy_static.pdf replaces the generated policy.
+        offer_pack = offer_cover = policy_static = None
+        for name in OFFER_PACK_FILES:
+            if os.path.exists(self._path(name)):
+                try:
+                    read(name)
+                    offer_pack = _normalised_pdf(self._path(name), first_pages=OFFER_PAGES)
+                    break
+                except Exception as e:
+                    print(f"[LETTERS] Ignoring unreadable offer pack {name}: {e}")
+        if os.path.exists(self._path(OFFER_COVER_FILE)):
+            try:
+                read(OFFER_COVER_FILE)
+                offer_cover = _normalised_pdf(self._path(OFFER_COVER_FILE))
+            except Exception as e:
+                print(f"[LETTERS] Ignoring unreadable offer cover: {e}")
+        if os.path.exists(self._path(POLICY_STATIC_FILE)):
+            try:
+                read(POLICY_STATIC_FILE)
+                policy_static = _normalised_pdf(self._path(POLICY_STATIC_FILE))
+            except Exception as e:
+                print(f"[LETTERS] Ignoring unreadable {POLICY_STATIC_FILE}: {e}")
+        digest.update(f"{OFFER_PAGES}\0{json.dumps(POLICY_TERMS, sort_keys=True)}".encode("utf-8"))
+        return {
+            "version": digest.hexdigest()[:16],
+            "offer": offer,
+            "policy": policy,
+            "assets": assets,
+            "offer_pack": offer_pack,
+            "offer_cover": offer_cover,
+            "policy_static": policy_static,
+        }
+
+    def _prepare(self):
+        signature = self._sources()
+        with self._lock:
+            if signature != self._signature:
+                self._state = self._load_state()
+                self._signature = signature
+                self._static_blocks.clear()
+                self._results.clear()
+                self._prune_disk(self._state["version"])
+                print(f"[LETTERS] Templates compiled (version {self._state['version']})")
+            return self._state
+
+    def _prune_disk(self, version):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name != version:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    # ---------- jobs ----------
+    def _parts(self, name, template, context, fixed):
+        parts = []
+        for index in range(len(template.blocks)):
+            if template.is_personal(index, fixed):
+                parts.append(("html", template.page_html(index, context), None))
+            elif (name, index) in self._static_blocks:
+                parts.append(("pdf", self._static_blocks[(name, index)]))
+            else:
+                parts.append(("html", template.page_html(index, context), (name, index)))
+        return parts
+
+    def _job(self, state, fields):
+        with self._lock:
+            offer = {"pack": state["offer_pack"], "cover": state["offer_cover"], "parts": []}
+            if offer["pack"] is None:
+                context = {**fields, **state["assets"]}
+                offer["parts"] = self._parts("offer", state["offer"], context, state["assets"])
+            policy = {"static": state["policy_static"], "parts": []}
+            if policy["static"] is None:
+                context = {"candidate_name": fields["candidate_name"], **POLICY_TERMS}
+                policy["parts"] = self._parts("policy", state["policy"], context, POLICY_TERMS)
+        return {"offer": offer, "policy": policy}
+
+    @staticmethod
+    def fields_key(fields):
+        payload = json.dumps({k: str(fields.get(k) or "") for k in CANDIDATE_FIELDS}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_paths(self, version, fields_hash):
+        base = os.path.join(self.cache_dir, version, fields_hash)
+        return base + ".offer.pdf", base + ".policy.pdf"
+
+    def _remember(self, letters):
+        with self._lock:
+            self._results[(letters.version, letters.key)] = letters
+            self._results.move_to_end((letters.version, letters.key))
+            while len(self._results) > self.cache_entries:
+                self._results.popitem(last=False)
+
+    def _from_disk(self, state, fields_hash):
+        # A static policy is the same for everyone and is not stored per candidate
+        offer_path, policy_path = self._disk_paths(state["version"], fields_hash)
+        try:
+            with open(offer_path, "rb") as f:
+                offer = f.read()
+            policy = state["policy_static"]
+            if policy is None:
+                with open(policy_path, "rb") as f:
+                    policy = f.read()
+        except OSError:
+            return None
+        return Letters(offer, policy, state["version"], fields_hash, "disk")
+
+    def _to_disk(self, letters, static_policy):
+        offer_path, policy_path = self._disk_paths(letters.version, letters.key)
+        files = [(offer_path, letters.offer)] if static_policy else [(policy_path, letters.policy), (offer_path, letters.offer)]
+        try:
+            os.makedirs(os.path.dirname(offer_path), exist_ok=True)
+            for path, data in files:
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+        except OSError as e:
+            print(f"[LETTERS] Could not write letter cache: {e}")
+
+    # ---------- pool ----------
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                if self.processes > 0 and _CAN_FORK:
+                    self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                     mp_context=multiprocessing.get_context("fork"))
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="letter-render")
+            return self._pool
+
+    def _run(self, fn, arg):
+        pool = self._executor()
+        try:
+            return pool.submit(fn, arg)
+        except BrokenProcessPool:
+            with self._lock:
+                self._pool = None
+            print("[LETTERS] Render pool was broken; starting a new one")
+            return self._executor().submit(fn, arg)
+
+    def warm(self):
+        """Compile templates and start the render processes ahead of the first letter."""
+        try:
+            self._prepare()
+            for _ in range(max(self.processes, 1)):
+                self._run(_warm, None)
+        except Exception as e:
+            print(f"[LETTERS] Warm-up failed: {e}")
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    # ---------- public ----------
+    def submit(self, fields):
+        """Future resolving to Letters(offer, policy, version, key, source) for candidate fields."""
+        try:
+            state = self._prepare()
+        except Exception as e:
+            print(f"[LETTERS] Could not load letter templates: {e}")
+            failed = Future()
+            failed.set_exception(e)
+            return failed
+        version, fields_hash = state["version"], self.fields_key(fields)
+        slot = (version, fields_hash)
+        with self._lock:
+            cached = self._results.get(slot)
+            if cached is not None:
+                self._results.move_to_end(slot)
+                self.counters["memory_hits"] += 1
+            pending = self._inflight.get(slot)
+        if cached is not None:
+            done = Future()
+            done.set_result(cached._replace(source="memory"))
+            return done
+        if pending is not None:
+            return pending
+        stored = self._from_disk(state, fields_hash)
+        if stored is not None:
+            self._remember(stored)
+            with self._lock:
+                self.counters["disk_hits"] += 1
+            done = Future()
+            done.set_result(stored)
+            return done
+
+        result = Future()
+        with self._lock:
+            if slot in self._inflight:
+                return self._inflight[slot]
+            self._inflight[slot] = result
+
+        def finished(job_future):
+            try:
+                built = job_future.result()
+                letters = Letters(built["offer"], built["policy"], version, fields_hash, "rendered")
+                with self._lock:
+                    if self._state is not None and self._state["version"] == version:
+                        for key, data in built["rendered"]:
+                            self._static_blocks[key] = data
+                    self.counters["renders"] += 1
+                    self.counters["blocks_rendered"] += built["blocks"]
+                self._remember(letters)
+                self._to_disk(letters, static_policy=state["policy_static"] is not None)
+                print(f"[LETTERS] Rendered letters {fields_hash[:12]} in {built['render_ms']} ms")
+                result.set_result(letters)
+            except Exception as e:
+                with self._lock:
+                    self.counters["failures"] += 1
+                result.set_exception(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(slot, None)
+
+        try:
+            job = self._job(state, {k: str(fields.get(k) or "") for k in CANDIDATE_FIELDS})
+            self._run(build_letters, job).add_done_callback(finished)
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(slot, None)
+                self.counters["failures"] += 1
+            result.set_exception(e)
+        return result
+
+    def build(self, fields, timeout=LETTER_RENDER_WAIT_SECONDS):
+        return self.submit(fields).result(timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "version": self._state["version"] if self._state else None,
+                "processes": self.processes,
+                "cached_letters": len(self._results),
+                "static_blocks": len(self._static_blocks),
+                "in_flight": len(self._inflight),
+                **self.counters,
+            }
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_letter_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = LetterPipeline()
+    return _pipeline
@@ -2,7 +2,12 @@ from flask import Flask, jsonify, request, session, current_app
 from flask_mail import Mail, Message
 import os
 import base64
+import smtplib
+import threading
+import time
 import traceback
+from contextlib import contextmanager
+from email.message import EmailMessage
 import requests as http_requests  # renamed to avoid conflict
 from dotenv import load_dotenv
 
@@ -25,6 +30,8 @@ mail = Mail(app)
 print("DEBUG: MAIL_USERNAME =", os.getenv("MAIL_USERNAME"))
 print("DEBUG: MAIL_DEFAULT_SENDER =", os.getenv("MAIL_DEFAULT_SENDER"))
 
+BREVO_API_URL = os.getenv('BREVO_API_URL', 'https://api.brevo.com/v3/smtp/email')
+
 
 # ------------------------------
 # ✉️ Email Send via Brevo API (formerly Sendinblue)
@@ -80,7 +87,7 @@ def send_email_brevo(subject, recipients, body, html=None, attachments=None):
     
     try:
         response = http_requests.post(
-            "https://api.brevo.com/v3/smtp/email",
+            BREVO_API_URL,
             headers={
                 "api-key": api_key,
                 "Content-Type": "application/json",
@@ -153,9 +160,40 @@ def send_email_resend(subject, recipients, body, html=None):
         return False
 
 
-def send_email(subject, recipients, body, html=None, cc=None, attachments=None):
+# ------------------------------
+# ✉️ Outbound queue hook
+# ------------------------------
+_outbound_queue = None
+
+
+def use_outbound_queue(queue):
+    """Route send_email() through a mail_queue.MailQueue (the server starts its worker)."""
+    global _outbound_queue
+    _outbound_queue = queue
+
+
+def send_email(subject, recipients, body, html=None, cc=None, attachments=None,
+               record_id=None, kind=None, idempotency_key=None):
     """
-    Send email - tries multiple providers in order:
+    Send email. With an outbound queue configured the message is queued and
+    delivered by the background worker (True = accepted); otherwise it is sent
+    now. record_id/kind/idempotency_key only apply to queued mail.
+    """
+    if _outbound_queue is not None:
+        try:
+            queued = _outbound_queue.enqueue(subject, recipients, body, html=html, cc=cc, attachments=attachments,
+                                             record_id=record_id, kind=kind, idempotency_key=idempotency_key)
+            print(f"[MAIL] Queued #{queued['id']} to={recipients}, subject={subject}"
+                  f"{' (duplicate)' if queued['duplicate'] else ''}", flush=True)
+            return True
+        except Exception as e:
+            print(f"[MAIL] Could not queue mail, sending now: {e}", flush=True)
+    return send_email_now(subject, recipients, body, html=html, cc=cc, attachments=attachments)
+
+
+def send_email_now(subject, recipients, body, html=None, cc=None, attachments=None):
+    """
+    Send email synchronously - tries multiple providers in order:
     1. Brevo API (300 free emails/day, no domain verification)
     2. Resend API (requires domain verification for non-self emails)
     3. Flask-Mail SMTP (for local dev or attachments)
@@ -202,5 +240,201 @@ def send_email(subject, recipients, body, html=None, cc=None, attachments=None):
         print(f"[MAIL] Flask-Mail failed: {e}", flush=True)
         traceback.print_exc()
         return False
-    
-    
+
+
+# ------------------------------
+# ✉️ Queued delivery (mail_queue.MailWorker)
+# ------------------------------
+BREVO_BATCH_SIZE = int(os.getenv('BREVO_BATCH_SIZE', '50'))
+
+
+def send_email_brevo_batch(messages):
+    """
+    Send several attachment-free messages in one Brevo call (messageVersions).
+    messages: [{"recipients", "cc", "subject", "body", "html"}], all with or
+    all without html. Returns [(ok, message id or error)] in order.
+    """
+    api_key = os.getenv('BREVO_API_KEY')
+    if not api_key:
+        return [(False, "no BREVO_API_KEY configured")] * len(messages)
+    from_email = os.getenv('BREVO_FROM_EMAIL', os.getenv('MAIL_USERNAME', 'noreply@example.com'))
+    from_name = os.getenv('BREVO_FROM_NAME', 'VTab Office Tool')
+    first = messages[0]
+    versions = []
+    for m in messages:
+        version = {"to": [{"email": e} for e in m["recipients"]], "subject": m["subject"], "textContent": m["body"] or " "}
+        if m.get("cc"):
+            version["cc"] = [{"email": e} for e in m["cc"]]
+        if m.get("html"):
+            version["htmlContent"] = m["html"]
+        versions.append(version)
+    payload = {
+        "sender": {"name": from_name, "email": from_email},
+        "subject": first["subject"],
+        "textContent": first["body"] or " ",
+        "messageVersions": versions,
+        "headers": {"X-Mailin-custom": "disable-tracking"},
+        "trackClicks": False,
+        "trackOpens": False,
+    }
+    if first.get("html"):
+        payload["htmlContent"] = first["html"]
+    try:
+        response = http_requests.post(
+            BREVO_API_URL,
+            headers={"api-key": api_key, "Content-Type": "application/json", "Accept": "application/json"},
+            json=payload,
+            timeout=30
+        )
+    except Exception as e:
+        return [(False, f"Brevo error: {e}")] * len(messages)
+    if response.status_code not in (200, 201):
+        return [(False, f"Brevo {response.status_code}: {response.text[:300]}")] * len(messages)
+    try:
+        ids = response.json().get("messageIds") or []
+    except Exception:
+        ids = []
+    print(f"[MAIL-BREVO] Batch of {len(messages)} sent", flush=True)
+    return [(True, ids[n] if n < len(ids) else None) for n in range(len(messages))]
+
+
+class SmtpConnectionPool:
+    """Authenticated SMTP connections kept open and reused across messages."""
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True, timeout=10,
+                 idle_seconds=60, max_idle=2):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.max_idle = max_idle
+        self.opened = 0
+        self._idle = []                 # [(smtp, last_used)]
+        self._lock = threading.Lock()
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            smtp.starttls()
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        self.opened += 1
+        return smtp
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _take(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return self._open()
+                smtp, last_used = self._idle.pop()
+            if time.time() - last_used <= self.idle_seconds:
+                try:
+                    if smtp.noop()[0] == 250:
+                        return smtp
+                except Exception:
+                    pass
+            self._close(smtp)
+
+    @contextmanager
+    def connection(self):
+        smtp = self._take()
+        try:
+            yield smtp
+        except Exception:
+            # Connection state is unknown after a failure; do not hand it out again
+            self._close(smtp)
+            raise
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((smtp, time.time()))
+                smtp = None
+        if smtp is not None:
+            self._close(smtp)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            self._close(smtp)
+
+
+_smtp_pool = None
+
+
+def get_smtp_pool():
+    global _smtp_pool
+    if _smtp_pool is None:
+        _smtp_pool = SmtpConnectionPool(
+            app.config['MAIL_SERVER'], int(os.getenv('MAIL_PORT', app.config['MAIL_PORT'])),
+            app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'],
+            use_tls=os.getenv('MAIL_USE_TLS', 'true').lower() != 'false', timeout=app.config['MAIL_TIMEOUT'],
+        )
+    return _smtp_pool
+
+
+def _mime_message(mail):
+    msg = EmailMessage()
+    msg['From'] = app.config['MAIL_DEFAULT_SENDER'] or app.config['MAIL_USERNAME'] or 'noreply@example.com'
+    msg['To'] = ', '.join(mail['recipients'])
+    if mail.get('cc'):
+        msg['Cc'] = ', '.join(mail['cc'])
+    msg['Subject'] = mail['subject'] or ''
+    msg.set_content(mail['body'] or '')
+    if mail.get('html'):
+        msg.add_alternative(mail['html'], subtype='html')
+    for filename, content_type, data in mail.get('attachments') or []:
+        maintype, _, subtype = (content_type or 'application/octet-stream').partition('/')
+        msg.add_attachment(data, maintype=maintype, subtype=subtype or 'octet-stream', filename=filename)
+    return msg
+
+
+def deliver_queued(mails, smtp_pool=None):
+    """
+    Deliver a batch for mail_queue.MailWorker with the same provider order as
+    send_email_now: Brevo (attachment-free mail batched per call), Resend,
+    then SMTP over pooled connections. Returns {id: (ok, provider, detail)}.
+    """
+    results = {}
+    pending = list(mails)
+    if os.getenv('BREVO_API_KEY'):
+        plain = [m for m in pending if not m.get('attachments')]
+        for with_html in (False, True):
+            group = [m for m in plain if bool(m.get('html')) == with_html]
+            for i in range(0, len(group), BREVO_BATCH_SIZE):
+                chunk = group[i:i + BREVO_BATCH_SIZE]
+                for m, (ok, detail) in zip(chunk, send_email_brevo_batch(chunk)):
+                    results[m['id']] = (ok, 'brevo', detail)
+        for m in pending:
+            if m.get('attachments'):
+                ok = send_email_brevo(m['subject'], m['recipients'], m['body'], m.get('html'),
+                                      attachments=[(f, d) for f, _, d in m['attachments']])
+                results[m['id']] = (ok, 'brevo', None if ok else 'Brevo send failed')
+        pending = [m for m in pending if not results[m['id']][0]]
+    if os.getenv('RESEND_API_KEY'):
+        for m in [m for m in pending if not m.get('attachments')]:
+            if send_email_resend(m['subject'], m['recipients'], m['body'], m.get('html')):
+                results[m['id']] = (True, 'resend', None)
+        pending = [m for m in pending if not results.get(m['id'], (False,))[0]]
+    if pending:
+        pool = smtp_pool or get_smtp_pool()
+        for m in pending:
+            try:
+                with pool.connection() as smtp:
+                    smtp.send_message(_mime_message(m))
+                results[m['id']] = (True, 'smtp', None)
+            except Exception as e:
+                results[m['id']] = (False, 'smtp', f"SMTP: {e}")
+    return results
@@ -0,0 +1,435 @@
+# mail_ingest.py - Background IMAP ingester and local index of candidate replies
+#
+# check_email_reply and check_documents_email opened a fresh IMAP4_SSL
+# connection per click, logged in, searched the whole INBOX with
+# FROM "<email>" and downloaded the full RFC822 message (attachments
+# included) - several seconds per check, a login per click.
+#
+# MailIngester keeps one authenticated connection and polls the mailbox:
+#   - only UIDs above the persisted watermark are fetched; the first run (or a
+#     UIDVALIDITY change) backfills MAIL_INGEST_BACKFILL_DAYS;
+#   - per message it downloads the selected header fields and the first
+#     MAIL_INGEST_TEXT_BYTES of the body (the text part comes first in
+#     replies; attachments that follow are never transferred);
+#   - each message is stored in ReplyIndex by sender, with the offer reply
+#     (Yes/No) and the "documents sent" acknowledgement already classified.
+# Gunicorn workers share the index (SQLite, WAL); a lease in mail_state lets
+# only one of them hold the IMAP connection. refresh() asks the lease holder,
+# in whichever process, to poll now and waits briefly for it.
+#
+# imaplib has no IDLE before Python 3.14, so the ingester polls every
+# MAIL_POLL_SECONDS (NOOP + UID SEARCH on the open connection).
+
+import email
+import imaplib
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.header import decode_header, make_header
+from email.utils import parseaddr, parsedate_to_datetime
+
+from sqlite_store import SQLiteStore, singleton
+
+MAIL_INGEST_DB = os.getenv(
+    "MAIL_INGEST_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "mail_replies.db"),
+)
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", "30"))
+MAIL_INGEST_TEXT_BYTES = int(os.getenv("MAIL_INGEST_TEXT_BYTES", "32768"))
+MAIL_INGEST_BACKFILL_DAYS = int(os.getenv("MAIL_INGEST_BACKFILL_DAYS", "90"))
+MAIL_INGEST_FETCH_CHUNK = int(os.getenv("MAIL_INGEST_FETCH_CHUNK", "50"))
+MAIL_INGEST_LEASE_SECONDS = float(os.getenv("MAIL_INGEST_LEASE_SECONDS", "90"))
+MAIL_BODY_KEEP_CHARS = 4000
+HEADER_FIELDS = "FROM SUBJECT DATE MESSAGE-ID MIME-VERSION CONTENT-TYPE CONTENT-TRANSFER-ENCODING"
+
+# ---------- classification ----------
+OFFER_ACCEPT_PATTERNS = [r"\byes\b", r"\bi accept\b", r"\baccept\b", r"\bagree\b", r"\bconfirm\b"]
+OFFER_DECLINE_PATTERNS = [r"\bno\b", r"\bdecline\b", r"\breject\b", r"\bcannot\b", r"can't", r"cannot accept",
+                          r"will not", r"not interested", r"i am not interested"]
+DOCUMENTS_SENT_PATTERNS = [
+    r"yes,\s*sent",
+    r"yes\s+sent",
+    r"documents\s+sent",
+    r"sent\s+the\s+documents",
+    r"i\s+have\s+sent\s+the\s+documents",
+]
+
+
+def classify_offer_reply(text):
+    """'No' if the text declines (decline wins over accept), 'Yes' if it accepts, else None."""
+    lowered = (text or "").lower()
+    if any(re.search(p, lowered) for p in OFFER_DECLINE_PATTERNS):
+        return "No"
+    if any(re.search(p, lowered) for p in OFFER_ACCEPT_PATTERNS):
+        return "Yes"
+    return None
+
+
+def is_documents_sent(text):
+    lowered = (text or "").lower()
+    return any(re.search(p, lowered) for p in DOCUMENTS_SENT_PATTERNS)
+
+
+# ---------- message parsing ----------
+def parse_fetch_response(data):
+    """
+    imaplib UID FETCH data -> {uid: {"size", "header", "text"}}. Literals
+    arrive as (prefix, bytes) tuples; the prefix says which section it is.
+    """
+    messages, current = [], None
+    for item in data or []:
+        prefix = item[0] if isinstance(item, tuple) else item
+        if not isinstance(prefix, bytes):
+            continue
+        if re.match(rb"^\d+ \(", prefix):
+            current = {"meta": b"", "header": b"", "text": b""}
+            messages.append(current)
+        if current is None:
+            continue
+        current["meta"] += prefix
+        if isinstance(item, tuple):
+            section = prefix[prefix.upper().rfind(b"BODY["):].upper()
+            if section.startswith(b"BODY[HEADER"):
+                current["header"] = item[1]
+            elif section.startswith(b"BODY[TEXT]"):
+                current["text"] = item[1]
+    out = {}
+    for m in messages:
+        uid = re.search(rb"UID (\d+)", m["meta"])
+        if not uid:
+            continue
+        size = re.search(rb"RFC822\.SIZE (\d+)", m["meta"])
+        out[int(uid.group(1))] = {"size": int(size.group(1)) if size else None,
+                                  "header": m["header"], "text": m["text"]}
+    return out
+
+
+def _decode(value):
+    try:
+        return str(make_header(decode_header(value or "")))
+    except Exception:
+        return value or ""
+
+
+def _part_text(part):
+    try:
+        payload = part.get_payload(decode=True) or b""
+        return payload.decode(part.get_content_charset() or "utf-8", errors="ignore")
+    except Exception:
+        return ""
+
+
+def message_summary(header, text):
+    """Sender, subject, date and plain-text body from a header block and a (possibly cut) body."""
+    header = header.rstrip(b"\r\n") + b"\r\n\r\n"
+    msg = email.message_from_bytes(header + (text or b""))
+    body = ""
+    html = ""
+    for part in (msg.walk() if msg.is_multipart() else [msg]):
+        ctype = part.get_content_type()
+        if ctype == "text/plain" and not body:
+            body = _part_text(part)
+        elif ctype == "text/html" and not html:
+            html = re.sub(r"<[^>]+>", " ", _part_text(part))
+    received_at = None
+    try:
+        received_at = parsedate_to_datetime(msg.get("Date")).astimezone(timezone.utc).isoformat()
+    except Exception:
+        pass
+    return {
+        "sender": parseaddr(msg.get("From", ""))[1].strip().lower(),
+        "subject": _decode(msg.get("Subject")),
+        "message_id": (msg.get("Message-ID") or "").strip(),
+        "received_at": received_at,
+        "body": (body or html).strip()[:MAIL_BODY_KEEP_CHARS],
+    }
+
+
+# ---------- index ----------
+class ReplyIndex(SQLiteStore):
+    def __init__(self, db_path=MAIL_INGEST_DB):
+        super().__init__(db_path)
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS mail_state (
+                mailbox TEXT PRIMARY KEY,
+                uidvalidity INTEGER,
+                last_uid INTEGER NOT NULL DEFAULT 0,
+                last_poll_at REAL,
+                last_error TEXT,
+                wake_at REAL,
+                owner TEXT,
+                lease_until REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS mail_replies (
+                mailbox TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                sender TEXT NOT NULL,
+                subject TEXT,
+                message_id TEXT,
+                received_at TEXT,
+                size INTEGER,
+                body TEXT,
+                offer_reply TEXT,
+                docs_sent INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (mailbox, uidvalidity, uid)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_mail_replies_sender ON mail_replies (sender, mailbox, uid)")
+
+    def _ensure_state(self, conn, mailbox):
+        conn.execute("INSERT OR IGNORE INTO mail_state (mailbox) VALUES (?)", (mailbox,))
+
+    # ---------- watermark ----------
+    def watermark(self, mailbox="INBOX"):
+        row = self._conn().execute(
+            "SELECT uidvalidity, last_uid FROM mail_state WHERE mailbox = ?", (mailbox,)
+        ).fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    def record(self, mailbox, uidvalidity, last_uid, replies):
+        """Store replies [(uid, summary, size)] and move the watermark, in one transaction."""
+        def apply(conn):
+            self._ensure_state(conn, mailbox)
+            stored = conn.execute("SELECT uidvalidity FROM mail_state WHERE mailbox = ?", (mailbox,)).fetchone()[0]
+            if stored is not None and stored != uidvalidity:
+                # Mailbox was rebuilt: old UIDs mean nothing any more
+                conn.execute("DELETE FROM mail_replies WHERE mailbox = ?", (mailbox,))
+                conn.execute("UPDATE mail_state SET last_uid = 0 WHERE mailbox = ?", (mailbox,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO mail_replies (mailbox, uidvalidity, uid, sender, subject, message_id,"
+                " received_at, size, body, offer_reply, docs_sent) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(mailbox, uidvalidity, uid, s["sender"], s["subject"], s["message_id"], s["received_at"], size,
+                  s["body"], classify_offer_reply(s["body"]), int(is_documents_sent(s["body"])))
+                 for uid, s, size in replies if s["sender"]],
+            )
+            conn.execute(
+                "UPDATE mail_state SET uidvalidity = ?, last_uid = MAX(last_uid, ?) WHERE mailbox = ?",
+                (uidvalidity, last_uid, mailbox),
+            )
+        self._transaction(apply)
+
+    # ---------- lookups ----------
+    def latest(self, sender, mailbox="INBOX"):
+        """Most recent message from this address, or None."""
+        keys = ("uid", "sender", "subject", "message_id", "received_at", "body", "offer_reply", "docs_sent")
+        row = self._conn().execute(
+            f"SELECT {', '.join(keys)} FROM mail_replies WHERE sender = ? AND mailbox = ? ORDER BY uid DESC LIMIT 1",
+            ((sender or "").strip().lower(), mailbox),
+        ).fetchone()
+        if row is None:
+            return None
+        result = dict(zip(keys, row))
+        result["docs_sent"] = bool(result["docs_sent"])
+        return result
+
+    def state(self, mailbox="INBOX"):
+        row = self._conn().execute(
+            "SELECT uidvalidity, last_uid, last_poll_at, last_error, wake_at, owner, lease_until"
+            " FROM mail_state WHERE mailbox = ?", (mailbox,),
+        ).fetchone()
+        keys = ("uidvalidity", "last_uid", "last_poll_at", "last_error", "wake_at", "owner", "lease_until")
+        return dict(zip(keys, row)) if row else dict.fromkeys(keys)
+
+    def stats(self, mailbox="INBOX"):
+        state = self.state(mailbox)
+        count = self._conn().execute("SELECT COUNT(*) FROM mail_replies WHERE mailbox = ?", (mailbox,)).fetchone()[0]
+        return {"messages": count, **{k: state[k] for k in ("last_uid", "last_poll_at", "last_error", "owner")}}
+
+    # ---------- polling coordination ----------
+    def acquire(self, mailbox, owner, lease_seconds=MAIL_INGEST_LEASE_SECONDS):
+        """Take or renew the poller lease. False while another live worker holds it."""
+        now = time.time()
+
+        def apply(conn):
+            self._ensure_state(conn, mailbox)
+            return conn.execute(
+                "UPDATE mail_state SET owner = ?, lease_until = ? WHERE mailbox = ?"
+                " AND (owner IS NULL OR owner = ? OR lease_until < ?)",
+                (owner, now + lease_seconds, mailbox, owner, now),
+            ).rowcount > 0
+        return self._transaction(apply)
+
+    def release(self, mailbox, owner):
+        self._conn().execute(
+            "UPDATE mail_state SET owner = NULL, lease_until = NULL WHERE mailbox = ? AND owner = ?", (mailbox, owner)
+        )
+
+    def mark_polled(self, mailbox, error=None):
+        def apply(conn):
+            self._ensure_state(conn, mailbox)
+            conn.execute("UPDATE mail_state SET last_poll_at = ?, last_error = ? WHERE mailbox = ?",
+                         (time.time(), error, mailbox))
+        self._transaction(apply)
+
+    def request_poll(self, mailbox="INBOX"):
+        now = time.time()
+
+        def apply(conn):
+            self._ensure_state(conn, mailbox)
+            conn.execute("UPDATE mail_state SET wake_at = ? WHERE mailbox = ?", (now, mailbox))
+        self._transaction(apply)
+        return now
+
+
+# ---------- ingester ----------
+def imap_connector(host, username, password, port=None, use_ssl=True, timeout=30):
+    """connect() for MailIngester: a logged-in IMAP4(_SSL) connection."""
+    def connect():
+        cls = imaplib.IMAP4_SSL if use_ssl else imaplib.IMAP4
+        imap = cls(host, port or (993 if use_ssl else 143), timeout=timeout)
+        try:
+            imap.login(username, password)
+        except imaplib.IMAP4.error as e:
+            imap.shutdown()
+            raise RuntimeError(f"IMAP auth failed: {e}")
+        return imap
+    return connect
+
+
+class MailIngester:
+    def __init__(self, index, connect, mailbox="INBOX", poll_seconds=MAIL_POLL_SECONDS,
+                 lease_seconds=MAIL_INGEST_LEASE_SECONDS, text_bytes=MAIL_INGEST_TEXT_BYTES,
+                 backfill_days=MAIL_INGEST_BACKFILL_DAYS, fetch_chunk=MAIL_INGEST_FETCH_CHUNK):
+        self.index = index
+        self.connect = connect
+        self.mailbox = mailbox
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.text_bytes = text_bytes
+        self.backfill_days = backfill_days
+        self.fetch_chunk = max(1, fetch_chunk)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._imap = None
+        self._uidvalidity = None
+        self._poll_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- connection ----------
+    def _connection(self):
+        if self._imap is None:
+            imap = self.connect()
+            typ, _ = imap.select(self.mailbox, readonly=True)
+            if typ != "OK":
+                imap.logout()
+                raise RuntimeError(f"Could not open mailbox {self.mailbox}")
+            _, data = imap.response("UIDVALIDITY")
+            self._uidvalidity = int(data[0]) if data and data[0] else 0
+            self._imap = imap
+            print(f"[MAIL INGEST] Connected to {self.mailbox} (UIDVALIDITY {self._uidvalidity})")
+        else:
+            self._imap.noop()
+        return self._imap
+
+    def _disconnect(self):
+        imap, self._imap = self._imap, None
+        if imap is not None:
+            try:
+                imap.logout()
+            except Exception:
+                pass
+
+    # ---------- polling ----------
+    def poll_once(self):
+        """Fetch messages above the watermark into the index. Returns how many were stored."""
+        with self._poll_lock:
+            try:
+                stored = self._poll()
+                self.index.mark_polled(self.mailbox)
+                return stored
+            except Exception as e:
+                self._disconnect()
+                self.index.mark_polled(self.mailbox, error=str(e))
+                print(f"[MAIL INGEST] Poll failed: {e}")
+                raise
+
+    def _poll(self):
+        imap = self._connection()
+        uidvalidity = self._uidvalidity
+        stored_validity, last_uid = self.index.watermark(self.mailbox)
+        if stored_validity != uidvalidity:
+            last_uid = 0
+        if last_uid:
+            typ, data = imap.uid("SEARCH", f"UID {last_uid + 1}:*")
+        elif self.backfill_days > 0:
+            since = (datetime.now(timezone.utc) - timedelta(days=self.backfill_days)).strftime("%d-%b-%Y")
+            typ, data = imap.uid("SEARCH", f"SINCE {since}")
+        else:
+            typ, data = imap.uid("SEARCH", "ALL")
+        if typ != "OK":
+            raise RuntimeError(f"UID SEARCH failed: {data}")
+        # n:* always matches the newest message, even when it is below n
+        uids = sorted(u for u in (int(x) for x in (data[0] or b"").split()) if u > last_uid)
+        if not uids:
+            self.index.record(self.mailbox, uidvalidity, last_uid, [])
+            return 0
+        items = f"(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})] BODY.PEEK[TEXT]<0.{self.text_bytes}>)"
+        stored = 0
+        for i in range(0, len(uids), self.fetch_chunk):
+            chunk = uids[i:i + self.fetch_chunk]
+            typ, data = imap.uid("FETCH", ",".join(str(u) for u in chunk), items)
+            if typ != "OK":
+                raise RuntimeError(f"UID FETCH failed: {data}")
+            replies = [(uid, message_summary(m["header"], m["text"]), m["size"])
+                       for uid, m in parse_fetch_response(data).items()]
+            # Watermark moves per chunk, so a failure later only refetches the rest
+            self.index.record(self.mailbox, uidvalidity, max(chunk), replies)
+            stored += len(replies)
+        print(f"[MAIL INGEST] Stored {stored} new message(s) from {self.mailbox}")
+        return stored
+
+    def refresh(self, timeout=3.0):
+        """Ask whichever worker holds the lease to poll now; True once a poll finished after the request."""
+        requested = self.index.request_poll(self.mailbox)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if (self.index.state(self.mailbox)["last_poll_at"] or 0) >= requested:
+                return True
+            time.sleep(0.1)
+        return False
+
+    # ---------- background loop ----------
+    def _due(self):
+        state = self.index.state(self.mailbox)
+        last = state["last_poll_at"] or 0
+        return time.time() - last >= self.poll_seconds or (state["wake_at"] or 0) > last
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.index.acquire(self.mailbox, self.owner, self.lease_seconds):
+                    if self._due():
+                        try:
+                            self.poll_once()
+                        except Exception:
+                            # Back off on failure instead of hammering the server every tick
+                            self._stop.wait(min(self.poll_seconds, 30))
+                elif self._imap is not None:
+                    self._disconnect()
+            except Exception as e:
+                print(f"[MAIL INGEST] Loop error: {e}")
+            self._stop.wait(0.5)
+        self._disconnect()
+        self.index.release(self.mailbox, self.owner)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="mail-ingest", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+get_reply_index = singleton(ReplyIndex)
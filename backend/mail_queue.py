@@ -0,0 +1,324 @@
+# mail_queue.py - Persistent outbound mail queue with a background sender
+#
+# Offer letters, interview results, login credentials and policy letters were
+# sent inside the request handler: an SMTP session (10s timeout) or a Brevo
+# call, often with PDF attachments, on every click - and a slow or failed send
+# failed the HR action with it.
+#
+# send_email() now enqueues into MailQueue (SQLite, shared by gunicorn
+# workers) and returns; MailWorker delivers in the background:
+#   - rows are claimed with a lease (status 'sending'), so every worker can run
+#     a sender without two of them taking the same message; a lease left by a
+#     dead worker expires and the message is picked up again;
+#   - delivery is handed a batch, so the transport can group Brevo API sends
+#     and reuse one SMTP connection (mail_app.deliver_queued);
+#   - failures are retried with exponential backoff up to MAIL_MAX_ATTEMPTS;
+#   - an idempotency key makes a repeated enqueue return the existing message.
+#     Callers may pass one; otherwise the key is a hash of the content, which
+#     only deduplicates for MAIL_DEDUP_SECONDS (double clicks, client retries);
+#   - status is queryable by record ID (onboarding record, employee ID).
+# Attachment bytes are dropped once a message is sent.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from sqlite_store import SQLiteStore, singleton
+
+MAIL_QUEUE_DB = os.getenv(
+    "MAIL_QUEUE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "mail_queue.db"),
+)
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "6"))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "30"))
+MAIL_RETRY_MAX_SECONDS = float(os.getenv("MAIL_RETRY_MAX_SECONDS", "3600"))
+MAIL_DEDUP_SECONDS = float(os.getenv("MAIL_DEDUP_SECONDS", "600"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "25"))
+MAIL_LEASE_SECONDS = float(os.getenv("MAIL_LEASE_SECONDS", "300"))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_QUEUE_POLL_SECONDS", "5"))
+
+_COLUMNS = ("id", "idempotency_key", "record_id", "kind", "subject", "recipients", "cc", "body", "html",
+            "status", "attempts", "next_attempt_at", "last_error", "provider", "provider_message_id",
+            "created_at", "sent_at")
+
+
+def content_key(subject, recipients, body, html=None, cc=None, attachments=None, record_id=None, kind=None):
+    digest = hashlib.sha256()
+    for part in (kind, record_id, subject, json.dumps(sorted(recipients or [])),
+                 json.dumps(sorted(cc or [])), body, html):
+        digest.update(f"{part or ''}\0".encode("utf-8"))
+    for filename, data in attachments or []:
+        digest.update(filename.encode("utf-8") + b"\0" + hashlib.sha256(data).digest())
+    return "auto:" + digest.hexdigest()
+
+
+class MailQueue(SQLiteStore):
+    def __init__(self, db_path=MAIL_QUEUE_DB):
+        super().__init__(db_path)
+        self._wake = threading.Event()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbound_mail (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL,
+                dedup_until REAL,
+                record_id TEXT,
+                kind TEXT,
+                subject TEXT,
+                recipients TEXT NOT NULL,
+                cc TEXT,
+                body TEXT,
+                html TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                provider TEXT,
+                provider_message_id TEXT,
+                owner TEXT,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbound_attachments (
+                mail_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                filename TEXT NOT NULL,
+                content_type TEXT,
+                size INTEGER,
+                data BLOB,
+                PRIMARY KEY (mail_id, position)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbound_due ON outbound_mail (status, next_attempt_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbound_key ON outbound_mail (idempotency_key)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbound_record ON outbound_mail (record_id)")
+
+    @staticmethod
+    def _row(row):
+        mail = dict(zip(_COLUMNS, row))
+        mail["recipients"] = json.loads(mail["recipients"] or "[]")
+        mail["cc"] = json.loads(mail["cc"] or "null")
+        return mail
+
+    # ---------- enqueue ----------
+    def enqueue(self, subject, recipients, body, html=None, cc=None, attachments=None,
+                record_id=None, kind=None, idempotency_key=None, content_type="application/pdf"):
+        """
+        Queue a message; attachments are [(filename, bytes)]. Returns the
+        message (without body/attachments) with duplicate=True when the key
+        matched an existing one.
+        """
+        recipients = [r for r in (recipients if isinstance(recipients, (list, tuple)) else [recipients]) if r]
+        if not recipients:
+            raise ValueError("no recipients")
+        now = time.time()
+        if idempotency_key:
+            key, dedup_until = str(idempotency_key), None
+        else:
+            key = content_key(subject, recipients, body, html, cc, attachments, record_id, kind)
+            dedup_until = now + MAIL_DEDUP_SECONDS
+
+        def apply(conn):
+            existing = conn.execute(
+                "SELECT id FROM outbound_mail WHERE idempotency_key = ? AND (dedup_until IS NULL OR dedup_until > ?)"
+                " ORDER BY id DESC LIMIT 1", (key, now),
+            ).fetchone()
+            if existing:
+                return existing[0], True
+            cur = conn.execute(
+                "INSERT INTO outbound_mail (idempotency_key, dedup_until, record_id, kind, subject, recipients, cc,"
+                " body, html, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, dedup_until, None if record_id is None else str(record_id), kind, subject,
+                 json.dumps(recipients), json.dumps(cc) if cc else None, body, html, now, now),
+            )
+            conn.executemany(
+                "INSERT INTO outbound_attachments (mail_id, position, filename, content_type, size, data)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(cur.lastrowid, n, filename, content_type, len(data), sqlite3.Binary(data))
+                 for n, (filename, data) in enumerate(attachments or [])],
+            )
+            return cur.lastrowid, False
+
+        mail_id, duplicate = self._transaction(apply)
+        if not duplicate:
+            self._wake.set()
+        mail = self.get(mail_id)
+        mail["duplicate"] = duplicate
+        return mail
+
+    # ---------- worker side ----------
+    def claim(self, owner, limit=MAIL_BATCH_SIZE, lease_seconds=MAIL_LEASE_SECONDS):
+        """Lease up to `limit` due messages (with attachments) for sending."""
+        now = time.time()
+
+        def apply(conn):
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM outbound_mail"
+                " WHERE (status = 'queued' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until < ?)"
+                " ORDER BY next_attempt_at, id LIMIT ?", (now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbound_mail SET status = 'sending', owner = ?, lease_until = ? WHERE id = ?",
+                [(owner, now + lease_seconds, r[0]) for r in rows],
+            )
+            return rows
+        mails = [self._row(r) for r in self._transaction(apply)]
+        for mail in mails:
+            mail["attachments"] = [
+                (filename, content_type, bytes(data)) for filename, content_type, data in self._conn().execute(
+                    "SELECT filename, content_type, data FROM outbound_attachments WHERE mail_id = ? ORDER BY position",
+                    (mail["id"],),
+                ).fetchall()
+            ]
+        return mails
+
+    def mark_sent(self, mail_id, provider, provider_message_id=None):
+        def apply(conn):
+            conn.execute(
+                "UPDATE outbound_mail SET status = 'sent', attempts = attempts + 1, sent_at = ?, provider = ?,"
+                " provider_message_id = ?, last_error = NULL, owner = NULL, lease_until = NULL WHERE id = ?",
+                (time.time(), provider, provider_message_id, mail_id),
+            )
+            conn.execute("UPDATE outbound_attachments SET data = NULL WHERE mail_id = ?", (mail_id,))
+        self._transaction(apply)
+
+    def mark_failed_attempt(self, mail_id, error, max_attempts=MAIL_MAX_ATTEMPTS,
+                            base_seconds=MAIL_RETRY_BASE_SECONDS, max_seconds=MAIL_RETRY_MAX_SECONDS):
+        """Schedule a retry with exponential backoff, or give up after max_attempts. Returns the new status."""
+        def apply(conn):
+            attempts = conn.execute("SELECT attempts FROM outbound_mail WHERE id = ?", (mail_id,)).fetchone()[0] + 1
+            status = "failed" if attempts >= max_attempts else "queued"
+            delay = min(max_seconds, base_seconds * (2 ** (attempts - 1)))
+            conn.execute(
+                "UPDATE outbound_mail SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?,"
+                " owner = NULL, lease_until = NULL WHERE id = ?",
+                (status, attempts, time.time() + delay, str(error)[:1000], mail_id),
+            )
+            return status
+        return self._transaction(apply)
+
+    def retry(self, mail_id):
+        """Put a failed message back in the queue now."""
+        requeued = self._transaction(lambda conn: conn.execute(
+            "UPDATE outbound_mail SET status = 'queued', attempts = 0, next_attempt_at = ? WHERE id = ? AND status = 'failed'",
+            (time.time(), mail_id),
+        ).rowcount > 0)
+        if requeued:
+            self._wake.set()
+        return requeued
+
+    # ---------- status ----------
+    def get(self, mail_id):
+        row = self._conn().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM outbound_mail WHERE id = ?", (mail_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        mail = self._row(row)
+        mail.pop("body")
+        mail.pop("html")
+        mail["attachments"] = [
+            {"filename": f, "size": s} for f, s in self._conn().execute(
+                "SELECT filename, size FROM outbound_attachments WHERE mail_id = ? ORDER BY position", (mail_id,)
+            ).fetchall()
+        ]
+        return mail
+
+    def for_record(self, record_id, limit=50):
+        """Messages queued for a record (newest first), without bodies."""
+        ids = self._conn().execute(
+            "SELECT id FROM outbound_mail WHERE record_id = ? ORDER BY id DESC LIMIT ?", (str(record_id), limit)
+        ).fetchall()
+        return [self.get(i) for (i,) in ids]
+
+    def stats(self):
+        counts = dict(self._conn().execute("SELECT status, COUNT(*) FROM outbound_mail GROUP BY status").fetchall())
+        oldest = self._conn().execute(
+            "SELECT MIN(created_at) FROM outbound_mail WHERE status IN ('queued', 'sending')"
+        ).fetchone()[0]
+        return {"counts": counts, "oldest_pending_age": round(time.time() - oldest, 1) if oldest else None}
+
+    def wait(self, timeout):
+        """Block until something is enqueued in this process or timeout passes."""
+        woke = self._wake.wait(timeout)
+        self._wake.clear()
+        return woke
+
+
+class MailWorker:
+    def __init__(self, queue, deliver, batch_size=MAIL_BATCH_SIZE, poll_seconds=MAIL_POLL_INTERVAL,
+                 lease_seconds=MAIL_LEASE_SECONDS, max_attempts=MAIL_MAX_ATTEMPTS,
+                 retry_base_seconds=MAIL_RETRY_BASE_SECONDS, retry_max_seconds=MAIL_RETRY_MAX_SECONDS):
+        """
+        deliver([mail]) -> {mail_id: (ok, provider, provider_message_id or
+        error)}; each mail has recipients, cc, subject, body, html and
+        attachments [(filename, content_type, bytes)].
+        """
+        self.queue = queue
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Deliver one batch of due messages. Returns how many were attempted."""
+        mails = self.queue.claim(self.owner, self.batch_size, self.lease_seconds)
+        if not mails:
+            return 0
+        try:
+            results = self.deliver(mails) or {}
+        except Exception as e:
+            print(f"[MAIL QUEUE] Delivery batch failed: {e}")
+            results = {}
+            error = str(e)
+        else:
+            error = "no delivery result"
+        for mail in mails:
+            ok, provider, detail = results.get(mail["id"], (False, None, error))
+            if ok:
+                self.queue.mark_sent(mail["id"], provider, detail)
+                print(f"[MAIL QUEUE] Sent #{mail['id']} ({mail['kind'] or 'mail'}) via {provider} -> {mail['recipients']}")
+            else:
+                status = self.queue.mark_failed_attempt(mail["id"], detail, max_attempts=self.max_attempts,
+                                                        base_seconds=self.retry_base_seconds,
+                                                        max_seconds=self.retry_max_seconds)
+                print(f"[MAIL QUEUE] #{mail['id']} not sent ({status}): {detail}")
+        return len(mails)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once() >= self.batch_size:
+                    continue                  # more may be due right away
+            except Exception as e:
+                print(f"[MAIL QUEUE] Worker error: {e}")
+            self.queue.wait(self.poll_seconds)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="mail-queue", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.queue._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+get_mail_queue = singleton(MailQueue)
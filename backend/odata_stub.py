@@ -0,0 +1,275 @@
+"""
+Minimal offline stand-in for the Dataverse Web API, used to exercise the
+replica sync loop (dataverse_replica.py) without a CRM connection.
+
+Supports what the replica needs:
+  - GET /api/data/v9.2/<entity_set>?$select=a,b
+  - paging via `Prefer: odata.maxpagesize=N` + @odata.nextLink
+  - change tracking: `Prefer: odata.track-changes` returns @odata.deltaLink,
+    GET on the delta link returns changed rows and $deletedEntity tombstones
+  - expire_tokens() makes older delta links answer 410 Gone
+  - throttle_next = N answers the next N requests with 429 + Retry-After
+  - POST <entity_set> and POST $batch with changesets (each changeset is
+    applied atomically; `Prefer: odata.continue-on-error` keeps going after a
+    failed one). reject(entity_set, body) -> error message makes a create fail.
+
+Usage:
+    stub = ODataStub({"crc6f_hr_holidayses": "crc6f_hr_holidaysid"})
+    base_url = stub.start()          # http://127.0.0.1:<port>/api/data/v9.2
+    stub.upsert("crc6f_hr_holidayses", {"crc6f_hr_holidaysid": "h1", "crc6f_holidayname": "Pongal"})
+    ...
+    stub.stop()
+"""
+
+import json
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+API_PREFIX = "/api/data/v9.2/"
+
+
+class ODataStub:
+    def __init__(self, entity_sets):
+        self.entity_sets = dict(entity_sets)           # entity_set -> primary key field
+        self.rows = {name: {} for name in self.entity_sets}
+        self.changes = {name: [] for name in self.entity_sets}   # [(version, record_id)]
+        self.version = 0
+        self.min_token = 0
+        self.requests = []
+        self.fail_next = 0
+        self.throttle_next = 0
+        self.retry_after = 1
+        self.reject = None
+        self.batches = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self.base_url = None
+
+    # ---------- data manipulation ----------
+    def upsert(self, entity_set, record):
+        pk = self.entity_sets[entity_set]
+        with self._lock:
+            self.version += 1
+            rid = str(record[pk])
+            merged = dict(self.rows[entity_set].get(rid) or {})
+            merged.update(record)
+            self.rows[entity_set][rid] = merged
+            self.changes[entity_set].append((self.version, rid))
+
+    def delete(self, entity_set, record_id):
+        with self._lock:
+            self.version += 1
+            self.rows[entity_set].pop(str(record_id), None)
+            self.changes[entity_set].append((self.version, str(record_id)))
+
+    def expire_tokens(self):
+        """Invalidate every delta link issued so far (Dataverse answers 410)."""
+        with self._lock:
+            self.min_token = self.version + 1
+
+    # ---------- HTTP ----------
+    def _select(self, row, select):
+        if not select:
+            return dict(row)
+        return {k: row.get(k) for k in select}
+
+    def handle_get(self, path, query, prefer):
+        entity_set = path[len(API_PREFIX):] if path.startswith(API_PREFIX) else None
+        if entity_set not in self.entity_sets:
+            return 404, {"error": {"message": f"Resource not found for the segment '{entity_set}'"}}
+        if self.throttle_next > 0:
+            self.throttle_next -= 1
+            return 429, {"error": {"code": "0x80072322", "message": "Number of requests exceeded the limit"}}
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            return 503, {"error": {"message": "stub failure"}}
+
+        select = [s for s in (query.get("$select", [""])[0] or "").split(",") if s]
+        page_size = 5000
+        for part in prefer.split(","):
+            part = part.strip()
+            if part.startswith("odata.maxpagesize="):
+                page_size = int(part.split("=", 1)[1])
+        track = "odata.track-changes" in prefer
+        skip = int(query.get("$skiptoken", ["0"])[0] or 0)
+        delta_token = query.get("$deltatoken", [None])[0]
+
+        with self._lock:
+            if delta_token is not None:
+                since = int(delta_token)
+                if since < self.min_token:
+                    return 410, {"error": {"code": "0x80044352", "message": "The delta token has expired"}}
+                changed = []
+                for version, rid in self.changes[entity_set]:
+                    if version > since and rid not in changed:
+                        changed.append(rid)
+                items = []
+                for rid in changed:
+                    row = self.rows[entity_set].get(rid)
+                    if row is None:
+                        items.append({
+                            "@odata.context": f"{self.base_url}/$metadata#{entity_set}/$deletedEntity",
+                            "id": rid,
+                            "reason": "deleted",
+                        })
+                    else:
+                        items.append(self._select(row, select))
+            else:
+                items = [self._select(r, select) for r in self.rows[entity_set].values()]
+            current_version = self.version
+
+        page = items[skip:skip + page_size]
+        body = {"@odata.context": f"{self.base_url}/$metadata#{entity_set}", "value": page}
+        base_params = {"$select": ",".join(select)} if select else {}
+        if delta_token is not None:
+            base_params["$deltatoken"] = delta_token
+        if skip + page_size < len(items):
+            body["@odata.nextLink"] = f"{self.base_url}/{entity_set}?" + urlencode({**base_params, "$skiptoken": skip + page_size})
+        elif track or delta_token is not None:
+            params = {k: v for k, v in base_params.items() if k != "$deltatoken"}
+            params["$deltatoken"] = current_version
+            body["@odata.deltaLink"] = f"{self.base_url}/{entity_set}?" + urlencode(params)
+        return 200, body
+
+    def _create(self, entity_set, body):
+        """Insert one row (caller holds the lock); returns (status, error, record_id)."""
+        if entity_set not in self.entity_sets:
+            return 404, f"Resource not found for the segment '{entity_set}'", None
+        error = self.reject(entity_set, body) if self.reject else None
+        if error:
+            return 400, error, None
+        pk = self.entity_sets[entity_set]
+        rid = str(body.get(pk) or uuid.uuid4())
+        self.version += 1
+        self.rows[entity_set][rid] = {**body, pk: rid}
+        self.changes[entity_set].append((self.version, rid))
+        return 204, None, rid
+
+    def handle_post(self, path, body, content_type, prefer):
+        if path == API_PREFIX + "$batch":
+            return self._handle_batch(body.decode("utf-8"), content_type, prefer)
+        entity_set = path[len(API_PREFIX):]
+        with self._lock:
+            status, error, rid = self._create(entity_set, json.loads(body or b"{}"))
+        if error:
+            return status, {"error": {"message": error}}, {}
+        return status, None, {"OData-EntityId": f"{self.base_url}/{entity_set}({rid})"}
+
+    def _handle_batch(self, text, content_type, prefer):
+        boundary = re.search(r"boundary=([^;\s]+)", content_type).group(1)
+        continue_on_error = "odata.continue-on-error" in prefer
+        out_boundary = f"batchresponse_{uuid.uuid4().hex}"
+        parts = []
+        self.batches += 1
+        for chunk in text.split(f"--{boundary}")[1:]:
+            if chunk.startswith("--"):
+                break
+            cs_boundary = re.search(r"boundary=([^;\s]+)", chunk).group(1)
+            ops = []
+            for op in chunk.split(f"--{cs_boundary}")[1:]:
+                if op.startswith("--"):
+                    break
+                request_text = op.replace("\r\n", "\n").split("\n\n", 1)[1]
+                request_line, _, rest = request_text.partition("\n")
+                method, url, _ = request_line.split(" ", 2)
+                payload = rest.split("\n\n", 1)[1] if "\n\n" in rest else ""
+                ops.append((method, url.rsplit("/", 1)[-1], json.loads(payload) if payload.strip() else {}))
+            with self._lock:
+                snapshot = ({k: dict(v) for k, v in self.rows.items()},
+                            {k: list(v) for k, v in self.changes.items()}, self.version)
+                created, failure = [], None
+                for method, entity_set, payload in ops:
+                    status, error, rid = self._create(entity_set, payload)
+                    if error:
+                        failure = (status, error)
+                        break
+                    created.append((entity_set, rid))
+                if failure:
+                    self.rows, self.changes, self.version = snapshot
+            if failure:
+                body = json.dumps({"error": {"message": failure[1]}})
+                parts.append(
+                    "Content-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n\r\n"
+                    f"HTTP/1.1 {failure[0]} Bad Request\r\nContent-Type: application/json\r\n\r\n{body}"
+                )
+                if not continue_on_error:
+                    break
+                continue
+            cs_out = f"changesetresponse_{uuid.uuid4().hex}"
+            responses = "".join(
+                f"--{cs_out}\r\nContent-Type: application/http\r\nContent-Transfer-Encoding: binary\r\n"
+                f"Content-ID: {n + 1}\r\n\r\nHTTP/1.1 204 No Content\r\n"
+                f"OData-EntityId: {self.base_url}/{entity_set}({rid})\r\n\r\n\r\n"
+                for n, (entity_set, rid) in enumerate(created)
+            )
+            parts.append(f"Content-Type: multipart/mixed; boundary={cs_out}\r\n\r\n{responses}--{cs_out}--")
+        body = "".join(f"--{out_boundary}\r\n{part}\r\n" for part in parts) + f"--{out_boundary}--\r\n"
+        return 200, body, {"Content-Type": f"multipart/mixed; boundary={out_boundary}"}
+
+    def start(self, host="127.0.0.1", port=0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                prefer = self.headers.get("Prefer", "")
+                stub.requests.append({"path": parsed.path, "query": query, "prefer": prefer})
+                status, body = stub.handle_get(parsed.path, query, prefer)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; odata.metadata=minimal")
+                self.send_header("Content-Length", str(len(payload)))
+                if status == 429:
+                    self.send_header("Retry-After", str(stub.retry_after))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                prefer = self.headers.get("Prefer", "")
+                stub.requests.append({"path": parsed.path, "method": "POST", "prefer": prefer})
+                status, payload, headers = stub.handle_post(
+                    parsed.path, body, self.headers.get("Content-Type", ""), prefer)
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload)
+                    headers = {"Content-Type": "application/json", **headers}
+                data = (payload or "").encode("utf-8")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.base_url = f"http://{host}:{self._server.server_address[1]}/api/data/v9.2"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if __name__ == "__main__":
+    import time
+
+    stub = ODataStub({"crc6f_hr_holidayses": "crc6f_hr_holidaysid"})
+    stub.upsert("crc6f_hr_holidayses", {"crc6f_hr_holidaysid": "h1", "crc6f_holidayname": "New Year", "crc6f_date": "2026-01-01"})
+    print(f"OData stub listening at {stub.start(port=5055)}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -216,9 +216,10 @@
 #         return jsonify({"success": False, "error": str(e)}), 500
 # boards_bp.py
 from flask import Blueprint, request, jsonify, current_app
-import requests, os, re, traceback
+import requests, os, traceback
 from dotenv import load_dotenv
-from dataverse_helper import get_access_token, get_dataverse_session
+from dataverse_helper import get_access_token, get_dataverse_session, fetch_column_values
+from id_sequences import get_id_sequences
 import urllib.parse
 
 bp = Blueprint("project_boards",  __name__, url_prefix="/api")
@@ -261,28 +262,16 @@ def headers():
 
 # Auto Generate Board ID (BRD001...)
 # ============================================================
-def generate_board_id():
-    try:
-        token = get_access_token()
-        hdr = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
-        url = f"{DATAVERSE_BASE}{DATAVERSE_API}/{ENTITY_SET_BOARDS}?$select={F_BOARD_ID}&$orderby=createdon desc&$top=1"
-        res = get_dataverse_session().get(url, headers=hdr, timeout=15)
+def _seed_board_ids():
+    return _id_sequences.max_number("board", fetch_column_values(ENTITY_SET_BOARDS, F_BOARD_ID))
 
-        last_id = None
-        if res.ok:
-            vals = res.json().get("value", [])
-            if vals and vals[0].get(F_BOARD_ID):
-                last_id = vals[0][F_BOARD_ID]
 
-        if last_id and re.match(r"BRD\d+", last_id):
-            num = int(last_id[3:])
-        else:
-            num = 0
+_id_sequences = get_id_sequences()
+_id_sequences.register("board", "BRD", 3, _seed_board_ids)
 
-        return f"BRD{num+1:03d}"
 
-    except:
-        return "BRD001"
+def generate_board_id():
+    return _id_sequences.next("board")
 
 # ============================================================
 # 🔒 CHECK DUPLICATE BOARD
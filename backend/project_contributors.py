@@ -1,8 +1,9 @@
 # contributors_bp.py
 from flask import Blueprint, request, jsonify, current_app
-import requests, os, uuid, re, traceback
+import requests, os, uuid, traceback
 from dotenv import load_dotenv
-from dataverse_helper import get_access_token, get_dataverse_session
+from dataverse_helper import get_access_token, get_dataverse_session, fetch_column_values
+from id_sequences import get_id_sequences
 
 bp = Blueprint("project_contributors", __name__, url_prefix="/api")
 
@@ -47,32 +48,16 @@ def extract_guid_from_response(res):
         return entity_uri.split("(")[-1].split(")")[0]
     return None
 
-def generate_record_id():
-    try:
-        token = get_access_token()
-        hdr = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+def _seed_record_ids():
+    return _id_sequences.max_number("contributor", fetch_column_values(ENTITY_SET_contributors, F_RECORD_ID))
 
-        url = (
-            f"{DATAVERSE_BASE}{DATAVERSE_API}/{ENTITY_SET_contributors}"
-            "?$select=crc6f_recordid&$orderby=createdon desc&$top=1"
-        )
-        res = get_dataverse_session().get(url, headers=hdr, timeout=15)
 
-        last_id = None
-        if res.ok:
-            v = res.json().get("value", [])
-            if v and v[0].get("crc6f_recordid"):
-                last_id = v[0]["crc6f_recordid"]
+_id_sequences = get_id_sequences()
+_id_sequences.register("contributor", "REC", 3, _seed_record_ids)
 
-        if last_id:
-            m = re.search(r"REC(\d+)", last_id)
-            num = int(m.group(1)) if m else 0
-        else:
-            num = 0
 
-        return f"REC{num+1:03d}"
-    except:
-        return "REC001"
+def generate_record_id():
+    return _id_sequences.next("contributor")
 
 
 def contributor_exists(project_code, employeeId):
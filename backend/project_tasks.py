@@ -1,8 +1,9 @@
 
 from flask import Blueprint, request, jsonify, current_app
-import requests, os, re
+import requests, os
 from dotenv import load_dotenv
-from dataverse_helper import get_access_token, get_dataverse_session
+from dataverse_helper import get_access_token, get_dataverse_session, fetch_column_values
+from id_sequences import get_id_sequences
 
 tasks_bp = Blueprint("project_tasks", __name__, url_prefix="/api")
 
@@ -33,34 +34,27 @@ def headers():
 # ======================
 # Auto-generate Task ID
 # ======================
+def _task_namespace(task_type):
+    return "bug" if str(task_type or "Task").strip().lower() == "bug" else "task"
+
+
+def _seed_task_ids(prefix):
+    def seeder():
+        values = fetch_column_values(ENTITY_SET_TASKS, "crc6f_taskid", f"startswith(crc6f_taskid,'{prefix}')")
+        return _id_sequences.max_number(prefix.lower(), values)
+    return seeder
+
+
+_id_sequences = get_id_sequences()
+_id_sequences.register("task", "TASK", 3, _seed_task_ids("TASK"))
+_id_sequences.register("bug", "BUG", 3, _seed_task_ids("BUG"))
+
+
 def generate_task_id(task_type="Task"):
     """Generate next work-item ID (TASK001 / BUG001, etc.)."""
-    prefix = "BUG" if str(task_type or "Task").strip().lower() == "bug" else "TASK"
-    try:
-        token = get_access_token()
-        hdrs = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
-        filter_prefix = prefix.replace("'", "''")
-        url = (
-            f"{DATAVERSE_BASE}{DATAVERSE_API}/{ENTITY_SET_TASKS}"
-            f"?$select=crc6f_taskid&$filter=startswith(crc6f_taskid,'{filter_prefix}')"
-            "&$orderby=createdon desc&$top=1"
-        )
-        res = get_dataverse_session().get(url, headers=hdrs, timeout=15)
-        next_num = 1
-        if res.ok:
-            data = res.json().get("value", [])
-            if data:
-                current_id = str(data[0].get("crc6f_taskid") or "").strip().upper()
-                match = re.match(rf"^{prefix}(\d+)$", current_id)
-                if match:
-                    next_num = int(match.group(1)) + 1
-
-        new_id = f"{prefix}{next_num:03d}"
-        print(f"[generate_task_id] Prefix: {prefix}, New: {new_id}")
-        return new_id
-    except Exception as e:
-        print(f"⚠️ Error generating task id: {e}")
-        return f"{prefix}001"
+    new_id = _id_sequences.next(_task_namespace(task_type))
+    print(f"[generate_task_id] New: {new_id}")
+    return new_id
 
 
 # ======================
@@ -124,7 +118,6 @@ def add_task(project_code):
         hdrs = headers()
 
         task_type = str(body.get("task_type") or "Task").strip().lower()
-        task_prefix = "BUG" if task_type == "bug" else "TASK"
 
         # ✅ Generate and verify unique Task ID (retry if collision)
         generated_id = None
@@ -142,10 +135,9 @@ def add_task(project_code):
                     generated_id = candidate_id
                     break
 
-            # Collision detected; increment numeric suffix and retry
-            match = re.search(rf"{task_prefix}(\d+)", candidate_id)
-            next_num = int(match.group(1)) + 1 if match else attempt + 1
-            candidate_id = f"{task_prefix}{next_num:03d}"
+            # Collision (created outside this app): move the sequence past it and retry
+            _id_sequences.observe(_task_namespace(task_type), candidate_id)
+            candidate_id = generate_task_id(task_type)
             attempt += 1
 
         if not generated_id:
@@ -0,0 +1,82 @@
+# sqlite_store.py - Shared SQLite plumbing for the local stores
+#
+# The leave ledger, ID sequences, import jobs, mail queue/replies, auth events,
+# employee archive, upload ledger, answer cache and Dataverse replica each keep
+# a SQLite db under storage/ that every gunicorn worker opens. They used to
+# copy the same connection setup and BEGIN IMMEDIATE wrapper, so a pragma
+# change had to be made in each of them. This module holds the one copy:
+#   - connect() opens a connection in autocommit mode with WAL and
+#     synchronous=NORMAL (plus any pragmas that must run first);
+#   - immediate() is a context manager around BEGIN IMMEDIATE / COMMIT /
+#     ROLLBACK, so a read-modify-write is atomic across workers;
+#   - SQLiteStore is the base class for the stores: one connection per thread
+#     (_conn) and _transaction(fn) for callers that pass a function;
+#   - singleton() builds the process-wide get_x() accessor.
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+def connect(db_path, timeout=10, pragmas=()):
+    """Open `db_path` for use from any thread. `pragmas` run before journal_mode
+    (auto_vacuum, for one, only takes effect on a new db if set first)."""
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    for pragma in pragmas:
+        conn.execute(f"PRAGMA {pragma}")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def immediate(conn):
+    """Write transaction taken up front, so two workers never interleave a read-modify-write."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+class SQLiteStore:
+    """Base for a store kept in one SQLite db: a connection per thread."""
+
+    timeout = 10
+    pragmas = ()
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.db_path, timeout=self.timeout, pragmas=self.pragmas)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        with immediate(self._conn()) as conn:
+            return fn(conn)
+
+
+def singleton(factory):
+    """get_x() accessor: builds the instance on first call, once per process."""
+    lock = threading.Lock()
+    instance = []
+
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+
+    get.__doc__ = f"Process-wide {getattr(factory, '__name__', 'instance')}, created on first use."
+    return get
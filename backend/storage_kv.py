@@ -0,0 +1,292 @@
+# storage_kv.py - Per-record JSON store for the small files under storage/
+#
+# team_hierarchy.json, document_index.json and auth_session_policy.json were
+# each one JSON blob: every change loaded the whole file, edited it and wrote
+# it back in place. A change cost as much as the file was big, a reader could
+# catch a half-written file, and two workers editing at once silently dropped
+# one of the edits (each wrote back the copy it had read).
+#
+# KVStore keeps one namespace per directory, one file per key:
+#   storage/kv/<namespace>/<quoted key>.json
+#   - get()/put()/delete() touch only that key's file, so they cost the same
+#     with five records or five thousand;
+#   - writes go to a temp file in the same directory and are committed with
+#     os.replace(), so readers see the old record or the new one, never a
+#     partial one; commits hold the namespace's fcntl lock (in-process lock
+#     only where fcntl is missing), and update() does its read-modify-write
+#     under that lock, so concurrent workers cannot lose each other's writes;
+#   - each process caches parsed records keyed by the file's (inode, mtime,
+#     size); a read is one stat() unless another worker changed the record;
+#   - items() lists the namespace, re-reading only files that changed.
+# import_json() loads a legacy JSON file (list of records or dict) into the
+# namespace; its size and mtime are recorded in .imported so an unchanged file
+# is not imported again. The legacy file is left where it is.
+
+import copy
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
+try:
+    import fcntl  # POSIX only; Windows dev boxes fall back to the in-process lock
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_STORAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage")
+STORAGE_KV_DIR = os.getenv("STORAGE_KV_DIR", os.path.join(_STORAGE_DIR, "kv"))
+STORAGE_KV_FSYNC = os.getenv("STORAGE_KV_FSYNC", "true").lower() in ("1", "true", "yes")
+
+_SUFFIX = ".json"
+
+
+def _filename(key):
+    key = str(key)
+    if not key:
+        raise ValueError("empty key")
+    name = quote(key, safe="")
+    # Dot files are the store's own (.lock, .imported, .tmp-*)
+    return ("%2E" + name[1:] if name.startswith(".") else name) + _SUFFIX
+
+
+class KVStore:
+    def __init__(self, namespace, root=STORAGE_KV_DIR, fsync=STORAGE_KV_FSYNC):
+        self.namespace = namespace
+        self.path = os.path.join(root, namespace)
+        self.fsync = fsync
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_path = os.path.join(self.path, ".lock")
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._cache = {}            # filename -> ((ino, mtime_ns, size), value)
+        self._cache_lock = threading.Lock()
+        self.reads = 0              # files actually parsed (cache misses)
+
+    # ---------- locking ----------
+    @contextmanager
+    def lock(self):
+        """Exclusive lock on the namespace across threads and workers."""
+        with self._thread_lock:
+            fh = None
+            self._depth += 1
+            # flock is per open file: a nested lock() in the same thread must not open it again
+            if fcntl is not None and self._depth == 1:
+                try:
+                    fh = open(self._lock_path, "a+")
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                except Exception as e:
+                    print(f"[KV] File lock unavailable for {self.namespace} ({e}); continuing with process lock only")
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if fh is not None:
+                    try:
+                        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+                        fh.close()
+                    except Exception:
+                        pass
+
+    # ---------- files ----------
+    def _read(self, name, st=None):
+        path = os.path.join(self.path, name)
+        try:
+            st = st or os.stat(path)
+        except FileNotFoundError:
+            with self._cache_lock:
+                self._cache.pop(name, None)
+            raise KeyError(name)
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._cache_lock:
+            cached = self._cache.get(name)
+        if cached and cached[0] == signature:
+            return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                # The file may have been replaced since the stat: key the cache on what was read
+                st = os.fstat(f.fileno())
+                signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+                value = json.load(f)
+        except FileNotFoundError:
+            raise KeyError(name)
+        with self._cache_lock:
+            self._cache[name] = (signature, value)
+            self.reads += 1
+        return value
+
+    def _write(self, name, value):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False, separators=(",", ":"))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(self.path, name))
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        st = os.stat(os.path.join(self.path, name))
+        with self._cache_lock:
+            self._cache[name] = ((st.st_ino, st.st_mtime_ns, st.st_size), copy.deepcopy(value))
+
+    def _remove(self, name):
+        with self._cache_lock:
+            self._cache.pop(name, None)
+        try:
+            os.remove(os.path.join(self.path, name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    # ---------- per-key API ----------
+    def get(self, key, default=None):
+        """The stored value (a private copy), or default."""
+        try:
+            return copy.deepcopy(self._read(_filename(key)))
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.path, _filename(key)))
+
+    def put(self, key, value):
+        with self.lock():
+            self._write(_filename(key), value)
+
+    def delete(self, key):
+        """Remove a key. Returns False if it was not there."""
+        with self.lock():
+            return self._remove(_filename(key))
+
+    def update(self, key, fn, default=None):
+        """Locked read-modify-write: stores and returns fn(current value or default).
+
+        If fn returns None the key is left unchanged.
+        """
+        name = _filename(key)
+        with self.lock():
+            try:
+                current = copy.deepcopy(self._read(name))
+            except KeyError:
+                current = copy.deepcopy(default)
+            value = fn(current)
+            if value is not None:
+                self._write(name, value)
+            return value
+
+    # ---------- whole namespace ----------
+    def items(self):
+        """(key, value) pairs in key order; only files changed since the last call are parsed."""
+        out = []
+        try:
+            entries = list(os.scandir(self.path))
+        except FileNotFoundError:
+            return out
+        seen = set()
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.name.endswith(_SUFFIX):
+                continue
+            try:
+                value = self._read(entry.name, entry.stat())
+            except (KeyError, FileNotFoundError):
+                continue
+            seen.add(entry.name)
+            out.append((unquote(entry.name[:-len(_SUFFIX)]), copy.deepcopy(value)))
+        with self._cache_lock:
+            for name in [n for n in self._cache if n not in seen]:
+                del self._cache[name]
+        out.sort(key=lambda kv: kv[0])
+        return out
+
+    def keys(self):
+        return [unquote(e.name[:-len(_SUFFIX)]) for e in os.scandir(self.path)
+                if not e.name.startswith(".") and e.name.endswith(_SUFFIX)]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def replace_all(self, mapping):
+        """Make the namespace equal to mapping, writing only keys whose value changed."""
+        wanted = {_filename(k): v for k, v in mapping.items()}
+        written = removed = 0
+        with self.lock():
+            for name in [e.name for e in os.scandir(self.path)
+                         if not e.name.startswith(".") and e.name.endswith(_SUFFIX)]:
+                if name not in wanted:
+                    removed += self._remove(name)
+            for name, value in wanted.items():
+                try:
+                    if self._read(name) == value:
+                        continue
+                except KeyError:
+                    pass
+                self._write(name, value)
+                written += 1
+        return written, removed
+
+    # ---------- legacy import ----------
+    def import_json(self, path, key_fn):
+        """Load a legacy JSON file (list of records, or dict of key -> value) once.
+
+        key_fn(record) gives the key for list items (falsy keys are skipped).
+        Returns how many records were imported (0 when already imported).
+        """
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            return 0
+        marker = os.path.join(self.path, ".imported")
+        with self.lock():
+            st = os.stat(path)
+            signature = f"{st.st_size}:{st.st_mtime_ns}"
+            try:
+                with open(marker, "r", encoding="utf-8") as f:
+                    imported = json.load(f)
+            except (FileNotFoundError, ValueError):
+                imported = {}
+            if imported.get(path) == signature:
+                return 0
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"[KV] Could not read {path}: {e}")
+                return 0
+            if isinstance(data, dict):
+                records = data
+            elif isinstance(data, list):
+                records = {}
+                for record in data:
+                    key = key_fn(record) if isinstance(record, dict) else None
+                    if key:
+                        records[str(key)] = record
+            else:
+                records = {}
+            for key, value in records.items():
+                self._write(_filename(key), value)
+            imported[path] = signature
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(imported, f)
+            os.replace(tmp, marker)
+        print(f"[KV] Imported {len(records)} records into {self.namespace} from {os.path.basename(path)}")
+        return len(records)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_kv_store(namespace):
+    store = _stores.get(namespace)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(namespace)
+            if store is None:
+                store = _stores[namespace] = KVStore(namespace)
+    return store
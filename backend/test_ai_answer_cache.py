@@ -0,0 +1,100 @@
+"""
+Offline test for the shared AI answer cache (ai_answer_cache.py).
+
+Run: python test_ai_answer_cache.py   (or via pytest)
+"""
+
+import os
+import tempfile
+import time
+
+from ai_answer_cache import AnswerCache, cache_key, cache_slot, context_version, org_view
+
+ADMIN_A = {"employee_id": "EMP001", "name": "Asha", "is_admin": True, "timezone": "Asia/Kolkata"}
+ADMIN_B = {"employee_id": "EMP002", "name": "Ravi", "is_admin": True, "timezone": "Asia/Kolkata"}
+EMPLOYEE = {"employee_id": "EMP007", "name": "Meena", "access_level": "L1", "timezone": "Asia/Kolkata"}
+
+
+def _context(joiners=2, profile="A"):
+    return {
+        "timestamp": time.time(),
+        "user_access": {"is_admin": True},
+        "current_user_profile": {"name": profile},
+        "my_leave_balance": {"available": {"CL": 3 if profile == "A" else 1}},
+        "new_joiners_summary": {"total_new_joiners": joiners},
+    }
+
+
+def _key(question, meta, context, scope="employee"):
+    slot = cache_slot(question, meta, scope)
+    if slot and slot.startswith("org"):
+        context = org_view(meta, context)[1]
+    return cache_key(question, slot, context_version(context))
+
+
+def test_key_rules():
+    q = "How many employees joined this week?"
+    # Org questions are shared by everyone in the role: no asker, none of their own sections
+    assert _key(q, ADMIN_A, _context()) == _key(q.lower() + "  ", ADMIN_A, _context())
+    assert _key(q, ADMIN_A, _context(profile="A")) == _key(q, ADMIN_B, _context(profile="B"))
+    meta, context = org_view(ADMIN_A, _context())
+    assert "Asha" not in repr(meta) and "EMP001" not in repr(meta) and meta["is_admin"]
+    assert set(context) == {"timestamp", "user_access", "new_joiners_summary"}
+    # Role, scope and data changes produce new keys; the build time does not
+    assert _key(q, ADMIN_A, _context()) != _key(q, EMPLOYEE, _context())
+    assert _key(q, ADMIN_A, _context(), "employee") != _key(q, ADMIN_A, _context(), "general")
+    assert _key(q, ADMIN_A, _context(joiners=2)) != _key(q, ADMIN_A, _context(joiners=3))
+    assert context_version(_context()) == context_version(dict(_context(), timestamp=0))
+
+    # Questions about the asker (and everything an L1 employee asks) stay per user
+    mine = "how many leaves have I taken"
+    assert cache_slot(mine, ADMIN_A).startswith("personal")
+    assert _key(mine, ADMIN_A, _context()) != _key(mine, ADMIN_B, _context())
+    assert _key(mine, ADMIN_A, _context(profile="A")) != _key(mine, ADMIN_A, _context(profile="B"))
+    assert cache_slot(q, EMPLOYEE).startswith("personal")
+    # Follow-ups are never cached
+    assert cache_slot("what about last week?", ADMIN_A) is None
+    assert cache_key("anything", None, "v1") is None
+
+
+def test_slot_version_lets_a_repeat_skip_the_context_build():
+    cache = AnswerCache(db_path=os.path.join(tempfile.mkdtemp(), "answers.db"), ttl=60)
+    q = "How many employees joined this week?"
+    slot = cache_slot(q, ADMIN_A, "employee")
+    assert cache.version(slot) is None                       # nothing built yet: build, then ask
+    version = context_version(org_view(ADMIN_A, _context())[1])
+    cache.set_version(slot, version)
+    cache.put(cache_key(q, slot, version), "2 joined")
+
+    # Another admin repeats it: the slot's version finds the answer without a context build
+    other_slot = cache_slot(q, ADMIN_B, "employee")
+    assert other_slot == slot
+    assert cache.get(cache_key(q, other_slot, cache.version(other_slot))) == "2 joined"
+
+    # A later build with changed data moves the slot on; the old answer is no longer found
+    cache.set_version(slot, context_version(org_view(ADMIN_A, _context(joiners=3))[1]))
+    assert cache.get(cache_key(q, slot, cache.version(slot))) is None
+
+
+def test_ttl_and_lru():
+    path = os.path.join(tempfile.mkdtemp(), "answers.db")
+    cache = AnswerCache(db_path=path, ttl=60, max_entries=2)
+    cache.put("a", "answer a")
+    cache.put("b", "answer b")
+    assert cache.get("a") == "answer a"          # a is now most recent
+    cache.put("c", "answer c")                  # evicts b
+    assert cache.get("b") is None and cache.get("a") == "answer a"
+
+    other_worker = AnswerCache(db_path=path, ttl=60, max_entries=2)
+    assert other_worker.get("c") == "answer c", "entries are shared through the database"
+
+    expiring = AnswerCache(db_path=path, ttl=0.05, max_entries=2)
+    expiring.put("d", "answer d")
+    time.sleep(0.1)
+    assert expiring.get("d") is None
+
+
+if __name__ == "__main__":
+    for fn in (test_key_rules, test_slot_version_lets_a_repeat_skip_the_context_build, test_ttl_and_lru):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,60 @@
+"""
+Offline test for the AI prompt context compactor (ai_context_compactor.py).
+
+Run: python test_ai_context_compactor.py   (or via pytest)
+"""
+
+import json
+
+from ai_context_compactor import compact_context, estimate_tokens
+
+
+def _holiday(i):
+    return {
+        "@odata.etag": f'W/"{1000 + i}"',
+        "crc6f_hr_holidaysid": f"a1b2c3d4-0000-0000-0000-{i:012d}",
+        "crc6f_holidayname": f"Holiday {i}",
+        "crc6f_date": f"2026-{i % 12 + 1:02d}-10",
+        "_ownerid_value": "owner-guid",
+        "versionnumber": 12345,
+        "overriddencreatedon": None,
+    }
+
+
+CONTEXT = {
+    "timestamp": "2026-10-19T09:00:00",
+    "user_access": {"access_level": "L3", "is_admin": True},
+    "employees_summary": {
+        "total_employees": 120,
+        "sample_employees": [{"id": f"EMP{i:03d}", "name": f"Employee {i}", "department": "IT"} for i in range(40)],
+    },
+    "holidays": {"total_holidays": 20, "holidays": [_holiday(i) for i in range(20)]},
+    "leave_summary": {"total_leave_requests": 12, "by_status": {"Pending": 2, "Approved": 10}},
+}
+
+
+def test_compact_serialisation_keeps_facts():
+    result = compact_context(CONTEXT, "list the holidays", "leave", budget=5000)
+    text, stats = result["text"], result["stats"]
+    assert stats["context_tokens"] * 3 < estimate_tokens(json.dumps(CONTEXT, indent=2))
+    assert "Holiday 19" in text and "2026-08-10" in text
+    assert "Pending:2" in text and "total_employees=120" in text
+    for noise in ("@odata", "versionnumber", "_ownerid_value", "a1b2c3d4-"):
+        assert noise not in text, noise
+    assert "holidayname|date" in text, "record lists render as tables"
+
+
+def test_budget_ranks_by_scope():
+    result = compact_context(CONTEXT, "list the holidays", "leave", budget=120)
+    stats = result["stats"]
+    assert stats["context_tokens"] <= 120
+    ordered = stats["sections_included"] + stats["sections_trimmed"]
+    assert ordered[0] == "user_access"
+    assert "holidays" in ordered, "in-scope section survives the budget"
+    assert "employees_summary" in stats["sections_dropped"] + stats["sections_trimmed"]
+
+
+if __name__ == "__main__":
+    for fn in (test_compact_serialisation_keeps_facts, test_budget_ranks_by_scope):
+        fn()
+        print(f"[OK] {fn.__name__}")
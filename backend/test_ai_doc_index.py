@@ -0,0 +1,100 @@
+"""
+Offline test for the HR document retrieval index (ai_doc_index.py).
+
+Run: python test_ai_doc_index.py   (or via pytest)
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import ai_doc_index
+from ai_doc_index import DocIndex, chunk_text, tokenize
+
+POLICY = """<html><head><style>.x{color:red}</style></head><body>
+<p>Dear {{candidate_name}},</p>
+<p>Working Hours: your working hours will be from {{work_hours_start}} to {{work_hours_end}}.</p>
+<p>Early Resignation: the intern must serve a 90-day notice period and pay a penalty of 3 months salary.</p>
+<p>Work and Leave Policy: no paid leave until confirmation of probation.</p>
+</body></html>"""
+
+LEAVE_TYPES = [
+    {"type": "Type 1", "experience": 3, "casualLeave": 6, "sickLeave": 6, "totalQuota": 12},
+    {"type": "Type 2", "experience": 2, "casualLeave": 4, "sickLeave": 4, "totalQuota": 8},
+]
+
+SOURCES = [("policy.html", "Internship policy"), ("data/leave_types.json", "Leave allocation types")]
+
+
+def _docs_dir():
+    base = tempfile.mkdtemp(prefix="ai_docs_")
+    os.makedirs(os.path.join(base, "data"))
+    with open(os.path.join(base, "policy.html"), "w", encoding="utf-8") as f:
+        f.write(POLICY)
+    with open(os.path.join(base, "data", "leave_types.json"), "w", encoding="utf-8") as f:
+        json.dump(LEAVE_TYPES, f)
+    return base
+
+
+def test_tokenize_and_chunk():
+    assert tokenize("The Interns' leaves") == ["intern", "leave"]
+    chunks = chunk_text(" ".join(str(i) for i in range(200)), size=90, overlap=30)
+    assert len(chunks) == 3 and chunks[1].split()[0] == "60"
+
+
+def test_search_returns_relevant_passage_only():
+    base = _docs_dir()
+    try:
+        index = DocIndex.build(SOURCES, base_dir=base)
+        hits = index.search("what is the notice period for interns", min_score=0.5)
+        assert hits and hits[0]["title"] == "Internship policy"
+        assert "90-day notice period" in hits[0]["text"]
+        assert "color:red" not in hits[0]["text"] and "[candidate name]" in hits[0]["text"]
+
+        hits = index.search("casual leave quota", min_score=0.5)
+        assert hits[0]["title"] == "Leave allocation types" and "casual leave: 4" in hits[0]["text"]
+
+        assert index.search("quarterly revenue forecast", min_score=0.5) == []
+    finally:
+        shutil.rmtree(base)
+
+
+def test_saved_index_round_trips_and_rebuilds_on_change():
+    base = _docs_dir()
+    old = (ai_doc_index.DOC_SOURCES, ai_doc_index.BACKEND_DIR, ai_doc_index.AI_DOC_INDEX_FILE,
+           ai_doc_index.AI_DOC_INDEX_CHECK_SECONDS, ai_doc_index._index)
+    try:
+        index_file = os.path.join(base, "index.npz")
+        built = DocIndex.build(SOURCES, base_dir=base)
+        built.save(index_file)
+        loaded = DocIndex.load(index_file)
+        assert loaded.chunks == built.chunks and loaded.signature == built.signature
+        assert loaded.search("notice period", min_score=0.5) == built.search("notice period", min_score=0.5)
+
+        ai_doc_index.DOC_SOURCES = SOURCES
+        ai_doc_index.BACKEND_DIR = base
+        ai_doc_index.AI_DOC_INDEX_FILE = index_file
+        ai_doc_index.AI_DOC_INDEX_CHECK_SECONDS = 0
+        ai_doc_index._index = None
+        first = ai_doc_index.get_doc_index()
+        assert first.signature == built.signature
+
+        time.sleep(1.1)
+        with open(os.path.join(base, "policy.html"), "a", encoding="utf-8") as f:
+            f.write("<p>Laptop return: interns return company laptops on the last working day.</p>")
+        second = ai_doc_index.get_doc_index()
+        assert second is not first
+        assert any("laptop" in h["text"].lower() for h in second.search("laptop return", min_score=0.5))
+    finally:
+        (ai_doc_index.DOC_SOURCES, ai_doc_index.BACKEND_DIR, ai_doc_index.AI_DOC_INDEX_FILE,
+         ai_doc_index.AI_DOC_INDEX_CHECK_SECONDS, ai_doc_index._index) = old
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_tokenize_and_chunk, test_search_returns_relevant_passage_only,
+               test_saved_index_round_trips_and_rebuilds_on_change):
+        fn()
+        print(f"[OK] {fn.__name__}")
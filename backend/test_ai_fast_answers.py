@@ -0,0 +1,63 @@
+"""
+Offline test for the AI fast-path answerer (ai_fast_answers.py).
+Summaries are stubbed, so no Dataverse connection is needed.
+
+Run: python test_ai_fast_answers.py   (or via pytest)
+"""
+
+import time
+from datetime import datetime
+
+import ai_fast_answers
+from ai_fast_answers import answer_fast, format_leave_balance, match_fast_intent
+
+EMPLOYEE = {"employee_id": "EMP007", "is_admin": False}
+ADMIN = {"employee_id": "EMP001", "is_admin": True, "is_l3": True}
+
+
+def _stub_summaries():
+    year = datetime.now().year
+    ai_fast_answers.get_leave_balance_summary = lambda token, emp_id: {
+        "employee_id": emp_id, "found": True, "available": {"CL": 4.5, "SL": 2.0, "CO": 1.0, "Total": 7.5},
+    }
+    ai_fast_answers.get_on_leave_summary = lambda token: {
+        "date": "2026-10-19", "total_on_leave": 1,
+        "employees": [{"employee_id": "EMP003", "name": "Priya", "type": "CL", "start": "2026-10-19", "end": "2026-10-20"}],
+    }
+    ai_fast_answers.get_holidays_list = lambda token: {"holidays": [
+        {"crc6f_date": f"{year}-01-01", "crc6f_holidayname": "New Year"},
+        {"crc6f_date": f"{year + 1}-01-14", "crc6f_holidayname": "Pongal"},
+    ]}
+
+
+def test_intent_confidence():
+    assert match_fast_intent("What's my leave balance?") == ("leave_balance", 1.0)
+    assert match_fast_intent("who is on leave today")[0] == "on_leave_today"
+    assert match_fast_intent("holidays this month")[1] >= 0.8
+    # Reasoning questions go to the model
+    assert match_fast_intent("how many leaves do I have left")[0] == "leave_balance"
+    assert match_fast_intent("hours I worked this week") == ("attendance_week", 1.0)
+    # Reasoning questions go to the model; "ask" inside "task" is not a keyword hit
+    for q in ("why is my leave balance low", "explain the holiday policy", "is diwali a holiday"):
+        assert match_fast_intent(q)[1] < 0.8, q
+    assert match_fast_intent("show my task list") == (None, 0.0)
+
+
+def test_answers_without_model():
+    _stub_summaries()
+    started = time.time()
+    result = answer_fast("what's my leave balance", "tok", EMPLOYEE)
+    assert result["intent"] == "leave_balance" and "Casual Leave (CL): 4.5" in result["answer"]
+    assert time.time() - started < 0.3
+
+    assert "Priya (EMP003)" in answer_fast("who is on leave today?", "tok", ADMIN)["answer"]
+    assert "do not have access" in answer_fast("who is on leave today?", "tok", EMPLOYEE)["answer"]
+    assert "New Year" in answer_fast("list all holidays this year", "tok", EMPLOYEE)["answer"]
+    assert answer_fast("why is my leave balance so low?", "tok", EMPLOYEE) is None
+    assert format_leave_balance({"CL": 4.5, "SL": 2.0, "CO": 1.0, "Total": 7.5}) == result["answer"]
+
+
+if __name__ == "__main__":
+    for fn in (test_intent_confidence, test_answers_without_model):
+        fn()
+        print(f"[OK] {fn.__name__}")
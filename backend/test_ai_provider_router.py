@@ -0,0 +1,178 @@
+"""
+Offline test for hedged LLM dispatch (ai_provider_router.py) against the fake
+Gemini / Hugging Face servers in fake_llm_servers.py.
+
+Run: python test_ai_provider_router.py   (or via pytest)
+"""
+
+import time
+
+import ai_gemini
+import ai_hf
+import ai_provider_router
+from ai_provider_router import LLMRouter, Provider
+from fake_llm_servers import FakeGeminiServer, FakeHFServer
+
+QUESTION = {"question": "How many employees joined this week?", "data_context": {"x": 1},
+            "user_meta": {"name": "Test", "is_admin": True}}
+
+
+def _setup(gemini_latency=0.0, gemini_status=200, hf_latency=0.0, hf_status=200):
+    gemini = FakeGeminiServer(answer="gemini streamed answer", latency=gemini_latency, status=gemini_status)
+    hf = FakeHFServer(answer="hf answer", latency=hf_latency, status=hf_status)
+    ai_gemini.GEMINI_API_KEY = "test-key"
+    base = gemini.start()
+    ai_gemini.GEMINI_API_URL = f"{base}/{ai_gemini.GEMINI_MODEL}:generateContent"
+    ai_gemini.GEMINI_STREAM_URL = f"{base}/{ai_gemini.GEMINI_MODEL}:streamGenerateContent"
+    ai_hf.HF_API_KEY = "test-key"
+    ai_hf.HF_API_URL = hf.start()
+    router = LLMRouter([
+        Provider("gemini", ai_provider_router._ask_gemini, lambda: bool(ai_gemini.GEMINI_API_KEY),
+                 stream=ai_provider_router._stream_gemini),
+        Provider("huggingface", ai_provider_router._ask_hf, lambda: bool(ai_hf.HF_API_KEY)),
+    ])
+    return router, gemini, hf
+
+
+def test_slow_primary_is_hedged():
+    ai_provider_router.AI_HEDGE_DEFAULT_DELAY = 0.2
+    router, gemini, hf = _setup(gemini_latency=1.5)
+    try:
+        started = time.time()
+        result = router.ask(**QUESTION)
+        elapsed = time.time() - started
+        assert result["success"], result
+        assert result["provider"] == "huggingface" and result["answer"] == "hf answer"
+        assert result["hedged"] is True
+        assert elapsed < 1.2, f"hedge should beat the slow primary ({elapsed:.2f}s)"
+        assert router.hedges_sent == 1 and router.hedges_won == 1
+        assert len(gemini.requests) == 1 and len(hf.requests) == 1
+    finally:
+        gemini.stop()
+        hf.stop()
+
+
+def test_fast_primary_is_not_hedged():
+    ai_provider_router.AI_HEDGE_DEFAULT_DELAY = 1.0
+    router, gemini, hf = _setup()
+    try:
+        result = router.ask(**QUESTION)
+        assert result["provider"] == "gemini" and result["hedged"] is False
+        assert len(hf.requests) == 0
+    finally:
+        gemini.stop()
+        hf.stop()
+
+
+def test_failover_and_ranking_by_error_rate():
+    ai_provider_router.AI_HEDGE_DEFAULT_DELAY = 5.0
+    router, gemini, hf = _setup(gemini_status=400)
+    try:
+        started = time.time()
+        result = router.ask(**QUESTION)
+        assert result["success"] and result["provider"] == "huggingface"
+        assert result["hedged"] is False
+        assert time.time() - started < 3, "failover must not wait for the hedge delay"
+
+        stats = router.stats()["providers"]
+        assert stats["gemini"]["error_rate"] == 1.0 and stats["huggingface"]["error_rate"] == 0.0
+        # The failing provider is no longer asked first
+        router.ask(**QUESTION)
+        assert len(gemini.requests) == 1 and len(hf.requests) == 2
+    finally:
+        gemini.stop()
+        hf.stop()
+
+
+def test_p90_sets_hedge_delay():
+    ai_provider_router.AI_HEDGE_MIN_DELAY = 0.05
+    router, gemini, hf = _setup()
+    try:
+        primary = router.providers[0]
+        for latency in (0.1, 0.1, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 2.0):
+            primary.stats.record(latency, True)
+        assert primary.stats.p90() == 0.7
+        assert router._hedge_delay(primary) == 0.7
+    finally:
+        gemini.stop()
+        hf.stop()
+
+
+def test_stream_is_hedged_and_fails_over():
+    ai_provider_router.AI_HEDGE_DEFAULT_DELAY = 1.0
+    router, gemini, hf = _setup()
+    try:
+        info = {}
+        assert "".join(router.stream(info=info, **QUESTION)) == "gemini streamed answer"
+        assert info["provider"] == "gemini" and info["hedged"] is False and info["prompt_stats"]
+        assert len(hf.requests) == 0
+    finally:
+        gemini.stop()
+        hf.stop()
+
+    ai_provider_router.AI_HEDGE_DEFAULT_DELAY = 0.2
+    router, gemini, hf = _setup(gemini_latency=1.5)
+    try:
+        info = {}
+        started = time.time()
+        assert list(router.stream(info=info, **QUESTION)) == ["hf answer"]   # HF cannot stream: one chunk
+        assert time.time() - started < 1.2 and info["provider"] == "huggingface" and info["hedged"] is True
+        assert router.hedges_sent == 1 and router.hedges_won == 1
+    finally:
+        gemini.stop()
+        hf.stop()
+
+    ai_provider_router.AI_HEDGE_DEFAULT_DELAY = 5.0
+    ai_provider_router.AI_RETRY_DELAYS = []
+    router, gemini, hf = _setup(gemini_status=400, hf_status=503)
+    try:
+        started = time.time()
+        try:
+            list(router.stream(**QUESTION))
+            raise AssertionError("expected AIStreamError")
+        except ai_gemini.AIStreamError:
+            pass
+        assert time.time() - started < 3 and len(hf.requests) >= 1
+        stats = router.stats()["providers"]
+        assert stats["gemini"]["in_flight"] == 0 and stats["gemini"]["error_rate"] == 1.0
+    finally:
+        gemini.stop()
+        hf.stop()
+
+
+def test_transient_failures_are_retried_by_the_router_only():
+    ai_provider_router.AI_HEDGE_DEFAULT_DELAY = 5.0
+    ai_provider_router.AI_RETRY_DELAYS = [0.05, 0.05]
+    router, gemini, hf = _setup(gemini_status=503)
+    try:
+        # An alternate is there: fail over, no retry of the failing provider
+        result = router.ask(**QUESTION)
+        assert result["provider"] == "huggingface" and len(gemini.requests) == 1
+
+        # Only provider left: one attempt per call inside ask_gemini, retried here with back-off
+        ai_hf.HF_API_KEY = None
+        result = router.ask(**QUESTION)
+        assert not result["success"] and result["retryable"]
+        assert len(gemini.requests) == 4
+        assert router.stats()["providers"]["gemini"]["samples"] == 4   # every attempt is a sample
+
+        try:
+            list(router.stream(**QUESTION))
+            raise AssertionError("expected AIStreamError")
+        except ai_gemini.AIStreamError as e:
+            assert e.retryable
+        assert len(gemini.requests) == 7
+
+        gemini.status = 400                                             # not transient: no retry
+        assert not router.ask(**QUESTION)["success"] and len(gemini.requests) == 8
+    finally:
+        gemini.stop()
+        hf.stop()
+
+
+if __name__ == "__main__":
+    for fn in (test_slow_primary_is_hedged, test_fast_primary_is_not_hedged,
+               test_failover_and_ranking_by_error_rate, test_p90_sets_hedge_delay,
+               test_stream_is_hedged_and_fails_over, test_transient_failures_are_retried_by_the_router_only):
+        fn()
+        print(f"[OK] {fn.__name__}")
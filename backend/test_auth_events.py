@@ -0,0 +1,113 @@
+"""
+Offline test for the auth session event log (auth_events.py).
+
+Run: python test_auth_events.py   (or via pytest)
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from auth_events import AuthEventLog
+
+
+def _event(event_type, employee_id, username, at):
+    return {
+        "id": str(uuid.uuid4()),
+        "event_type": event_type,
+        "employee_id": employee_id,
+        "username": username,
+        "employee_name": "",
+        "reason": "",
+        "source": "client",
+        "occurred_at_utc": at.isoformat(),
+        "date": at.date().isoformat(),
+        "ip_address": None,
+        "user_agent": "",
+    }
+
+
+def _fill(log, count, start=datetime(2026, 1, 1, tzinfo=timezone.utc)):
+    for n in range(count):
+        emp = f"EMP{n % 5:03d}"
+        log.append(_event("login" if n % 2 == 0 else "logout", emp, f"{emp.lower()}@x.io", start + timedelta(minutes=n)))
+
+
+def test_legacy_json_is_imported_once():
+    base = tempfile.mkdtemp(prefix="auth_events_")
+    try:
+        legacy = os.path.join(base, "auth_session_events.json")
+        at = datetime(2025, 12, 1, tzinfo=timezone.utc)
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump([_event("login", "EMP001", "a@x.io", at), _event("logout", "EMP001", "a@x.io", at)], f, indent=2)
+        log = AuthEventLog(os.path.join(base, "auth.db"), legacy_path=legacy)
+        assert not os.path.exists(legacy) and os.path.exists(legacy + ".migrated")
+        items, cursor = log.query(employee_id="emp001")
+        assert [e["event_type"] for e in items] == ["logout", "login"] and cursor is None
+        again = AuthEventLog(os.path.join(base, "auth.db"), legacy_path=legacy)
+        assert again.stats()["events"] == 2
+    finally:
+        shutil.rmtree(base)
+
+
+def test_paged_filtered_queries_inside_and_beyond_the_tail():
+    base = tempfile.mkdtemp(prefix="auth_events_")
+    try:
+        log = AuthEventLog(os.path.join(base, "auth.db"), legacy_path=None, tail_size=20)
+        _fill(log, 100)
+        reader = AuthEventLog(log.db_path, legacy_path=None, tail_size=20)   # another worker
+
+        seen, cursor = [], None
+        while True:
+            items, cursor = reader.query(employee_id="EMP003", limit=7, before=cursor)
+            seen.extend(items)
+            if cursor is None:
+                break
+        assert len(seen) == 20 and all(e["employee_id"] == "EMP003" for e in seen)
+        stamps = [e["occurred_at_utc"] for e in seen]
+        assert stamps == sorted(stamps, reverse=True)
+
+        items, _ = reader.query(username="EMP002@X.IO", event_type="login", limit=100)
+        assert len(items) == 10 and {e["event_type"] for e in items} == {"login"}
+        items, _ = reader.query(since="2026-01-01T00:10", until="2026-01-01T00:19:59", limit=100)
+        assert len(items) == 10
+
+        log.append(_event("force_logout", "EMP009", "z@x.io", datetime.now(timezone.utc)))
+        newest, _ = reader.query(limit=1)
+        assert newest[0]["event_type"] == "force_logout"                    # tail caught up from the other writer
+    finally:
+        shutil.rmtree(base)
+
+
+def test_append_cost_flat_and_size_retention():
+    base = tempfile.mkdtemp(prefix="auth_events_")
+    try:
+        log = AuthEventLog(os.path.join(base, "auth.db"), legacy_path=None, max_bytes=256 * 1024, check_every=50)
+        at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+        def batch_ms():
+            started = time.perf_counter()
+            for _ in range(200):
+                log.append(_event("login", "EMP001", "a@x.io", at))
+            return (time.perf_counter() - started) * 1000
+
+        first = batch_ms()
+        for _ in range(10):
+            batch_ms()
+        assert batch_ms() < max(first * 5, 50)                              # no growth with history
+        stats = log.stats()
+        assert log.pruned > 0 and stats["events"] < 2400
+        assert stats["size_bytes"] <= 256 * 1024 + 64 * 1024
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_legacy_json_is_imported_once, test_paged_filtered_queries_inside_and_beyond_the_tail,
+               test_append_cost_flat_and_size_retention):
+        fn()
+        print(f"[OK] {fn.__name__}")
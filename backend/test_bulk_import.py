@@ -0,0 +1,174 @@
+"""
+Offline test for background bulk import jobs (bulk_import.py) and the $batch
+helper in dataverse_helper.py, against the local OData stub.
+
+Run: python test_bulk_import.py   (or via pytest)
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DATAVERSE_TOKEN_CACHE", "")
+
+from bulk_import import ImportJobStore, ImportRunner, iter_csv_employees, validate_employee
+from dataverse_helper import execute_batch
+from odata_stub import ODataStub
+
+EMPLOYEES = "crc6f_table12s"
+LOGINS = "crc6f_hr_login_detailses"
+
+
+def _stub():
+    stub = ODataStub({EMPLOYEES: "crc6f_table12id", LOGINS: "crc6f_hr_login_detailsid"})
+    return stub, stub.start()
+
+
+def _process(base_url):
+    def process_batch(rows):
+        changesets = [[("POST", EMPLOYEES, {"crc6f_employeeid": d["employee_id"]}),
+                       ("POST", LOGINS, {"crc6f_username": d["email"]})] for _, d in rows]
+        results = execute_batch(changesets, base_url=base_url, token="test")
+        return {row_no: ("created", None) if r["ok"] else ("failed", r["error"]) for (row_no, _), r in zip(rows, results)}
+    return process_batch
+
+
+def _written(stub):
+    return sorted(r["crc6f_employeeid"] for r in stub.rows[EMPLOYEES].values())
+
+
+def test_csv_parsing_and_validation():
+    text = ("Employee ID,First Name,Last Name,Email,DOJ\n"
+            "EMP010,Asha,R,asha@example.com,2024-01-15\n"
+            "\n"
+            ",Ravi,K,ravi@example.com,15/02/2024\n"
+            "EMP010,Meena,S,asha@example.com,someday\n")
+    rows = list(iter_csv_employees(io.StringIO(text)))
+    assert [n for n, _ in rows] == [1, 2, 3]
+    assert rows[0][1] == {"employee_id": "EMP010", "first_name": "Asha", "last_name": "R",
+                          "email": "asha@example.com", "doj": "2024-01-15"}
+    seen_ids, seen_emails = set(), set()
+    errors = [validate_employee(emp, seen_ids, seen_emails, existing_emails={"old@example.com"}) for _, emp in rows]
+    assert errors[0] == [] and errors[1] == []
+    assert len(errors[2]) == 3                                           # repeated id, repeated email, bad doj
+    assert validate_employee({"first_name": "X", "email": "old@example.com"}, set(), set(),
+                             existing_emails={"old@example.com"}) == ["email old@example.com already exists"]
+
+    headerless = list(iter_csv_employees(["Asha,R,a@x.io,Addr,999,Eng,Dev,2024-01-01,true\n"]))
+    assert headerless[0][1]["first_name"] == "Asha" and "employee_id" not in headerless[0][1]
+
+
+def test_batched_job_reports_each_row():
+    stub, base_url = _stub()
+    base = tempfile.mkdtemp(prefix="bulk_import_")
+    try:
+        stub.reject = lambda entity_set, body: "duplicate username" if body.get("crc6f_username") == "dup@x.io" else None
+        store = ImportJobStore(os.path.join(base, "jobs.db"))
+        rows = [(i, {"employee_id": f"EMP{i:03d}", "email": "dup@x.io" if i == 7 else f"e{i}@x.io"})
+                for i in range(1, 61)]
+        job_id = store.create_job("employees", rows)
+        finished = []
+        runner = ImportRunner(store, _process(base_url), on_finish=finished.append, batch_size=10, workers=3)
+        assert runner.run(job_id)
+
+        progress = store.progress(job_id)
+        assert (progress["status"], progress["created"], progress["failed"], progress["percent"]) == ("done", 59, 1, 100.0)
+        assert stub.batches == 6 and finished == [job_id]
+        report = store.report(job_id)
+        assert report[6] == {"row": 7, "status": "failed", "employee_id": "EMP007", "error": "duplicate username"}
+        assert "EMP007" not in _written(stub)                               # changeset rolled back
+        assert len(_written(stub)) == 59
+    finally:
+        stub.stop()
+        shutil.rmtree(base)
+
+
+def test_resume_after_worker_died_mid_batch():
+    stub, base_url = _stub()
+    base = tempfile.mkdtemp(prefix="bulk_import_")
+    try:
+        store = ImportJobStore(os.path.join(base, "jobs.db"))
+        job_id = store.create_job("employees", [(i, {"employee_id": f"EMP{i:03d}", "email": f"e{i}@x.io"})
+                                                for i in range(1, 21)])
+        # The dead worker claimed 10 rows and got the first 4 into Dataverse
+        assert store.acquire(job_id, "dead-worker", lease_seconds=-1)
+        claimed = store.claim(job_id, 10)
+        _process(base_url)(claimed[:4])
+        assert store.abandoned_jobs() == [job_id]
+
+        def recover(rows):
+            written = set(_written(stub))
+            return {row_no for row_no, data in rows if data["employee_id"] in written}
+
+        runner = ImportRunner(store, _process(base_url), recover=recover, batch_size=5, workers=2)
+        assert runner.run(job_id)
+        assert _written(stub) == [f"EMP{i:03d}" for i in range(1, 21)]       # nothing written twice
+        assert store.progress(job_id)["created"] == 20
+        assert store.abandoned_jobs() == []
+    finally:
+        stub.stop()
+        shutil.rmtree(base)
+
+
+def test_live_lease_is_respected():
+    base = tempfile.mkdtemp(prefix="bulk_import_")
+    try:
+        store = ImportJobStore(os.path.join(base, "jobs.db"))
+        job_id = store.create_job("employees", [(1, {"employee_id": "EMP001"})])
+        assert store.acquire(job_id, "other-worker")
+        runner = ImportRunner(store, lambda rows: {n: ("created", None) for n, _ in rows})
+        assert not runner.run(job_id)
+        assert store.progress(job_id)["pending"] == 1
+        assert store.abandoned_jobs() == []
+    finally:
+        shutil.rmtree(base)
+
+
+def test_lease_is_renewed_while_a_slow_batch_runs():
+    base = tempfile.mkdtemp(prefix="bulk_import_")
+    try:
+        store = ImportJobStore(os.path.join(base, "jobs.db"))
+        job_id = store.create_job("employees", [(i, {"employee_id": f"EMP{i:03d}"}) for i in range(1, 5)])
+        sent = []
+
+        def slow_batch(rows):
+            time.sleep(0.8)                                              # several lease periods
+            sent.extend(n for n, _ in rows)
+            return {n: ("created", None) for n, _ in rows}
+
+        runner = ImportRunner(store, slow_batch, batch_size=2, workers=1, lease_seconds=0.3)
+        worker = threading.Thread(target=runner.run, args=(job_id,))
+        worker.start()
+        time.sleep(0.5)
+        assert store.abandoned_jobs() == []
+        assert not ImportRunner(store, slow_batch, lease_seconds=0.3).run(job_id)
+        worker.join(10)
+        assert sorted(sent) == [1, 2, 3, 4]                              # nothing sent twice
+        assert store.progress(job_id)["created"] == 4
+
+        # A worker that loses its lease anyway stops sending
+        job_id = store.create_job("employees", [(i, {"employee_id": f"EMP{i:03d}"}) for i in range(1, 5)])
+        sent.clear()
+
+        def stolen_batch(rows):
+            store._transaction(lambda conn: conn.execute(
+                "UPDATE import_jobs SET owner = 'other-worker', lease_until = ? WHERE job_id = ?",
+                (time.time() + 60, job_id)))
+            return slow_batch(rows)
+
+        assert not ImportRunner(store, stolen_batch, batch_size=1, workers=1, lease_seconds=0.3).run(job_id)
+        assert sent == [1]
+        assert store.progress(job_id)["created"] == 0
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_csv_parsing_and_validation, test_batched_job_reports_each_row,
+               test_resume_after_worker_died_mid_batch, test_live_lease_is_respected,
+               test_lease_is_renewed_while_a_slow_batch_runs):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,93 @@
+"""
+Offline test for the working-day engine (business_calendar.py).
+
+Run: python test_business_calendar.py   (or via pytest)
+"""
+
+from datetime import date, timedelta
+
+import numpy as np
+
+from business_calendar import BusinessCalendar
+
+# 2026-01-26 (Mon) Republic Day, 2026-01-14 (Wed) Pongal
+HOLIDAYS = [("2026-01-14", "Pongal"), ("2026-01-26T00:00:00Z", "Republic Day")]
+
+
+def _calendar(loader_calls=None, holidays=HOLIDAYS, weekmask="1111100"):
+    def loader():
+        if loader_calls is not None:
+            loader_calls.append(1)
+        return holidays
+    return BusinessCalendar(loader, weekmask=weekmask)
+
+
+def test_single_range_skips_weekends_and_holidays():
+    cal = _calendar()
+    assert cal.working_days("2026-01-09", "2026-01-12") == 2          # Fri..Mon
+    assert cal.working_days("2026-01-12", "2026-01-16") == 4          # week with Pongal
+    assert cal.working_days("2026-01-24", "2026-01-26") == 0          # Sat, Sun, Republic Day
+    assert cal.working_days("2026-01-12", "2026-01-11") == 0          # inverted
+    assert _calendar(weekmask="1111110").working_days("2026-01-09", "2026-01-12") == 3  # Saturdays worked
+
+
+def test_batch_matches_per_row_loop():
+    cal = _calendar()
+    rng = np.random.default_rng(7)
+    starts = [date(2026, 1, 1) + timedelta(days=int(x)) for x in rng.integers(0, 60, 500)]
+    ends = [s + timedelta(days=int(x)) for s, x in zip(starts, rng.integers(-2, 20, 500))]
+    batch = cal.working_days_batch(starts, ends)
+
+    holidays = {date(2026, 1, 14), date(2026, 1, 26)}
+    for s, e, got in zip(starts, ends, batch):
+        expected = sum(
+            1 for i in range((e - s).days + 1)
+            if (s + timedelta(days=i)).weekday() < 5 and (s + timedelta(days=i)) not in holidays
+        )
+        assert got == expected, (s, e, got, expected)
+    assert list(cal.working_days_batch(["2026-01-12", None], ["2026-01-13", "2026-01-13"])) == [2, 0]
+
+
+def test_split_range_for_paid_and_unpaid_parts():
+    cal = _calendar()
+    # 3 paid days from Mon 12th: 12, 13, 15 (Pongal on 14th) -> unpaid resumes Fri 16th
+    assert cal.split_range("2026-01-12", 3) == (date(2026, 1, 15), date(2026, 1, 16))
+    # Ending on a Friday rolls the remainder over the weekend
+    assert cal.split_range("2026-01-15", 2) == (date(2026, 1, 16), date(2026, 1, 19))
+
+
+def test_month_grid_and_holiday_cache():
+    calls = []
+    cal = _calendar(calls)
+    grid = cal.month_grid(2026, 1)
+    assert len(grid["days"]) == 31 and grid["working_days"] == 20
+    assert grid["holidays"] == {date(2026, 1, 14): "Pongal", date(2026, 1, 26): "Republic Day"}
+    assert not grid["working"][13] and grid["working"][12]
+    cal.working_days("2026-02-02", "2026-02-06")
+    assert len(calls) == 1, "holiday set is cached"
+    cal.invalidate()
+    cal.working_days("2026-02-02", "2026-02-06")
+    assert len(calls) == 2
+
+
+def test_loader_failure_keeps_last_good_set():
+    state = {"fail": False}
+
+    def loader():
+        if state["fail"]:
+            raise RuntimeError("dataverse down")
+        return HOLIDAYS
+
+    cal = BusinessCalendar(loader)
+    assert cal.working_days("2026-01-14", "2026-01-14") == 0
+    state["fail"] = True
+    cal.invalidate()
+    assert cal.working_days("2026-01-14", "2026-01-14") == 0
+
+
+if __name__ == "__main__":
+    for fn in (test_single_range_skips_weekends_and_holidays, test_batch_matches_per_row_loop,
+               test_split_range_for_paid_and_unpaid_parts, test_month_grid_and_holiday_cache,
+               test_loader_failure_keeps_last_good_set):
+        fn()
+        print(f"[OK] {fn.__name__}")
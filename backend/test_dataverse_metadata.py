@@ -0,0 +1,134 @@
+"""
+Offline test for the persisted entity-set catalogue (dataverse_metadata.py).
+
+Run: python test_dataverse_metadata.py   (or via pytest)
+"""
+
+import shutil
+import tempfile
+import threading
+import time
+
+from dataverse_metadata import EntitySetCatalogue, version_stamp
+from storage_kv import KVStore
+
+ORG = "https://example.crm.dynamics.com"
+ENTITY_SETS = {
+    "crc6f_table12s": "crc6f_table12",
+    "crc6f_hr_hierarchies": "crc6f_hr_hierarchy",
+    "crc6f_hr_login_detailses": "crc6f_hr_login_details",
+    "crc6f_compensatoryrequests": "crc6f_compensatoryrequest",
+}
+
+
+class _Fetcher:
+    def __init__(self, result=ENTITY_SETS, delay=0.0):
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, token):
+        self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return dict(self.result)
+
+
+def _catalogue(base, fetch, **kwargs):
+    catalogue = EntitySetCatalogue(store=KVStore("dataverse_metadata", root=base, fsync=False), **kwargs)
+    catalogue.configure(fetch, ORG)
+    return catalogue
+
+
+def test_one_fetch_then_restarts_read_the_snapshot():
+    base = tempfile.mkdtemp(prefix="dv_metadata_")
+    try:
+        fetch = _Fetcher(delay=0.05)
+        catalogue = _catalogue(base, fetch)
+        answers = []
+        threads = [threading.Thread(target=lambda: answers.append(catalogue.exists("crc6f_table12s", "tok")))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert answers == [True] * 8 and fetch.calls == 1                # first lookups share one fetch
+        assert catalogue.exists("crc6f_employees", "tok") is False and fetch.calls == 1
+
+        restarted_fetch = _Fetcher()
+        restarted = _catalogue(base, restarted_fetch)                    # new worker / after deploy
+        assert restarted.load_persisted()
+        assert restarted.exists("crc6f_hr_hierarchies", "tok") and restarted_fetch.calls == 0
+        assert restarted.stamp == catalogue.stamp == version_stamp(ENTITY_SETS)
+        assert restarted.entity_sets()["crc6f_compensatoryrequests"] == "crc6f_compensatoryrequest"
+    finally:
+        shutil.rmtree(base)
+
+
+def test_unavailable_metadata_falls_back_and_backs_off():
+    base = tempfile.mkdtemp(prefix="dv_metadata_")
+    try:
+        fetch = _Fetcher(result=Exception("403 no privilege"))
+        catalogue = _catalogue(base, fetch, retry_seconds=60)
+        assert catalogue.exists("crc6f_table12s", None) is None and fetch.calls == 0   # no token: no fetch
+        assert catalogue.exists("crc6f_table12s", "tok") is None and fetch.calls == 1
+        assert catalogue.exists("crc6f_table12s", "tok") is None and fetch.calls == 1  # not retried yet
+        assert catalogue.entity_sets("tok") == {} and catalogue.stats()["last_error"] == "403 no privilege"
+
+        disabled = _catalogue(base, _Fetcher(), enabled=False)
+        assert disabled.exists("crc6f_table12s", "tok") is None
+    finally:
+        shutil.rmtree(base)
+
+
+def test_stale_snapshot_is_served_and_refreshed_in_background():
+    base = tempfile.mkdtemp(prefix="dv_metadata_")
+    try:
+        _catalogue(base, _Fetcher()).refresh("tok")
+        renamed = dict(ENTITY_SETS, crc6f_hr_onboardings="crc6f_hr_onboarding")
+        fetch = _Fetcher(result=renamed, delay=0.05)
+        stale = _catalogue(base, fetch, ttl=0)
+        assert stale.load_persisted()
+        assert stale.exists("crc6f_hr_onboardings", "tok") is False       # old snapshot answers at once
+        deadline = time.time() + 5
+        while stale.stamp != version_stamp(renamed) and time.time() < deadline:
+            time.sleep(0.01)
+        assert stale.exists("crc6f_hr_onboardings") is True and fetch.calls >= 1
+
+        store = KVStore("dataverse_metadata", root=base)
+        store.put(ORG, dict(store.get(ORG), stamp="0:old-format"))
+        assert not _catalogue(base, _Fetcher()).load_persisted()         # other snapshot format: refetch
+    finally:
+        shutil.rmtree(base)
+
+
+def test_missing_name_is_rechecked_against_a_newer_snapshot():
+    base = tempfile.mkdtemp(prefix="dv_metadata_")
+    try:
+        fetch = _Fetcher()
+        catalogue = _catalogue(base, fetch, recheck_seconds=60)
+        assert catalogue.exists("crc6f_hr_onboardings", "tok") is False and fetch.calls == 1   # fresh: trusted
+
+        catalogue.fetched_at -= 120                                       # snapshot now older than the recheck window
+        fetch.result = dict(ENTITY_SETS, crc6f_hr_onboardings="crc6f_hr_onboarding")         # table created since
+        assert catalogue.exists("crc6f_hr_onboardings", "tok") is True and fetch.calls == 2
+        assert catalogue.exists("crc6f_hr_nosuchtable", "tok") is False and fetch.calls == 2
+
+        catalogue.fetched_at -= 120
+        fetch.result = Exception("503")
+        assert catalogue.exists("crc6f_hr_nosuchtable", "tok") is None   # cannot confirm: caller probes
+
+        store = KVStore("dataverse_metadata", root=base)
+        store.put(ORG, {"stamp": "1:abc", "entity_sets": ENTITY_SETS})  # no fetched_at
+        assert not _catalogue(base, _Fetcher()).load_persisted()
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_one_fetch_then_restarts_read_the_snapshot, test_unavailable_metadata_falls_back_and_backs_off,
+               test_stale_snapshot_is_served_and_refreshed_in_background,
+               test_missing_name_is_rechecked_against_a_newer_snapshot):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,95 @@
+"""
+Offline test for the throttling-aware Dataverse session (dataverse_helper.py).
+Uses the local OData stub to answer 429 + Retry-After - no CRM credentials needed.
+
+Run: python test_dataverse_throttle.py   (or via pytest)
+"""
+
+import threading
+
+import dataverse_helper
+from dataverse_helper import AdaptiveLimiter, DataverseSession, get_dataverse_stats
+from odata_stub import ODataStub
+
+HOLIDAYS = "crc6f_hr_holidayses"
+PK = "crc6f_hr_holidaysid"
+
+
+def test_retry_after_is_honoured():
+    stub = ODataStub({HOLIDAYS: PK})
+    stub.upsert(HOLIDAYS, {PK: "h1", "crc6f_holidayname": "New Year"})
+    base_url = stub.start()
+    try:
+        before = get_dataverse_stats()
+        stub.throttle_next = 2
+        stub.retry_after = 0.1
+        r = DataverseSession().get(f"{base_url}/{HOLIDAYS}", timeout=5)
+        assert r.status_code == 200 and r.json()["value"][0]["crc6f_holidayname"] == "New Year"
+        after = get_dataverse_stats()
+        assert after["throttled"] - before["throttled"] == 2
+        assert after["retries"] - before["retries"] == 2
+        assert after["retry_wait_seconds"] - before["retry_wait_seconds"] >= 0.2
+        assert after["concurrency_limit"] < after["max_concurrency"], "429 must shrink the limit"
+    finally:
+        stub.stop()
+
+
+def test_budget_exhaustion_returns_429():
+    stub = ODataStub({HOLIDAYS: PK})
+    base_url = stub.start()
+    old_budget = dataverse_helper.DATAVERSE_RETRY_BUDGET
+    dataverse_helper.DATAVERSE_RETRY_BUDGET = 0.5
+    try:
+        stub.throttle_next = 10
+        stub.retry_after = 1
+        r = DataverseSession().get(f"{base_url}/{HOLIDAYS}", timeout=5)
+        assert r.status_code == 429, "caller sees the throttle once the retry budget is spent"
+    finally:
+        dataverse_helper.DATAVERSE_RETRY_BUDGET = old_budget
+        stub.stop()
+
+
+def test_aimd_limiter():
+    limiter = AdaptiveLimiter(initial=8, min_limit=2, max_limit=8, decrease_cooldown=0)
+    limiter.on_throttle()
+    assert int(limiter.limit) == 4
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert int(limiter.limit) == 2, "never below min_limit"
+    for _ in range(20):
+        limiter.on_success()
+    assert 4 <= int(limiter.limit) <= 8, "additive recovery"
+
+    # In-flight requests are capped at the current limit
+    limiter = AdaptiveLimiter(initial=2, min_limit=1, max_limit=2)
+    assert limiter.acquire(timeout=0.1) and limiter.acquire(timeout=0.1)
+    assert not limiter.acquire(timeout=0.1)
+    threading.Timer(0.05, limiter.release).start()
+    assert limiter.acquire(timeout=1)
+
+
+def test_saturated_limiter_sends_without_a_slot():
+    stub = ODataStub({HOLIDAYS: PK})
+    base_url = stub.start()
+    limiter = dataverse_helper._dataverse_limiter
+    old_budget = dataverse_helper.DATAVERSE_RETRY_BUDGET
+    dataverse_helper.DATAVERSE_RETRY_BUDGET = 0.2
+    held = 0
+    try:
+        while limiter.acquire(timeout=0):
+            held += 1
+        r = DataverseSession().get(f"{base_url}/{HOLIDAYS}", timeout=5)
+        assert r.status_code == 200
+        assert limiter.in_flight == held, "a request sent without a slot must not release one"
+    finally:
+        for _ in range(held):
+            limiter.release()
+        dataverse_helper.DATAVERSE_RETRY_BUDGET = old_budget
+        stub.stop()
+
+
+if __name__ == "__main__":
+    for fn in (test_retry_after_is_honoured, test_budget_exhaustion_returns_429, test_aimd_limiter,
+               test_saturated_limiter_sends_without_a_slot):
+        fn()
+        print(f"[OK] {fn.__name__}")
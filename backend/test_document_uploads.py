@@ -0,0 +1,95 @@
+"""
+Offline test for onboarding document staging (document_uploads.py): streaming,
+image compression, in-request dedup, zip bundling and the upload ledger.
+
+Run: python test_document_uploads.py   (or via pytest)
+"""
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import zipfile
+
+from PIL import Image
+
+from document_uploads import UploadLedger, build_payload, content_key, stage_documents
+
+
+def _noisy_png(width, height):
+    rnd = random.Random(7)
+    img = Image.new("RGB", (width, height))
+    img.putdata([(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)) for _ in range(width * height)])
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_large_scan_is_downscaled_and_small_files_untouched():
+    scan = _noisy_png(2600, 400)
+    pdf = b"%PDF-1.4\n" + b"x" * 5000
+    docs = stage_documents([("aadhar.png", io.BytesIO(scan)), ("offer.pdf", io.BytesIO(pdf))])
+    try:
+        image, document = docs
+        assert image.compressed and image.name == "aadhar.jpg"
+        assert image.bytes_in == len(scan) and image.bytes_out < image.bytes_in // 2
+        image.file.seek(0)
+        with Image.open(image.file) as out:
+            assert out.format == "JPEG" and max(out.size) == 2000
+        assert not document.compressed and document.body() == pdf
+        report = image.report()
+        assert report["stage_ms"] >= 0 and report["compress_ms"] > 0 and report["error"] is None
+    finally:
+        for d in docs:
+            d.close()
+
+
+def test_duplicates_in_one_submission_are_kept_once():
+    docs = stage_documents([("a.pdf", io.BytesIO(b"%PDF same")), ("b.pdf", io.BytesIO(b"%PDF other")),
+                            ("a copy.pdf", io.BytesIO(b"%PDF same"))])
+    try:
+        assert [d.duplicate_of for d in docs] == [None, None, "a.pdf"]
+        assert docs[0].sha256 == docs[2].sha256
+    finally:
+        for d in docs:
+            d.close()
+
+
+def test_several_documents_are_bundled_into_one_file():
+    docs = stage_documents([("id.pdf", io.BytesIO(b"%PDF id")), ("id.pdf", io.BytesIO(b"%PDF other id")),
+                            ("degree.pdf", io.BytesIO(b"%PDF degree"))])
+    try:
+        name, payload = build_payload(docs, "documents_42.zip")
+        assert name == "documents_42.zip"
+        with zipfile.ZipFile(io.BytesIO(payload.body())) as zf:
+            assert zf.namelist() == ["id.pdf", "id (1).pdf", "degree.pdf"]
+            assert zf.read("degree.pdf") == b"%PDF degree"
+        assert payload.sha256 == content_key(list(reversed(docs)))           # order does not matter
+        single_name, single = build_payload(docs[:1], "documents_42.zip")
+        assert single_name == "id.pdf" and single is docs[0]
+        payload.close()
+    finally:
+        for d in docs:
+            d.close()
+
+
+def test_ledger_tracks_column_content():
+    base = tempfile.mkdtemp(prefix="doc_uploads_")
+    try:
+        ledger = UploadLedger(os.path.join(base, "uploads.db"))
+        assert ledger.current("rec-1", "crc6f_documentsuploaded") is None
+        ledger.remember("rec-1", "crc6f_documentsuploaded", "k1", "documents_rec-1.zip", 1200)
+        ledger.remember("rec-1", "crc6f_documentsuploaded", "k2", "offer.pdf", 300)
+        assert UploadLedger(ledger.db_path).current("rec-1", "crc6f_documentsuploaded")["content_key"] == "k2"
+        ledger.forget("rec-1", "crc6f_documentsuploaded")
+        assert ledger.current("rec-1", "crc6f_documentsuploaded") is None
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_large_scan_is_downscaled_and_small_files_untouched, test_duplicates_in_one_submission_are_kept_once,
+               test_several_documents_are_bundled_into_one_file, test_ledger_tracks_column_content):
+        fn()
+        print(f"[OK] {fn.__name__}")
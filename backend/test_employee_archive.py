@@ -0,0 +1,113 @@
+"""
+Offline test for the deleted-employee archive (employee_archive.py), with the
+restore changeset sent through dataverse_helper.execute_batch to the local
+OData stub.
+
+Run: python test_employee_archive.py   (or via pytest)
+"""
+
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault("DATAVERSE_TOKEN_CACHE", "")
+
+from dataverse_helper import execute_batch
+from employee_archive import EmployeeArchive
+from odata_stub import ODataStub
+
+EMPLOYEES = "crc6f_table12s"
+
+
+def _employees(count, start=1):
+    return [{"employee_id": f"EMP{n:04d}", "first_name": f"First{n}", "last_name": "Kumar",
+             "department": "Finance", "active": "true" if n % 2 else "false"} for n in range(start, start + count)]
+
+
+def test_legacy_csv_import_upsert_and_paging():
+    base = tempfile.mkdtemp(prefix="emp_archive_")
+    try:
+        legacy = os.path.join(base, "Deleted_employees.csv")
+        with open(legacy, "w", encoding="utf-8") as f:
+            f.write("employee_id,first_name,last_name,email,contact_number,address,department,designation,doj,active\n"
+                    "EMP0012,Michael,Wilson,,5556789012,654 Maple Dr,Finance,Financial Analyst,,false\n"
+                    "EMP0012,Michael,Wilson,,5556789012,New Address,Finance,Financial Analyst,,true\n"
+                    "EMP0009,Jane,Smith,,9876543210,456 Oak Ave,Marketing,Marketing Manager,,false\n")
+        archive = EmployeeArchive(os.path.join(base, "archive.db"), legacy_csv_paths=[legacy])
+        assert archive.count() == 2
+        records, total, cursor = archive.page()
+        assert [r["employee_id"] for r in records] == ["EMP0009", "EMP0012"] and total == 2 and cursor is None
+        assert records[1]["address"] == "New Address" and records[1]["active"] is True
+
+        archive.clear()
+        again = EmployeeArchive(archive.db_path, legacy_csv_paths=[legacy])   # unchanged CSV: not re-imported
+        assert again.count() == 0
+
+        assert archive.archive(_employees(25)) == 25
+        assert archive.archive([{"employee_id": "EMP0003", "first_name": "Renamed", "active": True}]) == 1
+        seen, cursor = [], None
+        while True:
+            page, total, cursor = archive.page(limit=10, after=cursor)
+            seen.extend(r["employee_id"] for r in page)
+            if cursor is None:
+                break
+        assert seen == sorted(seen) and len(seen) == 25 and total == 25
+        found, total, _ = archive.page(query="renamed")
+        assert [r["employee_id"] for r in found] == ["EMP0003"] and total == 1
+    finally:
+        shutil.rmtree(base)
+
+
+def test_restore_is_atomic_and_claims_rows():
+    stub = ODataStub({EMPLOYEES: "crc6f_table12id"})
+    base_url = stub.start()
+    base = tempfile.mkdtemp(prefix="emp_archive_")
+    try:
+        archive = EmployeeArchive(os.path.join(base, "archive.db"), legacy_csv_paths=[])
+        archive.archive(_employees(40))
+
+        def restore(ids):
+            records, missing = archive.claim(ids)
+            changeset = [("POST", EMPLOYEES, {"crc6f_employeeid": r["employee_id"]}) for r in records]
+            result = execute_batch([changeset], continue_on_error=False, base_url=base_url, token="test")[0]
+            (archive.complete if result["ok"] else archive.release)([r["employee_id"] for r in records])
+            return result["ok"], missing
+
+        stub.reject = lambda entity_set, body: "duplicate" if body["crc6f_employeeid"] == "EMP0020" else None
+        ok, _ = restore([f"EMP{n:04d}" for n in range(1, 31)])
+        assert not ok and stub.rows[EMPLOYEES] == {} and archive.count() == 40    # all or nothing
+
+        stub.reject = None
+        ok, missing = restore([f"EMP{n:04d}" for n in range(1, 31)] + ["EMP9999"])
+        assert ok and missing == ["EMP9999"] and stub.batches == 2
+        assert len(stub.rows[EMPLOYEES]) == 30 and archive.count() == 10
+
+        held, _ = archive.claim(["EMP0031", "EMP0032"])
+        assert len(held) == 2
+        assert archive.claim(["EMP0031", "EMP0033"]) == ([r for r in archive.page(query="emp0033")[0]], ["EMP0031"])
+    finally:
+        stub.stop()
+        shutil.rmtree(base)
+
+
+def test_file_stays_compact_after_restores():
+    base = tempfile.mkdtemp(prefix="emp_archive_")
+    try:
+        archive = EmployeeArchive(os.path.join(base, "archive.db"), legacy_csv_paths=[])
+        archive.archive(_employees(3000))
+        conn = archive._conn()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        full = os.path.getsize(archive.db_path)
+        records, _ = archive.claim([f"EMP{n:04d}" for n in range(1, 2901)])
+        archive.complete([r["employee_id"] for r in records])
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        assert archive.count() == 100 and os.path.getsize(archive.db_path) < full / 3
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_legacy_csv_import_upsert_and_paging, test_restore_is_atomic_and_claims_rows,
+               test_file_stays_compact_after_restores):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,143 @@
+"""
+Offline test for the cached Google Calendar service (google_calendar_client.py).
+A local HTTP server stands in for Google's OAuth token endpoint.
+
+Run: python test_google_calendar_client.py   (or via pytest)
+"""
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from google.auth.transport.requests import Request
+
+from google_calendar_client import GoogleCalendarClient, GoogleCredentialsMissing
+
+SCOPES = ["https://www.googleapis.com/auth/calendar.events"]
+
+
+class _TokenEndpoint:
+    def __init__(self, expires_in=3600, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = 0
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                endpoint.calls += 1
+                time.sleep(endpoint.delay)
+                body = json.dumps({"access_token": f"fresh-{endpoint.calls}",
+                                   "expires_in": endpoint.expires_in, "token_type": "Bearer"}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/token"
+
+    def transport(self):
+        """google.auth Request whose token refreshes land on this endpoint."""
+        endpoint = self
+
+        class _Session(requests.Session):
+            def request(self, method, url, *args, **kwargs):
+                return super().request(method, endpoint.url, *args, **kwargs)
+
+        return Request(session=_Session())
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _token_json(expires_in_seconds, now=None):
+    expiry = (now or datetime.now(timezone.utc)) + timedelta(seconds=expires_in_seconds)
+    return json.dumps({
+        "token": "stale", "refresh_token": "refresh",
+        "client_id": "cid", "client_secret": "secret", "scopes": SCOPES,
+        "expiry": expiry.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    })
+
+
+def test_service_is_built_once_per_thread():
+    endpoint = _TokenEndpoint()
+    loads = []
+    token = _token_json(3600)
+    client = GoogleCalendarClient(lambda: loads.append(1) or token, lambda t: None, SCOPES,
+                                  transport=endpoint.transport())
+    try:
+        first = client.service()
+        assert client.service() is first
+        assert client.build_count == 1 and len(loads) == 1 and endpoint.calls == 0
+        assert hasattr(first, "events")
+
+        other = []
+        t = threading.Thread(target=lambda: other.append(client.service()))
+        t.start()
+        t.join()
+        assert other[0] is not first and client.build_count == 2 and len(loads) == 1
+    finally:
+        client.stop()
+        endpoint.stop()
+
+
+def test_expired_credentials_refresh_once_under_concurrency():
+    endpoint = _TokenEndpoint(delay=0.2)
+    saved = []
+    client = GoogleCalendarClient(lambda: _token_json(-60), saved.append, SCOPES, transport=endpoint.transport())
+    try:
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(client.get_credentials().token)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert endpoint.calls == 1 and client.refresh_count == 1
+        assert set(tokens) == {"fresh-1"}
+        assert len(saved) == 1 and json.loads(saved[0])["token"] == "fresh-1"
+    finally:
+        client.stop()
+        endpoint.stop()
+
+
+def test_background_renewer_refreshes_before_expiry():
+    endpoint = _TokenEndpoint(expires_in=3600)
+    now = datetime(2026, 1, 5, 9, 0, 0)     # pinned clock: the token always has 60s left
+    client = GoogleCalendarClient(lambda: _token_json(60, now), lambda t: None, SCOPES,
+                                  refresh_margin=30, renew_margin=90, transport=endpoint.transport(),
+                                  clock=lambda: now)
+    try:
+        assert client.get_credentials().token == "stale"                 # outside the request-path margin
+        assert client._next_delay() == 1.0                                # inside the renew margin: due now
+        assert client.renewed.wait(10)
+        assert endpoint.calls == 1 and client.get_credentials().token == "fresh-1"
+    finally:
+        client.stop()
+        endpoint.stop()
+
+
+def test_missing_token_raises():
+    client = GoogleCalendarClient(lambda: None, lambda t: None, SCOPES)
+    try:
+        client.service()
+        assert False, "expected GoogleCredentialsMissing"
+    except GoogleCredentialsMissing as e:
+        assert "Google OAuth credentials not found" in str(e)
+
+
+if __name__ == "__main__":
+    for fn in (test_service_is_built_once_per_thread, test_expired_credentials_refresh_once_under_concurrency,
+               test_background_renewer_refreshes_before_expiry, test_missing_token_raises):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,153 @@
+"""
+Offline test for the team-hierarchy closure (hierarchy_index.py).
+
+Run: python test_hierarchy_index.py   (or via pytest)
+"""
+
+import random
+
+from hierarchy_index import HierarchyCycleError, HierarchyIndex, odata_in_filters
+
+# record_id, employee, manager:  CEO <- CTO <- LEAD <- DEV1/DEV2, CEO <- CFO, DEV2 also reports to CFO
+ROWS = [
+    ("r1", "cto", "ceo"),
+    ("r2", "CFO", "CEO"),
+    ("r3", "LEAD", "CTO"),
+    ("r4", "DEV1", "LEAD"),
+    ("r5", "DEV2", "LEAD"),
+    ("r6", "DEV2", "CFO"),
+]
+
+
+def _index(rows=ROWS):
+    index = HierarchyIndex()
+    index.load(rows)
+    return index
+
+
+def _closure(index):
+    return {e: index.chain_of(e) for e in ("CEO", "CTO", "CFO", "LEAD", "DEV1", "DEV2", "DEV3", "NEW")}, \
+           {m: index.reports_of(m) for m in ("CEO", "CTO", "CFO", "LEAD", "DEV1", "DEV2", "DEV3", "NEW")}
+
+
+def test_reports_and_chain_lookups():
+    index = _index()
+    assert index.reports_of("ceo") == ["CFO", "CTO", "DEV1", "DEV2", "LEAD"]
+    assert index.reports_of("CEO", depth=1) == ["CFO", "CTO"]
+    assert index.reports_of("CTO", depth=2) == ["DEV1", "DEV2", "LEAD"]
+    assert index.reports_of("DEV1") == [] and index.reports_of("NOBODY") == []
+
+    assert index.chain_of("dev1") == ["LEAD", "CTO", "CEO"]
+    assert index.chain_of("DEV2") == ["CFO", "LEAD", "CEO", "CTO"]   # two managers; CEO via CFO is nearer
+    assert index.depth_between("CEO", "DEV2") == 2 and index.depth_between("CTO", "CFO") is None
+    assert index.employee_of("r4") == "DEV1"
+
+
+def test_edits_match_a_rebuild_from_scratch():
+    index = _index()
+    rows = {r[0]: r for r in ROWS}
+
+    index.add("r7", "DEV3", "DEV1")
+    rows["r7"] = ("r7", "DEV3", "DEV1")
+    index.update("r3", "CFO")                                          # LEAD moves under CFO
+    rows["r3"] = ("r3", "LEAD", "CFO")
+    index.remove("r6")
+    del rows["r6"]
+    index.add("r8", "NEW", "LEAD")
+    rows["r8"] = ("r8", "NEW", "LEAD")
+    assert _closure(index) == _closure(_index(list(rows.values())))
+    assert index.chain_of("DEV3") == ["DEV1", "LEAD", "CFO", "CEO"]
+    assert index.reports_of("CTO") == []
+
+    # A random edit sequence still agrees with a fresh load of the final rows
+    rng = random.Random(7)
+    people = ["P%02d" % n for n in range(30)]
+    live, index, next_id = {}, HierarchyIndex(), 0
+    for _ in range(400):
+        op = rng.random()
+        if op < 0.5 or not live:
+            emp, mgr = rng.sample(people, 2)
+            next_id += 1
+            if not index.would_create_cycle(emp, mgr):
+                index.add(f"x{next_id}", emp, mgr)
+                live[f"x{next_id}"] = (f"x{next_id}", emp, mgr)
+        elif op < 0.75:
+            record_id = rng.choice(sorted(live))
+            mgr = rng.choice(people)
+            try:
+                index.update(record_id, mgr)
+                live[record_id] = (record_id, live[record_id][1], mgr)
+            except HierarchyCycleError:
+                pass
+        else:
+            record_id = rng.choice(sorted(live))
+            index.remove(record_id)
+            del live[record_id]
+    fresh = _index(list(live.values()))
+    assert not fresh.cycles
+    for p in people:
+        assert index.chain_of(p) == fresh.chain_of(p) and index.reports_of(p) == fresh.reports_of(p), p
+
+
+def test_cycles_and_orphans():
+    index = _index(ROWS + [("c1", "CEO", "DEV1"), ("c2", "SELF", "self"),
+                           ("o1", "", "CEO"), ("o2", "TEMP", None), ("o3", "CONTRACTOR", "GONE")])
+    assert [c["id"] for c in index.cycles] == ["c1", "c2"]             # skipped and reported
+    assert index.chain_of("CEO") == [] and index.chain_of("SELF") == []
+    assert index.chain_of("TEMP") == [] and index.employee_of("o2") is None
+    assert index.reports_of("GONE") == ["CONTRACTOR"]                  # manager with no row of their own
+
+    assert index.would_create_cycle("CTO", "DEV1") and index.would_create_cycle("LEAD", "lead")
+    assert not index.would_create_cycle("DEV1", "CFO")
+    before = _closure(index)
+    for call in (lambda: index.add("c3", "CTO", "DEV2"), lambda: index.update("r1", "DEV1")):
+        try:
+            call()
+            raise AssertionError("cycle accepted")
+        except HierarchyCycleError:
+            pass
+    assert _closure(index) == before                                   # rejected edits leave no trace
+
+    index.add("d1", "DEV1", "LEAD")                                    # duplicate row of r4
+    index.remove("r4")
+    assert index.chain_of("DEV1") == ["LEAD", "CTO", "CEO"]            # still held by the duplicate
+    index.remove("d1")
+    assert index.chain_of("DEV1") == [] and "DEV1" not in index.reports_of("CEO")
+
+
+def test_reload_from_loader():
+    rows = list(ROWS)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        if rows is None:
+            raise ConnectionError("dataverse down")
+        return list(rows)
+
+    index = HierarchyIndex(ttl=3600)
+    index.configure(loader)
+    assert index.reports_of("LEAD") == ["DEV1", "DEV2"] and len(calls) == 1
+    rows.append(("r9", "DEV9", "LEAD"))                                # another worker's insert
+    assert index.reports_of("LEAD") == ["DEV1", "DEV2"] and len(calls) == 1   # within TTL
+    index.invalidate()
+    assert index.reports_of("LEAD") == ["DEV1", "DEV2", "DEV9"] and len(calls) == 2
+
+    rows = None
+    index.invalidate()
+    assert index.reports_of("LEAD") == ["DEV1", "DEV2", "DEV9"]        # failed reload keeps the closure
+
+
+def test_odata_in_filters_are_chunked():
+    clauses = odata_in_filters("crc6f_employeeid", [f"E{n}" for n in range(450)] + ["E1", "O'NEIL", None])
+    assert len(clauses) == 3
+    assert clauses[0].startswith("Microsoft.Dynamics.CRM.In(PropertyName='crc6f_employeeid',PropertyValues=['E0',")
+    assert "'O''NEIL'" in clauses[2] and clauses[2].count("'E") == 50
+    assert odata_in_filters("x", []) == []
+
+
+if __name__ == "__main__":
+    for fn in (test_reports_and_chain_lookups, test_edits_match_a_rebuild_from_scratch, test_cycles_and_orphans,
+               test_reload_from_loader, test_odata_in_filters_are_chunked):
+        fn()
+        print(f"[OK] {fn.__name__}")
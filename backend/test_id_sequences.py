@@ -0,0 +1,108 @@
+"""
+Offline test for the shared ID sequences (id_sequences.py).
+
+Run: python test_id_sequences.py   (or via pytest)
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from id_sequences import IdSequences, SequenceUnavailable
+
+
+def _sequences(seed=0):
+    base = tempfile.mkdtemp(prefix="id_seq_")
+    seq = IdSequences(os.path.join(base, "seq.db"))
+    seq.register("employee", "EMP", 3, lambda: seed)
+    return seq, base
+
+
+def test_seeds_once_and_allocates_after_dataverse_max():
+    calls = []
+    base = tempfile.mkdtemp(prefix="id_seq_")
+    try:
+        seq = IdSequences(os.path.join(base, "seq.db"))
+        seq.register("employee", "EMP", 3,
+                     lambda: calls.append(1) or seq.max_number("employee", ["EMP007", "EMP041", "emp012", "X9", None]))
+        assert seq.next("employee") == "EMP042"
+        assert seq.next("employee") == "EMP043"
+
+        restarted = IdSequences(seq.db_path)                                  # new worker / restart
+        restarted.register("employee", "EMP", 3, lambda: calls.append(1) or 0)
+        assert restarted.next("employee") == "EMP044"
+        assert len(calls) == 1
+    finally:
+        shutil.rmtree(base)
+
+
+def test_reserve_peek_and_observe():
+    seq, base = _sequences(seed=9)
+    try:
+        assert seq.peek("employee") == "EMP010"
+        assert seq.reserve("employee", 3) == ["EMP010", "EMP011", "EMP012"]
+        assert seq.reserve("employee", 0) == []
+        assert seq.observe("employee", "EMP100")                              # CSV-provided ID
+        assert not seq.observe("employee", "EMP050")
+        assert not seq.observe("employee", "TEMP1")
+        assert seq.next("employee") == "EMP101"
+        seq.register("leave", "LVE-", 7, lambda: seq.max_number("leave", ["LVE-7K2P9QX", "LVE-0000020"]))
+        assert seq.next("leave") == "LVE-0000021"
+        assert seq.stats()["namespaces"]["employee"] == {"high_water": 101, "seeded": True}
+    finally:
+        shutil.rmtree(base)
+
+
+def test_failed_seed_raises_until_dataverse_answers():
+    state = {"down": True}
+
+    def seeder():
+        if state["down"]:
+            raise RuntimeError("dataverse down")
+        return 5
+
+    base = tempfile.mkdtemp(prefix="id_seq_")
+    try:
+        seq = IdSequences(os.path.join(base, "seq.db"))
+        seq.register("project", "VTAB", 3, seeder)
+        try:
+            seq.next("project")
+            assert False, "allocated from an unseeded sequence"
+        except SequenceUnavailable:
+            pass
+        assert seq.seed_all() == {"project": False}
+        state["down"] = False
+        assert seq.next("project") == "VTAB006"
+    finally:
+        shutil.rmtree(base)
+
+
+def test_workers_never_share_an_id():
+    seq, base = _sequences()
+    try:
+        seq.seed("employee")
+        workers = [IdSequences(seq.db_path) for _ in range(4)]
+        results = []
+
+        def create(w):
+            w.register("employee", "EMP", 3)
+            ids = [w.next("employee") for _ in range(50)] + w.reserve("employee", 25)
+            results.extend(ids)
+
+        threads = [threading.Thread(target=create, args=(w,)) for w in workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(results) == len(set(results)) == 300
+        assert seq.peek("employee") == "EMP301"
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_seeds_once_and_allocates_after_dataverse_max, test_reserve_peek_and_observe,
+               test_failed_seed_raises_until_dataverse_answers, test_workers_never_share_an_id):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,154 @@
+"""
+Offline test for the approved/pending leave interval index (leave_interval_index.py).
+
+Run: python test_leave_interval_index.py   (or via pytest)
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from leave_interval_index import LeaveIntervalIndex
+
+
+def _leave(leave_id, emp, start, end, status="Approved"):
+    return {"crc6f_leaveid": leave_id, "crc6f_employeeid": emp, "crc6f_leavetype": "Casual Leave",
+            "crc6f_startdate": start, "crc6f_enddate": end, "crc6f_status": status}
+
+
+ROWS = [
+    _leave("LVE-1", "EMP001", "2026-03-02", "2026-03-06"),
+    _leave("LVE-2", "EMP002", "2026-03-05", "2026-03-05", status="approved"),
+    _leave("LVE-3", "EMP003", "2026-02-20", "2026-03-20"),               # long leave
+    _leave("LVE-4", "EMP004", "2026-03-05", "2026-03-09", status="Pending"),
+    _leave("LVE-5", "EMP005", "2026-03-05", "2026-03-06", status="Rejected"),
+    _leave("LVE-6", "EMP006", "2026-03-10", None),                        # single day
+]
+
+
+def _index(rows=ROWS, marker_dir=None):
+    marker_dir = marker_dir or tempfile.mkdtemp(prefix="leave_idx_")
+    index = LeaveIntervalIndex(lambda: list(rows), marker_path=os.path.join(marker_dir, "changed"))
+    index.reconcile()
+    return index
+
+
+def _ids(rows):
+    return sorted(r["crc6f_leaveid"] for r in rows)
+
+
+def test_point_and_range_queries():
+    index = _index()
+    assert _ids(index.on_date("2026-03-05")) == ["LVE-1", "LVE-2", "LVE-3"]
+    assert _ids(index.on_date("2026-03-05", statuses=("approved", "pending"))) == ["LVE-1", "LVE-2", "LVE-3", "LVE-4"]
+    assert _ids(index.on_date("2026-03-10")) == ["LVE-3", "LVE-6"]
+    assert _ids(index.on_date("2026-03-21")) == []
+    assert _ids(index.overlapping("2026-03-07", "2026-03-09", statuses=("approved", "pending"))) == ["LVE-3", "LVE-4"]
+    assert _ids(index.on_date("2026-03-05", employee_ids=["emp001", "EMP004"])) == ["LVE-1"]
+    assert _ids(index.starting_between("2026-03-03", "2026-03-31")) == ["LVE-2", "LVE-6"]
+
+
+def test_matches_brute_force():
+    rng = np.random.default_rng(3)
+    rows = []
+    for i in range(400):
+        start = date(2026, 1, 1) + timedelta(days=int(rng.integers(0, 120)))
+        end = start + timedelta(days=int(rng.integers(0, 25)))
+        status = ["Approved", "Pending", "Canceled"][int(rng.integers(0, 3))]
+        rows.append(_leave(f"LVE-{i}", f"EMP{i % 40:03d}", start.isoformat(), end.isoformat(), status))
+    index = _index(rows)
+    for _ in range(50):
+        a = date(2026, 1, 1) + timedelta(days=int(rng.integers(0, 140)))
+        b = a + timedelta(days=int(rng.integers(0, 10)))
+        expected = [r["crc6f_leaveid"] for r in rows if r["crc6f_status"] == "Approved"
+                    and r["crc6f_startdate"] <= b.isoformat() and r["crc6f_enddate"] >= a.isoformat()]
+        assert _ids(index.overlapping(a, b)) == sorted(expected)
+
+
+def test_incremental_updates():
+    index = _index()
+    index.upsert({**ROWS[3], "crc6f_status": "Approved"})                  # approve the pending leave
+    assert "LVE-4" in _ids(index.on_date("2026-03-09"))
+    index.upsert({**ROWS[0], "crc6f_status": "Canceled"})                  # cancel
+    assert "LVE-1" not in _ids(index.on_date("2026-03-03", statuses=("approved", "pending")))
+    index.upsert(_leave("LVE-7", "EMP007", "2026-01-01", "2026-06-30"))    # longer than anything indexed
+    assert "LVE-7" in _ids(index.on_date("2026-05-01"))
+    index.remove("LVE-7")
+    assert _ids(index.on_date("2026-05-01")) == []
+
+
+def test_other_worker_write_triggers_reload():
+    marker_dir = tempfile.mkdtemp(prefix="leave_idx_")
+    try:
+        shared = list(ROWS)
+        a = _index(shared, marker_dir)
+        b = _index(shared, marker_dir)
+        time.sleep(0.01)
+        shared.append(_leave("LVE-8", "EMP008", "2026-03-05", "2026-03-05"))
+        a.upsert(shared[-1])                                               # worker A writes
+        assert "LVE-8" not in _ids(b.on_date("2026-03-05"))                # B answers at once, reloads behind
+        b._reloader.join(5)
+        assert "LVE-8" in _ids(b.on_date("2026-03-05"))
+        assert b.reconcile_count == 2
+    finally:
+        shutil.rmtree(marker_dir)
+
+
+def test_upserts_during_a_reload_survive_it():
+    loading, release = threading.Event(), threading.Event()
+    state = {"rows": list(ROWS), "block": False}
+
+    def loader():
+        rows = list(state["rows"])                                         # snapshot taken before the writes
+        if state["block"]:
+            loading.set()
+            release.wait(5)
+        return rows
+
+    index = LeaveIntervalIndex(loader, marker_path=os.path.join(tempfile.mkdtemp(prefix="leave_idx_"), "changed"))
+    index.reconcile()
+    state["block"] = True
+    reload = threading.Thread(target=index.reconcile)
+    reload.start()
+    assert loading.wait(5)
+    index.upsert({**ROWS[3], "crc6f_status": "Approved"})                  # approved while the load runs
+    index.upsert(_leave("LVE-9", "EMP009", "2026-03-05", "2026-03-05"))
+    index.remove("LVE-2")
+    release.set()
+    reload.join(5)
+    assert _ids(index.on_date("2026-03-05")) == ["LVE-1", "LVE-3", "LVE-4", "LVE-9"]
+
+    state["block"] = False
+    state["rows"] = [r for r in ROWS if r["crc6f_leaveid"] != "LVE-2"]     # Dataverse caught up; LVE-9 gone since
+    index.reconcile()
+    assert _ids(index.on_date("2026-03-05")) == ["LVE-1", "LVE-3"]
+
+
+def test_failed_reconcile_keeps_index():
+    state = {"fail": False}
+
+    def loader():
+        if state["fail"]:
+            raise RuntimeError("dataverse down")
+        return ROWS
+
+    index = LeaveIntervalIndex(loader, marker_path=os.path.join(tempfile.mkdtemp(prefix="leave_idx_"), "changed"))
+    assert not index.loaded
+    assert index.reconcile()
+    state["fail"] = True
+    assert not index.reconcile()
+    assert index.loaded and index.stats()["last_error"] == "dataverse down"
+    assert _ids(index.on_date("2026-03-05")) == ["LVE-1", "LVE-2", "LVE-3"]
+
+
+if __name__ == "__main__":
+    for fn in (test_point_and_range_queries, test_matches_brute_force, test_incremental_updates,
+               test_other_worker_write_triggers_reload, test_upserts_during_a_reload_survive_it,
+               test_failed_reconcile_keeps_index):
+        fn()
+        print(f"[OK] {fn.__name__}")
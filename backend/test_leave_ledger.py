@@ -0,0 +1,129 @@
+"""
+Offline test for the append-only leave ledger (leave_ledger.py).
+
+Run: python test_leave_ledger.py   (or via pytest)
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from leave_ledger import LeaveLedger
+
+
+def _ledger():
+    base = tempfile.mkdtemp(prefix="leave_ledger_")
+    return LeaveLedger(os.path.join(base, "ledger.db")), base
+
+
+def test_events_are_idempotent_and_materialised():
+    ledger, base = _ledger()
+    try:
+        assert ledger.record("accrual:EMP001:CL:2026", "emp001", "CL", 2026, "accrual", 6)
+        assert ledger.record("leave:LVE-1:consume", "EMP001", "CL", 2026, "consume", 2, ref="LVE-1")
+        assert not ledger.record("leave:LVE-1:consume", "EMP001", "CL", 2026, "consume", 2)   # approve after apply
+        assert ledger.balance("EMP001", 2026)["CL"] == {"accrued": 6.0, "consumed": 2.0, "available": 4.0}
+
+        assert ledger.reverse("leave:LVE-1:consume", "leave:LVE-1:release")                  # cancel
+        assert not ledger.reverse("leave:LVE-1:consume", "leave:LVE-1:release")              # cancel again
+        assert not ledger.reverse("leave:LVE-9:consume", "leave:LVE-9:release")              # unpaid / unknown
+        assert ledger.balance("EMP001", 2026)["CL"] == {"accrued": 6.0, "consumed": 0.0, "available": 6.0}
+        assert [e["kind"] for e in ledger.entries("EMP001")] == ["accrual", "consume", "release"]
+    finally:
+        shutil.rmtree(base)
+
+
+def test_comp_off_carries_across_years():
+    ledger, base = _ledger()
+    try:
+        ledger.record("compoff:REQ-1:grant", "EMP002", "CO", 2025, "grant", 1)
+        ledger.record("compoff:REQ-2:grant", "EMP002", "CO", 2026, "grant", 2)
+        ledger.record("leave:LVE-2:consume", "EMP002", "CO", 2026, "consume", 1)
+        assert ledger.balance("EMP002", 2026)["CO"]["available"] == 2.0
+        assert ledger.balance("EMP002", 2027)["CO"]["available"] == 2.0
+        assert "CL" not in ledger.balance("EMP002", 2027)
+    finally:
+        shutil.rmtree(base)
+
+
+def test_quota_top_up_and_adjustment():
+    ledger, base = _ledger()
+    try:
+        assert ledger.set_quota("EMP003", "CL", 2026, 3) == 3
+        assert ledger.set_quota("EMP003", "CL", 2026, 3) == 0            # incremental: nothing to do
+        ledger.record("leave:LVE-3:consume", "EMP003", "CL", 2026, "consume", 1)
+        assert ledger.set_quota("EMP003", "CL", 2026, 4) == 1            # experience moved to Type 2
+        assert ledger.balance("EMP003", 2026)["CL"]["available"] == 3.0
+        assert ledger.adjust_to("EMP003", "CL", 2026, 5, event_id="adjust:1") == 2
+        assert ledger.balance("EMP003", 2026)["CL"] == {"accrued": 4.0, "consumed": 1.0, "available": 5.0}
+    finally:
+        shutil.rmtree(base)
+
+
+def test_rebuild_replaces_the_year():
+    ledger, base = _ledger()
+    try:
+        ledger.record("leave:OLD:consume", "EMP004", "SL", 2026, "consume", 4)
+        ledger.record("leave:PREV:consume", "EMP004", "SL", 2025, "consume", 1)
+        applied = ledger.rebuild("EMP004", 2026, [
+            {"event_id": "accrual:EMP004:SL:2026:rebuild", "leave_type": "SL", "kind": "accrual", "days": 6},
+            {"event_id": "leave:LVE-4:consume", "leave_type": "SL", "kind": "consume", "days": 2, "year": 2026},
+            {"event_id": "leave:LVE-5:consume", "leave_type": "SL", "kind": "consume", "days": 1, "year": 2025},
+        ])
+        assert applied == 2
+        assert ledger.balance("EMP004", 2026)["SL"] == {"accrued": 6.0, "consumed": 2.0, "available": 4.0}
+        assert ledger.balance("EMP004", 2025)["SL"]["consumed"] == 1.0    # other years untouched
+        assert not ledger.has_event("leave:OLD:consume")
+
+        # New-year rollover without an anchoring balance row keeps the comp-off bucket
+        ledger.record("compoff:REQ-3:grant", "EMP004", "CO", 2026, "grant", 3)
+        ledger.adjust_to("EMP004", "CO", 2026, 2, event_id="opening:EMP004:CO")
+        rollover = [{"event_id": "accrual:EMP004:SL:2027:rebuild", "leave_type": "SL", "kind": "accrual", "days": 6},
+                    {"event_id": "leave:LVE-6:consume", "leave_type": "CO", "kind": "consume", "days": 1, "year": 2027}]
+        assert ledger.rebuild("EMP004", 2027, rollover, include_carry_forward=False) == 1
+        assert ledger.balance("EMP004", 2027)["CO"] == {"accrued": 3.0, "consumed": 0.0, "available": 2.0}
+        assert ledger.balance("EMP004", 2027)["SL"]["available"] == 6.0
+
+        # A consume posted ahead of time creates balance rows but not the year's accrual
+        ledger.record("leave:LVE-7:consume", "EMP004", "CL", 2028, "consume", 1)
+        assert "CL" in ledger.balance("EMP004", 2028) and not ledger.is_accrued("EMP004", 2028)
+        assert ledger.is_accrued("EMP004", 2027)
+
+        # An unanchored rebuild keeps the year's manual adjustments; a plain one drops them
+        ledger.adjust_to("EMP004", "SL", 2027, 4.5, event_id="adjust:EMP004:SL:manual")
+        assert ledger.rebuild("EMP004", 2027, rollover, include_carry_forward=False, keep_adjustments=True) == 2
+        assert ledger.balance("EMP004", 2027)["SL"]["available"] == 4.5
+        assert ledger.has_event("adjust:EMP004:SL:manual")
+        ledger.rebuild("EMP004", 2027, rollover, include_carry_forward=False)
+        assert ledger.balance("EMP004", 2027)["SL"]["available"] == 6.0
+    finally:
+        shutil.rmtree(base)
+
+
+def test_workers_apply_an_event_once():
+    ledger, base = _ledger()
+    try:
+        ledger.record("accrual:EMP005:CL:2026", "EMP005", "CL", 2026, "accrual", 6)
+        workers = [LeaveLedger(ledger.db_path) for _ in range(4)]
+
+        def approve(w):
+            for _ in range(20):
+                w.record("leave:LVE-6:consume", "EMP005", "CL", 2026, "consume", 1)
+
+        threads = [threading.Thread(target=approve, args=(w,)) for w in workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert ledger.balance("EMP005", 2026)["CL"]["available"] == 5.0
+        assert ledger.stats()["entries"] == 2
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_events_are_idempotent_and_materialised, test_comp_off_carries_across_years,
+               test_quota_top_up_and_adjustment, test_rebuild_replaces_the_year, test_workers_apply_an_event_once):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,103 @@
+"""
+Offline test for the cached offer/policy letter pipeline (letter_pdfs.py),
+using the real templates and static PDFs copied to a scratch directory.
+
+Run: python test_letter_pdfs.py   (or via pytest)
+"""
+
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+
+from letter_pdfs import OFFER_TEMPLATE, POLICY_STATIC_FILE, POLICY_TEMPLATE, CompiledTemplate, LetterPipeline
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+CANDIDATE = {
+    "current_date": "19-10-2026",
+    "candidate_name": "Sammer K",
+    "candidate_address": "Chennai",
+    "designation": "Data Analyst",
+    "date_of_joining": "15-11-2025",
+}
+
+
+def _scratch(with_policy_static=True):
+    base = tempfile.mkdtemp(prefix="letters_")
+    names = [OFFER_TEMPLATE, POLICY_TEMPLATE] + ([POLICY_STATIC_FILE] if with_policy_static else [])
+    for name in names:
+        shutil.copy(os.path.join(BACKEND_DIR, name), os.path.join(base, name))
+    return base
+
+
+def _pages(data):
+    return PdfReader(BytesIO(data)).pages
+
+
+def test_templates_split_into_fixed_and_personal_pages():
+    with open(os.path.join(BACKEND_DIR, OFFER_TEMPLATE), encoding="utf-8") as f:
+        offer = CompiledTemplate(f.read())
+    assets = {"logo_main", "logo_sub", "sign_img"}
+    assert len(offer.blocks) == 3
+    assert not offer.is_personal(0, assets)                                   # cover: logos only
+    assert offer.is_personal(1, assets) and {"candidate_name", "date_of_joining"} <= offer.fields[1]
+    html = offer.page_html(1, {**CANDIDATE, "logo_main": "", "logo_sub": "", "sign_img": ""})
+    assert "Sammer K" in html and "{{" not in html and html.rstrip().endswith("</html>")
+
+
+def test_only_personal_pages_rendered_and_results_cached():
+    base = _scratch()
+    try:
+        pipeline = LetterPipeline(backend_dir=base, cache_dir=os.path.join(base, "cache"), processes=0)
+        first = pipeline.build(CANDIDATE)
+        assert first.source == "rendered"
+        assert len(_pages(first.offer)) == 2 and "Sammer K" in _pages(first.offer)[1].extract_text()
+        with open(os.path.join(BACKEND_DIR, POLICY_STATIC_FILE), "rb") as f:
+            assert len(_pages(first.policy)) == len(PdfReader(f).pages)
+        assert pipeline.stats()["blocks_rendered"] == 2                       # cover + joining page
+
+        other = pipeline.build({**CANDIDATE, "candidate_name": "Asha R"})
+        assert "Asha R" in _pages(other.offer)[1].extract_text()
+        assert pipeline.stats()["blocks_rendered"] == 3                       # cover reused
+        assert pipeline.build(CANDIDATE).source == "memory"
+
+        restarted = LetterPipeline(backend_dir=base, cache_dir=os.path.join(base, "cache"), processes=0)
+        again = restarted.build(CANDIDATE)
+        assert again.source == "disk" and again.offer == first.offer and again.policy == first.policy
+
+        with open(os.path.join(base, OFFER_TEMPLATE), "a", encoding="utf-8") as f:
+            f.write("\n<!-- edited -->\n")
+        os.utime(os.path.join(base, OFFER_TEMPLATE), ns=(1, 1))
+        edited = restarted.build(CANDIDATE)
+        assert edited.source == "rendered" and edited.version != first.version
+        assert os.listdir(os.path.join(base, "cache")) == [edited.version]    # old version pruned
+        restarted.shutdown()
+        pipeline.shutdown()
+    finally:
+        shutil.rmtree(base)
+
+
+def test_policy_rendered_from_template_in_process_pool():
+    base = _scratch(with_policy_static=False)
+    try:
+        pipeline = LetterPipeline(backend_dir=base, cache_dir=os.path.join(base, "cache"), processes=1)
+        pipeline.warm()
+        first = pipeline.submit(CANDIDATE)
+        assert pipeline.submit(CANDIDATE) is first                            # concurrent requests share a render
+        letters = first.result(timeout=60)
+        policy = _pages(letters.policy)
+        assert len(policy) >= 4 and "Sammer K" in policy[0].extract_text()
+        stats = pipeline.stats()
+        assert stats["renders"] == 1 and stats["in_flight"] == 0 and stats["failures"] == 0
+        pipeline.shutdown()
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_templates_split_into_fixed_and_personal_pages, test_only_personal_pages_rendered_and_results_cached,
+               test_policy_rendered_from_template_in_process_pool):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,106 @@
+"""
+Offline test for the IMAP reply ingester (mail_ingest.py) against the local
+IMAP stand-in (imap_stub.py).
+
+Run: python test_mail_ingest.py   (or via pytest)
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+from imap_stub import ImapStub
+from mail_ingest import MailIngester, ReplyIndex, classify_offer_reply, imap_connector, is_documents_sent
+
+
+def _setup(**kwargs):
+    stub = ImapStub()
+    host, port = stub.start()
+    base = tempfile.mkdtemp(prefix="mail_ingest_")
+    index = ReplyIndex(os.path.join(base, "mail.db"))
+    connect = imap_connector(host, stub.username, stub.password, port=port, use_ssl=False, timeout=5)
+    return stub, base, index, MailIngester(index, connect, **kwargs)
+
+
+def test_classification_matches_previous_rules():
+    assert classify_offer_reply("Yes, I accept the offer") == "Yes"
+    assert classify_offer_reply("Sorry, I cannot accept") == "No"            # decline wins
+    assert classify_offer_reply("Thanks for the call") is None
+    assert is_documents_sent("Yes, sent them today") and not is_documents_sent("Will send soon")
+
+
+def test_only_new_uids_and_no_attachments_are_fetched():
+    stub, base, index, ingester = _setup()
+    try:
+        stub.add_message("Asha R <Asha@Example.com>", "Re: Offer", "Hi,\nYes, I accept.\n")
+        stub.add_message("ravi@example.com", "Re: Offer", "I am not interested, thanks")
+        assert ingester.poll_once() == 2
+        assert index.latest("asha@example.com")["offer_reply"] == "Yes"
+        assert index.latest("ravi@example.com")["offer_reply"] == "No"
+
+        stub.add_message("asha@example.com", "Re: Documents", "Yes, sent by courier", attachment=b"%PDF" + b"x" * 200000)
+        assert ingester.poll_once() == 1
+        assert ingester.poll_once() == 0                                      # n:* echo of the newest UID ignored
+        latest = index.latest("asha@example.com")
+        assert latest["docs_sent"] and latest["subject"] == "Re: Documents"
+        assert latest["body"].startswith("Yes, sent")
+
+        assert stub.logins == 1                                               # one connection for every poll
+        assert stub.fetched and all("RFC822)" not in f and "HEADER.FIELDS" in f and "<0." in f for f in stub.fetched)
+        assert index.watermark() == (stub.uidvalidity, 3)
+        assert index.latest("nobody@example.com") is None
+    finally:
+        ingester.stop()
+        stub.stop()
+        shutil.rmtree(base)
+
+
+def test_watermark_survives_restart_and_uidvalidity_reset():
+    stub, base, index, ingester = _setup(backfill_days=30)
+    try:
+        stub.add_message("old@example.com", "Re: Offer", "yes", date=datetime.now(timezone.utc) - timedelta(days=60))
+        stub.add_message("asha@example.com", "Re: Offer", "yes")
+        assert ingester.poll_once() == 1                                      # outside the backfill window
+        ingester._disconnect()
+
+        again = MailIngester(index, ingester.connect)
+        stub.add_message("ravi@example.com", "Re: Offer", "I agree")
+        assert again.poll_once() == 1
+        assert len(stub.fetched) == 2
+
+        stub.reset_uidvalidity()
+        again._disconnect()
+        assert again.poll_once() == 3                                         # mailbox rebuilt: re-indexed
+        assert index.latest("ravi@example.com")["uid"] == 3
+        again._disconnect()
+    finally:
+        stub.stop()
+        shutil.rmtree(base)
+
+
+def test_single_poller_across_workers_and_refresh():
+    stub, base, index, first = _setup(poll_seconds=60)
+    second = MailIngester(ReplyIndex(index.db_path), first.connect, poll_seconds=60)
+    try:
+        first.start()
+        second.start()
+        threading.Event().wait(1.0)
+        stub.add_message("asha@example.com", "Re: Offer", "yes please")
+        assert index.latest("asha@example.com") is None                       # next timed poll is a minute away
+        assert second.refresh(timeout=3)                                      # served by whichever holds the lease
+        assert index.latest("asha@example.com")["offer_reply"] == "Yes"
+        assert stub.logins == 1
+    finally:
+        first.stop()
+        second.stop()
+        stub.stop()
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_classification_matches_previous_rules, test_only_new_uids_and_no_attachments_are_fetched,
+               test_watermark_survives_restart_and_uidvalidity_reset, test_single_poller_across_workers_and_refresh):
+        fn()
+        print(f"[OK] {fn.__name__}")
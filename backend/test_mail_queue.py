@@ -0,0 +1,192 @@
+"""
+Offline test for the outbound mail queue (mail_queue.py) and the queued
+delivery transports in mail_app.py: batched Brevo sends against a local HTTP
+stand-in and pooled SMTP against a local SMTP stand-in.
+
+Run: python test_mail_queue.py   (or via pytest)
+"""
+
+import json
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mail_app
+from mail_queue import MailQueue, MailWorker
+
+
+class _SmtpStub:
+    """Accepts mail over plain SMTP; counts connections and messages."""
+
+    def __init__(self):
+        self.connections = 0
+        self.messages = []
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stub.connections += 1
+                self.wfile.write(b"220 stub ESMTP\r\n")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    verb = line.split(b" ", 1)[0].strip().upper()
+                    if verb in (b"EHLO", b"HELO"):
+                        self.wfile.write(b"250-stub\r\n250 OK\r\n")
+                    elif verb == b"DATA":
+                        self.wfile.write(b"354 go ahead\r\n")
+                        data = []
+                        while True:
+                            chunk = self.rfile.readline()
+                            if chunk in (b".\r\n", b""):
+                                break
+                            data.append(chunk)
+                        stub.messages.append(b"".join(data))
+                        self.wfile.write(b"250 queued\r\n")
+                    elif verb == b"QUIT":
+                        self.wfile.write(b"221 bye\r\n")
+                        return
+                    else:
+                        self.wfile.write(b"250 OK\r\n")
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _brevo_stub(calls, fail=False):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            calls.append(payload)
+            count = len(payload.get("messageVersions") or [None])
+            body = json.dumps({"message": "down"} if fail else {"messageIds": [f"<m{len(calls)}.{n}>" for n in range(count)]})
+            self.send_response(500 if fail else 201)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v3/smtp/email"
+
+
+def test_idempotency_and_status_by_record():
+    base = tempfile.mkdtemp(prefix="mail_queue_")
+    try:
+        queue = MailQueue(os.path.join(base, "mail.db"))
+        first = queue.enqueue("Offer", ["a@x.io"], "Dear A", record_id="rec-1", kind="offer_letter")
+        again = queue.enqueue("Offer", ["a@x.io"], "Dear A", record_id="rec-1", kind="offer_letter")
+        assert again["duplicate"] and again["id"] == first["id"]              # double click
+        other = queue.enqueue("Offer", ["a@x.io"], "Dear A, revised", record_id="rec-1", kind="offer_letter")
+        assert not other["duplicate"]
+
+        keyed = queue.enqueue("Creds", ["b@x.io"], "pw 1", record_id="EMP001", idempotency_key="credentials:EMP001")
+        assert queue.enqueue("Creds", ["b@x.io"], "pw 2", idempotency_key="credentials:EMP001")["id"] == keyed["id"]
+
+        with_pdf = queue.enqueue("Policy", ["a@x.io"], "see attached", record_id="rec-1",
+                                 attachments=[("Policy.pdf", b"%PDF policy")])
+        statuses = queue.for_record("rec-1")
+        assert [m["id"] for m in statuses] == [with_pdf["id"], other["id"], first["id"]]
+        assert statuses[0]["attachments"] == [{"filename": "Policy.pdf", "size": 11}]
+        assert all(m["status"] == "queued" and "body" not in m for m in statuses)
+    finally:
+        shutil.rmtree(base)
+
+
+def test_worker_retries_with_backoff_then_gives_up():
+    base = tempfile.mkdtemp(prefix="mail_queue_")
+    try:
+        queue = MailQueue(os.path.join(base, "mail.db"))
+        outcomes = iter([False, True])
+        worker = MailWorker(queue, lambda mails: {m["id"]: (next(outcomes), "smtp", "SMTP: timed out") for m in mails},
+                            retry_base_seconds=0.2, max_attempts=3)
+        mail_id = queue.enqueue("Hello", ["a@x.io"], "hi", record_id="rec-2")["id"]
+        assert worker.run_once() == 1
+        state = queue.get(mail_id)
+        assert (state["status"], state["attempts"], state["last_error"]) == ("queued", 1, "SMTP: timed out")
+        assert worker.run_once() == 0                                         # backing off
+        time.sleep(0.25)
+        assert worker.run_once() == 1
+        assert queue.get(mail_id)["status"] == "sent" and queue.get(mail_id)["attempts"] == 2
+
+        dead = MailWorker(queue, lambda mails: {}, retry_base_seconds=0, max_attempts=2)
+        lost = queue.enqueue("Hello", ["b@x.io"], "hi")["id"]
+        dead.run_once()
+        dead.run_once()
+        assert queue.get(lost)["status"] == "failed"
+        assert queue.retry(lost) and queue.get(lost)["status"] == "queued"
+    finally:
+        shutil.rmtree(base)
+
+
+def test_brevo_batches_and_smtp_connection_is_reused():
+    base = tempfile.mkdtemp(prefix="mail_queue_")
+    smtp = _SmtpStub()
+    calls = []
+    server, url = _brevo_stub(calls)
+    saved_url, saved_key = mail_app.BREVO_API_URL, os.environ.get("BREVO_API_KEY")
+    try:
+        mail_app.BREVO_API_URL = url
+        os.environ["BREVO_API_KEY"] = "test"
+        queue = MailQueue(os.path.join(base, "mail.db"))
+        for n in range(5):
+            queue.enqueue(f"Welcome {n}", [f"e{n}@x.io"], f"Hello {n}")
+        queue.enqueue("Policy", ["p@x.io"], "attached", attachments=[("Policy.pdf", b"%PDF")])
+        worker = MailWorker(queue, mail_app.deliver_queued)
+        assert worker.run_once() == 6
+        assert len(calls) == 2                                                # 5 plain in one call + 1 with attachment
+        batch = calls[0]
+        assert [v["to"][0]["email"] for v in batch["messageVersions"]] == [f"e{n}@x.io" for n in range(5)]
+        assert batch["messageVersions"][3]["textContent"] == "Hello 3"
+        assert calls[1]["attachment"][0]["name"] == "Policy.pdf"
+        sent = queue.get(1)
+        assert (sent["status"], sent["provider"], sent["provider_message_id"]) == ("sent", "brevo", "<m1.0>")
+
+        # Brevo down: everything falls through to SMTP over one pooled connection
+        server.shutdown()
+        server.server_close()
+        server, mail_app.BREVO_API_URL = _brevo_stub(calls, fail=True)
+        pool = mail_app.SmtpConnectionPool("127.0.0.1", smtp.port, use_tls=False)
+        for n in range(3):
+            queue.enqueue(f"Reminder {n}", [f"r{n}@x.io"], "Please reply")
+        worker = MailWorker(queue, lambda mails: mail_app.deliver_queued(mails, smtp_pool=pool))
+        assert worker.run_once() == 3
+        queue.enqueue("Later", ["l@x.io"], "one more")
+        assert worker.run_once() == 1
+        assert len(smtp.messages) == 4 and smtp.connections == 1 and pool.opened == 1
+        assert queue.stats()["counts"] == {"sent": 10}
+        pool.close_all()
+    finally:
+        mail_app.BREVO_API_URL = saved_url
+        if saved_key is None:
+            os.environ.pop("BREVO_API_KEY", None)
+        else:
+            os.environ["BREVO_API_KEY"] = saved_key
+        server.shutdown()
+        server.server_close()
+        smtp.stop()
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_idempotency_and_status_by_record, test_worker_retries_with_backoff_then_gives_up,
+               test_brevo_batches_and_smtp_connection_is_reused):
+        fn()
+        print(f"[OK] {fn.__name__}")
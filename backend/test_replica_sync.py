@@ -0,0 +1,102 @@
+"""
+Offline test for the Dataverse read replica (dataverse_replica.py).
+Runs the sync loop against the local OData stub - no CRM credentials needed.
+
+Run: python test_replica_sync.py   (or via pytest)
+"""
+
+import os
+import tempfile
+import time
+
+import requests
+
+from dataverse_replica import DataverseReplica, ReplicaTable
+from odata_stub import ODataStub
+
+HOLIDAYS = "crc6f_hr_holidayses"
+PK = "crc6f_hr_holidaysid"
+
+
+def _setup(page_size_rows=0, page_size=5000):
+    stub = ODataStub({HOLIDAYS: PK})
+    for i in range(page_size_rows or 3):
+        stub.upsert(HOLIDAYS, {PK: f"h{i}", "crc6f_holidayname": f"Holiday {i}", "crc6f_date": f"2026-01-{i + 1:02d}"})
+    base_url = stub.start()
+    db_path = os.path.join(tempfile.mkdtemp(), "replica.db")
+    session = requests.Session()
+    replica = DataverseReplica(db_path=db_path, base_url=base_url, token_provider=lambda: "stub", session_provider=lambda: session)
+    replica.register(ReplicaTable("holidays", HOLIDAYS, PK, "crc6f_hr_holidaysid,crc6f_holidayname,crc6f_date", refresh_seconds=60, page_size=page_size))
+    return stub, replica
+
+
+def _names(rows):
+    return sorted(r["crc6f_holidayname"] for r in rows)
+
+
+def test_full_then_delta_sync():
+    stub, replica = _setup()
+    try:
+        assert replica.read("holidays") is None, "never-synced replica must fall back to Dataverse"
+        result = replica.sync("holidays", force=True)
+        assert result["mode"] == "full" and result["rows"] == 3 and result["delta"]
+        assert _names(replica.read("holidays")) == ["Holiday 0", "Holiday 1", "Holiday 2"]
+
+        stub.upsert(HOLIDAYS, {PK: "h1", "crc6f_holidayname": "Renamed"})
+        stub.upsert(HOLIDAYS, {PK: "h9", "crc6f_holidayname": "Added", "crc6f_date": "2026-02-01"})
+        stub.delete(HOLIDAYS, "h0")
+        result = replica.sync("holidays", force=True)
+        assert result == {"mode": "delta", "upserts": 2, "deletes": 1}, result
+        assert _names(replica.read("holidays")) == ["Added", "Holiday 2", "Renamed"]
+        assert "$deltatoken" in stub.requests[-1]["query"]
+    finally:
+        stub.stop()
+
+
+def test_paging_and_expired_token():
+    stub, replica = _setup(page_size_rows=12, page_size=5)
+    try:
+        assert replica.sync("holidays", force=True)["rows"] == 12
+        assert sum(1 for r in stub.requests if "$skiptoken" in r["query"]) == 2
+
+        stub.expire_tokens()
+        stub.upsert(HOLIDAYS, {PK: "h3", "crc6f_holidayname": "After expiry"})
+        result = replica.sync("holidays", force=True)
+        assert result["mode"] == "full", "410 on the delta link must trigger a full resync"
+        assert "After expiry" in _names(replica.read("holidays"))
+    finally:
+        stub.stop()
+
+
+def test_invalidate_staleness_and_errors():
+    stub, replica = _setup()
+    try:
+        replica.sync("holidays", force=True)
+        stub.upsert(HOLIDAYS, {PK: "h5", "crc6f_holidayname": "Written through Dataverse"})
+
+        # Cadence not elapsed: background sync is skipped
+        assert replica.sync("holidays") is None
+        replica.invalidate("holidays")
+        assert replica.status()["holidays"]["dirty"]
+        assert "Written through Dataverse" in _names(replica.read("holidays"))
+        assert not replica.status()["holidays"]["dirty"]
+
+        # A failing sync keeps the table dirty, so reads fall back to Dataverse
+        replica.invalidate("holidays")
+        stub.fail_next = 1
+        assert replica.read("holidays") is None
+        assert replica.status()["holidays"]["last_error"]
+
+        # Stale beyond max_age: router declines
+        replica.sync("holidays", force=True)
+        time.sleep(0.05)
+        assert replica.read("holidays", max_age=0.01) is None
+        assert replica.read("holidays") is not None
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    for fn in (test_full_then_delta_sync, test_paging_and_expired_token, test_invalidate_staleness_and_errors):
+        fn()
+        print(f"[OK] {fn.__name__}")
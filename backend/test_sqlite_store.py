@@ -0,0 +1,75 @@
+"""
+Offline test for the shared SQLite plumbing (sqlite_store.py).
+
+Run: python test_sqlite_store.py   (or via pytest)
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from sqlite_store import SQLiteStore, connect, immediate, singleton
+
+
+class _Counter(SQLiteStore):
+    pragmas = ("auto_vacuum=INCREMENTAL",)
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self._conn().execute("CREATE TABLE IF NOT EXISTS counter (n INTEGER NOT NULL)")
+        self._transaction(lambda conn: conn.execute("INSERT INTO counter SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM counter)"))
+
+    def bump(self):
+        def apply(conn):
+            n = conn.execute("SELECT n FROM counter").fetchone()[0] + 1
+            conn.execute("UPDATE counter SET n = ?", (n,))
+            return n
+        return self._transaction(apply)
+
+
+def test_transactions_commit_and_roll_back():
+    base = tempfile.mkdtemp(prefix="sqlite_store_")
+    try:
+        path = os.path.join(base, "nested", "counter.db")                  # parent is created
+        store = _Counter(path)
+        assert store._conn().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert store._conn().execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+        # Two "workers" (separate stores, one connection per thread) never lose an increment
+        other = _Counter(path)
+        threads = [threading.Thread(target=lambda s=s: [s.bump() for _ in range(50)]) for s in (store, other) * 2]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert store.bump() == 201
+
+        conn = connect(path)
+        try:
+            with immediate(conn):
+                conn.execute("UPDATE counter SET n = 0")
+                raise ValueError("abort")
+        except ValueError:
+            pass
+        assert conn.execute("SELECT n FROM counter").fetchone()[0] == 201  # rolled back
+        assert not conn.in_transaction
+    finally:
+        shutil.rmtree(base)
+
+
+def test_singleton_builds_once():
+    built = []
+    get = singleton(lambda: built.append(1) or object())
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert get() is get() and len(built) == 1
+
+
+if __name__ == "__main__":
+    for fn in (test_transactions_commit_and_roll_back, test_singleton_builds_once):
+        fn()
+        print(f"[OK] {fn.__name__}")
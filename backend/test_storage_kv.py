@@ -0,0 +1,102 @@
+"""
+Offline test for the per-record JSON store (storage_kv.py).
+
+Run: python test_storage_kv.py   (or via pytest)
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from storage_kv import KVStore
+
+
+def test_legacy_import_and_per_key_operations():
+    base = tempfile.mkdtemp(prefix="storage_kv_")
+    try:
+        legacy = os.path.join(base, "team_hierarchy.json")
+        with open(legacy, "w", encoding="utf-8") as f:
+            json.dump([{"id": "A1", "employeeId": "EMP001"}, {"id": "B/2", "employeeId": "EMP002"},
+                       {"employeeId": "no-id"}], f, indent=2)
+        store = KVStore("team_hierarchy", root=base)
+        assert store.import_json(legacy, key_fn=lambda r: r.get("id")) == 2
+        assert store.import_json(legacy, key_fn=lambda r: r.get("id")) == 0        # unchanged: not again
+        assert KVStore("team_hierarchy", root=base).import_json(legacy, key_fn=lambda r: r.get("id")) == 0
+
+        assert store.get("B/2")["employeeId"] == "EMP002"
+        store.put(".hidden", {"id": ".hidden"})
+        assert [k for k, _ in store.items()] == [".hidden", "A1", "B/2"]
+        assert store.delete("A1") and not store.delete("A1") and store.get("A1") is None
+
+        record = store.get("B/2")
+        record["employeeId"] = "changed"                                           # callers get copies
+        assert store.get("B/2")["employeeId"] == "EMP002"
+
+        policy = KVStore("policy", root=base)
+        assert policy.replace_all({"global": None, "targets": {"EMP001": "t1"}}) == (2, 0)
+        assert policy.replace_all({"global": "t2", "targets": {"EMP001": "t1"}}) == (1, 0)
+        assert dict(policy.items()) == {"global": "t2", "targets": {"EMP001": "t1"}}
+        assert not [n for n in os.listdir(store.path) if n.startswith(".tmp-")]
+    finally:
+        shutil.rmtree(base)
+
+
+def _increment(root, rounds):
+    store = KVStore("counters", root=root, fsync=False)
+    for n in range(rounds):
+        store.update("shared", lambda value: {"count": value["count"] + 1}, default={"count": 0})
+        store.put(f"own-{os.getpid()}-{n}", {"n": n})
+
+
+def test_concurrent_workers_do_not_lose_writes():
+    base = tempfile.mkdtemp(prefix="storage_kv_")
+    try:
+        ctx = multiprocessing.get_context("fork")
+        workers = [ctx.Process(target=_increment, args=(base, 50)) for _ in range(4)]
+        for w in workers:
+            w.start()
+        reader = KVStore("counters", root=base)
+        while any(w.is_alive() for w in workers):
+            value = reader.get("shared")                                           # never a torn file
+            assert value is None or isinstance(value["count"], int)
+        for w in workers:
+            w.join()
+            assert w.exitcode == 0
+        assert reader.get("shared") == {"count": 200}
+        assert len(reader.keys()) == 201
+    finally:
+        shutil.rmtree(base)
+
+
+def test_reads_are_cached_until_the_file_changes():
+    base = tempfile.mkdtemp(prefix="storage_kv_")
+    try:
+        writer = KVStore("docs", root=base, fsync=False)
+        for n in range(2000):
+            writer.put(f"doc-{n:04d}", {"n": n, "path": f"/uploads/{n}.pdf"})
+        reader = KVStore("docs", root=base)
+        assert len(reader.items()) == 2000 and reader.reads == 2000
+        reader.items()
+        reader.get("doc-0007")
+        assert reader.reads == 2000                                                # nothing re-parsed
+
+        writer.put("doc-0007", {"n": 7, "path": "/uploads/7-v2.pdf"})
+        assert reader.get("doc-0007")["path"] == "/uploads/7-v2.pdf" and reader.reads == 2001
+
+        started = time.perf_counter()
+        for n in range(200):
+            writer.put("doc-0001", {"n": n})
+        per_write_ms = (time.perf_counter() - started) * 1000 / 200
+        assert per_write_ms < 5                                                    # one small file, not the index
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_legacy_import_and_per_key_operations, test_concurrent_workers_do_not_lose_writes,
+               test_reads_are_cached_until_the_file_changes):
+        fn()
+        print(f"[OK] {fn.__name__}")
@@ -0,0 +1,146 @@
+"""
+Offline test for the timesheet monitor rollups (timesheet_rollups.py).
+
+Run: python test_timesheet_rollups.py   (or via pytest)
+"""
+
+import os
+import shutil
+import tempfile
+
+from timesheet_rollups import TimesheetRollupStore
+
+WEEK = "2026-03-02"          # a Monday
+NEXT_WEEK = "2026-03-09"
+
+
+class _History:
+    """Stand-in for the Dataverse / local-cache / submission loaders time_tracking registers."""
+
+    def __init__(self):
+        self.dv = [("EMP001", "2026-03-03", 3600), ("EMP001", "2026-03-04", 1800)]
+        self.local = [("emp001", "2026-03-03", 60), ("EMP002", "2026-03-10", 7200)]
+        self.statuses = [("EMP001", "2026-03-03", "Pending")]
+        self.dv_fails = False
+        self.dv_calls = 0
+
+    def dv_rows(self, start, end, employee_id=None):
+        self.dv_calls += 1
+        if self.dv_fails:
+            raise ConnectionError("dataverse down")
+        return list(self.dv)
+
+    def local_rows(self, start, end, employee_id=None):
+        return list(self.local)
+
+    def status_rows(self):
+        return list(self.statuses)
+
+
+def _store(path, history, **kwargs):
+    store = TimesheetRollupStore(path, **kwargs)
+    store.configure(history.dv_rows, history.local_rows, history.status_rows)
+    return store
+
+
+def test_build_and_read_week_grid():
+    base = tempfile.mkdtemp(prefix="ts_rollup_")
+    try:
+        history = _History()
+        store = _store(os.path.join(base, "rollups.npz"), history)
+        grid = store.week_grid(["emp001", "EMP002", "EMP404"], [WEEK, NEXT_WEEK])
+        # Dataverse wins for a week it has; the local cache only fills weeks Dataverse lacks
+        assert grid["EMP001"] == [("Pending", 5400), ("Not Submitted", 0)]
+        assert grid["EMP002"] == [("Not Submitted", 0), ("Not Submitted", 7200)]
+        assert grid["EMP404"] == [("Not Submitted", 0), ("Not Submitted", 0)]
+
+        calls = history.dv_calls
+        assert store.week_grid(["EMP001"], [WEEK])["EMP001"] == [("Pending", 5400)]
+        assert history.dv_calls == calls                                   # covered: no reload
+
+        restarted = _store(os.path.join(base, "rollups.npz"), _History())  # another worker / restart
+        assert restarted.week_grid(["EMP002"], [NEXT_WEEK])["EMP002"] == [("Not Submitted", 7200)]
+    finally:
+        shutil.rmtree(base)
+
+
+def test_updates_are_journaled_and_seen_by_other_workers():
+    base = tempfile.mkdtemp(prefix="ts_rollup_")
+    try:
+        path = os.path.join(base, "rollups.npz")
+        history = _History()
+        writer = _store(path, history)
+        reader = _store(path, history)
+        writer.week_grid(["EMP001"], [WEEK])
+        npz_mtime = os.stat(path).st_mtime_ns
+
+        writer.add_seconds("EMP001", "2026-03-05", 900, dataverse_saved=True)
+        writer.record_status("EMP001", "2026-03-05", "Accepted")
+        assert os.stat(path).st_mtime_ns == npz_mtime                     # appended, .npz not rewritten
+        assert reader.week_grid(["EMP001"], [WEEK])["EMP001"] == [("Accepted", 6300)]
+
+        history.dv.append(("EMP001", "2026-03-06", 600))
+        reader.invalidate("EMP001", "2026-03-02", "2026-03-08")
+        assert writer.week_grid(["EMP001"], [WEEK])["EMP001"] == [("Accepted", 6000)]
+
+        # A torn last line (a worker mid-append) is left until it is complete
+        with open(writer.journal_path, "ab") as f:
+            f.write(b'["add","EMP001","2026-03-05",100,')
+        assert reader.week_grid(["EMP001"], [WEEK])["EMP001"] == [("Accepted", 6000)]
+        with open(writer.journal_path, "ab") as f:
+            f.write(b'true]\n')
+        assert reader.week_grid(["EMP001"], [WEEK])["EMP001"] == [("Accepted", 6100)]
+    finally:
+        shutil.rmtree(base)
+
+
+def test_journal_is_compacted_once_large():
+    base = tempfile.mkdtemp(prefix="ts_rollup_")
+    try:
+        path = os.path.join(base, "rollups.npz")
+        history = _History()
+        writer = _store(path, history, journal_max_bytes=2048)
+        reader = _store(path, history, journal_max_bytes=2048)
+        writer.week_grid(["EMP001"], [WEEK])
+        reader.week_grid(["EMP001"], [WEEK])
+        for _ in range(100):
+            writer.add_seconds("EMP001", "2026-03-05", 10, dataverse_saved=True)
+        assert os.path.getsize(writer.journal_path) <= 2048 + 64
+        assert reader.week_grid(["EMP001"], [WEEK])["EMP001"] == [("Pending", 6400)]
+
+        # Crash after the .npz was replaced but before the journal was reset: nothing is applied twice
+        with open(writer.journal_path, "rb") as f:
+            journal = f.read()
+        writer._save()
+        with open(writer.journal_path, "wb") as f:
+            f.write(journal)
+        restarted = _store(path, history, journal_max_bytes=2048)
+        assert restarted.week_grid(["EMP001"], [WEEK])["EMP001"] == [("Pending", 6400)]
+    finally:
+        shutil.rmtree(base)
+
+
+def test_reject_does_not_clobber_an_accepted_submission():
+    base = tempfile.mkdtemp(prefix="ts_rollup_")
+    try:
+        history = _History()
+        store = _store(os.path.join(base, "rollups.npz"), history)
+        store.week_grid(["EMP001"], [WEEK])
+        store.record_status("EMP001", "2026-03-03", "Accepted")
+        store.record_status("EMP001", "2026-03-05", "Pending")
+        assert store.week_grid(["EMP001"], [WEEK])["EMP001"][0][0] == "Accepted"
+
+        # The Pending submission is rejected; the week still holds an accepted one
+        store.set_week_status("EMP001", "2026-03-05", ["Accepted", "Rejected"])
+        assert store.week_grid(["EMP001"], [WEEK])["EMP001"][0][0] == "Accepted"
+        store.set_week_status("EMP001", "2026-03-05", ["Rejected"])
+        assert store.week_grid(["EMP001"], [WEEK])["EMP001"][0][0] == "Rejected"
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == "__main__":
+    for fn in (test_build_and_read_week_grid, test_updates_are_journaled_and_seen_by_other_workers,
+               test_journal_is_compacted_once_large, test_reject_does_not_clobber_an_accepted_submission):
+        fn()
+        print(f"[OK] {fn.__name__}")
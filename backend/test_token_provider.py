@@ -0,0 +1,75 @@
+"""
+Offline test for the shared token provider (token_provider.py).
+Uses a fake fetcher instead of AAD - no credentials needed.
+
+Run: python test_token_provider.py   (or via pytest)
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+from token_provider import TokenProvider
+
+
+class FakeFetcher:
+    def __init__(self, expires_in=3600, delay=0.05):
+        self.calls = 0
+        self.expires_in = expires_in
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        time.sleep(self.delay)
+        with self._lock:
+            self.calls += 1
+            return f"token-{self.calls}", self.expires_in
+
+
+def test_single_flight():
+    fetcher = FakeFetcher()
+    provider = TokenProvider(fetcher, cache_path=None)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(provider.get_token())) for _ in range(25)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    provider.stop()
+    assert fetcher.calls == 1, f"expected one AAD call, got {fetcher.calls}"
+    assert set(results) == {"token-1"}
+
+
+def test_shared_across_workers():
+    path = os.path.join(tempfile.mkdtemp(), "token.json")
+    fetcher = FakeFetcher()
+    worker_a = TokenProvider(fetcher, cache_path=path)
+    worker_b = TokenProvider(fetcher, cache_path=path)
+    assert worker_a.get_token() == "token-1"
+    assert worker_b.get_token() == "token-1", "second worker must reuse the on-disk token"
+    assert fetcher.calls == 1
+    assert oct(os.stat(path).st_mode & 0o777) == "0o600"
+
+    worker_a.invalidate()
+    worker_b._token = None
+    assert worker_b.get_token() == "token-2"
+    worker_a.stop()
+    worker_b.stop()
+
+
+def test_proactive_renewal():
+    # Token lives 3s; renewal is due 2s before expiry, so the renewer fetches ~1s in
+    fetcher = FakeFetcher(expires_in=3, delay=0)
+    provider = TokenProvider(fetcher, cache_path=None, refresh_margin=1, renew_margin=2)
+    assert provider.get_token() == "token-1"
+    time.sleep(1.6)
+    assert fetcher.calls >= 2, "background renewer should have refreshed ahead of expiry"
+    assert provider.get_token() != "token-1"
+    provider.stop()
+
+
+if __name__ == "__main__":
+    for fn in (test_single_flight, test_shared_across_workers, test_proactive_renewal):
+        fn()
+        print(f"[OK] {fn.__name__}")
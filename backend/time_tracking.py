@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from datetime import datetime, timezone, timedelta
 import os, json, traceback, re
 from dataverse_helper import get_access_token, update_record, create_record, get_employee_name, get_dataverse_session
+from timesheet_rollups import get_store as get_timesheet_rollups, week_start as _rollup_week_start
 import requests
 import urllib.parse
 
@@ -398,6 +399,82 @@ def _split_session_by_day(start_ms: int, end_ms: int, tz_offset_minutes: int = 0
     return segments
 
 
+# ---------- Timesheet monitor rollups (see timesheet_rollups.py) ----------
+def _rollup_dv_rows(start_date, end_date, employee_id=None):
+    """Yield (employee_id, work_date, seconds) from Dataverse timesheet logs, following paging."""
+    token = get_access_token()
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/json",
+        "OData-Version": "4.0",
+        "Prefer": 'odata.include-annotations="*",odata.maxpagesize=5000',
+    }
+    parts = [f"crc6f_workdate ge '{start_date}'", f"crc6f_workdate le '{end_date}'"]
+    if employee_id:
+        safe_emp = str(employee_id).replace("'", "''")
+        parts.append(f"crc6f_employeeid eq '{safe_emp}'")
+    url = (
+        f"{RESOURCE}{DV_API}/crc6f_hr_timesheetlogs"
+        f"?$filter={' and '.join(parts)}"
+        "&$select=crc6f_employeeid,crc6f_workdate,crc6f_hoursworked"
+    )
+    while url:
+        resp = get_dataverse_session().get(url, headers=headers, timeout=30)
+        if resp.status_code != 200:
+            raise Exception(f"timesheet log fetch failed ({resp.status_code}): {resp.text[:200]}")
+        data = resp.json()
+        for r in data.get("value", []):
+            eid = str(r.get("crc6f_employeeid") or "").strip().upper()
+            wd = _safe_date_part(r.get("crc6f_workdate"))
+            if not eid or not wd:
+                continue
+            secs = _hoursworked_to_seconds(
+                r.get("crc6f_hoursworked", 0),
+                r.get("crc6f_hoursworked@OData.Community.Display.V1.FormattedValue"),
+            )
+            yield eid, wd, secs
+        url = data.get("@odata.nextLink")
+
+
+def _rollup_local_rows(start_date, end_date, employee_id=None):
+    """Yield (employee_id, work_date, seconds) from the local timesheet log cache."""
+    emp_up = str(employee_id or "").strip().upper()
+    for r in _read_logs():
+        eid = str(r.get("employee_id") or "").strip().upper()
+        wd = _safe_date_part(r.get("work_date"))
+        if not eid or not wd or not (start_date <= wd <= end_date):
+            continue
+        if emp_up and eid != emp_up:
+            continue
+        try:
+            secs = int(r.get("seconds") or 0)
+        except Exception:
+            continue
+        if secs > 0:
+            yield eid, wd, secs
+
+
+def _rollup_status_rows():
+    """Yield (employee_id, date, status) for every timesheet submission."""
+    for s in _read_ts_entries():
+        eid = str(s.get("employee_id") or "").strip().upper()
+        d = _safe_date_part(s.get("date"))
+        if eid and d:
+            yield eid, d, s.get("status")
+
+
+get_timesheet_rollups().configure(
+    dv_loader=_rollup_dv_rows,
+    local_loader=_rollup_local_rows,
+    status_loader=_rollup_status_rows,
+)
+
+
+def rebuild_timesheet_rollups(start_date, end_date):
+    """Recompute the admin monitor rollups for [start_date, end_date] from history."""
+    return get_timesheet_rollups().rebuild(start_date, end_date)
+
+
 # ---------- Tasks proxy for My Tasks (Dataverse) ----------
 @bp_time.route("/tasks", methods=["GET"])
 def proxy_tasks():
@@ -560,6 +637,7 @@ def delete_logs_row():
 
     _write_logs(filtered)
     local_deleted = before - len(filtered)
+    get_timesheet_rollups().invalidate(employee_id, start_date, end_date)
 
     return jsonify({
         "success": True,
@@ -811,6 +889,9 @@ def set_exact_log():
             except Exception as local_cleanup_err:
                 print(f"[TEAM_TS_EDIT] Local cache cleanup warning: {local_cleanup_err}")
 
+        # Exact edits replace an unknown previous value; recompute the day on next monitor read
+        get_timesheet_rollups().invalidate(employee_id, work_date)
+
         return jsonify({
             "success": True,
             "log": {
@@ -1490,6 +1571,7 @@ def create_task_log():
                 logs.append(rec_local)
                 print(f"[TIME_TRACKER] Inserted new local log: {employee_id} {task_id} {seg_work_date} -> {seg_seconds}s")
             _write_logs(logs)
+            get_timesheet_rollups().add_seconds(employee_id, seg_work_date, seg_seconds, dataverse_saved=dataverse_saved)
             
             return rec_local, dataverse_saved, dataverse_error
 
@@ -1742,18 +1824,38 @@ def delete_logs():
         }
         
         if log_id:
+            # Remember employee/day of the row so the monitor rollup can be refreshed
+            logs = _read_logs()
+            rollup_target = next(
+                (
+                    (r.get("employee_id"), r.get("work_date")) for r in logs
+                    if str(r.get("id") or "") == log_id or str(r.get("dv_id") or "") == log_id
+                ),
+                None,
+            )
+            if not rollup_target:
+                try:
+                    row_url = f"{RESOURCE}{DV_API}/crc6f_hr_timesheetlogs({log_id})?$select=crc6f_employeeid,crc6f_workdate"
+                    row_resp = get_dataverse_session().get(row_url, headers=headers, timeout=30)
+                    if row_resp.status_code == 200:
+                        row = row_resp.json()
+                        rollup_target = (row.get("crc6f_employeeid"), row.get("crc6f_workdate"))
+                except Exception:
+                    rollup_target = None
+
             # Direct delete by ID
             url = f"{RESOURCE}{DV_API}/crc6f_hr_timesheetlogs({log_id})"
             resp = get_dataverse_session().delete(url, headers=headers, timeout=30)
             
             if resp.status_code in (200, 204):
                 # Also delete from local cache
-                logs = _read_logs()
                 logs = [
                     r for r in logs
                     if str(r.get("id") or "") != log_id and str(r.get("dv_id") or "") != log_id
                 ]
                 _write_logs(logs)
+                if rollup_target and rollup_target[0] and _safe_date_part(rollup_target[1]):
+                    get_timesheet_rollups().invalidate(rollup_target[0], _safe_date_part(rollup_target[1]))
                 return jsonify({"success": True, "deleted": 1, "source": "dataverse"}), 200
             else:
                 return jsonify({"success": False, "error": f"Dataverse delete failed: {resp.status_code}"}), 400
@@ -1774,6 +1876,7 @@ def delete_logs():
                 ((project_id and r.get("project_id") == project_id) or (task_guid and r.get("task_guid") == task_guid))
             )]
             _write_logs(logs)
+            get_timesheet_rollups().invalidate(employee_id, _safe_date_part(work_date))
             return jsonify({"success": True, "deleted": before - len(logs), "source": "local"}), 200
             
     except Exception as e:
@@ -1848,10 +1951,14 @@ def _update_timesheet_status(entry_id, new_status, comment=None, decided_by=None
 def admin_timesheet_monitor():
     """Return per-employee, per-week submission status + hours logged for a month.
 
+    Served from the precomputed rollups in timesheet_rollups.py; raw logs are
+    only read when the requested range has never been built.
+
     Accepts employee list from POST body (preferred) or fetches from Dataverse.
     Query params:
-      - month (1-12, default current)
-      - year  (e.g. 2026, default current)
+      - month  (1-12, default current)
+      - year   (e.g. 2026, default current)
+      - months (1-12, default 1) number of consecutive months starting at month/year
     POST body (optional JSON):
       - employees: [{ "employee_id": "EMP001", "name": "First Last" }, ...]
     """
@@ -1862,10 +1969,17 @@ def admin_timesheet_monitor():
         year = int(request.args.get("year") or now.year)
         if month < 1 or month > 12:
             month = now.month
+        try:
+            months = min(12, max(1, int(request.args.get("months") or 1)))
+        except (TypeError, ValueError):
+            months = 1
 
-        # ── 1. Compute weeks (Mon-Sun) that overlap with the month ──
+        # ── 1. Compute weeks (Mon-Sun) that overlap with the month range ──
         first_day = datetime(year, month, 1).date()
-        last_day = datetime(year, month, calendar.monthrange(year, month)[1]).date()
+        end_month_idx = (year * 12 + month - 1) + (months - 1)
+        end_year, end_month = divmod(end_month_idx, 12)
+        end_month += 1
+        last_day = datetime(end_year, end_month, calendar.monthrange(end_year, end_month)[1]).date()
 
         # Go back to Monday of the week containing the 1st
         start = first_day - timedelta(days=first_day.weekday())  # weekday(): Mon=0
@@ -1879,9 +1993,6 @@ def admin_timesheet_monitor():
             })
             start = start + timedelta(days=7)
 
-        month_start = weeks[0]["start"] if weeks else first_day.isoformat()
-        month_end = weeks[-1]["end"] if weeks else last_day.isoformat()
-
         # ── 2. Get employees from POST body (sent by frontend) ──
         employees = []
         body = {}
@@ -1903,117 +2014,20 @@ def admin_timesheet_monitor():
             employees.append({"id": eid, "name": name})
 
         if not employees:
-            return jsonify({"success": True, "weeks": weeks, "employees": [], "month": month, "year": year}), 200
-
-        emp_ids = {e["id"].upper() for e in employees}
-
-        # ── 3. Read timesheet submissions (local JSON) ──
-        submissions = _read_ts_entries()
+            return jsonify({"success": True, "weeks": weeks, "employees": [], "month": month, "year": year, "months": months}), 200
 
-        # Build a mapping: employee_id (upper) -> week_start -> best status
-        # Priority: Accepted > Rejected > Pending > (nothing)
-        status_priority = {"accepted": 3, "rejected": 2, "pending": 1}
-        sub_map = {}  # { "EMP001": { "2026-03-30": "Pending" } }
-        for s in submissions:
-            eid = str(s.get("employee_id") or "").strip().upper()
-            if eid not in emp_ids:
-                continue
-            date_str = str(s.get("date") or "")[:10]
-            if not date_str:
-                continue
-            try:
-                d = datetime.strptime(date_str, "%Y-%m-%d").date()
-            except Exception:
-                continue
-            # Find week_start (Monday)
-            ws = (d - timedelta(days=d.weekday())).isoformat()
-
-            status_raw = str(s.get("status") or "").strip()
-            status_lc = status_raw.lower()
-
-            if eid not in sub_map:
-                sub_map[eid] = {}
-            existing = sub_map[eid].get(ws, "")
-            existing_pri = status_priority.get(existing.lower(), 0)
-            new_pri = status_priority.get(status_lc, 0)
-            if new_pri > existing_pri:
-                sub_map[eid][ws] = status_raw.capitalize() if status_raw else ""
-
-        # ── 4. Fetch timesheet logs for the full month range (Dataverse) ──
-        hours_map = {}  # { "EMP001": { "2026-03-30": total_seconds } }
-        try:
-            token = get_access_token()
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Accept": "application/json",
-                "OData-Version": "4.0",
-                "Prefer": 'odata.include-annotations="*"',
-            }
-            filter_q = f"crc6f_workdate ge '{month_start}' and crc6f_workdate le '{month_end}'"
-            logs_url = (
-                f"{RESOURCE}{DV_API}/crc6f_hr_timesheetlogs"
-                f"?$filter={filter_q}"
-                "&$select=crc6f_employeeid,crc6f_workdate,crc6f_hoursworked"
-                "&$top=5000"
-            )
-            logs_resp = get_dataverse_session().get(logs_url, headers=headers, timeout=30)
-            if logs_resp.status_code == 200:
-                for r in logs_resp.json().get("value", []):
-                    eid = str(r.get("crc6f_employeeid") or "").strip().upper()
-                    wd = str(r.get("crc6f_workdate") or "")[:10]
-                    if not eid or not wd:
-                        continue
-                    try:
-                        d = datetime.strptime(wd, "%Y-%m-%d").date()
-                    except Exception:
-                        continue
-                    ws = (d - timedelta(days=d.weekday())).isoformat()
-                    secs = _hoursworked_to_seconds(
-                        r.get("crc6f_hoursworked", 0),
-                        r.get("crc6f_hoursworked@OData.Community.Display.V1.FormattedValue"),
-                    )
-                    if eid not in hours_map:
-                        hours_map[eid] = {}
-                    hours_map[eid][ws] = hours_map[eid].get(ws, 0) + secs
-        except Exception as log_err:
-            print(f"[TS-MONITOR] Log fetch error: {log_err}")
-
-        # Also merge local logs as fallback
-        try:
-            local_logs = _read_logs()
-            for r in local_logs:
-                eid = str(r.get("employee_id") or "").strip().upper()
-                wd = str(r.get("work_date") or "")[:10]
-                if not eid or not wd or eid not in emp_ids:
-                    continue
-                try:
-                    d = datetime.strptime(wd, "%Y-%m-%d").date()
-                except Exception:
-                    continue
-                if d < datetime.strptime(month_start, "%Y-%m-%d").date() or d > datetime.strptime(month_end, "%Y-%m-%d").date():
-                    continue
-                ws = (d - timedelta(days=d.weekday())).isoformat()
-                secs = int(r.get("seconds") or 0)
-                if secs <= 0:
-                    continue
-                # Only add if not already covered by Dataverse
-                if eid in hours_map and ws in hours_map[eid]:
-                    continue
-                if eid not in hours_map:
-                    hours_map[eid] = {}
-                hours_map[eid][ws] = hours_map[eid].get(ws, 0) + secs
-        except Exception:
-            pass
-
-        # ── 5. Build response ──
+        # ── 3. Status + seconds per (employee, week) from the rollup store ──
+        # Status priority Accepted > Rejected > Pending; Dataverse hours win over
+        # the local log cache for any week that has them.
         week_starts = [w["start"] for w in weeks]
+        grid = get_timesheet_rollups().week_grid([e["id"] for e in employees], week_starts)
+
+        # ── 4. Build response ──
         result_employees = []
         for emp in employees:
-            eid_up = emp["id"].upper()
+            cells = grid.get(emp["id"].upper()) or []
             emp_weeks = []
-            for ws in week_starts:
-                status = (sub_map.get(eid_up) or {}).get(ws, "Not Submitted")
-                seconds = (hours_map.get(eid_up) or {}).get(ws, 0)
+            for ws, (status, seconds) in zip(week_starts, cells):
                 hours = round(seconds / 3600, 2) if seconds else 0
                 emp_weeks.append({
                     "week_start": ws,
@@ -2031,6 +2045,7 @@ def admin_timesheet_monitor():
             "success": True,
             "month": month,
             "year": year,
+            "months": months,
             "weeks": weeks,
             "employees": result_employees,
         }), 200
@@ -2041,6 +2056,25 @@ def admin_timesheet_monitor():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@bp_time.route("/admin/timesheet-monitor/rebuild", methods=["POST"])
+def admin_timesheet_monitor_rebuild():
+    """Recompute monitor rollups from history.
+
+    Body (optional JSON): { "from": "YYYY-MM-DD", "to": "YYYY-MM-DD" } (default: last 12 months)
+    """
+    try:
+        body = request.get_json(force=True, silent=True) or {}
+        today = datetime.now().date()
+        start_date = _safe_date_part(body.get("from")) or (today - timedelta(days=365)).isoformat()
+        end_date = _safe_date_part(body.get("to")) or today.isoformat()
+        result = rebuild_timesheet_rollups(start_date, end_date)
+        return jsonify({"success": True, **result}), 200
+    except Exception as e:
+        print(f"[TS-MONITOR] Rebuild error: {e}")
+        traceback.print_exc()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @bp_time.route("/time-tracker/timesheet/submit", methods=["POST"])
 def submit_timesheet():
     """Create Pending timesheet submissions from the My Timesheet page.
@@ -2116,6 +2150,9 @@ def submit_timesheet():
             return jsonify({"success": False, "error": "No valid entries to submit"}), 400
 
         _write_ts_entries(entries)
+        rollups = get_timesheet_rollups()
+        for rec in created:
+            rollups.record_status(employee_id, rec["date"], "Pending")
         return jsonify({"success": True, "items": created, "count": len(created)}), 201
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -2158,6 +2195,29 @@ def list_timesheet_submissions():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+def _refresh_week_status(updated, entries):
+    """Re-derive the monitor's week status from the submissions now in that week.
+
+    Only the entries _update_timesheet_status matched changed; others in the
+    same rollup week (e.g. a differently cased employee ID) keep theirs.
+    """
+    eid = str(updated.get("employee_id") or "").strip().upper()
+    try:
+        week = _rollup_week_start(updated.get("date"))
+    except Exception:
+        return
+    statuses = []
+    for rec in entries:
+        if str(rec.get("employee_id") or "").strip().upper() != eid:
+            continue
+        try:
+            if _rollup_week_start(rec.get("date")) == week:
+                statuses.append(rec.get("status"))
+        except Exception:
+            continue
+    get_timesheet_rollups().set_week_status(eid, week, statuses)
+
+
 @bp_time.route("/time-tracker/timesheet/<entry_id>/approve", methods=["POST"])
 def approve_timesheet(entry_id):
     """Approve a pending timesheet submission."""
@@ -2167,6 +2227,7 @@ def approve_timesheet(entry_id):
         updated, _entries = _update_timesheet_status(entry_id, "Accepted", comment=None, decided_by=decided_by)
         if not updated:
             return jsonify({"success": False, "error": "Entry not found"}), 404
+        _refresh_week_status(updated, _entries)
         return jsonify({"success": True, "item": updated}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -2182,6 +2243,7 @@ def reject_timesheet(entry_id):
         updated, _entries = _update_timesheet_status(entry_id, "Rejected", comment=comment, decided_by=decided_by)
         if not updated:
             return jsonify({"success": False, "error": "Entry not found"}), 404
+        _refresh_week_status(updated, _entries)
         return jsonify({"success": True, "item": updated}), 200
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -0,0 +1,513 @@
+# timesheet_rollups.py - Precomputed (employee, ISO week) rollups for the admin timesheet monitor
+#
+# admin_timesheet_monitor used to pull every timesheet log + submission for the
+# month and loop over them on each request. This store keeps the same
+# aggregates as dense NumPy arrays so month (or 12-month) grids are a slice and
+# a reshape:
+#   - seconds:  employee x day  (Dataverse logs and local-cache logs kept apart
+#               so the monitor's "Dataverse first, local fallback" rule holds)
+#   - status:   employee x ISO week  (0 none, 1 Pending, 2 Rejected, 3 Accepted)
+#
+# Writers in time_tracking update the store incrementally. When a writer cannot
+# know the exact delta (exact edits, deletes) it marks the employee/day range
+# dirty and the next read recomputes only those cells via the loaders that
+# time_tracking registers with configure().
+#
+# Incremental writes are not saved by rewriting the .npz: each one appends a
+# small JSON op to ROLLUP_FILE.journal under the file lock, and every worker
+# replays the ops it has not seen yet before reading or writing. Past
+# ROLLUP_JOURNAL_MAX_BYTES the journal is folded into the .npz and truncated.
+#
+# Rebuild from history:  python timesheet_rollups.py --rebuild [--from YYYY-MM-DD] [--to YYYY-MM-DD]
+
+import io
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows dev boxes: in-process lock only
+    fcntl = None
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "_data")
+ROLLUP_FILE = os.path.join(DATA_DIR, "timesheet_rollups.npz")
+ROLLUP_LOCK_FILE = ROLLUP_FILE + ".lock"
+ROLLUP_JOURNAL_MAX_BYTES = int(os.getenv("ROLLUP_JOURNAL_MAX_BYTES", str(256 * 1024)))
+
+# Extra weeks allocated whenever the day axis has to grow forward
+GROW_WEEKS = 26
+
+STATUS_CODES = {"pending": 1, "rejected": 2, "accepted": 3}
+STATUS_LABELS = {1: "Pending", 2: "Rejected", 3: "Accepted"}
+
+os.makedirs(DATA_DIR, exist_ok=True)
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value or "").strip()[:10], "%Y-%m-%d").date()
+
+
+def week_start(value):
+    """Monday of the ISO week containing value."""
+    d = _to_date(value)
+    return d - timedelta(days=d.weekday())
+
+
+class _FileLock:
+    """Cross-worker advisory lock (fcntl) layered on an in-process RLock."""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._fh = None
+        self._depth = 0
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._fh = open(self.path, "a+")
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX)
+            except Exception:
+                self._fh = None
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fh is not None:
+            try:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+                self._fh.close()
+            except Exception:
+                pass
+            self._fh = None
+        self._thread_lock.release()
+        return False
+
+
+class TimesheetRollupStore:
+    def __init__(self, path=ROLLUP_FILE, journal_max_bytes=ROLLUP_JOURNAL_MAX_BYTES):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.journal_max_bytes = journal_max_bytes
+        self._lock = _FileLock(path + ".lock")
+        self._loaded_mtime = None
+        self._journal_id = None         # journal whose ops up to _journal_offset are applied
+        self._journal_offset = 0
+        self._dv_loader = None
+        self._local_loader = None
+        self._status_loader = None
+        self._reset()
+
+    # ---------- state ----------
+    def _reset(self):
+        self.origin = week_start(date.today()) - timedelta(weeks=GROW_WEEKS)
+        self.emp_index = {}
+        self.dv_seconds = np.zeros((0, GROW_WEEKS * 14), dtype=np.int32)
+        self.local_seconds = np.zeros((0, GROW_WEEKS * 14), dtype=np.int32)
+        self.status = np.zeros((0, GROW_WEEKS * 2), dtype=np.int8)
+        self.covered_from = None
+        self.covered_to = None
+        self.dirty = []
+
+    def configure(self, dv_loader=None, local_loader=None, status_loader=None):
+        """Register history loaders.
+
+        dv_loader(start, end, employee_id=None) / local_loader(...) return an
+        iterable of (employee_id, work_date, seconds); dv_loader may raise when
+        Dataverse is unreachable. status_loader() returns (employee_id, date, status).
+        """
+        self._dv_loader = dv_loader
+        self._local_loader = local_loader
+        self._status_loader = status_loader
+
+    def _file_mtime(self):
+        # Inode too: every save is an os.replace, so a new file is always noticed
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def _maybe_reload(self):
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self._loaded_mtime:
+            self._load(mtime)
+        self._replay_journal()
+
+    def _load(self, mtime):
+        self._journal_id, self._journal_offset = None, 0
+        try:
+            with np.load(self.path, allow_pickle=False) as z:
+                meta = json.loads(str(z["meta"]))
+                self.dv_seconds = z["dv_seconds"].astype(np.int32)
+                self.local_seconds = z["local_seconds"].astype(np.int32)
+                self.status = z["status"].astype(np.int8)
+            self.origin = _to_date(meta["origin"])
+            self.emp_index = {eid: i for i, eid in enumerate(meta.get("employees") or [])}
+            self.covered_from = _to_date(meta["covered_from"]) if meta.get("covered_from") else None
+            self.covered_to = _to_date(meta["covered_to"]) if meta.get("covered_to") else None
+            self.dirty = [tuple(x) for x in (meta.get("dirty") or [])]
+            # The .npz already contains this much of that journal (it may outlive a crash mid-compaction)
+            self._journal_id = meta.get("journal_id")
+            self._journal_offset = int(meta.get("journal_offset") or 0)
+            self._loaded_mtime = mtime
+        except Exception as e:
+            print(f"[TS-ROLLUP] Could not load {self.path}, starting empty: {e}")
+            self._reset()
+            self._loaded_mtime = mtime
+
+    def _save(self):
+        employees = [None] * len(self.emp_index)
+        for eid, i in self.emp_index.items():
+            employees[i] = eid
+        meta = {
+            "origin": self.origin.isoformat(),
+            "employees": employees,
+            "covered_from": self.covered_from.isoformat() if self.covered_from else None,
+            "covered_to": self.covered_to.isoformat() if self.covered_to else None,
+            "dirty": [list(x) for x in self.dirty],
+            "journal_id": self._journal_id,
+            "journal_offset": self._journal_offset,
+            "saved_at": datetime.now().isoformat(),
+        }
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf,
+            meta=np.array(json.dumps(meta)),
+            dv_seconds=self.dv_seconds,
+            local_seconds=self.local_seconds,
+            status=self.status,
+        )
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf.getvalue())
+        os.replace(tmp, self.path)
+        self._loaded_mtime = self._file_mtime()
+        self._new_journal()
+
+    # ---------- journal ----------
+    def _new_journal(self):
+        """Start an empty journal; its first line is an id so stale offsets are never applied to it."""
+        header = (json.dumps(["journal", os.urandom(8).hex()]) + "\n").encode("utf-8")
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+        os.replace(tmp, self.journal_path)
+        self._journal_id = json.loads(header)[1]
+        self._journal_offset = len(header)
+
+    def _replay_journal(self):
+        """Apply ops appended (by any worker) since this store last looked."""
+        try:
+            with open(self.journal_path, "rb") as f:
+                header = f.readline()
+                if not header.endswith(b"\n"):
+                    return
+                journal_id = json.loads(header)[1]
+                if journal_id != self._journal_id:
+                    self._journal_id, self._journal_offset = journal_id, len(header)
+                f.seek(self._journal_offset)
+                data = f.read()
+        except (FileNotFoundError, ValueError, IndexError):
+            return
+        end = data.rfind(b"\n") + 1     # a torn last line is left for later
+        for line in data[:end].splitlines():
+            try:
+                self._apply(json.loads(line))
+            except Exception as e:
+                print(f"[TS-ROLLUP] Skipping bad journal op: {e}")
+        self._journal_offset += end
+
+    def _log(self, op):
+        """Apply op and persist it: one appended line, or a compaction once the journal is large."""
+        self._apply(op)
+        if self._journal_id is None or not os.path.exists(self.journal_path):
+            self._new_journal()
+        line = (json.dumps(op, separators=(",", ":")) + "\n").encode("utf-8")
+        with open(self.journal_path, "ab") as f:
+            f.write(line)
+        self._journal_offset += len(line)
+        if self._journal_offset > self.journal_max_bytes:
+            self._save()
+
+    def _apply(self, op):
+        kind = op[0]
+        if kind == "journal":
+            return
+        if kind == "add":
+            _, eid, work_date, secs, dataverse_saved = op
+            col = self._day(work_date)
+            row = self._row(eid)
+            if row is None:
+                return
+            self.local_seconds[row, col] += secs
+            if dataverse_saved:
+                self.dv_seconds[row, col] += secs
+        elif kind == "dirty":
+            key = (op[1], op[2], op[3])
+            if key not in self.dirty:
+                self.dirty.append(key)
+        elif kind == "status":
+            _, eid, week, code, replace = op
+            col = self._day(week)
+            row = self._row(eid)
+            if row is None:
+                return
+            wk = col // 7
+            self.status[row, wk] = code if replace else max(int(self.status[row, wk]), code)
+
+    # ---------- axis management ----------
+    def _row(self, employee_id, create=True):
+        eid = str(employee_id or "").strip().upper()
+        if not eid:
+            return None
+        row = self.emp_index.get(eid)
+        if row is None and create:
+            row = len(self.emp_index)
+            self.emp_index[eid] = row
+            self.dv_seconds = np.vstack([self.dv_seconds, np.zeros((1, self.dv_seconds.shape[1]), dtype=np.int32)])
+            self.local_seconds = np.vstack([self.local_seconds, np.zeros((1, self.local_seconds.shape[1]), dtype=np.int32)])
+            self.status = np.vstack([self.status, np.zeros((1, self.status.shape[1]), dtype=np.int8)])
+        return row
+
+    def _day(self, value):
+        """Day column for value, growing the day axis (in whole weeks) if needed."""
+        d = _to_date(value)
+        if d < self.origin:
+            new_origin = week_start(d)
+            pad_weeks = (self.origin - new_origin).days // 7
+            self.dv_seconds = np.pad(self.dv_seconds, ((0, 0), (pad_weeks * 7, 0)))
+            self.local_seconds = np.pad(self.local_seconds, ((0, 0), (pad_weeks * 7, 0)))
+            self.status = np.pad(self.status, ((0, 0), (pad_weeks, 0)))
+            self.origin = new_origin
+        col = (d - self.origin).days
+        if col >= self.dv_seconds.shape[1]:
+            extra_weeks = (col - self.dv_seconds.shape[1]) // 7 + 1 + GROW_WEEKS
+            self.dv_seconds = np.pad(self.dv_seconds, ((0, 0), (0, extra_weeks * 7)))
+            self.local_seconds = np.pad(self.local_seconds, ((0, 0), (0, extra_weeks * 7)))
+            self.status = np.pad(self.status, ((0, 0), (0, extra_weeks)))
+        return col
+
+    # ---------- incremental writers ----------
+    def add_seconds(self, employee_id, work_date, seconds, dataverse_saved=True):
+        """create_task_log: add a segment to the local cache and (if saved) the Dataverse view."""
+        try:
+            secs = int(seconds or 0)
+            if secs == 0:
+                return
+            eid = str(employee_id or "").strip().upper()
+            if not eid:
+                return
+            with self._lock:
+                self._maybe_reload()
+                self._log(["add", eid, _to_date(work_date).isoformat(), secs, bool(dataverse_saved)])
+        except Exception as e:
+            print(f"[TS-ROLLUP] add_seconds failed: {e}")
+
+    def invalidate(self, employee_id, start_date, end_date=None):
+        """Mark an employee/day range for recomputation on the next read."""
+        try:
+            eid = str(employee_id or "").strip().upper()
+            start = _to_date(start_date).isoformat()
+            end = _to_date(end_date or start_date).isoformat()
+            if end < start:
+                start, end = end, start
+            with self._lock:
+                self._maybe_reload()
+                self._log(["dirty", eid, start, end])
+        except Exception as e:
+            print(f"[TS-ROLLUP] invalidate failed: {e}")
+
+    def record_status(self, employee_id, any_date, status):
+        """A submission for the week containing any_date; the week keeps its
+        highest-priority status (Accepted > Rejected > Pending)."""
+        self._record_week(employee_id, any_date, [status], replace=False)
+
+    def set_week_status(self, employee_id, any_date, statuses):
+        """Replace the week's status with the one derived from every submission
+        status now in that week (after approve/reject changed some of them)."""
+        self._record_week(employee_id, any_date, statuses, replace=True)
+
+    def _record_week(self, employee_id, any_date, statuses, replace):
+        try:
+            eid = str(employee_id or "").strip().upper()
+            if not eid:
+                return
+            code = max((STATUS_CODES.get(str(s or "").strip().lower(), 0) for s in statuses), default=0)
+            with self._lock:
+                self._maybe_reload()
+                self._log(["status", eid, week_start(any_date).isoformat(), code, replace])
+        except Exception as e:
+            print(f"[TS-ROLLUP] record_status failed: {e}")
+
+    # ---------- rebuild ----------
+    def _fill(self, rows, target, start, end, employee_id=None):
+        for eid, work_date, secs in rows or []:
+            try:
+                d = _to_date(work_date)
+            except Exception:
+                continue
+            if d < start or d > end:
+                continue
+            if employee_id and str(eid or "").strip().upper() != employee_id:
+                continue
+            col = self._day(d)
+            row = self._row(eid)
+            if row is None:
+                continue
+            # Resolve the array after _day/_row, both of which may reallocate it
+            getattr(self, target)[row, col] += int(secs or 0)
+
+    def _recompute(self, start, end, employee_id=None):
+        """Recompute seconds for [start, end] (optionally one employee). Returns True if Dataverse loaded."""
+        dv_rows = None
+        dv_ok = False
+        if self._dv_loader:
+            try:
+                dv_rows = list(self._dv_loader(start.isoformat(), end.isoformat(), employee_id))
+                dv_ok = True
+            except Exception as e:
+                print(f"[TS-ROLLUP] Dataverse load failed for {start}..{end}: {e}")
+        local_rows = list(self._local_loader(start.isoformat(), end.isoformat(), employee_id)) if self._local_loader else []
+
+        c0 = self._day(start)
+        c1 = self._day(end) + 1
+        rows = slice(None)
+        if employee_id:
+            row = self._row(employee_id)
+            rows = slice(row, row + 1)
+        if dv_ok:
+            self.dv_seconds[rows, c0:c1] = 0
+            self._fill(dv_rows, "dv_seconds", start, end, employee_id)
+        self.local_seconds[rows, c0:c1] = 0
+        self._fill(local_rows, "local_seconds", start, end, employee_id)
+        return dv_ok
+
+    def _reload_status(self):
+        if not self._status_loader:
+            return
+        self.status[:, :] = 0
+        for eid, d, status in self._status_loader() or []:
+            code = STATUS_CODES.get(str(status or "").strip().lower(), 0)
+            if not code:
+                continue
+            try:
+                col = self._day(week_start(d))
+            except Exception:
+                continue
+            row = self._row(eid)
+            if row is None:
+                continue
+            wk = col // 7
+            self.status[row, wk] = max(int(self.status[row, wk]), code)
+
+    def rebuild(self, start_date, end_date):
+        """Recompute seconds and statuses for [start_date, end_date] from history."""
+        start = week_start(start_date)
+        end = week_start(end_date) + timedelta(days=6)
+        with self._lock:
+            self._maybe_reload()
+            dv_ok = self._recompute(start, end)
+            self._reload_status()
+            if dv_ok:
+                self.covered_from = start if not self.covered_from else min(self.covered_from, start)
+                self.covered_to = end if not self.covered_to else max(self.covered_to, end)
+            self._save()
+        print(f"[TS-ROLLUP] Rebuilt {start}..{end} for {len(self.emp_index)} employees (dataverse={'ok' if dv_ok else 'failed'})")
+        return {
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "employees": len(self.emp_index),
+            "dataverse_loaded": dv_ok,
+        }
+
+    def _refresh_dirty(self):
+        if not self.dirty:
+            return
+        remaining = []
+        for eid, start, end in self.dirty:
+            if not self._recompute(_to_date(start), _to_date(end), eid or None):
+                remaining.append((eid, start, end))
+        self.dirty = remaining
+        self._save()
+
+    # ---------- reads ----------
+    def week_grid(self, employee_ids, week_starts):
+        """Return {EMP_UPPER: [(status_label, seconds), ...]} aligned with week_starts.
+
+        Cells outside the covered range are rebuilt first; dirty cells are refreshed.
+        """
+        weeks = [week_start(ws) for ws in week_starts]
+        if not weeks:
+            return {}
+        first, last = weeks[0], weeks[-1] + timedelta(days=6)
+        with self._lock:
+            self._maybe_reload()
+            if self.covered_from is None or first < self.covered_from or last > self.covered_to:
+                lo = first if self.covered_from is None else min(first, self.covered_from)
+                hi = last if self.covered_to is None else max(last, self.covered_to)
+                self.rebuild(lo, hi)
+            self._refresh_dirty()
+
+            c0 = self._day(first)
+            c1 = self._day(last) + 1
+            n = len(self.emp_index)
+            dv = self.dv_seconds[:, c0:c1].reshape(n, -1, 7).sum(axis=2, dtype=np.int64)
+            local = self.local_seconds[:, c0:c1].reshape(n, -1, 7).sum(axis=2, dtype=np.int64)
+            # Dataverse is authoritative for a week; local cache only fills weeks it lacks
+            secs = np.where(dv > 0, dv, local)
+            status = self.status[:, c0 // 7:c1 // 7]
+            week_cols = [(w - first).days // 7 for w in weeks]
+
+            out = {}
+            for emp in employee_ids:
+                eid = str(emp or "").strip().upper()
+                row = self.emp_index.get(eid)
+                if row is None:
+                    out[eid] = [("Not Submitted", 0) for _ in weeks]
+                    continue
+                out[eid] = [
+                    (STATUS_LABELS.get(int(status[row, c]), "Not Submitted"), int(secs[row, c]))
+                    for c in week_cols
+                ]
+            return out
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = TimesheetRollupStore()
+    return _store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Timesheet monitor rollups")
+    parser.add_argument("--rebuild", action="store_true", help="recompute rollups from history")
+    parser.add_argument("--from", dest="start", default=None, help="YYYY-MM-DD (default: 12 months ago)")
+    parser.add_argument("--to", dest="end", default=None, help="YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+    else:
+        # Registers the Dataverse/local loaders on the shared store
+        from time_tracking import rebuild_timesheet_rollups
+
+        end = args.end or date.today().isoformat()
+        start = args.start or (date.today() - timedelta(days=365)).isoformat()
+        print(rebuild_timesheet_rollups(start, end))
@@ -0,0 +1,157 @@
+# token_provider.py - One client-credentials token for every module and worker
+#
+# dataverse_helper.get_access_token() is backed by a single TokenProvider:
+#   - in-process: one thread refreshes while the others wait for its result
+#     (single flight), instead of every request hitting AAD at expiry;
+#   - cross-worker: the token is shared through a small JSON file guarded by an
+#     fcntl lock, so gunicorn workers reuse each other's token;
+#   - proactive: a daemon thread renews the token RENEW_MARGIN seconds before it
+#     expires, so request threads rarely see a refresh at all.
+#
+# The cache file holds a bearer token; it is written 0600 and git-ignored.
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl  # POSIX only; Windows dev boxes fall back to the in-process lock
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_RENEW_MARGIN = int(os.getenv("TOKEN_RENEW_MARGIN", "600"))
+
+
+class TokenProvider:
+    def __init__(self, fetcher, cache_path=None, refresh_margin=TOKEN_REFRESH_MARGIN,
+                 renew_margin=TOKEN_RENEW_MARGIN, name="dataverse"):
+        """fetcher() returns (access_token, expires_in_seconds) and must bypass any cache of its own."""
+        self.fetcher = fetcher
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.renew_margin = max(renew_margin, refresh_margin)
+        self.name = name
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._renewer = None
+        self._stop = threading.Event()
+        self.fetch_count = 0
+
+    # ---------- shared on-disk cache ----------
+    @contextmanager
+    def _file_lock(self):
+        if not self.cache_path or fcntl is None:
+            yield
+            return
+        fh = None
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            fh = open(self.cache_path + ".lock", "a+")
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        except Exception as e:
+            print(f"[TOKEN] File lock unavailable ({e}); continuing with process lock only")
+        try:
+            yield
+        finally:
+            if fh is not None:
+                try:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+                    fh.close()
+                except Exception:
+                    pass
+
+    def _read_disk(self):
+        if not self.cache_path:
+            return None, 0.0
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data.get("access_token"), float(data.get("expires_at") or 0)
+        except Exception:
+            return None, 0.0
+
+    def _write_disk(self, token, expires_at):
+        if not self.cache_path:
+            return
+        tmp = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"access_token": token, "expires_at": expires_at}, f)
+            os.replace(tmp, self.cache_path)
+        except Exception as e:
+            print(f"[TOKEN] Could not persist token cache: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    # ---------- refresh ----------
+    def _valid(self, expires_at, margin):
+        return expires_at - margin > time.time()
+
+    def _refresh(self, margin):
+        """Caller holds self._lock. Reuse another worker's token if fresh enough, else fetch."""
+        with self._file_lock():
+            token, expires_at = self._read_disk()
+            if token and self._valid(expires_at, margin) and expires_at > self._expires_at:
+                self._token, self._expires_at = token, expires_at
+                return
+            token, expires_in = self.fetcher()
+            self.fetch_count += 1
+            expires_at = time.time() + int(expires_in or 3600)
+            self._token, self._expires_at = token, expires_at
+            self._write_disk(token, expires_at)
+            print(f"[TOKEN] Acquired new {self.name} token (valid {int(expires_in or 3600)}s)")
+
+    def get_token(self):
+        token, expires_at = self._token, self._expires_at
+        if token and self._valid(expires_at, self.refresh_margin):
+            return token
+        with self._lock:
+            if not (self._token and self._valid(self._expires_at, self.refresh_margin)):
+                self._refresh(self.refresh_margin)
+            token = self._token
+        self.start_renewer()
+        return token
+
+    def renew_if_due(self):
+        """Refresh ahead of expiry; returns seconds until the next renewal is due."""
+        with self._lock:
+            if not (self._token and self._valid(self._expires_at, self.renew_margin)):
+                self._refresh(self.renew_margin)
+            return max(1.0, self._expires_at - self.renew_margin - time.time())
+
+    def invalidate(self):
+        """Drop the token (e.g. after a 401) so the next call fetches a fresh one."""
+        with self._lock:
+            self._token, self._expires_at = None, 0.0
+            with self._file_lock():
+                self._write_disk(None, 0.0)
+
+    # ---------- background renewal ----------
+    def start_renewer(self):
+        if self._renewer is not None and self._renewer.is_alive():
+            return
+        with self._lock:
+            if self._renewer is not None and self._renewer.is_alive():
+                return
+            self._stop.clear()
+            self._renewer = threading.Thread(target=self._renew_loop, name=f"{self.name}-token-renewer", daemon=True)
+            self._renewer.start()
+
+    def _renew_loop(self):
+        delay = max(1.0, self._expires_at - self.renew_margin - time.time())
+        while not self._stop.wait(delay):
+            try:
+                delay = self.renew_if_due()
+            except Exception as e:
+                print(f"[TOKEN] Background renewal failed: {e}")
+                delay = 30.0
+
+    def stop(self):
+        self._stop.set()
@@ -1,5 +1,5 @@
 # unified_server.py - Combined Attendance & Leave Tracker Backend
-from flask import Flask, render_template, request, jsonify, current_app, redirect
+from flask import Flask, render_template, request, jsonify, current_app, redirect, Response, stream_with_context
 from flask_cors import CORS
 from datetime import datetime, timedelta, timezone, date
 from calendar import monthrange
@@ -10,13 +10,15 @@ import traceback
 import requests, re, base64
 import os
 import hashlib
+import io
+import csv
 import json
+import queue
+import threading
 import uuid
-import imaplib
-import email
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Tuple
 import jwt
-from email.header import decode_header
 from dotenv import load_dotenv
 
 # Load environment variables FIRST (before any os.getenv calls)
@@ -26,14 +28,12 @@ elif os.path.exists("id.env"):
     load_dotenv("id.env")
 load_dotenv()  # Also try .env in current directory
 
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from google_token_store import load_google_token, save_google_token
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from dataverse_helper import create_record, update_record, delete_record, get_access_token, get_employee_name, get_employee_email, get_record, get_dataverse_session
+from google_calendar_client import GoogleCalendarClient
+from dataverse_helper import create_record, update_record, delete_record, get_access_token, get_employee_name, get_employee_email, get_record, get_dataverse_session, get_dataverse_stats, fetch_column_values, execute_batch
 from flask_mail import Mail, Message
-from mail_app import send_email
+from mail_app import send_email, use_outbound_queue, deliver_queued
 from project_contributors import bp as contributors_bp
 from project_boards import bp as boards_bp
 from project_tasks import tasks_bp
@@ -42,12 +42,32 @@ from chats import chat_bp
 from time_tracking import bp_time, stop_active_task_entries_for_user
 from attendance_service_v2 import attendance_v2_bp
 from attendance_scheduler import setup_scheduler as _setup_attendance_scheduler
+from hierarchy_index import get_hierarchy_index, HierarchyCycleError, odata_in_filters
+from dataverse_replica import get_replica as get_dataverse_replica, ReplicaTable
+from business_calendar import BusinessCalendar
+from leave_interval_index import LeaveIntervalIndex
+from leave_ledger import get_leave_ledger
+from id_sequences import get_id_sequences
+from bulk_import import ImportJobStore, ImportRunner, iter_csv_employees, validate_employee, normalize_active
+from document_uploads import ALLOWED_DOCUMENT_EXTENSIONS, stage_documents, build_payload, content_key, get_upload_ledger
+from mail_ingest import MailIngester, get_reply_index, imap_connector
+from mail_queue import MailWorker, get_mail_queue
+from letter_pdfs import LETTER_RENDER_WAIT_SECONDS, get_letter_pipeline
+from auth_events import get_auth_event_log
+from employee_archive import get_employee_archive
+from storage_kv import get_kv_store
+from dataverse_metadata import get_entity_set_catalogue
 
 try:
     from zoneinfo import ZoneInfo
 except Exception:
     ZoneInfo = None
 
+# 📄 Offer/policy letter renderer. warm() forks the render processes now,
+# before any background thread of this module is started (see letter_pdfs.py).
+letter_pipeline = get_letter_pipeline()
+letter_pipeline.warm()
+
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
@@ -288,6 +308,14 @@ app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', app.config[
 # ✉️ Initialize Flask-Mail with the app configuration
 mail = Mail(app)
 
+# ✉️ Outbound mail queue: send_email() enqueues and returns; a background
+# worker delivers (batched Brevo calls, pooled SMTP, retry with backoff).
+mail_queue = get_mail_queue()
+mail_worker = MailWorker(mail_queue, deliver_queued)
+if os.getenv('MAIL_QUEUE_ENABLED', 'true').lower() != 'false':
+    use_outbound_queue(mail_queue)
+    mail_worker.start()
+
 # Allow insecure (HTTP) transport for Google OAuth when not running in production.
 if os.getenv("FLASK_ENV", "development").lower() != "production":
     os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
@@ -888,31 +916,11 @@ UPLOADS_DIR = os.path.join(STORAGE_DIR, "uploads")
 TEAM_HIERARCHY_STORAGE = os.path.join(STORAGE_DIR, "team_hierarchy.json")
 DOCUMENT_INDEX_FILE = os.path.join(STORAGE_DIR, "document_index.json")
 GOOGLE_TOKEN_FILE = os.path.join(STORAGE_DIR, "google_tokens.json")
-AUTH_SESSION_EVENTS_FILE = os.path.join(STORAGE_DIR, "auth_session_events.json")
 AUTH_SESSION_POLICY_FILE = os.path.join(STORAGE_DIR, "auth_session_policy.json")
 
-def _load_json_file(path, default_value):
-    try:
-        os.makedirs(STORAGE_DIR, exist_ok=True)
-        if not os.path.exists(path):
-            return default_value
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return default_value
-
-def _save_json_file(path, payload):
-    try:
-        os.makedirs(STORAGE_DIR, exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception:
-        return False
-
-def _read_auth_session_events():
-    data = _load_json_file(AUTH_SESSION_EVENTS_FILE, [])
-    return data if isinstance(data, list) else []
+# Login/logout/force-logout events: append-only SQLite log with indexed,
+# paged queries (auth_events.py); imports auth_session_events.json once.
+auth_event_log = get_auth_event_log()
 
 def _append_auth_session_event(event_type, req=None, employee_id=None, username=None, employee_name=None, reason=None, source="system"):
     now = datetime.now(timezone.utc)
@@ -929,56 +937,88 @@ def _append_auth_session_event(event_type, req=None, employee_id=None, username=
         "ip_address": req.remote_addr if req else None,
         "user_agent": req.headers.get("User-Agent", "") if req else "",
     }
-    events = _read_auth_session_events()
-    events.append(event)
-    if len(events) > 10000:
-        events = events[-10000:]
-    _save_json_file(AUTH_SESSION_EVENTS_FILE, events)
+    auth_event_log.append(event)
     return event
 
-def _get_auth_session_policy():
-    raw = _load_json_file(AUTH_SESSION_POLICY_FILE, {})
+# Small local stores (auth session policy, document index, team hierarchy
+# cache) live one record per file under storage/kv/ (storage_kv.py): per-key
+# reads and atomic, locked writes, so workers no longer overwrite each
+# other's changes. The old single-file JSONs are imported once.
+auth_session_policy_store = get_kv_store("auth_session_policy")
+auth_session_policy_store.import_json(AUTH_SESSION_POLICY_FILE, key_fn=None)
+document_index_store = get_kv_store("document_index")
+document_index_store.import_json(DOCUMENT_INDEX_FILE, key_fn=None)
+
+def _safe_auth_session_policy(raw):
     if not isinstance(raw, dict):
         raw = {}
-    policy = {
+    return {
         "global_force_logout_at": raw.get("global_force_logout_at"),
         "target_force_logout_at": raw.get("target_force_logout_at") if isinstance(raw.get("target_force_logout_at"), dict) else {},
         "target_force_logout_by_email": raw.get("target_force_logout_by_email") if isinstance(raw.get("target_force_logout_by_email"), dict) else {},
         "updated_at": raw.get("updated_at"),
         "updated_by": raw.get("updated_by"),
     }
-    return policy
+
+def _get_auth_session_policy():
+    # One record per policy field; the legacy file was a single dict of them
+    return _safe_auth_session_policy(dict(auth_session_policy_store.items()))
+
+def _update_auth_session_policy(mutate):
+    """Apply mutate(policy) under the store lock so concurrent force-logouts all land. Returns the saved policy or None."""
+    try:
+        with auth_session_policy_store.lock():
+            policy = _safe_auth_session_policy(dict(auth_session_policy_store.items()))
+            mutate(policy)
+            auth_session_policy_store.replace_all(_safe_auth_session_policy(policy))
+        return policy
+    except Exception as e:
+        print(f"[WARN] Failed to persist auth session policy: {e}")
+        return None
 
 def _save_auth_session_policy(policy):
-    policy = policy or {}
-    safe_policy = {
-        "global_force_logout_at": policy.get("global_force_logout_at"),
-        "target_force_logout_at": policy.get("target_force_logout_at") if isinstance(policy.get("target_force_logout_at"), dict) else {},
-        "target_force_logout_by_email": policy.get("target_force_logout_by_email") if isinstance(policy.get("target_force_logout_by_email"), dict) else {},
-        "updated_at": policy.get("updated_at"),
-        "updated_by": policy.get("updated_by"),
-    }
-    return _save_json_file(AUTH_SESSION_POLICY_FILE, safe_policy)
+    return _update_auth_session_policy(lambda current: current.update(policy or {})) is not None
 
-def _load_document_index():
+# Document index: one record per document key. There is deliberately no
+# whole-map save; a worker writing back its copy would drop other workers' entries.
+def _get_document_index_entry(key, default=None):
     try:
-        os.makedirs(STORAGE_DIR, exist_ok=True)
-        if os.path.exists(DOCUMENT_INDEX_FILE):
-            with open(DOCUMENT_INDEX_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+        return document_index_store.get(key, default)
     except Exception:
-        pass
-    return {}
+        return default
 
-def _save_document_index(idx):
+def _put_document_index_entry(key, entry):
     try:
-        os.makedirs(STORAGE_DIR, exist_ok=True)
-        with open(DOCUMENT_INDEX_FILE, 'w', encoding='utf-8') as f:
-            json.dump(idx, f)
+        document_index_store.put(key, entry)
         return True
     except Exception:
         return False
 
+def _update_document_index_entry(key, mutate):
+    """Locked read-modify-write of one entry: mutate(entry or {}) edits it in place. Returns the saved entry or None."""
+    def apply(entry):
+        entry = entry if isinstance(entry, dict) else {}
+        mutate(entry)
+        return entry
+    try:
+        return document_index_store.update(key, apply)
+    except Exception as e:
+        print(f"[WARN] Failed to update document index entry {key}: {e}")
+        return None
+
+def _delete_document_index_entry(key):
+    try:
+        return document_index_store.delete(key)
+    except Exception:
+        return False
+
+def _document_index_entries():
+    """Read-only snapshot of the whole index (listing only; write through the per-key helpers)."""
+    try:
+        return dict(document_index_store.items())
+    except Exception:
+        return {}
+
 # Cache for resolved entity set name (set after first successful call)
 EMPLOYEE_ENTITY_RESOLVED = None
 
@@ -1787,7 +1827,33 @@ def _parse_submission_intext(text: str) -> dict:
         pass
     return res
 
+# Entity-set resolution reads one EntityDefinitions snapshot (dataverse_metadata.py),
+# persisted per org, instead of a $top=1 probe per candidate per worker. Probing
+# is the fallback when metadata cannot be read or cannot confirm a missing name.
+def _fetch_entity_definitions(token: str) -> dict:
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/json",
+        "OData-MaxVersion": "4.0",
+        "OData-Version": "4.0",
+    }
+    url = f"{RESOURCE}/api/data/v9.2/EntityDefinitions?$select=EntitySetName,LogicalName"
+    resp = get_dataverse_session().get(url, headers=headers, timeout=30)
+    if resp.status_code != 200:
+        raise Exception(f"{resp.status_code} {resp.text[:200]}")
+    return {
+        row["EntitySetName"]: str(row.get("LogicalName") or "")
+        for row in resp.json().get("value", []) if row.get("EntitySetName")
+    }
+
+entity_set_catalogue = get_entity_set_catalogue()
+entity_set_catalogue.configure(_fetch_entity_definitions, RESOURCE)
+entity_set_catalogue.load_persisted()
+
 def _probe_entity_set(token: str, entity_set: str) -> bool:
+    known = entity_set_catalogue.exists(entity_set, token)
+    if known is not None:
+        return known
     try:
         headers = {}
         if token:
@@ -1858,54 +1924,31 @@ def get_inbox_entity_set(token: str) -> str:
     return INBOX_ENTITY_RESOLVED
 
 def _discover_compoff_entity_candidates(token: str) -> list:
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
-        "OData-MaxVersion": "4.0",
-        "OData-Version": "4.0",
-    }
-    try:
-        url = f"{RESOURCE}/api/data/v9.2/EntityDefinitions?$select=EntitySetName,LogicalName&$top=5000"
-        resp = get_dataverse_session().get(url, headers=headers, timeout=30)
-        if resp.status_code != 200:
-            print(f"[WARN] Could not read Dataverse metadata for comp-off entity discovery: {resp.status_code}")
-            return []
+    entity_sets = entity_set_catalogue.entity_sets(token)
+    if not entity_sets:
+        print("[WARN] Could not read Dataverse metadata for comp-off entity discovery")
+        return []
 
-        scored = []
-        for row in resp.json().get("value", []):
-            entity_set = str(row.get("EntitySetName") or "").strip()
-            logical = str(row.get("LogicalName") or "").strip().lower()
-            if not entity_set:
-                continue
+    scored = []
+    for entity_set, logical in entity_sets.items():
+        name_low = entity_set.lower()
+        blob = f"{name_low} {logical.lower()}"
+        if not any(k in blob for k in ("comp", "compens", "off", "request")):
+            continue
 
-            name_low = entity_set.lower()
-            blob = f"{name_low} {logical}"
-            if not any(k in blob for k in ("comp", "compens", "off", "request")):
-                continue
+        score = 0
+        if "compens" in blob:
+            score += 4
+        if "comp" in blob:
+            score += 2
+        if "off" in blob:
+            score += 2
+        if "request" in blob:
+            score += 3
+        scored.append((score, entity_set))
 
-            score = 0
-            if "compens" in blob:
-                score += 4
-            if "comp" in blob:
-                score += 2
-            if "off" in blob:
-                score += 2
-            if "request" in blob:
-                score += 3
-            scored.append((score, entity_set))
-
-        scored.sort(key=lambda item: (-item[0], item[1]))
-        discovered = []
-        seen = set()
-        for _, cand in scored:
-            if cand in seen:
-                continue
-            discovered.append(cand)
-            seen.add(cand)
-        return discovered
-    except Exception as meta_err:
-        print(f"[WARN] Comp-off metadata discovery failed: {meta_err}")
-        return []
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return list(dict.fromkeys(cand for _, cand in scored))
 
 def get_compoff_request_entity_set(token: str) -> str:
     global COMPOFF_REQUEST_ENTITY_RESOLVED
@@ -1963,45 +2006,12 @@ def get_clients_entity(token: str) -> str:
 
 def generate_project_id():
     """
-    Auto-generate a unique Project ID (VTAB001, VTAB002, etc.).
-    Finds the latest ID from Dataverse and increments it.
+    Auto-generate a unique Project ID (VTAB001, VTAB002, etc.)
+    from the shared "project" sequence (see ID SEQUENCES).
     """
-    try:
-        token = get_access_token()
-        entity_set = get_projects_entity(token)
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-        }
-
-        # [OK] Fetch latest project record (ordered descending)
-        url = f"{RESOURCE}/api/data/v9.2/{entity_set}?$select=crc6f_projectid&$orderby=createdon desc&$top=1"
-
-        res = get_dataverse_session().get(url, headers=headers, timeout=15)
-
-        last_id = None
-        if res.ok:
-            items = res.json().get("value", [])
-            if items and items[0].get("crc6f_projectid"):
-                last_id = items[0]["crc6f_projectid"]
-
-        # [OK] Extract numeric part and increment
-        if last_id:
-            match = re.search(r"VTAB(\d+)", last_id)
-            if match:
-                next_num = int(match.group(1)) + 1
-            else:
-                next_num = 1
-        else:
-            next_num = 1
-
-        new_id = f"VTAB{next_num:03d}"
-        current_app.logger.info(f"Auto-generated Project ID: {new_id}")
-        return new_id
-
-    except Exception as e:
-        current_app.logger.exception("Error generating project ID")
-        return "VTAB001"
+    new_id = id_sequences.next("project")
+    current_app.logger.info(f"Auto-generated Project ID: {new_id}")
+    return new_id
 
 
 def get_projects_entity(token: str) -> str:
@@ -2044,10 +2054,109 @@ def get_field_map(entity_set: str) -> dict:
     return FIELD_MAPS.get(entity_set, FIELD_MAPS["crc6f_table12s"])
 
 
+# ================== LOCAL READ REPLICA (see dataverse_replica.py) ==================
+# Read-heavy endpoints serve these tables from a SQLite mirror kept current with
+# Dataverse change tracking; writes stay on Dataverse and mark the table dirty.
+EMPLOYEE_REPLICA_KEYS = [
+    'id', 'fullname', 'firstname', 'lastname', 'email', 'contact', 'address',
+    'department', 'designation', 'doj', 'active', 'profile_picture'
+]
+
+def _employee_replica_select(token):
+    field_map = get_field_map(get_employee_entity_set(token))
+    fields = [field_map.get('primary')] + [field_map[k] for k in EMPLOYEE_REPLICA_KEYS if field_map.get(k)]
+    return fields + ["createdon"]
+
+dataverse_replica = get_dataverse_replica()
+dataverse_replica.register(ReplicaTable(
+    "holidays", HOLIDAY_ENTITY, "crc6f_hr_holidaysid",
+    "crc6f_date,crc6f_holidayname,crc6f_hr_holidaysid", refresh_seconds=3600,
+))
+dataverse_replica.register(ReplicaTable(
+    "employees", get_employee_entity_set,
+    lambda token: get_field_map(get_employee_entity_set(token)).get('primary'),
+    _employee_replica_select, refresh_seconds=EMPLOYEE_CACHE_TTL,
+))
+dataverse_replica.register(ReplicaTable(
+    "clients", get_clients_entity, "crc6f_hr_clientsid",
+    "crc6f_clientid,crc6f_clientname,crc6f_companyname,crc6f_email,crc6f_phone,"
+    "crc6f_address,crc6f_country,crc6f_hr_clientsid,createdby,createdon",
+    refresh_seconds=600,
+))
+dataverse_replica.register(ReplicaTable(
+    "projects", get_projects_entity, "crc6f_hr_projectheaderid",
+    "crc6f_projectid,crc6f_projectname,crc6f_client,crc6f_manager,"
+    "crc6f_projectstatus,crc6f_startdate,crc6f_enddate,"
+    "crc6f_estimationcost,crc6f_noofcontributors,crc6f_projectdescription,"
+    "crc6f_hr_projectheaderid,createdon",
+    refresh_seconds=300, annotations=True,
+))
+
+# Successful writes under these routes change the mirrored tables
+REPLICA_WRITE_ROUTES = [
+    ("/api/holidays", "holidays"),
+    ("/api/employees", "employees"),
+    ("/api/deleted-employees/restore", "employees"),
+    ("/api/clients", "clients"),
+    ("/api/projects", "projects"),
+]
+
+@app.after_request
+def _invalidate_replica_on_write(response):
+    if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+        for prefix, table_name in REPLICA_WRITE_ROUTES:
+            if request.path.startswith(prefix):
+                dataverse_replica.invalidate(table_name)
+                if table_name == "holidays":
+                    business_calendar.invalidate()
+    return response
+
+try:
+    dataverse_replica.start()
+except Exception as _replica_err:
+    print(f"[WARN] Failed to start Dataverse replica sync: {_replica_err}")
+
+
+# ================== ID SEQUENCES ==================
+# Generated IDs come from id_sequences.py (one SQLite high-water mark per
+# namespace, shared by all workers). The seeders below run once per namespace
+# and return the highest number already in Dataverse.
+id_sequences = get_id_sequences()
+
+
+def _seed_employee_ids():
+    token = get_access_token()
+    entity_set = get_employee_entity_set(token)
+    id_field = get_field_map(entity_set).get('id') or 'crc6f_employeeid'
+    return id_sequences.max_number("employee", fetch_column_values(entity_set, id_field))
+
+
+def _seed_project_ids():
+    entity_set = get_projects_entity(get_access_token())
+    return id_sequences.max_number("project", fetch_column_values(entity_set, "crc6f_projectid"))
+
+
+def _seed_client_ids():
+    entity_set = get_clients_entity(get_access_token())
+    return id_sequences.max_number("client", fetch_column_values(entity_set, "crc6f_clientid"))
+
+
+def _seed_leave_ids():
+    # Random legacy IDs (LVE-7K2P9QX) never parse, so only all-digit ones count
+    return id_sequences.max_number("leave", fetch_column_values(LEAVE_ENTITY, "crc6f_leaveid"))
+
+
+id_sequences.register("employee", "EMP", 3, _seed_employee_ids)
+id_sequences.register("project", "VTAB", 3, _seed_project_ids)
+id_sequences.register("client", "CL", 3, _seed_client_ids)
+id_sequences.register("leave", "LVE-", 7, _seed_leave_ids)
+# Also seeds the board/contributor/task namespaces registered by their blueprints
+id_sequences.start()
+
+
 def generate_leave_id():
-    """Generate Leave ID: LVE-XXXXXXX"""
-    random_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=7))
-    leave_id = f"LVE-{random_part}"
+    """Generate Leave ID: LVE-XXXXXXX (sequential digits; older IDs are random alphanumerics)"""
+    leave_id = id_sequences.next("leave")
     print(f"   [KEY] Generated Leave ID: {leave_id}")
     return leave_id
 
@@ -2112,12 +2221,81 @@ def _resolve_employee_identifier(raw_identifier: str, token: str = None) -> str:
     return upper
 
 
+def _load_holiday_dates():
+    """(date, name) pairs for the business calendar: replica first, Dataverse fallback."""
+    rows = dataverse_replica.read("holidays")
+    if rows is None:
+        token = get_access_token()
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json",
+            "OData-MaxVersion": "4.0",
+            "OData-Version": "4.0"
+        }
+        url = f"{RESOURCE}/api/data/v9.2/{HOLIDAY_ENTITY}?$select=crc6f_date,crc6f_holidayname"
+        resp = get_dataverse_session().get(url, headers=headers, timeout=10)
+        if resp.status_code != 200:
+            raise RuntimeError(f"holiday fetch failed: {resp.status_code}")
+        rows = resp.json().get("value", [])
+    return [(str(r.get("crc6f_date"))[:10], r.get("crc6f_holidayname")) for r in rows if r.get("crc6f_date")]
+
+
+# Weekends (WORKWEEK_MASK) and company holidays for all working-day arithmetic
+business_calendar = BusinessCalendar(_load_holiday_dates)
+
+
+def _leave_type_code(leave_type):
+    """'Casual Leave' / 'CL' -> 'CL' (likewise SL, CO); None for other types."""
+    ltl = (leave_type or "").strip().lower()
+    if "casual" in ltl or ltl == "cl":
+        return "CL"
+    if "sick" in ltl or ltl == "sl":
+        return "SL"
+    if "comp" in ltl or ltl in ("co", "compoff", "comp off", "compensatory off"):
+        return "CO"
+    return None
+
+
+def _load_leave_index_rows():
+    """Every leave row for leave_index; the index keeps the approved/pending ones."""
+    rows = []
+    token = get_access_token()
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/json",
+        "OData-MaxVersion": "4.0",
+        "OData-Version": "4.0",
+        "Prefer": "odata.maxpagesize=5000",
+    }
+    # No $select: the endpoints served from the index return whole rows (reason etc.)
+    url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}"
+    while url:
+        resp = get_dataverse_session().get(url, headers=headers, timeout=30)
+        if resp.status_code != 200:
+            raise Exception(f"leave fetch failed: {resp.status_code} {resp.text[:200]}")
+        data = resp.json()
+        rows.extend(data.get('value', []))
+        url = data.get('@odata.nextLink')
+    return rows
+
+
+# Approved/pending leaves by date for on-leave-today, upcoming and attendance overlays
+leave_index = LeaveIntervalIndex(_load_leave_index_rows)
+leave_index.start()
+
+
+def _leave_index_write(record, update_data=None):
+    """Apply a leave create/update to leave_index after the Dataverse write succeeded."""
+    try:
+        leave_index.upsert({**(record or {}), **(update_data or {})})
+    except Exception as e:
+        print(f"[LEAVE INDEX] Incremental update failed: {e}")
+
+
 def calculate_leave_days(start_date, end_date):
-    """Calculate number of days between start and end date"""
-    start = datetime.strptime(start_date, "%Y-%m-%d")
-    end = datetime.strptime(end_date, "%Y-%m-%d")
-    days = (end - start).days + 1
-    print(f"   [DATE] Calculated Leave Days: {days} (from {start_date} to {end_date})")
+    """Working days between start and end date (inclusive), skipping weekends and holidays"""
+    days = business_calendar.working_days(start_date, end_date)
+    print(f"   [DATE] Calculated Leave Days: {days} working day(s) (from {start_date} to {end_date})")
     return days
 
 
@@ -2319,34 +2497,13 @@ def _save_google_credentials(creds):
         print(f"[WARN] Failed to persist Google OAuth credentials: {e}")
 
 
-def _load_google_credentials():
-    try:
-        token_json = load_google_token()
-        if not token_json:
-            return None
-        data = json.loads(token_json)
-        creds = Credentials.from_authorized_user_info(data, GOOGLE_SCOPES)
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-            _save_google_credentials(creds)
-        return creds
-    except Exception as e:
-        print(f"[WARN] Failed to load Google OAuth credentials: {e}")
-        return None
+# One calendar service per thread, built from the bundled discovery document;
+# credentials are cached per process and renewed in the background.
+google_calendar = GoogleCalendarClient(load_google_token, save_google_token, GOOGLE_SCOPES)
 
 
 def get_google_calendar_service():
-    creds = _load_google_credentials()
-    if not creds:
-        raise RuntimeError("Google OAuth credentials not found. Please authorize via /google/authorize.")
-    if not creds.valid and creds.expired and creds.refresh_token:
-        try:
-            creds.refresh(Request())
-            _save_google_credentials(creds)
-        except Exception as e:
-            print(f"[ERROR] Failed to refresh Google OAuth credentials: {e}")
-            raise
-    return build("calendar", "v3", credentials=creds)
+    return google_calendar.service()
 
 
 def _get_project_member_employee_ids(token: str, project_id: str):
@@ -2377,9 +2534,10 @@ def _get_project_member_employee_ids(token: str, project_id: str):
         return []
 
 
-def notify_socket_server(admin_id: str, meet_url: str, participants: list, title: str = "Meeting"):
+def notify_socket_server(admin_id: str, meet_url: str, participants: list, title: str = "Meeting", call_id: str = None):
     try:
         payload = {
+            "call_id": call_id,
             "admin_id": admin_id,
             "title": title or "Meeting",
             "meet_url": meet_url,
@@ -2401,75 +2559,95 @@ def notify_socket_server(admin_id: str, meet_url: str, participants: list, title
         return None
 
 
-def _ensure_storage_dir():
-    try:
-        os.makedirs(STORAGE_DIR, exist_ok=True)
-    except Exception as e:
-        print(f"[WARN] Failed to ensure storage directory: {e}")
+_meet_notify_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="meet-notify")
+
+
+def notify_socket_server_async(admin_id: str, meet_url: str, participants: list, title: str = "Meeting"):
+    """Queue the socket notification and return the call_id it will carry (socket server accepts ours)."""
+    call_id = str(uuid.uuid4())
+    _meet_notify_executor.submit(notify_socket_server, admin_id, meet_url, participants, title, call_id)
+    return call_id
+
+
+# Local hierarchy cache: one record per hierarchy row id (storage_kv.py);
+# team_hierarchy.json is imported once.
+team_hierarchy_store = get_kv_store("team_hierarchy")
+team_hierarchy_store.import_json(TEAM_HIERARCHY_STORAGE, key_fn=lambda r: _normalize_guid(r.get('id')) or r.get('id'))
 
 
 def _load_team_hierarchy_local():
-    _ensure_storage_dir()
-    if not os.path.exists(TEAM_HIERARCHY_STORAGE):
-        return []
     try:
-        with open(TEAM_HIERARCHY_STORAGE, 'r', encoding='utf-8') as fh:
-            data = json.load(fh)
-            if isinstance(data, list):
-                return data
+        return team_hierarchy_store.values()
     except Exception as e:
         print(f"[WARN] Failed to load team hierarchy cache: {e}")
     return []
 
 
-def _save_team_hierarchy_local(records: list):
-    _ensure_storage_dir()
-    try:
-        with open(TEAM_HIERARCHY_STORAGE, 'w', encoding='utf-8') as fh:
-            json.dump(records or [], fh, indent=2)
-    except Exception as e:
-        print(f"[WARN] Failed to persist team hierarchy cache: {e}")
-
-
 def _upsert_team_hierarchy_local(record: dict):
     if not record or not record.get('id'):
         return
-    current = _load_team_hierarchy_local()
     normalized_id = _normalize_guid(record.get('id')) or record.get('id')
     record['id'] = normalized_id
-    updated = False
-    for idx, existing in enumerate(current):
-        existing_id = _normalize_guid(existing.get('id')) or existing.get('id')
-        if existing_id == normalized_id:
-            current[idx] = record
-            updated = True
-            break
-    if not updated:
-        current.append(record)
-    _save_team_hierarchy_local(current)
+    try:
+        team_hierarchy_store.put(normalized_id, record)
+    except Exception as e:
+        print(f"[WARN] Failed to persist team hierarchy cache: {e}")
 
 
 def _delete_team_hierarchy_local(record_id: str) -> bool:
     if not record_id:
         return False
     normalized = _normalize_guid(record_id) or record_id
-    current = _load_team_hierarchy_local()
-    remaining = [r for r in current if (_normalize_guid(r.get('id')) or r.get('id')) != normalized]
-    if len(remaining) != len(current):
-        _save_team_hierarchy_local(remaining)
-        return True
-    return False
+    try:
+        return team_hierarchy_store.delete(normalized)
+    except Exception as e:
+        print(f"[WARN] Failed to persist team hierarchy cache: {e}")
+        return False
 
 
 def _find_local_hierarchy_record(record_id: str):
     if not record_id:
         return None
     normalized = _normalize_guid(record_id) or record_id
-    for rec in _load_team_hierarchy_local():
-        rec_id = _normalize_guid(rec.get('id')) or rec.get('id')
-        if rec_id == normalized:
-            return rec
-    return None
+    return team_hierarchy_store.get(normalized)
+
+
+def _hierarchy_index_rows():
+    """(record_id, employee_id, manager_id) for every hierarchy row; feeds hierarchy_index."""
+    rows = []
+    token = get_access_token()
+    entity = get_hierarchy_entity(token)
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/json",
+        "OData-MaxVersion": "4.0",
+        "OData-Version": "4.0",
+        "Prefer": "odata.maxpagesize=5000",
+    }
+    select_clause = ",".join([HIERARCHY_PRIMARY_FIELD, HIERARCHY_EMPLOYEE_FIELD, HIERARCHY_MANAGER_FIELD])
+    url = f"{RESOURCE}/api/data/v9.2/{entity}?$select={select_clause}"
+    while url:
+        resp = get_dataverse_session().get(url, headers=headers, timeout=15)
+        if resp.status_code != 200:
+            raise Exception(f"hierarchy fetch failed: {resp.status_code} {resp.text[:200]}")
+        data = resp.json()
+        for row in data.get('value', []):
+            rows.append((
+                _normalize_guid(row.get(HIERARCHY_PRIMARY_FIELD)),
+                _normalize_employee_id(row.get(HIERARCHY_EMPLOYEE_FIELD)),
+                _normalize_employee_id(row.get(HIERARCHY_MANAGER_FIELD)),
+            ))
+        url = data.get('@odata.nextLink')
+    if not rows:
+        # Same fallback as list_hierarchy: local cache when Dataverse has nothing
+        rows = [
+            (_normalize_guid(r.get('id')), r.get('employeeId'), r.get('managerId'))
+            for r in _load_team_hierarchy_local() if r.get('employeeId') and r.get('managerId')
+        ]
+    return rows
+
+
+get_hierarchy_index().configure(_hierarchy_index_rows)
 
 
 def _compose_hierarchy_display(token: str, employee_id: str, manager_id: str, record_id: str):
@@ -2526,6 +2704,24 @@ def get_leave_allocation_by_experience(experience_years):
     print(f"   [FETCH] Leave allocation: Type {allocation_type} - CL: {cl}, SL: {sl}, Total: {total}")
 
 
+def _allocation_from_doj(doj_value):
+    """(cl, sl, allocation_type) for a DOJ stored as MM/DD/YYYY or YYYY-MM-DD; Type 3 when unknown."""
+    doj_date = None
+    try:
+        if isinstance(doj_value, str):
+            if '/' in doj_value:
+                parts = doj_value.split('/')
+                if len(parts) == 3:
+                    doj_date = datetime(int(parts[2]), int(parts[0]), int(parts[1]))
+            elif '-' in doj_value:
+                doj_date = datetime.fromisoformat(doj_value.split('T')[0])
+    except Exception as e:
+        print(f"   [WARN] Error parsing DOJ {doj_value!r}: {e}")
+    experience_years = max(0, int((datetime.now() - doj_date).days / 365.25)) if doj_date else 0
+    cl, sl, _total, allocation_type = get_leave_allocation_by_experience(experience_years)
+    return cl, sl, allocation_type
+
+
 # ================== LEAVE BALANCE HELPERS ==================
 def _fetch_leave_balance(token: str, employee_id: str) -> dict:
     """Fetch leave balance row for an employee from Dataverse leave management table.
@@ -2818,6 +3014,159 @@ def _ensure_leave_balance_row(token: str, employee_id: str, defaults: dict = Non
         "crc6f_actualtotal": payload["crc6f_actualtotal"],
     }
 
+# ================== LEAVE LEDGER ==================
+# Append-only accrual/consumption entries with a materialised balance per
+# (employee, type, year); see leave_ledger.py. The crc6f_hr_leavemangements row
+# is still patched by _decrement_leave_balance for other readers.
+leave_ledger = get_leave_ledger()
+
+_LEDGER_LABELS = {"CL": "Casual Leave", "SL": "Sick Leave", "CO": "Comp Off"}
+
+
+def _leave_year(date_value):
+    try:
+        return int(str(date_value)[:4])
+    except (TypeError, ValueError):
+        return datetime.now().year
+
+
+def _ledger_consume_event(leave_row):
+    """Ledger consume event for a paid CL/SL/CO leave row, or None."""
+    code = _leave_type_code(leave_row.get("crc6f_leavetype"))
+    paid = str(leave_row.get("crc6f_paidunpaid") or "").strip().lower() == "paid"
+    try:
+        days = float(leave_row.get("crc6f_totaldays") or 0)
+    except (TypeError, ValueError):
+        days = 0.0
+    leave_id = leave_row.get("crc6f_leaveid")
+    if not code or not paid or days <= 0 or not leave_id:
+        return None
+    return {
+        "event_id": f"leave:{leave_id}:consume", "leave_type": code, "kind": "consume",
+        "days": days, "year": _leave_year(leave_row.get("crc6f_startdate")), "ref": leave_id,
+    }
+
+
+def _ledger_consume(leave_row):
+    """Record a paid leave once; apply_leave and approve_leave both call this."""
+    try:
+        emp = str(leave_row.get("crc6f_employeeid") or "").strip().upper()
+        event = _ledger_consume_event(leave_row)
+        # Employees not in the ledger yet are seeded from history on their first balance read
+        if event and emp and leave_ledger.has_employee(emp):
+            leave_ledger.record(event["event_id"], emp, event["leave_type"], event["year"],
+                                "consume", event["days"], ref=event["ref"])
+    except Exception as e:
+        print(f"[LEDGER] Failed to record consumption for {leave_row.get('crc6f_leaveid')}: {e}")
+
+
+def _ledger_release(leave_row):
+    """Reverse a leave's consume entry once (reject / cancel)."""
+    leave_id = leave_row.get("crc6f_leaveid")
+    if not leave_id:
+        return
+    try:
+        leave_ledger.reverse(f"leave:{leave_id}:consume", f"leave:{leave_id}:release", ref=leave_id)
+    except Exception as e:
+        print(f"[LEDGER] Failed to release {leave_id}: {e}")
+
+
+def _ledger_adjust(employee_id, code, available, ref):
+    """Bring the ledger in line with a manual balance edit."""
+    emp = str(employee_id or "").strip().upper()
+    try:
+        if emp and leave_ledger.has_employee(emp):
+            leave_ledger.adjust_to(emp, code, datetime.now().year, float(available),
+                                   event_id=f"adjust:{emp}:{code}:{uuid.uuid4().hex}", ref=ref)
+    except Exception as e:
+        print(f"[LEDGER] Failed to adjust {code} for {emp}: {e}")
+
+
+def _employee_doj(token, emp):
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/json",
+        "OData-MaxVersion": "4.0",
+        "OData-Version": "4.0"
+    }
+    entity_set = get_employee_entity_set(token)
+    field_map = get_field_map(entity_set)
+    safe_emp = emp.replace("'", "''")
+    url = f"{RESOURCE}/api/data/v9.2/{entity_set}?$filter={field_map['id']} eq '{safe_emp}'"
+    resp = get_dataverse_session().get(url, headers=headers, timeout=15)
+    if resp.status_code != 200:
+        raise Exception(f"employee fetch failed: {resp.status_code}")
+    rows = resp.json().get("value", [])
+    return rows[0].get(field_map['doj']) if rows else None
+
+
+def _employee_paid_leaves(token, emp):
+    """Approved/pending leave rows for one employee (leave_index when loaded)."""
+    if leave_index.loaded:
+        return leave_index.by_employee(emp)
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/json",
+        "OData-MaxVersion": "4.0",
+        "OData-Version": "4.0"
+    }
+    safe_emp = emp.replace("'", "''")
+    url = (
+        f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}"
+        f"?$filter=crc6f_employeeid eq '{safe_emp}' and (crc6f_status eq 'Approved' or crc6f_status eq 'Pending')"
+        "&$select=crc6f_leaveid,crc6f_employeeid,crc6f_leavetype,crc6f_totaldays,crc6f_paidunpaid,"
+        "crc6f_status,crc6f_startdate,crc6f_enddate"
+    )
+    resp = get_dataverse_session().get(url, headers=headers, timeout=15)
+    if resp.status_code != 200:
+        raise Exception(f"leave history fetch failed: {resp.status_code}")
+    return resp.json().get("value", [])
+
+
+def _rebuild_leave_ledger(token, emp, year=None, anchor=None, doj=None, leave_rows=None, balance_row=None):
+    """
+    Replay one employee's ledger for `year` from history: the DOJ-based quota plus
+    every approved/pending paid leave. With anchor (default: the employee's first
+    time in the ledger) an adjustment makes the balances equal the Dataverse
+    balance row, which also carries comp-off grants and manual edits.
+    Without an anchoring row (e.g. the first read of a new year) the comp-off
+    bucket is left as it is and the year's adjust entries (manual edits) are
+    carried over: neither is in the replayed history. Returns the rebuilt balances.
+    """
+    emp = str(emp or "").strip().upper()
+    year = int(year or datetime.now().year)
+    if anchor is None:
+        anchor = not leave_ledger.has_employee(emp)
+    if doj is None:
+        doj = _employee_doj(token, emp)
+    cl, sl, allocation_type = _allocation_from_doj(doj)
+    if leave_rows is None:
+        leave_rows = _employee_paid_leaves(token, emp)
+
+    events = [
+        {"event_id": f"accrual:{emp}:CL:{year}:rebuild", "leave_type": "CL", "kind": "accrual", "days": cl, "ref": allocation_type},
+        {"event_id": f"accrual:{emp}:SL:{year}:rebuild", "leave_type": "SL", "kind": "accrual", "days": sl, "ref": allocation_type},
+    ]
+    for row in leave_rows:
+        if str(row.get("crc6f_status") or "").strip().lower() not in ("approved", "pending"):
+            continue
+        event = _ledger_consume_event(row)
+        if event:
+            events.append(event)
+    if anchor and balance_row is None:
+        balance_row = _fetch_leave_balance(token, emp)
+    anchored = bool(anchor and balance_row)
+    applied = leave_ledger.rebuild(emp, year, events, include_carry_forward=anchored, keep_adjustments=not anchored)
+
+    if anchored:
+        for code, label in _LEDGER_LABELS.items():
+            leave_ledger.adjust_to(emp, code, year, _get_available_days(balance_row, label),
+                                   event_id=f"opening:{emp}:{code}:{year}:{uuid.uuid4().hex}",
+                                   ref="dataverse balance row")
+    print(f"[LEDGER] Rebuilt {emp} {year}: {applied} entries ({allocation_type}, anchored={anchored})")
+    return leave_ledger.balance(emp, year)
+
+
 # ================== ASSET MANAGEMENT FUNCTIONS ==================
 def get_all_assets():
     token = get_access_token()
@@ -5779,15 +6128,25 @@ def get_monthly_attendance(employee_id, year, month):
                 "liveAugmented": live_augmented
             })
         
+        month_grid = business_calendar.month_grid(year, month)
+        month_working = month_grid["working"]
+
         # Overlay employee-specific leaves into the same month range (CL/SL/CO)
         try:
-            leaves_url = (
-                f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}"
-                f"?$filter=crc6f_employeeid eq '{normalized_emp_id}'"
-            )
-            leaves_resp = get_dataverse_session().get(leaves_url, headers=headers, timeout=15)
-            if leaves_resp.status_code == 200:
-                leaves = leaves_resp.json().get("value", [])
+            leaves = None
+            if leave_index.loaded:
+                leaves = leave_index.overlapping(
+                    start_date, end_date, statuses=("approved", "pending"), employee_ids=[normalized_emp_id]
+                )
+            else:
+                leaves_url = (
+                    f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}"
+                    f"?$filter=crc6f_employeeid eq '{normalized_emp_id}'"
+                )
+                leaves_resp = get_dataverse_session().get(leaves_url, headers=headers, timeout=15)
+                if leaves_resp.status_code == 200:
+                    leaves = leaves_resp.json().get("value", [])
+            if leaves is not None:
                 # Build day -> record map for quick overlay
                 by_day = {}
                 for fr in formatted_records:
@@ -5805,14 +6164,8 @@ def get_monthly_attendance(employee_id, year, month):
                         # Only overlay approved/pending leaves; others shouldn't affect attendance
                         continue
                     # Determine short code
-                    ltl = lt_raw.lower()
-                    if "casual" in ltl or ltl == "cl":
-                        lt_code = "CL"
-                    elif "sick" in ltl or ltl == "sl":
-                        lt_code = "SL"
-                    elif "comp" in ltl or ltl in ("co", "compoff", "comp off", "compensatory off"):
-                        lt_code = "CO"
-                    else:
+                    lt_code = _leave_type_code(lt_raw)
+                    if not lt_code:
                         # Unknown type: do not overlay to avoid incorrect marks
                         continue
                     paid_unpaid = lv.get("crc6f_paidunpaid")
@@ -5835,6 +6188,10 @@ def get_monthly_attendance(employee_id, year, month):
                     cur = rng_start
                     while cur <= rng_end:
                         day_idx = cur.day
+                        if not month_working[day_idx - 1]:
+                            # Weekends and holidays inside a leave range are not leave days
+                            cur = cur + timedelta(days=1)
+                            continue
                         # Create or update day's record
                         rec = by_day.get(day_idx)
                         if not rec:
@@ -5882,7 +6239,9 @@ def get_monthly_attendance(employee_id, year, month):
         return jsonify({
             "success": True,
             "records": formatted_records,
-            "count": len(formatted_records)
+            "count": len(formatted_records),
+            "working_days": month_grid["working_days"],
+            "holidays": {d.isoformat(): name for d, name in month_grid["holidays"].items()}
         })
             
     except Exception as e:
@@ -6167,8 +6526,10 @@ def apply_leave():
         if missing_fields:
             return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
 
-        leave_id = generate_leave_id()
         leave_days = calculate_leave_days(start_date, end_date)
+        if leave_days <= 0:
+            return jsonify({"error": "The selected dates fall on weekends or holidays; no working days to apply for"}), 400
+        leave_id = generate_leave_id()
 
         token = get_access_token()
         balance_row = None
@@ -6193,10 +6554,12 @@ def apply_leave():
 
             start_dt = datetime.strptime(start_date, "%Y-%m-%d")
             end_dt = datetime.strptime(end_date, "%Y-%m-%d")
+            # Paid part covers the first paid_days working days; unpaid resumes on the next one
+            paid_end_day, unpaid_start_day = business_calendar.split_range(start_dt, int(paid_days))
 
             if paid_days > 0:
                 paid_leave_id = leave_id
-                paid_end_dt = start_dt + timedelta(days=int(paid_days) - 1)
+                paid_end_dt = datetime.combine(paid_end_day, datetime.min.time())
                 record_data_paid = {
                     "crc6f_leaveid": paid_leave_id,
                     "crc6f_leavetype": leave_type,
@@ -6212,6 +6575,8 @@ def apply_leave():
                 print(f"📦 Dataverse Record Data (Paid): {record_data_paid}")
                 created_paid = create_record(LEAVE_ENTITY, record_data_paid)
                 created_records.append(created_paid)
+                _leave_index_write(record_data_paid)
+                _ledger_consume(record_data_paid)
                 primary_leave_id = paid_leave_id
                 try:
                     if paid_days > 0:
@@ -6221,7 +6586,7 @@ def apply_leave():
 
             if unpaid_days > 0:
                 unpaid_leave_id = generate_leave_id()
-                unpaid_start_dt = start_dt + timedelta(days=int(paid_days))
+                unpaid_start_dt = datetime.combine(unpaid_start_day, datetime.min.time()) if paid_days > 0 else start_dt
                 record_data_unpaid = {
                     "crc6f_leaveid": unpaid_leave_id,
                     "crc6f_leavetype": leave_type,
@@ -6237,6 +6602,7 @@ def apply_leave():
                 print(f"📦 Dataverse Record Data (Unpaid): {record_data_unpaid}")
                 created_unpaid = create_record(LEAVE_ENTITY, record_data_unpaid)
                 created_records.append(created_unpaid)
+                _leave_index_write(record_data_unpaid)
                 if primary_leave_id is None:
                     primary_leave_id = unpaid_leave_id
 
@@ -6313,6 +6679,8 @@ def apply_leave():
 
         print(f"📦 Dataverse Record Data: {record_data}")
         created_record = create_record(LEAVE_ENTITY, record_data)
+        _leave_index_write(record_data)
+        _ledger_consume(record_data)
 
         try:
             if paid_flag and leave_days > 0:
@@ -6529,12 +6897,13 @@ def list_projects():
             "crc6f_estimationcost,crc6f_noofcontributors,crc6f_projectdescription,"
             "crc6f_hr_projectheaderid,createdon"
         )
-        url = f"{RESOURCE}/api/data/v9.2/{entity_set}?{select}&$top=5000"
-        resp = get_dataverse_session().get(url, headers=headers, timeout=15)
-        if resp.status_code != 200:
-            return jsonify({"success": False, "error": resp.text}), resp.status_code
-
-        values = resp.json().get("value", [])
+        values = dataverse_replica.read("projects")
+        if values is None:
+            url = f"{RESOURCE}/api/data/v9.2/{entity_set}?{select}&$top=5000"
+            resp = get_dataverse_session().get(url, headers=headers, timeout=15)
+            if resp.status_code != 200:
+                return jsonify({"success": False, "error": resp.text}), resp.status_code
+            values = resp.json().get("value", [])
 
         # Optional filters
         q = (request.args.get("search") or "").strip().lower()
@@ -6649,6 +7018,7 @@ def create_project():
             "crc6f_projectdescription": data.get("crc6f_projectdescription"),
         }
         created = create_record(entity_set, payload)
+        id_sequences.observe("project", pid)
         return jsonify({"success": True, "project": created}), 201
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -6967,7 +7337,7 @@ def get_leave_balance_query():
 
 @app.route('/api/leave-balance/all/<employee_id>', methods=['GET'])
 def get_all_leave_balances(employee_id):
-    """Return all leave balances (CL, SL, Comp Off) for an employee with annual quota, consumed (from history), and available"""
+    """Return all leave balances (CL, SL, Comp Off) for an employee with annual quota, consumed and available (from the leave ledger)"""
     try:
         print(f"\n{'='*70}")
         print(f"[SEARCH] FETCHING ALL LEAVE BALANCES FOR EMPLOYEE: {employee_id}")
@@ -6978,183 +7348,57 @@ def get_all_leave_balances(employee_id):
         if emp.isdigit():
             emp = f"EMP{int(emp):03d}"
         
-        token = get_access_token()
-        inbox_entity = get_inbox_entity_set(token)
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "OData-MaxVersion": "4.0",
-            "OData-Version": "4.0"
-        }
-        
-        # ============================================================
-        # CALCULATE ANNUAL QUOTA BASED ON EMPLOYEE EXPERIENCE (DOJ)
-        # ============================================================
-        print(f"[DATA] Calculating annual leave quota based on employee experience for {emp}...")
-        
-        # Fetch employee DOJ from employee master table
-        entity_set = get_employee_entity_set(token)
-        field_map = get_field_map(entity_set)
-        
-        # Fetch employee record to get DOJ
-        safe_emp = emp.replace("'", "''")
-        emp_filter = f"?$filter={field_map['id']} eq '{safe_emp}'"
-        emp_url = f"{RESOURCE}/api/data/v9.2/{entity_set}{emp_filter}"
-        emp_response = get_dataverse_session().get(emp_url, headers=headers, timeout=15)
-        
-        # Default quotas for Type 3 (0-1 years experience)
-        cl_annual = 3
-        sl_annual = 3
-        co_annual = 0   # Comp off doesn't have fixed annual quota
-        
-        if emp_response.status_code == 200:
-            emp_records = emp_response.json().get("value", [])
-            if emp_records:
-                emp_record = emp_records[0]
-                doj_value = emp_record.get(field_map['doj'])
-                
-                print(f"   [DATE] Employee DOJ: {doj_value}")
-                
-                # Calculate experience from DOJ
-                if doj_value:
-                    try:
-                        from datetime import datetime
-                        # Parse DOJ - handle multiple formats
-                        doj_date = None
-                        if isinstance(doj_value, str):
-                            # Try MM/DD/YYYY format first
-                            if '/' in doj_value:
-                                parts = doj_value.split('/')
-                                if len(parts) == 3:
-                                    doj_date = datetime(int(parts[2]), int(parts[0]), int(parts[1]))
-                            # Try YYYY-MM-DD format
-                            elif '-' in doj_value:
-                                doj_date = datetime.fromisoformat(doj_value.split('T')[0])
-                        
-                        if doj_date:
-                            current_date = datetime.now()
-                            experience_years = (current_date - doj_date).days / 365.25
-                            experience_years = max(0, int(experience_years))
-                            
-                            print(f"   [DATA] Calculated Experience: {experience_years} years")
-                            
-                            # Determine allocation based on experience
-                            # Type 1: 3+ years -> CL=6, SL=6, Total=12
-                            # Type 2: 2+ years -> CL=4, SL=4, Total=8
-                            # Type 3: <2 years -> CL=3, SL=3, Total=6
-                            if experience_years >= 3:
-                                cl_annual = 6
-                                sl_annual = 6
-                                print(f"   [OK] Allocation Type 1 (3+ years): CL={cl_annual}, SL={sl_annual}")
-                            elif experience_years >= 2:
-                                cl_annual = 4
-                                sl_annual = 4
-                                print(f"   [OK] Allocation Type 2 (2+ years): CL={cl_annual}, SL={sl_annual}")
-                            else:
-                                cl_annual = 3
-                                sl_annual = 3
-                                print(f"   [OK] Allocation Type 3 (<2 years): CL={cl_annual}, SL={sl_annual}")
-                    except Exception as e:
-                        print(f"   [WARN] Error calculating experience: {e}")
-                        print(f"   Using default Type 3 allocation: CL={cl_annual}, SL={sl_annual}")
-                else:
-                    print(f"   [WARN] No DOJ found, using default Type 3 allocation: CL={cl_annual}, SL={sl_annual}")
-            else:
-                print(f"   [WARN] Employee record not found, using default Type 3 allocation: CL={cl_annual}, SL={sl_annual}")
-        else:
-            print(f"   [WARN] Failed to fetch employee record, using default Type 3 allocation: CL={cl_annual}, SL={sl_annual}")
-        
         # ============================================================
-        # CALCULATE CONSUMED FROM ACTUAL LEAVE HISTORY (REAL-TIME)
-        # Only APPROVED paid leaves should reduce the balance
+        # BALANCES FROM THE LEAVE LEDGER (one materialised row per type)
+        # First read for an employee/year (no accrual yet) rebuilds it from history.
         # ============================================================
-        print(f"[DATA] Fetching leave history for {emp} to calculate consumed leaves...")
-        
-        # Fetch leave records with Approved status (Pending shouldn't reduce balances)
-        safe_emp = emp.replace("'", "''")
-        filter_query = f"?$filter=crc6f_employeeid eq '{safe_emp}' and crc6f_status eq 'Approved'"
-        leave_url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{filter_query}&$select=crc6f_leavetype,crc6f_totaldays,crc6f_paidunpaid,crc6f_status"
-        
-        leave_response = get_dataverse_session().get(leave_url, headers=headers, timeout=15)
-        
-        cl_consumed = 0.0
-        sl_consumed = 0.0
-        co_consumed = 0.0
-        
-        if leave_response.status_code == 200:
-            leave_records = leave_response.json().get("value", [])
-            print(f"[FETCH] Found {len(leave_records)} leave records (Approved/Pending/Cancelled)")
-            
-            for record in leave_records:
-                leave_type = (record.get("crc6f_leavetype") or "").strip()
-                total_days = float(record.get("crc6f_totaldays", 0))
-                paid_unpaid = (record.get("crc6f_paidunpaid") or "").strip().lower()
-                status = (record.get("crc6f_status") or "").strip()
-                status_low = status.lower()
-                
-                lt_low = leave_type.lower()
-                
-                # Count PAID leaves only when status is Approved
-                if paid_unpaid == "paid" and total_days > 0 and status_low == "approved":
-                    # Casual Leave: support both full name and short code CL
-                    if "casual" in lt_low or lt_low in ("cl", "casual leave"):
-                        cl_consumed += total_days
-                        print(f"   [OK] Casual Leave: +{total_days} days ({status})")
-                    # Sick Leave: support both full name and short code SL
-                    elif "sick" in lt_low or lt_low in ("sl", "sick leave"):
-                        sl_consumed += total_days
-                        print(f"   [OK] Sick Leave: +{total_days} days ({status})")
-                    # Comp Off: support CO / Comp Off variants
-                    elif "comp" in lt_low or lt_low in ("co", "comp off", "compoff", "compensatory off"):
-                        co_consumed += total_days
-                        print(f"   [OK] Comp Off: +{total_days} days ({status})")
+        year = datetime.now().year
+        token = None
+        if leave_ledger.is_accrued(emp, year):
+            ledger = leave_ledger.balance(emp, year)
         else:
-            print(f"[WARN] Could not fetch leave history: {leave_response.status_code}")
-        
-        print(f"\n[DATA] REAL-TIME CONSUMED CALCULATION (including Pending/Cancelled):")
-        print(f"   Casual Leave Consumed: {cl_consumed}")
-        print(f"   Sick Leave Consumed: {sl_consumed}")
-        print(f"   Comp Off Consumed: {co_consumed}")
-        
-        # ============================================================
-        # CALCULATE AVAILABLE = ANNUAL QUOTA - CONSUMED (BASELINE)
-        # ============================================================
-        cl_available = max(0, cl_annual - cl_consumed)
-        sl_available = max(0, sl_annual - sl_consumed)
-        co_available = max(0, co_annual - co_consumed)  # Comp off available (earned comp offs)
-
-        # ------------------------------------------------------------
-        # OVERRIDE WITH DATAVERSE LEAVE-BALANCE ROW (crc6f_cl/sl/compoff)
-        # So that the "Available" shown in UI matches the Dataverse table
-        # exactly for CL/SL/CO. We then recompute Consumed = Annual - Available.
-        # ------------------------------------------------------------
+            token = get_access_token()
+            ledger = _rebuild_leave_ledger(token, emp, year)
+        empty = {"accrued": 0.0, "consumed": 0.0, "available": 0.0}
+        cl_row, sl_row, co_row = (ledger.get(code, empty) for code in ("CL", "SL", "CO"))
+
+        cl_annual = cl_row["accrued"]
+        sl_annual = sl_row["accrued"]
+        co_annual = 0   # Comp off doesn't have fixed annual quota
+        cl_available = max(0.0, cl_row["available"])
+        sl_available = max(0.0, sl_row["available"])
+        co_available = max(0.0, co_row["available"])
+        # Consumed = Annual - Available so cards stay consistent with manual edits
+        cl_consumed = max(0.0, cl_annual - cl_available)
+        sl_consumed = max(0.0, sl_annual - sl_available)
+        co_consumed = max(0.0, co_row["consumed"])
+
+        # Pending paid leaves, counted in working days over their date range.
+        # apply_leave already consumed them, so they are shown but not subtracted again.
+        pending_by_code = {"CL": 0.0, "SL": 0.0, "CO": 0.0}
         try:
-            balance_row = _fetch_leave_balance(token, emp)
-        except Exception as bal_err:
-            balance_row = None
-            print(f"[WARN] Failed to fetch leave-balance row for {emp} in all-balances: {bal_err}")
+            if leave_index.loaded:
+                open_leaves = leave_index.by_employee(emp, statuses=("pending",))
+            else:
+                open_leaves = _employee_paid_leaves(token or get_access_token(), emp)
+            pending_paid = [
+                r for r in open_leaves
+                if (r.get("crc6f_status") or "").strip().lower() == "pending"
+                and (r.get("crc6f_paidunpaid") or "").strip().lower() == "paid"
+            ]
+            if pending_paid:
+                pending_days = business_calendar.working_days_batch(
+                    [r.get("crc6f_startdate") for r in pending_paid],
+                    [r.get("crc6f_enddate") or r.get("crc6f_startdate") for r in pending_paid],
+                )
+                for r, days in zip(pending_paid, pending_days):
+                    code = _leave_type_code(r.get("crc6f_leavetype"))
+                    if code in pending_by_code:
+                        pending_by_code[code] += float(days)
+        except Exception as pending_err:
+            print(f"[WARN] Could not load pending leaves for {emp}: {pending_err}")
 
-        if balance_row:
-            try:
-                cl_db = _get_available_days(balance_row, "Casual Leave")
-                sl_db = _get_available_days(balance_row, "Sick Leave")
-                co_db = _get_available_days(balance_row, "Comp Off")
-                print(f"[DATA] Using Dataverse balance overrides: CL={cl_db}, SL={sl_db}, CO={co_db}")
-
-                # Use Dataverse values as canonical "Available" counts
-                cl_available = max(0.0, float(cl_db or 0))
-                sl_available = max(0.0, float(sl_db or 0))
-                co_available = max(0.0, float(co_db or 0))
-
-                # Recompute consumed from annual quota so cards stay consistent
-                cl_consumed = max(0.0, float(cl_annual) - cl_available)
-                sl_consumed = max(0.0, float(sl_annual) - sl_available)
-                # Keep co_consumed from history, but ensure non-negative
-                co_consumed = max(0.0, float(co_consumed))
-            except Exception as bal2_err:
-                print(f"[WARN] Failed to apply Dataverse overrides in all-balances: {bal2_err}")
-
-        print(f"\n[DATA] CALCULATED AVAILABLE BALANCES (after overrides if any):")
+        print(f"\n[DATA] CALCULATED AVAILABLE BALANCES (leave ledger):")
         print(f"   Casual Leave Available: {cl_available} (Quota: {cl_annual}, Consumed: {cl_consumed})")
         print(f"   Sick Leave Available: {sl_available} (Quota: {sl_annual}, Consumed: {sl_consumed})")
         print(f"   Comp Off Available: {co_available}")
@@ -7163,30 +7407,42 @@ def get_all_leave_balances(employee_id):
         total_available = cl_available + sl_available + co_available
         actual_total = cl_annual + sl_annual  # Total quota based on allocation type
         
+        # Projected = what stays available once pending requests are approved;
+        # pending paid leaves were consumed at application, so nothing is outstanding
+        outstanding = {"CL": 0.0, "SL": 0.0, "CO": 0.0}
+        pending_total = sum(pending_by_code.values())
         balances = [
             {
                 "type": "Casual Leave",
                 "annual_quota": cl_annual,
                 "consumed": cl_consumed,
-                "available": cl_available
+                "available": cl_available,
+                "pending": pending_by_code["CL"],
+                "projected": max(0.0, cl_available - outstanding["CL"])
             },
             {
                 "type": "Sick Leave",
                 "annual_quota": sl_annual,
                 "consumed": sl_consumed,
-                "available": sl_available
+                "available": sl_available,
+                "pending": pending_by_code["SL"],
+                "projected": max(0.0, sl_available - outstanding["SL"])
             },
             {
                 "type": "Comp off",
                 "annual_quota": co_annual,
                 "consumed": co_consumed,
-                "available": co_available
+                "available": co_available,
+                "pending": pending_by_code["CO"],
+                "projected": max(0.0, co_available - outstanding["CO"])
             },
             {
                 "type": "Total",
                 "annual_quota": cl_annual + sl_annual + co_annual,
                 "consumed": cl_consumed + sl_consumed + co_consumed,
-                "available": total_available
+                "available": total_available,
+                "pending": pending_total,
+                "projected": max(0.0, total_available - sum(outstanding.values()))
             },
             {
                 "type": "Actual Total",
@@ -7543,6 +7799,8 @@ def approve_leave(leave_id):
         
         print(f"   [LOG] Updating leave record {record_id} with status: Approved")
         updated_record = update_record(LEAVE_ENTITY, record_id, update_data)
+        _leave_index_write(record, update_data)
+        _ledger_consume({**record, **update_data})
         
         print(f"[OK] Leave {leave_id} approved successfully by {approved_by}")
         # get mail apporved leave
@@ -7650,6 +7908,8 @@ def reject_leave(leave_id):
         print(f"   [LOG] Updating leave record {record_id} with status: Rejected")
         
         updated_record = update_record(LEAVE_ENTITY, record_id, update_data)
+        _leave_index_write(record, update_data)
+        _ledger_release(record)
         
         # Restore leave balance when a paid leave is rejected (balance was deducted at application time)
         if (
@@ -7709,7 +7969,11 @@ def reject_leave(leave_id):
 
 @app.route('/api/leaves/pending', methods=['GET'])
 def get_pending_leaves():
-    """Get all pending leave requests (for admin review)"""
+    """Get pending leave requests (for admin review).
+
+    Optional: ?manager_id=EMP001[&depth=N] limits results to that manager's
+    (transitive) reports using the hierarchy index.
+    """
     try:
         print(f"\n{'='*70}")
         print(f"[FETCH] FETCHING ALL PENDING LEAVE REQUESTS")
@@ -7722,13 +7986,27 @@ def get_pending_leaves():
             "OData-MaxVersion": "4.0",
             "OData-Version": "4.0"
         }
-        
-        # Fetch all pending leaves
-        filter_query = "?$filter=crc6f_status eq 'Pending'"
-        url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{filter_query}"
-        
-        print(f"   [URL] Request URL: {url}")
-        response = get_dataverse_session().get(url, headers=headers, timeout=15)
+
+        manager_id = (request.args.get('manager_id') or '').strip()
+        team_filters = [""]
+        if manager_id:
+            reports = get_hierarchy_index().reports_of(manager_id, _parse_depth_arg(request.args.get('depth')))
+            if not reports:
+                return jsonify({"success": True, "leaves": [], "count": 0}), 200
+            team_filters = [f" and {clause}" for clause in odata_in_filters("crc6f_employeeid", reports)]
+
+        # Fetch pending leaves (one request per In() chunk when scoped to a team)
+        records = []
+        response = None
+        for team_clause in team_filters:
+            filter_query = f"?$filter=crc6f_status eq 'Pending'{team_clause}"
+            url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{filter_query}"
+
+            print(f"   [URL] Request URL: {url}")
+            response = get_dataverse_session().get(url, headers=headers, timeout=15)
+            if response.status_code != 200:
+                break
+            records.extend(response.json().get("value", []))
         
         if response.status_code != 200:
             print(f"   [ERROR] Failed to fetch pending leaves: {response.status_code}")
@@ -7740,7 +8018,6 @@ def get_pending_leaves():
                 "warning": "Pending leaves unavailable (Dataverse error)"
             }), 200
         
-        records = response.json().get("value", [])
         print(f"   [DATA] Found {len(records)} pending leave requests")
         
         formatted_leaves = []
@@ -7779,6 +8056,52 @@ def get_pending_leaves():
         }), 500
 
 
+def _fetch_on_leave_today_dataverse(headers, today, month_end, ids_list, include_upcoming):
+    """Dataverse fallback for get_on_leave_today while leave_index is not loaded.
+    Returns (records, upcoming_records, error)."""
+    # Build filter for approved leaves that include today
+    date_filter = f"crc6f_startdate le '{today}' and crc6f_enddate ge '{today}' and crc6f_status eq 'Approved'"
+
+    # If specific employee IDs provided, add them to filter
+    if ids_list:
+        emp_filter_parts = [f"crc6f_employeeid eq '{emp_id}'" for emp_id in ids_list]
+        emp_filter = f" and ({' or '.join(emp_filter_parts)})"
+        full_filter = f"?$filter={date_filter}{emp_filter}"
+    else:
+        full_filter = f"?$filter={date_filter}"
+
+    url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{full_filter}"
+    print(f"   [URL] Request URL: {url}")
+    response = get_dataverse_session().get(url, headers=headers, timeout=15)
+    if response.status_code != 200:
+        print(f"   [ERROR] Failed to fetch leaves: {response.status_code}")
+        return [], [], f"Failed to fetch leaves: {response.status_code}"
+
+    records = response.json().get("value", [])
+    print(f"   [DATA] Found {len(records)} employees on leave today")
+
+    upcoming_records = []
+    if include_upcoming:
+        upcoming_filter = f"crc6f_startdate gt '{today}' and crc6f_startdate le '{month_end}' and crc6f_status eq 'Approved'"
+        if ids_list:
+            emp_filter_parts = [f"crc6f_employeeid eq '{emp_id}'" for emp_id in ids_list]
+            emp_filter = f" and ({' or '.join(emp_filter_parts)})"
+            upcoming_full_filter = f"?$filter={upcoming_filter}{emp_filter}"
+        else:
+            upcoming_full_filter = f"?$filter={upcoming_filter}"
+
+        upcoming_url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{upcoming_full_filter}"
+        print(f"   [URL] Upcoming request URL: {upcoming_url}")
+        upcoming_response = get_dataverse_session().get(upcoming_url, headers=headers, timeout=15)
+        if upcoming_response.status_code != 200:
+            print(f"   [ERROR] Failed to fetch upcoming leaves: {upcoming_response.status_code}")
+            return [], [], f"Failed to fetch upcoming leaves: {upcoming_response.status_code}"
+
+        upcoming_records = upcoming_response.json().get("value", [])
+        print(f"   [DATA] Found {len(upcoming_records)} upcoming approved leaves for this month")
+    return records, upcoming_records, None
+
+
 @app.route('/api/leaves/on-leave-today', methods=['GET'])
 def get_on_leave_today():
     """Return active leaves for today, optionally limited to a set of employee IDs."""
@@ -7787,14 +8110,6 @@ def get_on_leave_today():
         print(f"[FETCH] FETCHING EMPLOYEES ON LEAVE FOR TODAY")
         print(f"{'='*70}")
 
-        token = get_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "OData-MaxVersion": "4.0",
-            "OData-Version": "4.0"
-        }
-
         # Get today's date in ISO format
         today = datetime.now().date().isoformat()
         print(f"   [DATE] Today's date: {today}")
@@ -7808,34 +8123,24 @@ def get_on_leave_today():
         month_last_day = monthrange(today_dt.year, today_dt.month)[1]
         month_end = today_dt.replace(day=month_last_day).isoformat()
 
-        # Build filter for approved leaves that include today
-        date_filter = f"crc6f_startdate le '{today}' and crc6f_enddate ge '{today}' and crc6f_status eq 'Approved'"
-
-        # If specific employee IDs provided, add them to filter
-        if ids_list:
-            emp_filter_parts = [f"crc6f_employeeid eq '{emp_id}'" for emp_id in ids_list]
-            emp_filter = f" and ({' or '.join(emp_filter_parts)})"
-            full_filter = f"?$filter={date_filter}{emp_filter}"
+        if leave_index.loaded:
+            records = leave_index.on_date(today, employee_ids=ids_list)
+            upcoming_records = leave_index.starting_between(
+                today_dt + timedelta(days=1), month_end, employee_ids=ids_list
+            ) if include_upcoming else []
+            print(f"   [DATA] Leave index: {len(records)} on leave today, {len(upcoming_records)} upcoming")
         else:
-            full_filter = f"?$filter={date_filter}"
-
-        # Build the URL
-        url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{full_filter}"
-        print(f"   [URL] Request URL: {url}")
-
-        # Make the request
-        response = get_dataverse_session().get(url, headers=headers, timeout=15)
-
-        if response.status_code != 200:
-            print(f"   [ERROR] Failed to fetch leaves: {response.status_code}")
-            return jsonify({
-                "success": False,
-                "error": f"Failed to fetch leaves: {response.status_code}",
-                "leaves": []
-            }), 500
-
-        records = response.json().get("value", [])
-        print(f"   [DATA] Found {len(records)} employees on leave today")
+            headers = {
+                "Authorization": f"Bearer {get_access_token()}",
+                "Accept": "application/json",
+                "OData-MaxVersion": "4.0",
+                "OData-Version": "4.0"
+            }
+            records, upcoming_records, error = _fetch_on_leave_today_dataverse(
+                headers, today, month_end, ids_list, include_upcoming
+            )
+            if error:
+                return jsonify({"success": False, "error": error, "leaves": []}), 500
 
         # Format the response
         leaves = []
@@ -7850,39 +8155,15 @@ def get_on_leave_today():
             })
 
         upcoming_leaves = []
-        if include_upcoming:
-            upcoming_filter = f"crc6f_startdate gt '{today}' and crc6f_startdate le '{month_end}' and crc6f_status eq 'Approved'"
-            if ids_list:
-                emp_filter_parts = [f"crc6f_employeeid eq '{emp_id}'" for emp_id in ids_list]
-                emp_filter = f" and ({' or '.join(emp_filter_parts)})"
-                upcoming_full_filter = f"?$filter={upcoming_filter}{emp_filter}"
-            else:
-                upcoming_full_filter = f"?$filter={upcoming_filter}"
-
-            upcoming_url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{upcoming_full_filter}"
-            print(f"   [URL] Upcoming request URL: {upcoming_url}")
-            upcoming_response = get_dataverse_session().get(upcoming_url, headers=headers, timeout=15)
-
-            if upcoming_response.status_code != 200:
-                print(f"   [ERROR] Failed to fetch upcoming leaves: {upcoming_response.status_code}")
-                return jsonify({
-                    "success": False,
-                    "error": f"Failed to fetch upcoming leaves: {upcoming_response.status_code}",
-                    "leaves": []
-                }), 500
-
-            upcoming_records = upcoming_response.json().get("value", [])
-            print(f"   [DATA] Found {len(upcoming_records)} upcoming approved leaves for this month")
-
-            for r in upcoming_records:
-                upcoming_leaves.append({
-                    "employee_id": r.get("crc6f_employeeid"),
-                    "leave_type": r.get("crc6f_leavetype"),
-                    "start_date": r.get("crc6f_startdate"),
-                    "end_date": r.get("crc6f_enddate"),
-                    "status": r.get("crc6f_status"),
-                    "reason": r.get("crc6f_reason", "")
-                })
+        for r in upcoming_records:
+            upcoming_leaves.append({
+                "employee_id": r.get("crc6f_employeeid"),
+                "leave_type": r.get("crc6f_leavetype"),
+                "start_date": r.get("crc6f_startdate"),
+                "end_date": r.get("crc6f_enddate"),
+                "status": r.get("crc6f_status"),
+                "reason": r.get("crc6f_reason", "")
+            })
 
         print(f"   [SEND] Returning {len(leaves)} leave records")
         print(f"{'='*70}\n")
@@ -7918,14 +8199,6 @@ def get_upcoming_leaves():
         print(f"[FETCH] FETCHING UPCOMING LEAVES")
         print(f"{'='*70}")
 
-        token = get_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "OData-MaxVersion": "4.0",
-            "OData-Version": "4.0"
-        }
-
         today_dt = datetime.now().date()
         last_day = monthrange(today_dt.year, today_dt.month)[1]
         range_start_dt = today_dt + timedelta(days=1)
@@ -7938,29 +8211,41 @@ def get_upcoming_leaves():
         print(f"   [DATE] Filter range: {start_date} to {end_date}")
         print(f"   [DATE] Days remaining in month: {days}")
 
-        # Fetch ALL leaves without status filter - Dataverse may store status
-        # in different cases (e.g. "approved", "Approved", "APPROVED").
-        # Filter status and date window in Python, same pattern as the working
-        # attendance monthly overlay code (line ~5143 in this file).
-        filter_query = (
-            "?$select="
-            "crc6f_employeeid,crc6f_leavetype,crc6f_startdate,crc6f_enddate,crc6f_totaldays,crc6f_status"
-            "&$top=5000"
-        )
-        url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{filter_query}"
-        print(f"   [URL] Request URL: {url}")
+        if leave_index.loaded:
+            records = leave_index.starting_between(range_start_dt, range_end_dt, statuses=("approved", "pending"))
+            print(f"   [DATA] Leave index: {len(records)} leaves starting in range")
+        else:
+            token = get_access_token()
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/json",
+                "OData-MaxVersion": "4.0",
+                "OData-Version": "4.0"
+            }
 
-        response = get_dataverse_session().get(url, headers=headers, timeout=15)
-        if response.status_code != 200:
-            print(f"   [ERROR] Failed to fetch upcoming leaves: {response.status_code}")
-            return jsonify({
-                "success": False,
-                "error": f"Failed to fetch upcoming leaves: {response.status_code}",
-                "leaves": []
-            }), 500
+            # Fetch ALL leaves without status filter - Dataverse may store status
+            # in different cases (e.g. "approved", "Approved", "APPROVED").
+            # Filter status and date window in Python, same pattern as the working
+            # attendance monthly overlay code (line ~5143 in this file).
+            filter_query = (
+                "?$select="
+                "crc6f_employeeid,crc6f_leavetype,crc6f_startdate,crc6f_enddate,crc6f_totaldays,crc6f_status"
+                "&$top=5000"
+            )
+            url = f"{RESOURCE}/api/data/v9.2/{LEAVE_ENTITY}{filter_query}"
+            print(f"   [URL] Request URL: {url}")
 
-        records = response.json().get("value", [])
-        print(f"   [DATA] Total leave records from Dataverse: {len(records)}")
+            response = get_dataverse_session().get(url, headers=headers, timeout=15)
+            if response.status_code != 200:
+                print(f"   [ERROR] Failed to fetch upcoming leaves: {response.status_code}")
+                return jsonify({
+                    "success": False,
+                    "error": f"Failed to fetch upcoming leaves: {response.status_code}",
+                    "leaves": []
+                }), 500
+
+            records = response.json().get("value", [])
+            print(f"   [DATA] Total leave records from Dataverse: {len(records)}")
 
         leaves = []
         for r in records:
@@ -8000,6 +8285,14 @@ def get_upcoming_leaves():
 
         leaves.sort(key=lambda row: ((row.get("days_until") if row.get("days_until") is not None else 9999), row.get("employee_id") or ""))
 
+        # Working days for every listed leave in one vectorised pass
+        if leaves:
+            working = business_calendar.working_days_batch(
+                [row["start_date"] for row in leaves], [row["end_date"] for row in leaves]
+            )
+            for row, row_days in zip(leaves, working):
+                row["working_days"] = int(row_days)
+
         print(f"   [SEND] Returning {len(leaves)} upcoming leave records")
         print(f"{'='*70}\n")
 
@@ -8641,24 +8934,30 @@ def get_all_employees():
             if field_map.get(k)
         ]
 
-        select_fields = f"$select={','.join(select_list)}"
-        url = f"{RESOURCE}/api/data/v9.2/{entity_set}?{select_fields}&$top={fetch_count}&$orderby=createdon desc"
+        replica_rows = dataverse_replica.read("employees")
+        if replica_rows is not None:
+            replica_rows.sort(key=lambda r: str(r.get("createdon") or ""), reverse=True)
+            records = replica_rows[:fetch_count]
+            print(f"[REPLICA] Serving {len(records)} employee records from local replica")
+        else:
+            select_fields = f"$select={','.join(select_list)}"
+            url = f"{RESOURCE}/api/data/v9.2/{entity_set}?{select_fields}&$top={fetch_count}&$orderby=createdon desc"
 
-        print(f"[URL] Fetching from Dataverse: {url}")
-        resp = get_dataverse_session().get(url, headers=headers, timeout=15)
-        print(f"[DATA] Dataverse status: {resp.status_code}")
+            print(f"[URL] Fetching from Dataverse: {url}")
+            resp = get_dataverse_session().get(url, headers=headers, timeout=15)
+            print(f"[DATA] Dataverse status: {resp.status_code}")
 
-        if resp.status_code != 200:
-            print(f"[ERROR] Dataverse error: {resp.text}")
-            return jsonify({
-                "success": False,
-                "error": f"Failed to fetch employees ({resp.status_code})",
-                "details": resp.text
-            }), 500
+            if resp.status_code != 200:
+                print(f"[ERROR] Dataverse error: {resp.text}")
+                return jsonify({
+                    "success": False,
+                    "error": f"Failed to fetch employees ({resp.status_code})",
+                    "details": resp.text
+                }), 500
 
-        data = resp.json()
-        records = data.get("value", [])
-        print(f"[OK] Retrieved {len(records)} employee records")
+            data = resp.json()
+            records = data.get("value", [])
+            print(f"[OK] Retrieved {len(records)} employee records")
 
         employees = []
         for rec in records:
@@ -8827,6 +9126,7 @@ def create_employee():
         _apply_employee_rpt(payload)
         
         created = create_record(entity_set, payload)
+        id_sequences.observe("employee", employee_id)
         
         # Auto-create login record for the new employee
         if email:
@@ -8887,7 +9187,7 @@ def create_employee():
                             'employee_id': employee_id
                         }
                         send_login_credentials_email(employee_data, credentials)
-                        print(f"[OK] Login credentials email sent to {email}")
+                        print(f"[OK] Login credentials email queued for {email}")
             except Exception as login_err:
                 print(f"   [ERROR] Failed to create login record: {login_err}")
                 import traceback
@@ -9722,293 +10022,212 @@ def get_last_employee_id():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+# ================== BULK EMPLOYEE IMPORT ==================
+# Uploads are validated in the request and written by employee_import_runner in
+# the background (see bulk_import.py): one $batch per 25 rows, one changeset
+# (employee + login + leave balance) per row, job state in storage/import_jobs.db.
+import_jobs = ImportJobStore()
+
+
+def _bulk_employee_changeset(emp_data, entity_set, field_map, login_table):
+    """Dataverse creates for one import row: employee, login (when needed) and leave balance."""
+    emp_id = emp_data.get("employee_id")
+    first_name = emp_data.get("first_name", "")
+    email_val = (emp_data.get("email") or "").strip()
+    designation_val = emp_data.get("designation", "")
+    doj_val = emp_data.get("doj")
+
+    payload = {}
+    if field_map['id']:
+        payload[field_map['id']] = emp_id
+    if field_map['fullname']:
+        payload[field_map['fullname']] = f"{first_name} {emp_data.get('last_name', '')}".strip()
+    else:
+        if field_map['firstname']:
+            payload[field_map['firstname']] = first_name
+        if field_map['lastname']:
+            payload[field_map['lastname']] = emp_data.get("last_name")
+    if field_map['email']:
+        payload[field_map['email']] = email_val
+    if field_map['contact']:
+        payload[field_map['contact']] = emp_data.get("contact_number")
+    if field_map['address']:
+        payload[field_map['address']] = emp_data.get("address")
+    if field_map['department']:
+        payload[field_map['department']] = emp_data.get("department")
+    if field_map['designation']:
+        payload[field_map['designation']] = designation_val
+    if field_map['doj']:
+        payload[field_map['doj']] = doj_val
+    if field_map['active']:
+        payload[field_map['active']] = "Active" if normalize_active(emp_data.get("active")) else "Inactive"
+    experience = calculate_experience(doj_val) if doj_val else 0
+    if field_map.get('experience') and doj_val:
+        payload[field_map['experience']] = str(experience)
+    if field_map.get('quota_hours'):
+        payload[field_map['quota_hours']] = "9"
+    operations = [("POST", entity_set, payload)]
+
+    if emp_data.get("_create_login"):
+        name_val = f"{first_name} {emp_data.get('last_name', '')}".strip()
+        operations.append(("POST", login_table, {
+            "crc6f_username": email_val.lower(),
+            "crc6f_password": _hash_password(os.getenv("DEFAULT_USER_PASSWORD", "Temp@123")),
+            "crc6f_user_status": "Active",
+            "crc6f_loginattempts": "0",
+            "crc6f_employeename": name_val or emp_id,
+            "crc6f_accesslevel": determine_access_level(designation_val),
+            "crc6f_userid": generate_user_id(emp_id, first_name),
+        }))
+
+    cl, sl, total, allocation_type = get_leave_allocation_by_experience(experience)
+    operations.append(("POST", LEAVE_BALANCE_ENTITY, {
+        "crc6f_employeeid": emp_id,
+        "crc6f_cl": str(cl),
+        "crc6f_sl": str(sl),
+        "crc6f_compoff": "0",
+        "crc6f_total": str(total),
+        "crc6f_actualtotal": str(cl + sl),  # Actual total = CL + SL (no comp off initially)
+        "crc6f_leaveallocationtype": allocation_type,
+    }))
+    return operations
+
+
+def _import_employee_batch(rows):
+    """ImportRunner batch: one $batch request, each row committed or rolled back on its own."""
+    token = get_access_token()
+    entity_set = get_employee_entity_set(token)
+    field_map = get_field_map(entity_set)
+    login_table = get_login_table(token)
+    changesets = [_bulk_employee_changeset(data, entity_set, field_map, login_table) for _, data in rows]
+    results = execute_batch(changesets, token=token)
+    return {
+        row_no: ("created", None) if r["ok"] else ("failed", r["error"] or f"HTTP {r['status']}")
+        for (row_no, _), r in zip(rows, results)
+    }
+
+
+def _recover_employee_rows(rows):
+    """Rows whose employee ID is already in Dataverse (their changeset committed)."""
+    token = get_access_token()
+    entity_set = get_employee_entity_set(token)
+    id_field = get_field_map(entity_set).get('id') or 'crc6f_employeeid'
+    existing = {str(v).upper() for v in fetch_column_values(entity_set, id_field) if v}
+    return {row_no for row_no, data in rows if str(data.get("employee_id") or "").upper() in existing}
+
+
+def _employee_import_finished(job_id):
+    dataverse_replica.invalidate("employees")
+
+
+employee_import_runner = ImportRunner(
+    import_jobs, _import_employee_batch, recover=_recover_employee_rows, on_finish=_employee_import_finished,
+)
+employee_import_runner.start()
+
+
 @app.route('/api/employees/bulk', methods=['POST'])
 def bulk_create_employees():
-    """Bulk upload employees from CSV data"""
+    """Validate a bulk upload (JSON `employees` array or CSV `file`) and queue it as an import job"""
     try:
+        if 'file' in request.files:
+            # Parsed row by row straight off the upload stream
+            stream = io.TextIOWrapper(request.files['file'].stream, encoding='utf-8-sig', newline='')
+            rows = iter_csv_employees(stream)
+        else:
+            data = request.get_json(force=True) or {}
+            rows = enumerate(data.get('employees') or [], start=1)
+
         token = get_access_token()
         entity_set = get_employee_entity_set(token)
         field_map = get_field_map(entity_set)
-        data = request.get_json(force=True)
-        
-        employees = data.get('employees', [])
-        if not employees:
-            return jsonify({"success": False, "error": "No employees provided"}), 400
-        
-        print(f"\n[SEND] Bulk upload: Processing {len(employees)} employees")
-        print(f"Entity Set: {entity_set}")
-        print(f"Field Map: {field_map}")
-        
-        # Get the last employee ID for auto-increment
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "OData-MaxVersion": "4.0",
-            "OData-Version": "4.0"
+        id_field = field_map.get('id') or 'crc6f_employeeid'
+
+        # One paged scan each instead of per-row lookups
+        existing_ids = {str(v).strip().upper() for v in fetch_column_values(entity_set, id_field) if v}
+        existing_emails = set()
+        if field_map.get('email'):
+            existing_emails = {str(v).strip().lower() for v in fetch_column_values(entity_set, field_map['email']) if v}
+        existing_logins = {
+            str(v).strip().lower() for v in fetch_column_values(get_login_table(token), "crc6f_username") if v
         }
-        
-        # Auto-generate employee IDs if not provided in CSV
-        start_number = 1
-        select_fields = f"$select={field_map['id']}"
-        url = f"{BASE_URL}/{entity_set}?{select_fields}&$orderby=createdon desc&$top=100"
-        response = get_dataverse_session().get(url, headers=headers, timeout=15)
-        
-        if response.status_code == 200:
-            records = response.json().get('value', [])
-            max_number = 0
-            for record in records:
-                emp_id = record.get(field_map['id'], '')
-                if emp_id and isinstance(emp_id, str) and emp_id.upper().startswith('EMP'):
-                    try:
-                        number_str = emp_id.upper().replace('EMP', '').strip()
-                        if number_str.isdigit():
-                            number = int(number_str)
-                            max_number = max(max_number, number)
-                    except (ValueError, AttributeError):
-                        continue
-            start_number = max_number + 1
-            print(f"[DATA] Starting employee ID generation from: EMP{start_number:04d}")
-        
-        # Assign auto-generated IDs to employees without IDs
-        for idx, emp in enumerate(employees):
-            if not emp.get('employee_id') or emp.get('employee_id').strip() == '':
-                next_id = format_employee_id(start_number + idx)
-                emp['employee_id'] = next_id
-                print(f"   Generated ID for employee {idx + 1}: {next_id}")
-        
-        # Check for duplicate employee IDs in Dataverse
-        print("\n[SEARCH] Checking for duplicate employee IDs...")
-        try:
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Accept": "application/json",
-                "OData-MaxVersion": "4.0",
-                "OData-Version": "4.0"
-            }
-            
-            # Get all existing employee IDs
-            url = f"{BASE_URL}/{entity_set}?$select={field_map['id']}"
-            response = get_dataverse_session().get(url, headers=headers, timeout=15)
-            
-            if response.status_code == 200:
-                existing_records = response.json().get('value', [])
-                existing_ids = set()
-                for record in existing_records:
-                    emp_id = record.get(field_map['id'])
-                    if emp_id:
-                        existing_ids.add(str(emp_id).upper())
-                
-                print(f"[OK] Found {len(existing_ids)} existing employee IDs in Dataverse")
-                
-                # Check for duplicates in the upload (only check provided IDs, not auto-generated ones)
-                csv_ids = [emp.get('employee_id', '').upper() for emp in employees if emp.get('employee_id') and emp.get('employee_id').strip()]
-                duplicates = [emp_id for emp_id in csv_ids if emp_id in existing_ids]
-                
-                if duplicates:
-                    print(f"[ERROR] Found {len(duplicates)} duplicate employee IDs: {duplicates}")
-                    return jsonify({
-                        "success": False,
-                        "error": "Duplicate employee IDs found",
-                        "duplicates": duplicates,
-                        "message": f"Cannot upload: {len(duplicates)} employee ID(s) already exist in the system"
-                    }), 400
-                
-                print("[OK] No duplicates found, proceeding with upload")
+
+        valid, invalid = [], []
+        seen_ids, seen_emails = set(), set()
+        for row_no, emp in rows:
+            errors = validate_employee(emp, seen_ids, seen_emails, existing_ids, existing_emails)
+            if errors:
+                invalid.append({"row": row_no, "employee_id": emp.get("employee_id") or None, "errors": errors})
             else:
-                print(f"[WARN] Could not fetch existing employees (status {response.status_code}), proceeding anyway")
-        except Exception as check_err:
-            print(f"[WARN] Error checking for duplicates: {str(check_err)}, proceeding anyway")
-        
-        created_count = 0
-        errors = []
-        
-        # Get the last employee ID for auto-generation
-        last_emp_id = None
-        try:
-            last_id_response = get_dataverse_session().get(f"{RESOURCE}/api/data/v9.2/{entity_set}?$select={field_map['id']}&$orderby={field_map['id']} desc&$top=1", headers=headers, timeout=15)
-            if last_id_response.status_code == 200:
-                last_records = last_id_response.json().get('value', [])
-                if last_records:
-                    last_emp_id = last_records[0].get(field_map['id'])
-                    print(f"[DATA] Last employee ID in Dataverse: {last_emp_id}")
-        except Exception as e:
-            print(f"[WARN] Could not fetch last employee ID: {e}")
-        
-        # Extract numeric part from last ID for auto-increment
-        next_id_num = 1
-        if last_emp_id:
-            import re
-            match = re.search(r'(\d+)', str(last_emp_id))
-            if match:
-                next_id_num = int(match.group(1)) + 1
-        
-        for idx, emp_data in enumerate(employees):
-            try:
-                # Build payload based on table structure
-                payload = {}
-                
-                # Handle employee ID - auto-generate if missing
-                if field_map['id']:
-                    emp_id = emp_data.get("employee_id")
-                    if not emp_id or emp_id.strip() == "":
-                        # Auto-generate employee ID with 3 digits
-                        emp_id = f"EMP{next_id_num:03d}"
-                        next_id_num += 1
-                        print(f"[PROC] Auto-generated employee ID: {emp_id}")
-                    else:
-                        print(f"[FETCH] Using provided employee ID: {emp_id}")
-                    payload[field_map['id']] = emp_id
-                
-                # Handle name fields
-                if field_map['fullname']:
-                    first = emp_data.get("first_name", "")
-                    last = emp_data.get("last_name", "")
-                    payload[field_map['fullname']] = f"{first} {last}".strip()
-                else:
-                    if field_map['firstname']:
-                        payload[field_map['firstname']] = emp_data.get("first_name")
-                    if field_map['lastname']:
-                        payload[field_map['lastname']] = emp_data.get("last_name")
-                
-                # Other fields
-                email_val = emp_data.get("email", "")
-                designation_val = emp_data.get("designation", "")
-                doj_val = emp_data.get("doj")
-                first_name = emp_data.get("first_name", "")
-                
-                if field_map['email']:
-                    payload[field_map['email']] = email_val
-                if field_map['contact']:
-                    payload[field_map['contact']] = emp_data.get("contact_number")
-                if field_map['address']:
-                    payload[field_map['address']] = emp_data.get("address")
-                if field_map['department']:
-                    payload[field_map['department']] = emp_data.get("department")
-                if field_map['designation']:
-                    payload[field_map['designation']] = designation_val
-                if field_map['doj']:
-                    payload[field_map['doj']] = doj_val
-                if field_map['active']:
-                    # Convert boolean to string format expected by Dataverse
-                    active_value = emp_data.get("active")
-                    if isinstance(active_value, bool):
-                        payload[field_map['active']] = "Active" if active_value else "Inactive"
-                    else:
-                        # Handle string values
-                        payload[field_map['active']] = "Active" if str(active_value).lower() in ['true', '1', 'active'] else "Inactive"
-                
-                # Calculate and add experience
-                if field_map.get('experience') and doj_val:
-                    experience = calculate_experience(doj_val)
-                    payload[field_map['experience']] = str(experience)
-                
-                # Set quota hours to 9
-                if field_map.get('quota_hours'):
-                    payload[field_map['quota_hours']] = "9"
-                
-                print(f"\n[LOG] Row {idx + 1}: {emp_data.get('employee_id')} - {emp_data.get('first_name')} {emp_data.get('last_name')}")
-                print(f"   Payload: {payload}")
-                
-                create_record(entity_set, payload)
-                print(f"   [OK] Success")
-                created_count += 1
+                valid.append((row_no, emp))
 
-                # Auto-create login if email is present and not already created
-                try:
-                    email_val = (emp_data.get("email") or "").strip()
-                    name_val = (f"{emp_data.get('first_name','')} {emp_data.get('last_name','')}").strip()
-                    if email_val:
-                        # Check if login exists
-                        headers_login = {
-                            "Authorization": f"Bearer {token}",
-                            "Accept": "application/json",
-                            "OData-MaxVersion": "4.0",
-                            "OData-Version": "4.0"
-                        }
-                        login_table = get_login_table(token)
-                        safe_email = email_val.strip().replace("'", "''")
-                        check_url = f"{BASE_URL}/{login_table}?$top=1&$filter=crc6f_username eq '{safe_email}'"
-                        resp_check = get_dataverse_session().get(check_url, headers=headers_login, timeout=15)
-                        exists = False
-                        if resp_check.status_code == 200:
-                            recs = resp_check.json().get("value", [])
-                            exists = len(recs) > 0
-                        if not exists:
-                            default_password = os.getenv("DEFAULT_USER_PASSWORD", "Temp@123")
-                            hashed = _hash_password(default_password)
-                            access_level = determine_access_level(designation_val)
-                            user_id = generate_user_id(emp_id, first_name)
-                            login_payload = {
-                                "crc6f_username": email_val.lower(),
-                                "crc6f_password": hashed,
-                                "crc6f_user_status": "Active",
-                                "crc6f_loginattempts": "0",
-                                "crc6f_employeename": name_val or emp_data.get("employee_id"),
-                                "crc6f_accesslevel": access_level,
-                                "crc6f_userid": user_id
-                            }
-                            try:
-                                create_record(login_table, login_payload)
-                                print(f"   [USER] Created login for {email_val} | Access: {access_level} | UserID: {user_id}")
-                            except Exception as le:
-                                print(f"   [WARN] Failed creating login for {email_val}: {le}")
-                except Exception as auto_login_err:
-                    print(f"   [WARN] Auto-login creation skipped: {auto_login_err}")
-                
-                # Auto-create leave balance record for the new employee
-                try:
-                    if emp_id:
-                        print(f"   [FETCH] Creating leave balance for {emp_id}")
-                        
-                        # Calculate experience if DOJ is provided
-                        experience = 0
-                        if doj_val:
-                            experience = calculate_experience(doj_val)
-                        
-                        # Get leave allocation based on experience
-                        cl, sl, total, allocation_type = get_leave_allocation_by_experience(experience)
-                        actual_total = cl + sl  # Actual total = CL + SL (no comp off initially)
-                        
-                        print(f"   [DATA] Experience: {experience} years -> {allocation_type}")
-                        print(f"   [FETCH] Leave allocation: CL={cl}, SL={sl}, Total Quota={total}")
-                        
-                        leave_payload = {
-                            "crc6f_employeeid": emp_id,
-                            "crc6f_cl": str(cl),
-                            "crc6f_sl": str(sl),
-                            "crc6f_compoff": "0",
-                            "crc6f_total": str(total),
-                            "crc6f_actualtotal": str(actual_total),
-                            "crc6f_leaveallocationtype": allocation_type
-                        }
-                        
-                        create_record(LEAVE_BALANCE_ENTITY, leave_payload)
-                        print(f"   [OK] Leave balance created for {emp_id}")
-                except Exception as leave_err:
-                    print(f"   [WARN] Failed to create leave balance for {emp_id}: {leave_err}")
-            except Exception as e:
-                error_msg = f"Row {idx + 1} ({emp_data.get('employee_id')}): {str(e)}"
-                print(f"   [ERROR] Error: {error_msg}")
-                errors.append(error_msg)
-        
-        response = {
+        if not valid and not invalid:
+            return jsonify({"success": False, "error": "No employees provided"}), 400
+        if invalid:
+            duplicates = sorted({
+                str(r["employee_id"]).upper() for r in invalid
+                if r["employee_id"] and any("employee_id" in e and "already exists" in e for e in r["errors"])
+            })
+            print(f"[ERROR] Bulk upload rejected: {len(invalid)} invalid row(s)")
+            return jsonify({
+                "success": False,
+                "error": "Duplicate employee IDs found" if duplicates else "Validation failed",
+                "duplicates": duplicates,
+                "invalid": invalid,
+                "message": f"Cannot upload: {len(invalid)} row(s) failed validation"
+            }), 400
+
+        # Rows without an ID get one contiguous block from the sequence
+        missing = [emp for _, emp in valid if not str(emp.get('employee_id') or '').strip()]
+        for emp, next_id in zip(missing, id_sequences.reserve("employee", len(missing))):
+            emp['employee_id'] = next_id
+        id_sequences.observe("employee", id_sequences.max_number("employee", seen_ids))
+        for _, emp in valid:
+            emp['employee_id'] = str(emp['employee_id']).strip().upper()
+            emp['active'] = normalize_active(emp.get('active'))
+            email = str(emp.get('email') or '').strip().lower()
+            emp['_create_login'] = bool(email) and email not in existing_logins
+
+        job_id = import_jobs.create_job("employees", valid)
+        employee_import_runner.submit(job_id)
+        print(f"\n[SEND] Bulk upload: queued {len(valid)} employees as job {job_id}")
+        return jsonify({
             "success": True,
-            "count": created_count,
-            "total": len(employees),
-            "entitySet": entity_set
-        }
-        
-        if errors:
-            response["errors"] = errors
-            response["message"] = f"Uploaded {created_count} out of {len(employees)} employees. Some records failed."
-        else:
-            response["message"] = f"Successfully uploaded all {created_count} employees to Dataverse!"
-        
-        return jsonify(response), 201
+            "job_id": job_id,
+            "total": len(valid),
+            "status_url": f"/api/employees/bulk/{job_id}",
+            "report_url": f"/api/employees/bulk/{job_id}/report",
+            "message": f"Import of {len(valid)} employees started"
+        }), 202
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route('/api/employees/bulk/<job_id>', methods=['GET'])
+def bulk_import_progress(job_id):
+    progress = import_jobs.progress(job_id)
+    if progress is None:
+        return jsonify({"success": False, "error": "Import job not found"}), 404
+    return jsonify({"success": True, **progress})
+
+
+@app.route('/api/employees/bulk/<job_id>/report', methods=['GET'])
+def bulk_import_report(job_id):
+    """Per-row results; ?format=csv downloads them"""
+    progress = import_jobs.progress(job_id)
+    if progress is None:
+        return jsonify({"success": False, "error": "Import job not found"}), 404
+    rows = import_jobs.report(job_id)
+    if request.args.get("format") == "csv":
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=["row", "employee_id", "status", "error"])
+        writer.writeheader()
+        writer.writerows(rows)
+        return Response(out.getvalue(), mimetype="text/csv",
+                        headers={"Content-Disposition": f"attachment; filename=employee_import_{job_id}.csv"})
+    return jsonify({"success": True, **progress, "rows": rows})
+
+
 # ================== TEAM MANAGEMENT ROUTES ==================
 def _build_employee_lookup(token: str, employee_ids: set) -> dict:
     if not employee_ids:
@@ -10240,6 +10459,9 @@ def create_hierarchy():
             return jsonify({"success": False, "error": "Employee ID and Manager ID are required"}), 400
         if employee_id.lower() == manager_id.lower():
             return jsonify({"success": False, "error": "Employee and Manager cannot be the same"}), 400
+        hierarchy_index = get_hierarchy_index()
+        if hierarchy_index.would_create_cycle(employee_id, manager_id):
+            return jsonify({"success": False, "error": f"{manager_id} already reports to {employee_id}; this would create a reporting cycle"}), 400
 
         token = get_access_token()
         entity = get_hierarchy_entity(token)
@@ -10261,6 +10483,10 @@ def create_hierarchy():
 
         display_row = _compose_hierarchy_display(token=get_access_token(), employee_id=employee_id, manager_id=manager_id, record_id=record_id)
         _upsert_team_hierarchy_local(display_row)
+        try:
+            hierarchy_index.add(record_id, employee_id, manager_id)
+        except HierarchyCycleError:
+            hierarchy_index.invalidate()
 
         return jsonify({
             "success": True,
@@ -10289,6 +10515,11 @@ def update_hierarchy(record_id):
         # Normalize record id
         normalized_record = _normalize_guid(record_id)
 
+        hierarchy_index = get_hierarchy_index()
+        current_employee = hierarchy_index.employee_of(normalized_record) or (_find_local_hierarchy_record(normalized_record) or {}).get('employeeId')
+        if current_employee and hierarchy_index.would_create_cycle(current_employee, manager_id):
+            return jsonify({"success": False, "error": f"{manager_id} already reports to {current_employee}; this would create a reporting cycle"}), 400
+
         payload = {
             HIERARCHY_MANAGER_FIELD: manager_id
         }
@@ -10303,6 +10534,10 @@ def update_hierarchy(record_id):
         employee_id = existing.get('employeeId') or ''
         display_row = _compose_hierarchy_display(token=get_access_token(), employee_id=employee_id, manager_id=manager_id, record_id=normalized_record)
         _upsert_team_hierarchy_local(display_row)
+        try:
+            hierarchy_index.update(normalized_record, manager_id, employee_id=current_employee or employee_id)
+        except HierarchyCycleError:
+            hierarchy_index.invalidate()
 
         return jsonify({"success": True})
     except Exception as e:
@@ -10324,6 +10559,7 @@ def delete_hierarchy(record_id):
             print(f"[WARN] Dataverse delete failed, removing from local cache: {dv_err}")
 
         _delete_team_hierarchy_local(normalized_record)
+        get_hierarchy_index().remove(normalized_record)
 
         return jsonify({"success": True})
     except Exception as e:
@@ -10332,6 +10568,37 @@ def delete_hierarchy(record_id):
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+def _parse_depth_arg(value):
+    try:
+        depth = int(value)
+        return depth if depth > 0 else None
+    except (TypeError, ValueError):
+        return None
+
+
+@app.route('/api/team-management/hierarchy/reports/<manager_id>', methods=['GET'])
+def get_hierarchy_reports(manager_id):
+    """Transitive reports of a manager. ?depth=1 limits to direct reports."""
+    try:
+        depth = _parse_depth_arg(request.args.get('depth'))
+        reports = get_hierarchy_index().reports_of(manager_id, depth)
+        return jsonify({"success": True, "managerId": manager_id, "depth": depth, "reports": reports, "count": len(reports)})
+    except Exception as e:
+        print(f"[ERROR] Error resolving hierarchy reports: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route('/api/team-management/hierarchy/chain/<employee_id>', methods=['GET'])
+def get_hierarchy_chain(employee_id):
+    """Management chain of an employee, nearest manager first."""
+    try:
+        chain = get_hierarchy_index().chain_of(employee_id)
+        return jsonify({"success": True, "employeeId": employee_id, "chain": chain})
+    except Exception as e:
+        print(f"[ERROR] Error resolving hierarchy chain: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 # ================== ASSET MANAGEMENT ROUTES ==================
 # ================== ASSET MANAGEMENT ROUTES ==================
 @app.route("/api/assets", methods=["GET"])
@@ -10390,13 +10657,14 @@ def list_clients():
             "crc6f_clientid,crc6f_clientname,crc6f_companyname,crc6f_email,crc6f_phone,"
             "crc6f_address,crc6f_country,crc6f_hr_clientsid,createdby,createdon"
         )
-        entity_set = get_clients_entity(token)
-        url = f"{RESOURCE}/api/data/v9.2/{entity_set}?{select}&$top=5000"
-        resp = get_dataverse_session().get(url, headers=headers, timeout=15)
-        if resp.status_code != 200:
-            return jsonify({"success": False, "error": resp.text}), resp.status_code
-
-        values = resp.json().get("value", [])
+        values = dataverse_replica.read("clients")
+        if values is None:
+            entity_set = get_clients_entity(token)
+            url = f"{RESOURCE}/api/data/v9.2/{entity_set}?{select}&$top=5000"
+            resp = get_dataverse_session().get(url, headers=headers, timeout=15)
+            if resp.status_code != 200:
+                return jsonify({"success": False, "error": resp.text}), resp.status_code
+            values = resp.json().get("value", [])
 
         # Filters
         q = (request.args.get("search") or "").strip().lower()
@@ -10495,6 +10763,7 @@ def create_client():
         }
         _apply_clients_rpt(payload)
         created = create_record(entity_set, payload)
+        id_sequences.observe("client", client_id)
         return jsonify({"success": True, "client": created}), 201
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -10539,32 +10808,8 @@ def delete_client(record_id):
 @app.route("/api/clients/next-id", methods=["GET"])
 def get_next_client_id():
     try:
-        token = get_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "OData-MaxVersion": "4.0",
-            "OData-Version": "4.0",
-        }
-        entity_set = get_clients_entity(token)
-        url = f"{RESOURCE}/api/data/v9.2/{entity_set}?$select=crc6f_clientid&$orderby=createdon desc&$top=200"
-        resp = get_dataverse_session().get(url, headers=headers, timeout=15)
-        if resp.status_code != 200:
-            return jsonify({"success": False, "error": "Failed to fetch clients"}), 500
-        values = resp.json().get("value", [])
-        max_n = 0
-        for r in values:
-            cid = r.get("crc6f_clientid") or ""
-            if isinstance(cid, str) and cid.upper().startswith("CL"):
-                try:
-                    n = int(''.join([c for c in cid[2:] if c.isdigit()]) or "0")
-                    if n > max_n:
-                        max_n = n
-                except Exception:
-                    pass
-        next_num = max_n + 1
-        next_id = f"CL{next_num:03d}"
-        return jsonify({"success": True, "next_id": next_id})
+        # Pre-fills the form without allocating; create_client observes the ID actually saved
+        return jsonify({"success": True, "next_id": id_sequences.peek("client")})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 # ================== SIMPLE CLIENT NAME FETCH (for dropdowns) ==================
@@ -10610,10 +10855,28 @@ def get_all_clients():
         return jsonify({"success": False, "error": str(e)}), 500
 
 # ================== HOLIDAY MANAGEMENT ROUTES ==================
+@app.route("/api/dataverse/stats", methods=["GET"])
+def get_dataverse_client_stats():
+    """Throttle/retry counters and the adaptive concurrency limit for this worker, plus the entity-set metadata snapshot."""
+    return jsonify({"success": True, "worker_pid": os.getpid(), "stats": get_dataverse_stats(),
+                    "metadata": entity_set_catalogue.stats()}), 200
+
+
+@app.route("/api/replica/status", methods=["GET"])
+def get_replica_status():
+    """Staleness metadata for the local Dataverse read replica."""
+    return jsonify({"success": True, "tables": dataverse_replica.status(), "leave_index": leave_index.stats()}), 200
+
+
 @app.route("/api/holidays", methods=["GET"])
 def get_holidays():
     """Fetch all holidays from Dataverse"""
     try:
+        replica_rows = dataverse_replica.read("holidays")
+        if replica_rows is not None:
+            replica_rows.sort(key=lambda h: str(h.get("crc6f_date") or ""))
+            return jsonify(replica_rows), 200
+
         print("[RECV] Fetching holidays from Dataverse...")
         token = get_access_token()
         headers = {
@@ -10731,205 +10994,149 @@ def delete_holiday(holiday_id):
         return jsonify({"error": str(e)}), 500
 
 
-# ================== DELETED EMPLOYEES CSV MANAGEMENT ==================
-DELETED_EMPLOYEES_CSV = "Deleted_employees.csv"
+# ================== DELETED EMPLOYEES ARCHIVE ==================
+# Keyed SQLite archive (employee_archive.py); imports Deleted_employees.csv once.
+deleted_employee_archive = get_employee_archive()
+# A restore is one $batch changeset (all or nothing); Dataverse caps a changeset at 1000 requests
+DELETED_EMPLOYEE_RESTORE_MAX = 1000
+
+
+def _archived_employee_payload(emp, field_map):
+    """Dataverse create payload for an archived employee snapshot"""
+    payload = {}
+
+    # Employee ID
+    if field_map['id']:
+        payload[field_map['id']] = emp.get('employee_id')
+
+    # Name fields
+    if field_map['fullname']:
+        payload[field_map['fullname']] = f"{emp.get('first_name', '')} {emp.get('last_name', '')}".strip()
+    else:
+        if field_map['firstname']:
+            payload[field_map['firstname']] = emp.get('first_name')
+        if field_map['lastname']:
+            payload[field_map['lastname']] = emp.get('last_name')
+
+    # Other fields
+    if field_map['email']:
+        payload[field_map['email']] = emp.get('email')
+    if field_map['contact']:
+        payload[field_map['contact']] = emp.get('contact_number')
+    if field_map['address']:
+        payload[field_map['address']] = emp.get('address')
+    if field_map['department']:
+        payload[field_map['department']] = emp.get('department')
+    if field_map['designation']:
+        payload[field_map['designation']] = emp.get('designation')
+    if field_map['doj']:
+        payload[field_map['doj']] = emp.get('doj')
+    if field_map['active']:
+        payload[field_map['active']] = "Active" if emp.get('active') else "Inactive"
+    return payload
+
 
 @app.route('/api/deleted-employees/append', methods=['POST'])
 def append_deleted_employees():
-    """Append deleted employees to CSV file"""
+    """Archive deleted employees (re-archiving an employee replaces the earlier snapshot)"""
     try:
-        import csv
-        
         data = request.json
         employees = data.get('employees', [])
         
         if not employees:
             return jsonify({"success": False, "error": "No employees provided"}), 400
         
-        # Check if file exists
-        file_exists = os.path.isfile(DELETED_EMPLOYEES_CSV)
-        
-        # Open file in append mode
-        with open(DELETED_EMPLOYEES_CSV, 'a', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['employee_id', 'first_name', 'last_name', 'email', 'contact_number', 
-                         'address', 'department', 'designation', 'doj', 'active']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            # Write header only if file is new
-            if not file_exists:
-                writer.writeheader()
-                print(f"[OK] Created new file: {DELETED_EMPLOYEES_CSV}")
-            
-            # Write employee records
-            for emp in employees:
-                writer.writerow({
-                    'employee_id': emp.get('employee_id', ''),
-                    'first_name': emp.get('first_name', ''),
-                    'last_name': emp.get('last_name', ''),
-                    'email': emp.get('email', ''),
-                    'contact_number': emp.get('contact_number', ''),
-                    'address': emp.get('address', ''),
-                    'department': emp.get('department', ''),
-                    'designation': emp.get('designation', ''),
-                    'doj': emp.get('doj', ''),
-                    'active': str(emp.get('active', 'false')).lower()
-                })
-        
-        print(f"[OK] Appended {len(employees)} employees to {DELETED_EMPLOYEES_CSV}")
+        stored = deleted_employee_archive.archive(employees)
+        print(f"[OK] Archived {stored} deleted employees")
         
         return jsonify({
             "success": True,
-            "message": f"Appended {len(employees)} employees to deleted employees CSV",
-            "count": len(employees)
+            "message": f"Appended {stored} employees to deleted employees archive",
+            "count": stored
         })
         
     except Exception as e:
-        print(f"[ERROR] Error appending to deleted employees CSV: {str(e)}")
+        print(f"[ERROR] Error archiving deleted employees: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route('/api/deleted-employees', methods=['GET'])
 def get_deleted_employees():
-    """Fetch all deleted employees from CSV"""
+    """List archived employees in ID order. Optional: limit + cursor (paging), q (ID or name)."""
     try:
-        import csv
-        
-        if not os.path.isfile(DELETED_EMPLOYEES_CSV):
-            return jsonify({
-                "success": True,
-                "employees": [],
-                "count": 0,
-                "message": "No deleted employees file found"
-            })
-        
-        employees = []
-        with open(DELETED_EMPLOYEES_CSV, 'r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                employees.append({
-                    'employee_id': row.get('employee_id', ''),
-                    'first_name': row.get('first_name', ''),
-                    'last_name': row.get('last_name', ''),
-                    'email': row.get('email', ''),
-                    'contact_number': row.get('contact_number', ''),
-                    'address': row.get('address', ''),
-                    'department': row.get('department', ''),
-                    'designation': row.get('designation', ''),
-                    'doj': row.get('doj', ''),
-                    'active': row.get('active', 'false').lower() == 'true'
-                })
-        
-        print(f"[DATA] Fetched {len(employees)} deleted employees from CSV")
+        query = (request.args.get('q') or '').strip() or None
+        cursor = (request.args.get('cursor') or '').strip() or None
+        limit = None
+        if request.args.get('limit'):
+            try:
+                limit = max(1, min(int(request.args['limit']), 1000))
+            except ValueError:
+                return jsonify({"success": False, "error": "limit must be a number"}), 400
+
+        employees, total, next_cursor = deleted_employee_archive.page(limit=limit, after=cursor, query=query)
+        print(f"[DATA] Fetched {len(employees)} of {total} deleted employees")
         
         return jsonify({
             "success": True,
             "employees": employees,
-            "count": len(employees)
+            "count": total,
+            "next_cursor": next_cursor,
         })
         
     except Exception as e:
-        print(f"[ERROR] Error reading deleted employees CSV: {str(e)}")
+        print(f"[ERROR] Error reading deleted employees archive: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route('/api/deleted-employees/restore', methods=['POST'])
 def restore_deleted_employees():
-    """Restore selected employees from CSV back to Dataverse and remove from CSV"""
+    """Recreate selected archived employees in Dataverse in one atomic $batch, then drop them from the archive"""
     try:
-        import csv
-        
         data = request.json
         employee_ids = data.get('employee_ids', [])
         
         if not employee_ids:
             return jsonify({"success": False, "error": "No employee IDs provided"}), 400
+        if len(employee_ids) > DELETED_EMPLOYEE_RESTORE_MAX:
+            return jsonify({"success": False, "error": f"Restore at most {DELETED_EMPLOYEE_RESTORE_MAX} employees at a time"}), 400
         
-        if not os.path.isfile(DELETED_EMPLOYEES_CSV):
-            return jsonify({"success": False, "error": "No deleted employees file found"}), 404
-        
-        # Read all employees from CSV
-        all_employees = []
-        employees_to_restore = []
-        
-        with open(DELETED_EMPLOYEES_CSV, 'r', newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                emp_id = row.get('employee_id', '')
-                if emp_id in employee_ids:
-                    employees_to_restore.append(row)
-                else:
-                    all_employees.append(row)
-        
-        # Restore employees to Dataverse
-        token = get_access_token()
-        entity_set = get_employee_entity_set(token)
-        field_map = FIELD_MAPS.get(entity_set, FIELD_MAPS["crc6f_table12s"])
-        
-        restored_count = 0
-        errors = []
-        
-        for emp in employees_to_restore:
-            try:
-                payload = {}
-                
-                # Employee ID
-                if field_map['id']:
-                    payload[field_map['id']] = emp.get('employee_id')
-                
-                # Name fields
-                if field_map['fullname']:
-                    payload[field_map['fullname']] = f"{emp.get('first_name', '')} {emp.get('last_name', '')}".strip()
-                else:
-                    if field_map['firstname']:
-                        payload[field_map['firstname']] = emp.get('first_name')
-                    if field_map['lastname']:
-                        payload[field_map['lastname']] = emp.get('last_name')
-                
-                # Other fields
-                if field_map['email']:
-                    payload[field_map['email']] = emp.get('email')
-                if field_map['contact']:
-                    payload[field_map['contact']] = emp.get('contact_number')
-                if field_map['address']:
-                    payload[field_map['address']] = emp.get('address')
-                if field_map['department']:
-                    payload[field_map['department']] = emp.get('department')
-                if field_map['designation']:
-                    payload[field_map['designation']] = emp.get('designation')
-                if field_map['doj']:
-                    payload[field_map['doj']] = emp.get('doj')
-                if field_map['active']:
-                    payload[field_map['active']] = "Active" if emp.get('active', 'false').lower() == 'true' else "Inactive"
-                
-                create_record(entity_set, payload)
-                restored_count += 1
-                print(f"[OK] Restored: {emp.get('employee_id')}")
-                
-            except Exception as e:
-                error_msg = f"{emp.get('employee_id')}: {str(e)}"
-                errors.append(error_msg)
-                print(f"[ERROR] Failed to restore {emp.get('employee_id')}: {str(e)}")
+        employees, missing = deleted_employee_archive.claim(employee_ids)
+        if not employees:
+            return jsonify({"success": False, "error": "Selected employees are not in the deleted employees archive",
+                            "not_found": missing}), 404
         
-        # Rewrite CSV with remaining employees
-        with open(DELETED_EMPLOYEES_CSV, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['employee_id', 'first_name', 'last_name', 'email', 'contact_number', 
-                         'address', 'department', 'designation', 'doj', 'active']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(all_employees)
+        restored_ids = [emp['employee_id'] for emp in employees]
+        try:
+            token = get_access_token()
+            entity_set = get_employee_entity_set(token)
+            field_map = FIELD_MAPS.get(entity_set, FIELD_MAPS["crc6f_table12s"])
+            changeset = [("POST", entity_set, _archived_employee_payload(emp, field_map)) for emp in employees]
+            result = execute_batch([changeset], continue_on_error=False, token=token)[0]
+        except Exception:
+            deleted_employee_archive.release(restored_ids)
+            raise
+        if not result["ok"]:
+            # The changeset rolled back: nobody was created, everyone stays archived
+            deleted_employee_archive.release(restored_ids)
+            error = result["error"] or f"HTTP {result['status']}"
+            print(f"[ERROR] Restore of {len(restored_ids)} employees rolled back: {error}")
+            return jsonify({"success": False, "error": f"Restore failed, no employees were restored: {error}"}), 502
         
-        print(f"[OK] Restored {restored_count} employees. {len(all_employees)} remaining in CSV")
+        deleted_employee_archive.complete(restored_ids)
+        remaining = deleted_employee_archive.count()
+        print(f"[OK] Restored {len(restored_ids)} employees. {remaining} remaining in archive")
         
         response = {
             "success": True,
-            "restored": restored_count,
-            "remaining": len(all_employees),
-            "message": f"Successfully restored {restored_count} employee(s)"
+            "restored": len(restored_ids),
+            "remaining": remaining,
+            "message": f"Successfully restored {len(restored_ids)} employee(s)"
         }
         
-        if errors:
-            response["errors"] = errors
-            response["message"] += f". {len(errors)} failed."
+        if missing:
+            response["not_found"] = missing
+            response["errors"] = [f"{emp_id}: not in archive" for emp_id in missing]
+            response["message"] += f". {len(missing)} not found."
         
         return jsonify(response)
         
@@ -10941,22 +11148,17 @@ def restore_deleted_employees():
 
 @app.route('/api/deleted-employees/clear', methods=['DELETE'])
 def clear_deleted_employees():
-    """Clear all deleted employees from CSV"""
+    """Clear the deleted employees archive"""
     try:
-        if os.path.isfile(DELETED_EMPLOYEES_CSV):
-            os.remove(DELETED_EMPLOYEES_CSV)
-            print(f"[OK] Deleted file: {DELETED_EMPLOYEES_CSV}")
-            return jsonify({
-                "success": True,
-                "message": "Deleted employees CSV cleared"
-            })
-        else:
-            return jsonify({
-                "success": True,
-                "message": "No deleted employees file to clear"
-            })
+        cleared = deleted_employee_archive.clear()
+        print(f"[OK] Cleared {cleared} archived employees")
+        return jsonify({
+            "success": True,
+            "message": "Deleted employees archive cleared" if cleared else "No deleted employees to clear",
+            "cleared": cleared
+        })
     except Exception as e:
-        print(f"[ERROR] Error clearing deleted employees CSV: {str(e)}")
+        print(f"[ERROR] Error clearing deleted employees archive: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
@@ -11002,6 +11204,8 @@ def cancel_leave(leave_id):
         # Update status to Canceled
         update_data = {"crc6f_status": "Canceled"}
         update_record(LEAVE_ENTITY, record_id, update_data)
+        _leave_index_write(record, update_data)
+        _ledger_release(record)
 
         # Restore leave balance if it was a paid leave
         employee_id = record.get("crc6f_employeeid")
@@ -11138,6 +11342,7 @@ def update_leave(leave_id):
 
         # Update the record
         update_record(LEAVE_ENTITY, record_id, update_data)
+        _leave_index_write(record, update_data)
 
         print(f"[OK] Leave {leave_id} updated successfully")
         print(f"   Updated fields: {list(update_data.keys())}")
@@ -11225,6 +11430,8 @@ def update_employee_leave_allocation(employee_id):
                     update_response = get_dataverse_session().patch(update_url, headers=headers, json=balance_data, timeout=15)
 
                     if update_response.status_code in [200, 204]:
+                        _ledger_adjust(emp_id, "CL", casual_leave, ref="leave allocation edit")
+                        _ledger_adjust(emp_id, "SL", sick_leave, ref="leave allocation edit")
                         print(f"[OK] Successfully updated leave allocation for {emp_id}")
                         print(f"{'='*70}\n")
                         return jsonify({
@@ -11245,6 +11452,8 @@ def update_employee_leave_allocation(employee_id):
                 create_response = get_dataverse_session().post(create_url, headers=headers, json=balance_data, timeout=15)
 
                 if create_response.status_code in [200, 201, 204]:
+                    _ledger_adjust(emp_id, "CL", casual_leave, ref="leave allocation edit")
+                    _ledger_adjust(emp_id, "SL", sick_leave, ref="leave allocation edit")
                     print(f"[OK] Successfully created leave allocation for {emp_id}")
                     print(f"{'='*70}\n")
                     return jsonify({
@@ -11342,8 +11551,11 @@ def get_all_employee_leave_allocations():
 @app.route('/api/sync-leave-allocations', methods=['POST'])
 def sync_leave_allocations():
     """
-    Sync leave allocations to crc6f_hr_leavemangement table based on employee experience.
-    Creates or updates records for all employees with their calculated leave quotas.
+    Incremental leave allocation job. For every employee the DOJ-based quota is
+    applied to the leave ledger as an accrual top-up (employees new to the ledger
+    are rebuilt from history first). Only employees whose quota changed, or who
+    have no crc6f_hr_leavemangements row, get a Dataverse write; the row receives
+    the ledger's available CL/SL/CO instead of being reset to the full quota.
     """
     try:
         print(f"\n{'='*70}")
@@ -11358,6 +11570,7 @@ def sync_leave_allocations():
             "OData-MaxVersion": "4.0",
             "OData-Version": "4.0"
         }
+        year = datetime.now().year
 
         # Fetch all employees
         entity_set = get_employee_entity_set(token)
@@ -11371,99 +11584,77 @@ def sync_leave_allocations():
         employees = emp_response.json().get("value", [])
         print(f"[DATA] Found {len(employees)} employees to process")
 
+        # Balance rows and leave history in one read each, not per employee
+        balance_rows = {}
+        balance_response = get_dataverse_session().get(
+            f"{RESOURCE}/api/data/v9.2/crc6f_hr_leavemangements?$top=5000", headers=headers, timeout=30
+        )
+        if balance_response.status_code == 200:
+            for row in balance_response.json().get("value", []):
+                key = str(row.get("crc6f_employeeid") or row.get("crc6f_empid") or "").strip().upper()
+                if key:
+                    balance_rows.setdefault(key, row)
+        leaves_by_emp = {}
+        all_leaves = leave_index.records() if leave_index.loaded else _load_leave_index_rows()
+        for row in all_leaves:
+            leaves_by_emp.setdefault(str(row.get("crc6f_employeeid") or "").strip().upper(), []).append(row)
+
         synced_count = 0
+        unchanged_count = 0
         errors = []
 
         for emp_record in employees:
+            emp_id = None
             try:
-                emp_id = emp_record.get(field_map['id'])
+                emp_id = str(emp_record.get(field_map['id']) or "").strip().upper()
                 if not emp_id:
                     continue
 
-                doj_value = emp_record.get(field_map['doj'])
+                cl_annual, sl_annual, allocation_type = _allocation_from_doj(emp_record.get(field_map['doj']))
+                existing = balance_rows.get(emp_id)
 
-                # Calculate experience and allocation
-                cl_annual = 3  # Default Type 3
-                sl_annual = 3
-                allocation_type = "Type 3"
+                rebuilt = False
+                if not leave_ledger.is_accrued(emp_id, year):
+                    _rebuild_leave_ledger(
+                        token, emp_id, year, doj=emp_record.get(field_map['doj']),
+                        leave_rows=leaves_by_emp.get(emp_id, []), balance_row=existing or {},
+                    )
+                    rebuilt = True
+                deltas = [leave_ledger.set_quota(emp_id, "CL", year, cl_annual),
+                          leave_ledger.set_quota(emp_id, "SL", year, sl_annual)]
 
-                if doj_value:
-                    try:
-                        from datetime import datetime
-                        doj_date = None
-                        if isinstance(doj_value, str):
-                            if '/' in doj_value:
-                                parts = doj_value.split('/')
-                                if len(parts) == 3:
-                                    doj_date = datetime(int(parts[2]), int(parts[0]), int(parts[1]))
-                            elif '-' in doj_value:
-                                doj_date = datetime.fromisoformat(doj_value.split('T')[0])
-
-                        if doj_date:
-                            current_date = datetime.now()
-                            experience_years = int((current_date - doj_date).days / 365.25)
-
-                            if experience_years >= 3:
-                                cl_annual = 6
-                                sl_annual = 6
-                                allocation_type = "Type 1"
-                            elif experience_years >= 2:
-                                cl_annual = 4
-                                sl_annual = 4
-                                allocation_type = "Type 2"
-                    except Exception as e:
-                        print(f"   [WARN] Error calculating experience for {emp_id}: {e}")
-
-                total_quota = cl_annual + sl_annual
-
-                print(f"\n[USER] Processing {emp_id}: {allocation_type} (CL={cl_annual}, SL={sl_annual}, Total={total_quota})")
-
-                # Check if record exists in leave management table
-                safe_emp = emp_id.replace("'", "''")
-                balance_filter = f"?$filter=crc6f_employeeid eq '{safe_emp}'"
-                balance_url = f"{RESOURCE}/api/data/v9.2/crc6f_hr_leavemangements{balance_filter}"
-                balance_response = get_dataverse_session().get(balance_url, headers=headers, timeout=15)
+                if existing and not rebuilt and not any(deltas):
+                    unchanged_count += 1
+                    continue
 
+                ledger = leave_ledger.balance(emp_id, year)
+                cl = max(0.0, ledger.get("CL", {}).get("available", cl_annual))
+                sl = max(0.0, ledger.get("SL", {}).get("available", sl_annual))
+                co = max(0.0, ledger.get("CO", {}).get("available", 0.0))
                 balance_data = {
                     "crc6f_employeeid": emp_id,
-                    "crc6f_cl": str(cl_annual),
-                    "crc6f_sl": str(sl_annual),
-                    "crc6f_total": str(total_quota)
+                    "crc6f_cl": str(cl),
+                    "crc6f_sl": str(sl),
+                    "crc6f_total": str(cl + sl + co)
                 }
+                print(f"\n[USER] {emp_id}: {allocation_type} (CL={cl_annual}, SL={sl_annual}) "
+                      f"quota change CL{deltas[0]:+g} SL{deltas[1]:+g}{' after rebuild' if rebuilt else ''}")
 
-                if balance_response.status_code == 200:
-                    existing_records = balance_response.json().get("value", [])
-
-                    if existing_records:
-                        # Update existing record
-                        record_id = existing_records[0].get("crc6f_hr_leavemangementid")
-                        if record_id:
-                            update_url = f"{RESOURCE}/api/data/v9.2/crc6f_hr_leavemangements({record_id})"
-                            update_response = get_dataverse_session().patch(update_url, headers=headers, json=balance_data, timeout=15)
-
-                            if update_response.status_code in [200, 204]:
-                                print(f"   [OK] Updated existing record for {emp_id}")
-                                synced_count += 1
-                            else:
-                                error_detail = update_response.text
-                                error_msg = f"Failed to update {emp_id}: {update_response.status_code} - {error_detail}"
-                                print(f"   [ERROR] {error_msg}")
-                                errors.append(error_msg)
-                    else:
-                        # Create new record
-                        create_url = f"{RESOURCE}/api/data/v9.2/crc6f_hr_leavemangements"
-                        create_response = get_dataverse_session().post(create_url, headers=headers, json=balance_data, timeout=15)
+                if existing:
+                    record_id = existing.get("crc6f_hr_leavemangementid")
+                    if not record_id:
+                        continue
+                    update_url = f"{RESOURCE}/api/data/v9.2/crc6f_hr_leavemangements({record_id})"
+                    write_response = get_dataverse_session().patch(update_url, headers=headers, json=balance_data, timeout=15)
+                else:
+                    create_url = f"{RESOURCE}/api/data/v9.2/crc6f_hr_leavemangements"
+                    write_response = get_dataverse_session().post(create_url, headers=headers, json=balance_data, timeout=15)
 
-                        if create_response.status_code in [200, 201, 204]:
-                            print(f"   [OK] Created new record for {emp_id}")
-                            synced_count += 1
-                        else:
-                            error_detail = create_response.text
-                            error_msg = f"Failed to create {emp_id}: {create_response.status_code} - {error_detail}"
-                            print(f"   [ERROR] {error_msg}")
-                            errors.append(error_msg)
+                if write_response.status_code in [200, 201, 204]:
+                    print(f"   [OK] {'Updated' if existing else 'Created'} balance row for {emp_id}")
+                    synced_count += 1
                 else:
-                    error_msg = f"Failed to check existing record for {emp_id}"
+                    error_msg = f"Failed to write {emp_id}: {write_response.status_code} - {write_response.text}"
                     print(f"   [ERROR] {error_msg}")
                     errors.append(error_msg)
 
@@ -11473,7 +11664,7 @@ def sync_leave_allocations():
                 errors.append(error_msg)
 
         print(f"\n{'='*70}")
-        print(f"[OK] SYNC COMPLETE: {synced_count}/{len(employees)} employees synced")
+        print(f"[OK] SYNC COMPLETE: {synced_count} updated, {unchanged_count} unchanged, {len(employees)} employees")
         if errors:
             print(f"[WARN] Errors: {len(errors)}")
         print(f"{'='*70}\n")
@@ -11481,6 +11672,7 @@ def sync_leave_allocations():
         return jsonify({
             "success": True,
             "synced_count": synced_count,
+            "unchanged_count": unchanged_count,
             "total_employees": len(employees),
             "errors": errors if errors else None
         }), 200
@@ -11491,6 +11683,69 @@ def sync_leave_allocations():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route('/api/leave-ledger/rebuild', methods=['POST'])
+def rebuild_leave_ledger():
+    """
+    Rebuild the leave ledger from history for the given employees (default: all
+    employees in the balance table). Body: {employee_ids?, year?, anchor?}; anchor
+    (default true) reconciles the result to the Dataverse balance row, without it
+    the year's manual adjustments are kept.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        year = int(data.get("year") or datetime.now().year)
+        anchor = str(data.get("anchor", True)).strip().lower() not in ("0", "false", "no")
+        token = get_access_token()
+        employee_ids = [str(e).strip().upper() for e in (data.get("employee_ids") or []) if str(e).strip()]
+        if not employee_ids:
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/json",
+                "OData-MaxVersion": "4.0",
+                "OData-Version": "4.0"
+            }
+            resp = get_dataverse_session().get(
+                f"{RESOURCE}/api/data/v9.2/crc6f_hr_leavemangements?$select=crc6f_employeeid&$top=5000",
+                headers=headers, timeout=30,
+            )
+            if resp.status_code != 200:
+                return jsonify({"success": False, "error": f"Failed to list balance rows: {resp.status_code}"}), 500
+            employee_ids = sorted({
+                str(r.get("crc6f_employeeid") or "").strip().upper() for r in resp.json().get("value", [])
+            } - {""})
+
+        rebuilt, errors = {}, []
+        for emp in employee_ids:
+            try:
+                rebuilt[emp] = _rebuild_leave_ledger(token, emp, year, anchor=anchor)
+            except Exception as e:
+                errors.append(f"{emp}: {e}")
+        return jsonify({
+            "success": True, "year": year, "rebuilt": len(rebuilt), "balances": rebuilt,
+            "errors": errors or None,
+        }), 200
+    except Exception as e:
+        print(f"[ERROR] Error rebuilding leave ledger: {str(e)}")
+        traceback.print_exc()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route('/api/leave-ledger/<employee_id>', methods=['GET'])
+def get_leave_ledger_entries(employee_id):
+    """Ledger entries and materialised balances for one employee (audit view)."""
+    emp = (employee_id or '').strip().upper()
+    if emp.isdigit():
+        emp = f"EMP{int(emp):03d}"
+    year = int(request.args.get("year") or datetime.now().year)
+    return jsonify({
+        "success": True,
+        "employee_id": emp,
+        "year": year,
+        "balances": leave_ledger.balance(emp, year),
+        "entries": leave_ledger.entries(emp, year),
+    }), 200
+
+
 # ... (rest of the code remains the same)
 
 @app.route('/api/attendance/submit', methods=['POST'])
@@ -11811,15 +12066,10 @@ def get_onboarding_entity_set(token):
         return ONBOARDING_ENTITY_RESOLVED
     
     for candidate in ONBOARDING_ENTITY_CANDIDATES:
-        try:
-            test_url = f"{BASE_URL}/{candidate}?$top=1"
-            response = get_dataverse_session().get(test_url, headers={"Authorization": f"Bearer {token}"}, timeout=15)
-            if response.status_code == 200:
-                ONBOARDING_ENTITY_RESOLVED = candidate
-                print(f"[OK] Resolved onboarding entity: {candidate}")
-                return candidate
-        except:
-            continue
+        if _probe_entity_set(token, candidate):
+            ONBOARDING_ENTITY_RESOLVED = candidate
+            print(f"[OK] Resolved onboarding entity: {candidate}")
+            return candidate
 
 def get_progress_log_entity_set(token):
     """Resolve the HR_Onboarding Progress Log entity set name."""
@@ -11827,16 +12077,27 @@ def get_progress_log_entity_set(token):
     if PROGRESS_LOG_ENTITY_RESOLVED:
         return PROGRESS_LOG_ENTITY_RESOLVED
     for candidate in PROGRESS_LOG_ENTITY_CANDIDATES:
-        try:
-            test_url = f"{BASE_URL}/{candidate}?$top=1"
-            response = get_dataverse_session().get(test_url, headers={"Authorization": f"Bearer {token}"}, timeout=15)
-            if response.status_code == 200:
-                PROGRESS_LOG_ENTITY_RESOLVED = candidate
-                return candidate
-        except Exception:
-            continue
+        if _probe_entity_set(token, candidate):
+            PROGRESS_LOG_ENTITY_RESOLVED = candidate
+            return candidate
     return PROGRESS_LOG_ENTITY
 
+
+def _warm_entity_sets():
+    """Fetch metadata if no snapshot is stored yet and resolve every entity set, before requests need them."""
+    try:
+        token = get_access_token()
+        for resolve in (get_employee_entity_set, get_hierarchy_entity, get_inbox_entity_set,
+                        get_compoff_request_entity_set, get_clients_entity, get_projects_entity,
+                        get_login_table, get_onboarding_entity_set, get_progress_log_entity_set):
+            resolve(token)
+        print(f"[METADATA] Entity sets resolved (stamp {entity_set_catalogue.stamp})")
+    except Exception as e:
+        print(f"[METADATA] Entity-set warm-up failed: {e}")
+
+
+threading.Thread(target=_warm_entity_sets, name="entity-set-warm", daemon=True).start()
+
 def _now_iso():
     try:
         return datetime.utcnow().isoformat() + "Z"
@@ -11985,61 +12246,22 @@ def _fill_stage_ts_fallbacks(formatted_item: dict, raw_record: dict):
         # otherwise avoid forcing a completion timestamp from DOJ.
         if not formatted_item.get('completed_at'):
             progress = (formatted_item.get('progress_step') or '').strip().lower()
-            reached_stage4 = progress in ['onboarding', 'physical document verification', 'document verification', 'completed']
-            if reached_stage4:
-                formatted_item['completed_at'] = modified_on or formatted_item.get('doj')
-
-        # Stage 5: Physical Document Verification
-        if not formatted_item.get('document_updated_at') and (formatted_item.get('document_status') or '').lower() == 'verified':
-            formatted_item['document_updated_at'] = modified_on
-
-    except Exception:
-        pass
-
-def generate_employee_id():
-    """Generate sequential Employee ID in format EMP### by inspecting existing records."""
-    try:
-        token = get_access_token()
-        entity_set = get_employee_entity_set(token)
-        field_map = get_field_map(entity_set)
-        id_field = field_map.get('id') or 'crc6f_employeeid'
-
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "OData-MaxVersion": "4.0",
-            "OData-Version": "4.0"
-        }
+            reached_stage4 = progress in ['onboarding', 'physical document verification', 'document verification', 'completed']
+            if reached_stage4:
+                formatted_item['completed_at'] = modified_on or formatted_item.get('doj')
 
-        url = f"{RESOURCE}/api/data/v9.2/{entity_set}?$select={id_field}&$orderby=createdon desc&$top=200"
-        response = get_dataverse_session().get(url, headers=headers, timeout=15)
+        # Stage 5: Physical Document Verification
+        if not formatted_item.get('document_updated_at') and (formatted_item.get('document_status') or '').lower() == 'verified':
+            formatted_item['document_updated_at'] = modified_on
 
-        max_num = 0
-        if response.status_code == 200:
-            rows = response.json().get('value', [])
-            for row in rows:
-                raw_id = str(row.get(id_field) or '').strip().upper()
-                if not raw_id:
-                    continue
-                if not raw_id.startswith('EMP'):
-                    continue
-                match = re.search(r"(\d+)$", raw_id)
-                if not match:
-                    continue
-                try:
-                    num = int(match.group(1))
-                    if num > max_num:
-                        max_num = num
-                except ValueError:
-                    continue
-        else:
-            print(f"[WARN] Could not fetch existing employee IDs (status {response.status_code}): {response.text[:120]}")
+    except Exception:
+        pass
 
-        next_num = max_num + 1
-        return format_employee_id(next_num)
-    except Exception as e:
-        print(f"[WARN] Error generating employee ID: {e}")
-        return format_employee_id(1)
+def generate_employee_id():
+    """Allocate the next sequential Employee ID (EMP###) from the shared "employee" sequence."""
+    emp_id = id_sequences.next("employee")
+    print(f"   [USER] Allocated Employee ID: {emp_id}")
+    return emp_id
 
 def generate_login_credentials(email, firstname, lastname):
     """Generate login credentials for new employee"""
@@ -12058,8 +12280,8 @@ def generate_login_credentials(email, firstname, lastname):
         'temp_password': True
     }
 
-def send_offer_letter_email(candidate_data):
-    """Send offer letter email to candidate"""
+def send_offer_letter_email(candidate_data, record_id=None):
+    """Queue the offer letter email to the candidate"""
     try:
         subject = "[SUCCESS] Congratulations on Your Offer from VTab Pvt. Ltd.!"
         recipient = candidate_data.get('email')
@@ -12087,14 +12309,14 @@ VTab Pvt. Ltd.
 """
 
         # Use existing mail system – plain text only (no HTML template)
-        success = send_email(subject, [recipient], body)
+        success = send_email(subject, [recipient], body, record_id=record_id, kind='offer_letter')
         return success
     except Exception as e:
         print(f"[WARN] Error sending offer letter: {e}")
         return False
 
-def send_interview_rejection_email(candidate_data):
-    """Send interview rejection email to candidate"""
+def send_interview_rejection_email(candidate_data, record_id=None):
+    """Queue the interview rejection email to the candidate"""
     try:
         subject = "[INFO] Interview Update from VTab Pvt. Ltd."
         recipient = candidate_data.get('email')
@@ -12138,7 +12360,7 @@ VTab Pvt. Ltd.
         </html>
         """
 
-        return send_email(subject, [recipient], body)
+        return send_email(subject, [recipient], body, record_id=record_id, kind='interview_rejection')
     except Exception as e:
         print(f"[WARN] Error sending rejection email: {e}")
         return False
@@ -12201,12 +12423,42 @@ VTab Pvt. Ltd.
         </html>
         """
         
-        success = send_email(subject, [recipient], body)
+        success = send_email(subject, [recipient], body, record_id=emp_id, kind='login_credentials')
         return success
     except Exception as e:
         print(f"[WARN] Error sending login credentials: {e}")
         return False
 
+# ==================== OUTBOUND MAIL STATUS ====================
+@app.route('/api/mail/outbound', methods=['GET'])
+def list_outbound_mail():
+    """Delivery status of queued mail for a record (?record_id=<onboarding record / employee ID>)."""
+    record_id = (request.args.get('record_id') or '').strip()
+    if not record_id:
+        return jsonify({'success': False, 'error': 'record_id is required'}), 400
+    return jsonify({'success': True, 'record_id': record_id, 'messages': mail_queue.for_record(record_id)}), 200
+
+
+@app.route('/api/mail/outbound/<int:mail_id>', methods=['GET'])
+def get_outbound_mail(mail_id):
+    message = mail_queue.get(mail_id)
+    if message is None:
+        return jsonify({'success': False, 'error': 'Message not found'}), 404
+    return jsonify({'success': True, 'message': message}), 200
+
+
+@app.route('/api/mail/outbound/<int:mail_id>/retry', methods=['POST'])
+def retry_outbound_mail(mail_id):
+    """Re-queue a message that exhausted its retries."""
+    if not mail_queue.retry(mail_id):
+        return jsonify({'success': False, 'error': 'Only failed messages can be retried'}), 409
+    return jsonify({'success': True, 'message': mail_queue.get(mail_id)}), 200
+
+
+@app.route('/api/mail/outbound/stats', methods=['GET'])
+def outbound_mail_stats():
+    return jsonify({'success': True, 'stats': mail_queue.stats()}), 200
+
 # ==================== STATIC UPLOADS SERVE ====================
 @app.route('/uploads/<path:filename>', methods=['GET'])
 def serve_upload(filename):
@@ -12669,7 +12921,8 @@ VTab Pvt. Ltd.
         """
 
         # Send email (plain text only)
-        sent = send_email(subject="Interview Schedule - VTab Pvt. Ltd.", recipients=[recipient], body=body)
+        sent = send_email(subject="Interview Schedule - VTab Pvt. Ltd.", recipients=[recipient], body=body,
+                          record_id=record_id, kind='interview_schedule')
 
         # Persist interview date and mark progress as scheduled
         try:
@@ -12717,7 +12970,7 @@ def send_offer_letter(record_id):
         }
         current_reply = (candidate.get('crc6f_offerpmailreply') or '').strip().lower()
 
-        ok = send_offer_letter_email(candidate_data)
+        ok = send_offer_letter_email(candidate_data, record_id=record_id)
 
         # Update mail status and progress to Offer Acceptance
         try:
@@ -12775,7 +13028,7 @@ def update_result_and_send_mail(record_id):
 
         if status_lc == 'passed':
             # Send offer letter and update progress
-            email_sent = send_offer_letter_email(candidate_data)
+            email_sent = send_offer_letter_email(candidate_data, record_id=record_id)
             update_payload['crc6f_offerpmail'] = 'Sent'
             update_payload['crc6f_progresssteps'] = 'Offer Acceptance'
             current_reply = (candidate.get('crc6f_offerpmailreply') or '').strip().lower()
@@ -12789,7 +13042,7 @@ def update_result_and_send_mail(record_id):
 
         elif status_lc == 'failed':
             # Send rejection email
-            email_sent = send_interview_rejection_email(candidate_data)
+            email_sent = send_interview_rejection_email(candidate_data, record_id=record_id)
             message = 'Interview failed. Rejection email sent.' if email_sent else 'Interview failed. Rejection send attempted.'
             try:
                 create_progress_log_row(token, record_id, "Interview Result - Failed", 2, _now_iso())
@@ -12851,6 +13104,35 @@ def update_mail_reply(record_id):
         print(f"[ERROR] Error updating mail reply: {e}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
+# ==================== MAIL REPLY INGEST ====================
+# Candidate replies are ingested in the background (one IMAP connection, new
+# UIDs only) into a local index; the check endpoints below read from it.
+mail_replies = get_reply_index()
+mail_ingester = None
+if os.getenv('MAIL_USERNAME') and os.getenv('MAIL_PASSWORD') and os.getenv('MAIL_INGEST_ENABLED', 'true').lower() != 'false':
+    # IMAP_SSL=false + IMAP_PORT point it at a plain local server (e.g. imap_stub.py)
+    mail_ingester = MailIngester(mail_replies, imap_connector(
+        os.getenv('IMAP_SERVER', 'imap.gmail.com'), os.getenv('MAIL_USERNAME'), os.getenv('MAIL_PASSWORD'),
+        port=int(os.getenv('IMAP_PORT') or 0) or None, use_ssl=os.getenv('IMAP_SSL', 'true').lower() != 'false'))
+    mail_ingester.start()
+MAIL_REFRESH_WAIT_SECONDS = float(os.getenv('MAIL_REFRESH_WAIT_SECONDS', '3'))
+
+
+def _latest_candidate_reply(candidate_email, needs_refresh=lambda reply: reply is None):
+    """(latest indexed mail from the candidate or None, message when none). Polls once more on a miss."""
+    if mail_ingester is None:
+        return None, 'Email credentials not configured'
+    reply = mail_replies.latest(candidate_email)
+    if needs_refresh(reply) and mail_ingester.refresh(timeout=MAIL_REFRESH_WAIT_SECONDS):
+        reply = mail_replies.latest(candidate_email)
+    if reply is None:
+        last_error = mail_replies.state().get('last_error')
+        if last_error:
+            return None, f'IMAP check failed: {last_error}'
+        return None, 'No reply found yet'
+    return reply, None
+
+
 @app.route('/api/onboarding/<record_id>/check-email', methods=['GET'])
 def check_email_reply(record_id):
     """Check for email reply (Stage 3) - Check inbox for candidate response"""
@@ -12870,68 +13152,13 @@ def check_email_reply(record_id):
         if not candidate_email:
             return jsonify({'success': False, 'message': 'No candidate email found'}), 400
         
-        # 2) Connect to email inbox via IMAP
-        mail_username = os.getenv('MAIL_USERNAME')
-        mail_password = os.getenv('MAIL_PASSWORD')
-        imap_server = os.getenv('IMAP_SERVER', 'imap.gmail.com')
-        
-        if not mail_username or not mail_password:
-            return jsonify({'success': False, 'message': 'Email credentials not configured'}), 200
-        
-        try:
-            imap = imaplib.IMAP4_SSL(imap_server)
-            imap.login(mail_username, mail_password)
-            imap.select('INBOX')
-        except imaplib.IMAP4.error as auth_err:
-            return jsonify({'success': False, 'message': f'IMAP auth failed: {str(auth_err)}'}), 200
-        except Exception as conn_err:
-            return jsonify({'success': False, 'message': f'IMAP connection failed: {str(conn_err)}'}), 200
-        
-        # 3) Search for emails from candidate
-        status, messages = imap.search(None, f'FROM "{candidate_email}"')
-        
-        if status != 'OK' or not messages[0]:
-            imap.logout()
-            return jsonify({'success': False, 'message': 'No reply found yet'}), 200
-        
-        # 4) Check most recent email for acceptance keywords
-        email_ids = messages[0].split()
-        latest_id = email_ids[-1]
-        
-        status, msg_data = imap.fetch(latest_id, '(RFC822)')
-        if status != 'OK':
-            imap.logout()
-            return jsonify({'success': False, 'message': 'Failed to fetch email'}), 200
-        
-        email_body = msg_data[0][1]
-        email_message = email.message_from_bytes(email_body)
-        
-        # Extract email content
-        body = ""
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    try:
-                        body = part.get_payload(decode=True).decode(errors='ignore')
-                    except Exception:
-                        body = ''
-                    break
-        else:
-            try:
-                body = email_message.get_payload(decode=True).decode(errors='ignore')
-            except Exception:
-                body = ''
-        
-        imap.logout()
-        
-        # 5) Check for acceptance keywords
-        body_lower = body.lower()
-
-        accept_patterns = [r"\byes\b", r"\bi accept\b", r"\baccept\b", r"\bagree\b", r"\bconfirm\b"]
-        decline_patterns = [r"\bno\b", r"\bdecline\b", r"\breject\b", r"\bcannot\b", r"can't", r"cannot accept", r"will not", r"not interested", r"i am not interested"]
-
-        accepted = any(re.search(pattern, body_lower) for pattern in accept_patterns)
-        declined = any(re.search(pattern, body_lower) for pattern in decline_patterns)
+        # 2) Latest reply from the candidate, from the background mail index
+        reply, missing = _latest_candidate_reply(candidate_email, lambda r: r is None or r['offer_reply'] is None)
+        if reply is None:
+            return jsonify({'success': False, 'message': missing}), 200
+        mail_reply = reply['offer_reply']
+        declined = mail_reply == 'No'
+        accepted = mail_reply == 'Yes'
 
         # Prioritize decline over accept if both keywords found
         if declined:
@@ -13004,7 +13231,7 @@ VTab Pvt. Ltd.
 
         html_address = '<br/>'.join(postal_address.split('\n'))
         # Email now sent as plain text only; HTML version is no longer used.
-        ok = send_email(subject=subject, recipients=[recipient], body=body)
+        ok = send_email(subject=subject, recipients=[recipient], body=body, record_id=record_id, kind='documents_request')
         return jsonify({'success': True, 'message': 'Documents mail sent' if ok else 'Documents mail send attempted'}), 200
     except Exception as e:
         print(f"[ERROR] Error sending documents mail: {e}")
@@ -13031,70 +13258,12 @@ def check_documents_email(record_id):
         if not candidate_email:
             return jsonify({'success': False, 'message': 'No candidate email found'}), 400
 
-        # Connect to email inbox via IMAP
-        mail_username = os.getenv('MAIL_USERNAME')
-        mail_password = os.getenv('MAIL_PASSWORD')
-        imap_server = os.getenv('IMAP_SERVER', 'imap.gmail.com')
-
-        if not mail_username or not mail_password:
-            return jsonify({'success': False, 'message': 'Email credentials not configured'}), 200
-
-        try:
-            imap = imaplib.IMAP4_SSL(imap_server)
-            imap.login(mail_username, mail_password)
-            imap.select('INBOX')
-        except imaplib.IMAP4.error as auth_err:
-            return jsonify({'success': False, 'message': f'IMAP auth failed: {str(auth_err)}'}), 200
-        except Exception as conn_err:
-            return jsonify({'success': False, 'message': f'IMAP connection failed: {str(conn_err)}'}), 200
-
-        # Search for emails from candidate
-        status, messages = imap.search(None, f'FROM "{candidate_email}"')
-        if status != 'OK' or not messages[0]:
-            imap.logout()
-            return jsonify({'success': False, 'message': 'No reply found yet'}), 200
-
-        # Check most recent email for "Yes, sent" style acknowledgement
-        email_ids = messages[0].split()
-        latest_id = email_ids[-1]
-
-        status, msg_data = imap.fetch(latest_id, '(RFC822)')
-        if status != 'OK':
-            imap.logout()
-            return jsonify({'success': False, 'message': 'Failed to fetch email'}), 200
-
-        email_body = msg_data[0][1]
-        email_message = email.message_from_bytes(email_body)
-
-        body = ""
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                if part.get_content_type() == "text/plain":
-                    try:
-                        body = part.get_payload(decode=True).decode(errors='ignore')
-                    except Exception:
-                        body = ''
-                    break
-        else:
-            try:
-                body = email_message.get_payload(decode=True).decode(errors='ignore')
-            except Exception:
-                body = ''
-
-        imap.logout()
-
-        body_lower = body.lower()
-
-        # Look for phrases like "yes, sent" / "yes sent" / "documents sent" etc.
-        patterns = [
-            r"yes,\s*sent",
-            r"yes\s+sent",
-            r"documents\s+sent",
-            r"sent\s+the\s+documents",
-            r"i\s+have\s+sent\s+the\s+documents",
-        ]
+        # Latest reply from the candidate, from the background mail index
+        reply, missing = _latest_candidate_reply(candidate_email, lambda r: r is None or not r['docs_sent'])
+        if reply is None:
+            return jsonify({'success': False, 'message': missing}), 200
 
-        acknowledged = any(re.search(p, body_lower) for p in patterns)
+        acknowledged = reply['docs_sent']
         if acknowledged:
             return jsonify({'success': True, 'message': 'Candidate confirmed documents have been sent', 'reply': 'YesSent'}), 200
 
@@ -13154,7 +13323,8 @@ HR Team
 VTab Pvt. Ltd.
 """
                         # Send plain-text confirmation email (HTML version no longer used)
-                        send_email(subject=subject, recipients=[recipient], body=body)
+                        send_email(subject=subject, recipients=[recipient], body=body,
+                                   record_id=record_id, kind='documents_verified')
             except Exception as mail_err:
                 print(f"[WARN] Failed to send documents received email: {mail_err}")
 
@@ -13170,11 +13340,6 @@ VTab Pvt. Ltd.
 def send_policy_letter(record_id):
     print(f"[POLICY LETTER] Received request for record_id: {record_id}")
     try:
-        from PyPDF2 import PdfReader, PdfWriter
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import letter
-        from io import BytesIO
-        
         data = request.get_json() or {}
         doj = data.get('doj')
         print(f"[POLICY LETTER] DOJ: {doj}")
@@ -13213,6 +13378,21 @@ def send_policy_letter(record_id):
         except Exception:
             pass
 
+        # Start the offer/policy PDFs now so they render while the record is
+        # updated. Static pages and compiled templates are cached; only the
+        # personalised pages are rendered, off this worker (letter_pdfs.py).
+        letter_fields = {
+            'current_date': datetime.now().strftime('%d-%m-%Y'),
+            'candidate_name': f"{firstname} {lastname}".strip(),
+            'candidate_address': candidate.get('crc6f_address', '') or 'Address not provided',
+            'designation': designation or 'Employee',
+            'date_of_joining': display_doj,
+        }
+        print(f"[PDF GENERATION] Name: {letter_fields['candidate_name']}")
+        print(f"[PDF GENERATION] Designation: {letter_fields['designation']}")
+        print(f"[PDF GENERATION] DOJ: {letter_fields['date_of_joining']}")
+        letters_future = letter_pipeline.submit(letter_fields)
+
         # Update DOJ in record
         try:
             print(f"[POLICY LETTER] Updating DOJ to: {doj}")
@@ -13222,175 +13402,6 @@ def send_policy_letter(record_id):
             print(f"[POLICY LETTER ERROR] Failed to update DOJ: {upd_err}")
             return jsonify({'success': False, 'message': 'Failed to update DOJ'}), 500
 
-        # Generate personalized PDF from HTML templates
-        print("[POLICY LETTER] Generating personalized PDF from HTML templates...")
-        try:
-            from xhtml2pdf import pisa
-            from datetime import datetime as _dt
-            
-            # Paths
-            backend_dir = os.path.dirname(os.path.abspath(__file__))
-            offer_template_path = os.path.join(backend_dir, "offer_letter_new_template.html")
-            policy_template_path = os.path.join(backend_dir, "policy_template.html")
-            
-            # Read templates
-            with open(offer_template_path, 'r', encoding='utf-8') as f:
-                offer_html = f.read()
-            with open(policy_template_path, 'r', encoding='utf-8') as f:
-                policy_html = f.read()
-            
-            # Get current date
-            current_date = _dt.now().strftime('%d-%m-%Y')
-            address = candidate.get('crc6f_address', '')
-
-            # Resolve images for logos/signature
-            import base64
-            def _data_uri_if_exists(p):
-                try:
-                    if p and os.path.exists(p):
-                        with open(p, 'rb') as f:
-                            b64 = base64.b64encode(f.read()).decode('ascii')
-                            return f"data:image/png;base64,{b64}"
-                except Exception:
-                    pass
-                return None
-
-            logo_main = os.environ.get('LOGO_MAIN_URL') or _data_uri_if_exists(os.path.join(backend_dir, 'vtab_logo.png')) or ''
-            logo_sub  = os.environ.get('LOGO_SUB_URL')  or _data_uri_if_exists(os.path.join(backend_dir, 'siroco_logo.png')) or ''
-            sign_img  = os.environ.get('SIGN_IMG_URL')  or _data_uri_if_exists(os.path.join(backend_dir, 'signature.png')) or ''
-            
-            # Prepare context for offer letter
-            offer_context = {
-                'current_date': current_date,
-                'candidate_name': f"{firstname} {lastname}".strip(),
-                'candidate_address': address or 'Address not provided',
-                'designation': designation or 'Employee',
-                'date_of_joining': display_doj,
-                'logo_main': logo_main,
-                'logo_sub': logo_sub,
-                'sign_img': sign_img
-            }
-            
-            # Prepare context for policy letter
-            policy_context = {
-                'candidate_name': f"{firstname} {lastname}".strip(),
-                'unpaid_duration': '3',
-                'training_duration': '3',
-                'training_salary': '₹10,000',
-                'probation_duration': '6',
-                'probation_salary': '₹15,000',
-                'postprobation_salary': '₹20,000',
-                'postprobation_duration': '12',
-                'work_hours_start': '9:00 AM',
-                'work_hours_end': '6:00 PM'
-            }
-            
-            # Replace placeholders in offer letter
-            for key, value in offer_context.items():
-                offer_html = offer_html.replace('{{' + key + '}}', str(value))
-            
-            # Replace placeholders in policy letter
-            for key, value in policy_context.items():
-                policy_html = policy_html.replace('{{' + key + '}}', str(value))
-            
-            print(f"[PDF GENERATION] Name: {offer_context['candidate_name']}")
-            print(f"[PDF GENERATION] Designation: {offer_context['designation']}")
-            print(f"[PDF GENERATION] DOJ: {offer_context['date_of_joining']}")
-            
-            # Generate offer letter PDF
-            offer_pdf = BytesIO()
-            pisa_status = pisa.CreatePDF(offer_html, dest=offer_pdf)
-            if pisa_status.err:
-                raise Exception("Offer letter PDF generation failed")
-            offer_pdf.seek(0)
-            print("[PDF GENERATION] Offer letter PDF generated")
-            
-            # Generate policy PDF
-            policy_pdf = BytesIO()
-            pisa_status = pisa.CreatePDF(policy_html, dest=policy_pdf)
-            if pisa_status.err:
-                raise Exception("Policy PDF generation failed")
-            policy_pdf.seek(0)
-            print("[PDF GENERATION] Policy PDF generated")
-            
-            # Build Offer Letter (separate PDF): static p1 & p3 where available, generated p2
-            offer_reader = PdfReader(offer_pdf)
-            cover_path = os.path.join(backend_dir, 'offer_cover_static.pdf')
-            contact_path = os.path.join(backend_dir, 'offer_contact_static.pdf')
-            offer_pack_paths = [
-                os.path.join(backend_dir, 'Offer Letter.pdf'),
-                os.path.join(backend_dir, 'Offer_Letter.pdf'),
-                os.path.join(backend_dir, 'offer_letter.pdf'),
-                os.path.join(backend_dir, 'OfferLetter.pdf'),
-            ]
-            offer_pack_reader = None
-            offer_pack_path_used = None
-            for pp in offer_pack_paths:
-                if os.path.exists(pp):
-                    try:
-                        offer_pack_reader = PdfReader(pp)
-                        offer_pack_path_used = pp
-                        break
-                    except Exception:
-                        offer_pack_reader = None
-
-            # If we have a static Offer Letter.pdf, use pages 1 and 2 as-is (no additional pages)
-            offer_pdf_bytes = BytesIO()
-            if offer_pack_reader and offer_pack_path_used:
-                offer_writer = PdfWriter()
-                # Page 1 as-is
-                if len(offer_pack_reader.pages) >= 1:
-                    offer_writer.add_page(offer_pack_reader.pages[0])
-                # Page 2 as-is
-                if len(offer_pack_reader.pages) >= 2:
-                    offer_writer.add_page(offer_pack_reader.pages[1])
-                offer_writer.write(offer_pdf_bytes)
-                offer_pdf_bytes.seek(0)
-            else:
-                # No static Offer Letter.pdf present -> fallback to mixed assemble
-                offer_writer = PdfWriter()
-                if len(offer_reader.pages) >= 1:
-                    if os.path.exists(cover_path):
-                        try:
-                            cover_reader = PdfReader(cover_path)
-                            for p in cover_reader.pages:
-                                offer_writer.add_page(p)
-                        except Exception:
-                            offer_writer.add_page(offer_reader.pages[0])
-                    else:
-                        offer_writer.add_page(offer_reader.pages[0])
-                if len(offer_reader.pages) >= 2:
-                    offer_writer.add_page(offer_reader.pages[1])
-                offer_writer.write(offer_pdf_bytes)
-                offer_pdf_bytes.seek(0)
-
-            # Build Policy (separate PDF): prefer static policy_static.pdf else generated
-            policy_static_path = os.path.join(backend_dir, 'policy_static.pdf')
-            policy_bytes = None
-            if os.path.exists(policy_static_path):
-                try:
-                    policy_static_reader = PdfReader(policy_static_path)
-                    policy_writer = PdfWriter()
-                    for p in policy_static_reader.pages:
-                        policy_writer.add_page(p)
-                    _policy_bytes = BytesIO()
-                    policy_writer.write(_policy_bytes)
-                    _policy_bytes.seek(0)
-                    policy_bytes = _policy_bytes.getvalue()
-                except Exception:
-                    policy_pdf.seek(0)
-                    policy_bytes = policy_pdf.getvalue()
-            else:
-                policy_pdf.seek(0)
-                policy_bytes = policy_pdf.getvalue()
-
-            print("[POLICY LETTER] Offer and Policy PDFs prepared (separate)")
-
-        except Exception as pdf_err:
-            print(f"[POLICY LETTER ERROR] Failed to generate PDF: {pdf_err}")
-            traceback.print_exc()
-            return jsonify({'success': False, 'message': f'Failed to generate PDF: {str(pdf_err)}'}), 500
-
         # Prepare email
         subject = "Offer Letter & Policy Agreement - VTab Pvt. Ltd."
         print(f"[POLICY LETTER] Preparing to send email to {recipient}")
@@ -13440,31 +13451,55 @@ def send_policy_letter(record_id):
         body = _render(body_tpl, ctx)
         html = _render(html_tpl, ctx)
 
-        # Send email with PDF attachments (plain-text body only)
-        print("[POLICY LETTER] Sending email with two PDF attachments (Offer, Policy)...")
-        try:
+        def _send_letters(letters):
+            print("[POLICY LETTER] Sending email with two PDF attachments (Offer, Policy)...")
             send_email(
                 subject=subject,
                 recipients=[recipient],
                 body=body,
                 attachments=[
-                    ("Offer_Letter.pdf", offer_pdf_bytes.getvalue()),
-                    ("Policy.pdf", policy_bytes),
-                ]
+                    ("Offer_Letter.pdf", letters.offer),
+                    ("Policy.pdf", letters.policy),
+                ],
+                record_id=record_id,
+                kind='policy_letter'
             )
-            print("[POLICY LETTER] Email sent successfully")
+            print("[POLICY LETTER] Email queued")
+            try:
+                create_progress_log_row(token, record_id, "Policy Letter Sent", 4, _now_iso())
+                print("[POLICY LETTER] Progress log created")
+            except Exception as log_err:
+                print(f"[POLICY LETTER WARN] Failed to create progress log: {log_err}")
+
+        try:
+            letters = letters_future.result(timeout=LETTER_RENDER_WAIT_SECONDS)
+            print(f"[POLICY LETTER] Offer and Policy PDFs ready ({letters.source}, version {letters.version})")
+        except FutureTimeoutError:
+            # Still rendering (cold pool, busy renderer): finish in the background
+            def _when_rendered(future):
+                try:
+                    with app.app_context():
+                        _send_letters(future.result())
+                except Exception as late_err:
+                    print(f"[POLICY LETTER ERROR] Background letter send failed for {record_id}: {late_err}")
+                    traceback.print_exc()
+
+            letters_future.add_done_callback(_when_rendered)
+            print("[POLICY LETTER] PDFs still rendering; email will be queued when they are ready")
+            return jsonify({'success': True, 'pending': True,
+                            'message': 'Offer Letter and Policy are being generated and will be emailed shortly.'}), 202
+        except Exception as pdf_err:
+            print(f"[POLICY LETTER ERROR] Failed to generate PDF: {pdf_err}")
+            traceback.print_exc()
+            return jsonify({'success': False, 'message': f'Failed to generate PDF: {str(pdf_err)}'}), 500
+
+        try:
+            _send_letters(letters)
         except Exception as email_err:
             print(f"[POLICY LETTER ERROR] Failed to send email: {email_err}")
             traceback.print_exc()
             return jsonify({'success': False, 'message': 'Failed to send email'}), 500
-        
-        # Create progress log
-        try:
-            create_progress_log_row(token, record_id, "Policy Letter Sent", 4, _now_iso())
-            print("[POLICY LETTER] Progress log created")
-        except Exception as log_err:
-            print(f"[POLICY LETTER WARN] Failed to create progress log: {log_err}")
-        
+
         print("[POLICY LETTER] Request completed successfully (separate Offer & Policy attachments)")
         return jsonify({'success': True, 'message': 'Offer Letter and Policy sent as separate attachments (Offer: static p1+p3, generated p2).'}), 200
     except Exception as e:
@@ -13579,7 +13614,9 @@ def send_policy_letter_with_upload(record_id):
             subject=subject,
             recipients=[recipient],
             body=body,
-            attachments=atts
+            attachments=atts,
+            record_id=record_id,
+            kind='policy_letter_upload'
         )
         if not ok:
             return jsonify({'success': False, 'message': 'Failed to send email'}), 500
@@ -13634,7 +13671,7 @@ Regards,
 HR Team
 VTab Pvt. Ltd.
 """
-        send_email(subject=subject, recipients=[recipient], body=body)
+        send_email(subject=subject, recipients=[recipient], body=body, record_id=record_id, kind='onboarding_mail')
         try:
             create_progress_log_row(token, record_id, "Onboarding", 5, _now_iso())
         except Exception:
@@ -13819,7 +13856,16 @@ def verify_documents_and_complete(record_id):
 
 @app.route('/api/onboarding/<record_id>/documents', methods=['POST'])
 def upload_onboarding_documents(record_id):
-    """Upload files to Dataverse File column (crc6f_documentsuploaded)"""
+    """
+    Upload documents to the Dataverse File column (crc6f_documentsuploaded).
+
+    The column holds one file, so several documents are sent as one zip. Files
+    are staged in parallel (streamed to spooled temp files, hashed, large scans
+    downscaled) and the upload is skipped when the column already holds the
+    same content. See document_uploads.py.
+    """
+    docs = []
+    payload = None
     try:
         token = get_access_token()
         onboarding_entity = get_onboarding_entity_set(token)
@@ -13828,55 +13874,71 @@ def upload_onboarding_documents(record_id):
         if not files:
             return jsonify({'success': False, 'message': 'No files provided'}), 400
 
-        uploaded_files = []
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "OData-MaxVersion": "4.0",
-            "OData-Version": "4.0"
-        }
-
-        for f in files:
-            if not f or not getattr(f, 'filename', ''):
-                continue
-            name = f.filename
-            ext = os.path.splitext(name)[1].lower()
-            if ext not in ['.pdf', '.jpg', '.jpeg', '.png']:
-                continue
+        accepted = [
+            (f.filename, f.stream) for f in files
+            if f and getattr(f, 'filename', '') and os.path.splitext(f.filename)[1].lower() in ALLOWED_DOCUMENT_EXTENSIONS
+        ]
+        docs = stage_documents(accepted)
+        for doc in docs:
+            if doc.error:
+                print(f"[ERROR] Error staging file {doc.name}: {doc.error}")
+        unique_docs = [d for d in docs if not d.error and not d.duplicate_of]
+        if not unique_docs:
+            return jsonify({'success': False, 'message': 'No files were successfully uploaded to Dataverse'}), 400
 
+        column = 'crc6f_documentsuploaded'
+        ledger = get_upload_ledger()
+        previous = ledger.current(record_id, column)
+        key = content_key(unique_docs)
+        upload_info = {'skipped': False, 'ms': 0.0}
+        if previous and previous['content_key'] == key:
+            # The file may have been removed outside this API; only trust the ledger if it is still there
             try:
-                # Read file content
-                file_content = f.read()
-                
-                # Upload to Dataverse File column using PATCH with file data
-                # Reference: https://learn.microsoft.com/en-us/power-apps/developer/data-platform/file-column-data
-                file_upload_url = f"{BASE_URL}/{onboarding_entity}({record_id})/crc6f_documentsuploaded"
-                
-                file_headers = headers.copy()
-                file_headers["Content-Type"] = "application/octet-stream"
-                file_headers["x-ms-file-name"] = name
-                
-                # Try upload without If-Match first (for new uploads)
-                upload_resp = get_dataverse_session().patch(file_upload_url, headers=file_headers, data=file_content, timeout=30)
-                
-                # If it fails with 412 Precondition Failed, retry with If-Match: * (for re-upload)
-                if upload_resp.status_code == 412:
-                    print(f"[INFO] File exists, retrying with If-Match for {name}")
-                    file_headers["If-Match"] = "*"
-                    upload_resp = get_dataverse_session().patch(file_upload_url, headers=file_headers, data=file_content, timeout=30)
-                
-                if upload_resp.status_code in [200, 204]:
-                    uploaded_files.append(name)
-                    print(f"[OK] Uploaded file to Dataverse: {name}")
-                else:
-                    print(f"[WARN] Failed to upload {name}: {upload_resp.status_code} - {upload_resp.text}")
-                    
-            except Exception as file_err:
-                print(f"[ERROR] Error uploading file {name}: {file_err}")
-                continue
-
-        if not uploaded_files:
-            return jsonify({'success': False, 'message': 'No files were successfully uploaded to Dataverse'}), 400
+                check = get_dataverse_session().get(
+                    f"{BASE_URL}/{onboarding_entity}({record_id})?$select={column}",
+                    headers={"Authorization": f"Bearer {token}", "Accept": "application/json"}, timeout=20)
+                if check.status_code == 200 and check.json().get(f"{column}_name") != previous['file_name']:
+                    ledger.forget(record_id, column)
+                    previous = None
+            except Exception as check_err:
+                print(f"[WARN] Could not verify existing documents for {record_id}: {check_err}")
+        if previous and previous['content_key'] == key:
+            upload_info.update(skipped=True, file_name=previous['file_name'], bytes=previous['size'])
+            print(f"[DOCS] {record_id}: documents unchanged, upload skipped")
+        else:
+            upload_name, payload = build_payload(unique_docs, f"documents_{record_id}.zip")
+            # Reference: https://learn.microsoft.com/en-us/power-apps/developer/data-platform/file-column-data
+            file_upload_url = f"{BASE_URL}/{onboarding_entity}({record_id})/{column}"
+            file_headers = {
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/json",
+                "OData-MaxVersion": "4.0",
+                "OData-Version": "4.0",
+                "Content-Type": "application/octet-stream",
+                "x-ms-file-name": upload_name,
+            }
+            # A column we know is filled needs If-Match; skip the 412 round trip (and second full send)
+            if previous:
+                file_headers["If-Match"] = "*"
+            started = _time.perf_counter()
+            upload_resp = get_dataverse_session().patch(file_upload_url, headers=file_headers, data=payload.body(), timeout=60)
+            if upload_resp.status_code == 412 and "If-Match" not in file_headers:
+                print(f"[INFO] File exists, retrying with If-Match for {upload_name}")
+                file_headers["If-Match"] = "*"
+                upload_resp = get_dataverse_session().patch(file_upload_url, headers=file_headers, data=payload.body(), timeout=60)
+            upload_info.update(file_name=upload_name, bytes=payload.bytes_out,
+                               ms=round((_time.perf_counter() - started) * 1000, 1))
+            if upload_resp.status_code not in (200, 204):
+                print(f"[WARN] Failed to upload {upload_name}: {upload_resp.status_code} - {upload_resp.text}")
+                return jsonify({
+                    'success': False,
+                    'message': 'No files were successfully uploaded to Dataverse',
+                    'files': [d.report() for d in docs],
+                }), 400
+            ledger.remember(record_id, column, key, upload_name, payload.bytes_out)
+            print(f"[OK] Uploaded {len(unique_docs)} document(s) to Dataverse as {upload_name} "
+                  f"({sum(d.bytes_in for d in unique_docs)} -> {payload.bytes_out} bytes, {upload_info['ms']}ms)")
+        uploaded_files = [d.name for d in unique_docs]
 
         # Update document status and progress (if candidate already accepted offer)
         mail_reply_value = ''
@@ -13913,15 +13975,24 @@ def upload_onboarding_documents(record_id):
             print(f"[WARN] Could not update document status/progress: {status_err}")
 
         return jsonify({
-            'success': True, 
+            'success': True,
             'uploaded': uploaded_files,
-            'message': f'Successfully uploaded {len(uploaded_files)} file(s) to Dataverse'
+            'files': [d.report() for d in docs],
+            'upload': upload_info,
+            'message': (f'Documents unchanged, {len(uploaded_files)} file(s) already in Dataverse'
+                        if upload_info['skipped'] else
+                        f'Successfully uploaded {len(uploaded_files)} file(s) to Dataverse')
         }), 200
-        
+
     except Exception as e:
         print(f"[ERROR] Error uploading documents: {e}")
         traceback.print_exc()
         return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        for doc in docs:
+            doc.close()
+        if payload is not None:
+            payload.close()
 
 @app.route('/api/onboarding/<record_id>/documents', methods=['DELETE'])
 def delete_onboarding_documents(record_id):
@@ -13977,6 +14048,7 @@ def delete_onboarding_documents(record_id):
             print(f"[WARN] Failed to delete documents file column: {resp.status_code} - {err_msg}")
             return jsonify({'success': False, 'message': f'Failed to delete documents: {err_msg}'}), resp.status_code
 
+        get_upload_ledger().forget(record_id, 'crc6f_documentsuploaded')
         try:
             update_record(onboarding_entity, record_id, {'crc6f_documentsstatus': 'Pending'})
         except Exception as upd_err:
@@ -14062,6 +14134,7 @@ def google_oauth2callback():
         flow.fetch_token(authorization_response=request.url)
         creds = flow.credentials
         _save_google_credentials(creds)
+        google_calendar.set_credentials(creds)
         return jsonify({"success": True}), 200
     except Exception as e:
         print(f"[ERROR] Google OAuth callback failed: {e}")
@@ -14189,9 +14262,7 @@ def start_google_meet():
 
         try:
             if meet_url:
-                call_id = notify_socket_server(admin_id, meet_url, participants_for_socket, title)
-                if call_id:
-                    response_payload["call_id"] = call_id
+                response_payload["call_id"] = notify_socket_server_async(admin_id, meet_url, participants_for_socket, title)
         except Exception as notify_err:
             print(f"[MEET][SOCKET] notify_socket_server failed: {notify_err}")
 
@@ -14543,6 +14614,9 @@ def approve_comp_off_request(request_id):
                 # Reuse the existing balance updater; negative decrement means credit.
                 _decrement_leave_balance(token, balance_row, "Compensatory Off", -float(requested_days))
                 credit_applied = True
+                if leave_ledger.has_employee(employee_id):
+                    leave_ledger.record(f"compoff:{request_id}:grant", employee_id, "CO", datetime.now().year,
+                                        "grant", float(requested_days), ref=request_id)
             except Exception as credit_err:
                 credit_error = str(credit_err)
                 print(f"[WARN] Failed to credit comp off balance for {employee_id} on approval {request_id}: {credit_err}")
@@ -14620,6 +14694,7 @@ def reject_comp_off_request(request_id):
                 if not balance_row:
                     balance_row = _ensure_leave_balance_row(token, employee_id)
                 _decrement_leave_balance(token, balance_row, "Comp Off", -float(requested_days))
+                _ledger_release(request_row)
             except Exception as restore_err:
                 print(f"[WARN] Failed to restore comp off balance for {employee_id} on reject {request_id}: {restore_err}")
         return jsonify({"success": True, "message": "Comp Off request rejected", "request_id": request_id}), 200
@@ -14749,6 +14824,7 @@ def update_comp_off(employee_id):
 
         patch_response = get_dataverse_session().patch(update_url, headers=headers, json=update_data, timeout=15)
         if patch_response.status_code in [204, 200]:
+            _ledger_adjust(employee_id, "CO", new_balance, ref="comp-off balance edit")
             return jsonify({"status": "success", "message": "Comp Off balance updated successfully."})
         else:
             return jsonify({
@@ -14762,16 +14838,27 @@ def update_comp_off(employee_id):
 
 
 # ================== AI ASSISTANT ==================
-from ai_gemini import ask_gemini
+from ai_gemini import AIStreamError
+from ai_provider_router import get_llm_router
 from ai_dataverse_service import build_ai_context
+from ai_fast_answers import answer_fast, format_leave_balance, match_fast_intent
+from ai_answer_cache import (get_answer_cache, cache_key as ai_answer_cache_key, cache_slot as ai_answer_slot,
+                             context_version as ai_context_version, org_view as ai_org_view)
+from ai_doc_index import get_doc_index, retrieve_passages
 from ai_automation import process_automation, execute_automation_action
 
-@app.route("/api/ai/query", methods=["POST"])
-def ai_query():
+# Build (or load) the HR document index off the request path
+threading.Thread(target=get_doc_index, name="ai-doc-index", daemon=True).start()
+
+def _prepare_ai_query(data, progress=None):
     """
-    AI Assistant endpoint - answers questions using Gemini + Dataverse data.
-    Also handles automation flows (e.g., create employee via chat).
-    
+    Shared front half of /api/ai/query and /api/ai/query/stream: resolves the user,
+    runs automation flows and deterministic answers, and builds the Dataverse context.
+
+    Returns (payload, status, llm_request). llm_request is None when payload is the
+    final answer; otherwise it holds what the model call needs.
+    progress(source) is called as each context section loads.
+
     Request body:
         - question: str (required)
         - scope: str (optional) - 'general', 'attendance', 'leave', 'employee', etc.
@@ -14780,14 +14867,13 @@ def ai_query():
         - automationState: dict (optional) - state for multi-step automation flows
     """
     try:
-        data = request.get_json(force=True)
-        question = data.get("question", "").strip()
+        question = (data.get("question") or "").strip()
         
         if not question:
-            return jsonify({
+            return {
                 "success": False,
                 "error": "Question is required"
-            }), 400
+            }, 400, None
 
         def _normalize_emp_id_ai(value):
             raw = (str(value or "").strip()).upper()
@@ -14858,16 +14944,10 @@ def ai_query():
                 today_local = datetime.now().strftime("%Y-%m-%d")
                 return f"* Current Time: {now_local}\\n* Date: {today_local}"
 
-            if any(kw in q for kw in ["leave balance", "available leave", "how many leaves", "leave quota"]):
+            if match_fast_intent(question_text)[0] == "leave_balance":
                 balance = (context.get("my_leave_balance") or {}).get("available") or {}
                 if balance:
-                    return (
-                        "Here is your leave balance:\\n\\n"
-                        f"* Casual Leave (CL): {balance.get('CL', 0)}\\n"
-                        f"* Sick Leave (SL): {balance.get('SL', 0)}\\n"
-                        f"* Comp Off (CO): {balance.get('CO', 0)}\\n"
-                        f"* Total: {balance.get('Total', 0)}"
-                    )
+                    return format_leave_balance(balance)
 
             if any(kw in q for kw in ["leave approval", "leave approvals", "pending leaves", "awaiting approval", "approve leaves"]):
                 org_scope = bool(meta.get("is_admin") or meta.get("is_l3"))
@@ -15173,7 +15253,7 @@ def ai_query():
                 if not allowed:
                     response_data["answer"] = (response_data.get("answer") or "") + f"\n\n⚠️ {denial_reason}"
                     response_data["actionError"] = denial_reason
-                    return jsonify(response_data)
+                    return response_data, 200, None
 
                 action_result = execute_automation_action(action, token)
                 
@@ -15303,7 +15383,7 @@ What would you like to say to {employee_name}?"""
                     response_data["answer"] += f"\n\n❌ Error: {action_result.get('error')}"
                     response_data["actionError"] = action_result.get("error")
             
-            return jsonify(response_data)
+            return response_data, 200, None
         
         # Not an automation - proceed with normal AI query
         # Determine scope from question keywords
@@ -15325,71 +15405,260 @@ What would you like to say to {employee_name}?"""
         elif any(kw in question_lower for kw in ["intern", "trainee"]):
             scope = "interns"
         
+        # Fast path: common lookups are answered from a single summary, skipping
+        # the full context build and the model call
+        fast = answer_fast(question, token, user_meta)
+        if fast:
+            return {
+                "success": True,
+                "answer": fast["answer"],
+                "scope": scope,
+                "timestamp": datetime.now().isoformat(),
+                "automationState": automation_result.get("state"),
+                "fastPath": fast["intent"]
+            }, 200, None
+
+        # Repeat questions are answered from the shared cache before any context is built
+        answer_cache = get_answer_cache()
+        answer_slot = ai_answer_slot(question, user_meta, scope) if answer_cache else None
+
+        def _cached_ai_answer(version):
+            answer = answer_cache.get(ai_answer_cache_key(question, answer_slot, version))
+            if not answer:
+                return None
+            return {
+                "success": True,
+                "answer": answer,
+                "scope": scope,
+                "timestamp": datetime.now().isoformat(),
+                "automationState": automation_result.get("state"),
+                "cached": True
+            }
+
+        if answer_slot:
+            cached = _cached_ai_answer(answer_cache.version(answer_slot))
+            if cached:
+                return cached, 200, None
+
         # Get Dataverse context
-        data_context = build_ai_context(token, user_meta, scope)
+        data_context = build_ai_context(token, user_meta, scope, progress=progress)
+
+        # Policy / onboarding document passages relevant to the question (BM25, top-k only)
+        policy_passages = retrieve_passages(question)
+        if policy_passages:
+            data_context["policy_passages"] = policy_passages
+            if progress:
+                progress("policy_documents")
 
         # Deterministic answers for high-frequency HR queries (avoids LLM drift)
         deterministic_answer = _deterministic_ai_answer(question, data_context, user_meta)
         if deterministic_answer:
-            return jsonify({
+            return {
                 "success": True,
                 "answer": deterministic_answer,
                 "scope": scope,
                 "timestamp": data_context.get("timestamp"),
                 "automationState": automation_result.get("state")
-            })
-        
-        # Get chat history
-        history = data.get("history", [])
-        
-        # Call Gemini model
-        result = ask_gemini(
-            question=question,
-            data_context=data_context,
-            user_meta=user_meta,
-            history=history
-        )
-        
-        if result.get("success"):
-            return jsonify({
-                "success": True,
-                "answer": result.get("answer"),
-                "scope": scope,
-                "timestamp": data_context.get("timestamp"),
-                "automationState": automation_result.get("state")  # Preserve state
-            })
-        else:
-            err_msg = result.get("error", "Failed to get AI response")
-            if "RESOURCE_EXHAUSTED" in err_msg or "429" in err_msg:
-                return jsonify({
-                    "success": True,
-                    "answer": "⚠️ AI service is currently busy (rate limited). Please retry in a few moments. For attendance, leave, and checkout actions, use the normal app controls and this assistant will sync once quota recovers.",
-                    "scope": scope,
-                    "timestamp": data_context.get("timestamp"),
-                    "automationState": automation_result.get("state")
-                })
-            return jsonify({
-                "success": False,
-                "error": err_msg
-            }), 500
-            
+            }, 200, None
+
+        # Org questions are asked without the asker's name or own sections, so the
+        # answer can be shared with everyone in the same role
+        llm_user_meta = user_meta
+        answer_key = None
+        if answer_slot:
+            if answer_slot.startswith("org"):
+                llm_user_meta, data_context = ai_org_view(user_meta, data_context)
+            version = ai_context_version(data_context)
+            answer_cache.set_version(answer_slot, version)
+            cached = _cached_ai_answer(version)   # another worker may have answered it meanwhile
+            if cached:
+                return cached, 200, None
+            answer_key = ai_answer_cache_key(question, answer_slot, version)
+
+        return None, 200, {
+            "cache_key": answer_key,
+            "question": question,
+            "data_context": data_context,
+            "user_meta": llm_user_meta,
+            "history": data.get("history", []),
+            "scope": scope,
+            "automation_state": automation_result.get("state"),
+        }
+
     except Exception as e:
         print(f"[AI] Error in ai_query: {e}")
         import traceback
         traceback.print_exc()
-        return jsonify({
+        return {
             "success": False,
             "error": str(e)
-        }), 500
+        }, 500, None
+
+
+def _finish_ai_query(llm_request, result):
+    """Map a model result onto the /api/ai/query response payload and status."""
+    data_context = llm_request["data_context"]
+    if result.get("success"):
+        payload = {
+            "success": True,
+            "answer": result.get("answer"),
+            "scope": llm_request["scope"],
+            "timestamp": data_context.get("timestamp"),
+            "automationState": llm_request["automation_state"]  # Preserve state
+        }
+        if result.get("prompt_stats"):
+            payload["promptStats"] = result["prompt_stats"]
+        if result.get("provider"):
+            payload["provider"] = result["provider"]
+            payload["hedged"] = bool(result.get("hedged"))
+        if result.get("truncated"):
+            payload["truncated"] = True
+        elif llm_request.get("cache_key") and result.get("answer"):
+            get_answer_cache().put(llm_request["cache_key"], result["answer"])
+        return payload, 200
+
+    err_msg = result.get("error", "Failed to get AI response")
+    if "RESOURCE_EXHAUSTED" in err_msg or "429" in err_msg:
+        return {
+            "success": True,
+            "answer": "⚠️ AI service is currently busy (rate limited). Please retry in a few moments. For attendance, leave, and checkout actions, use the normal app controls and this assistant will sync once quota recovers.",
+            "scope": llm_request["scope"],
+            "timestamp": data_context.get("timestamp"),
+            "automationState": llm_request["automation_state"]
+        }, 200
+    return {
+        "success": False,
+        "error": err_msg
+    }, 500
+
+
+@app.route("/api/ai/query", methods=["POST"])
+def ai_query():
+    """
+    AI Assistant endpoint - answers questions using the LLM router (Gemini, with
+    hedged fallback to Hugging Face) + Dataverse data.
+    Also handles automation flows (e.g., create employee via chat).
+    Request body: see _prepare_ai_query.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    payload, status, llm_request = _prepare_ai_query(data)
+    if llm_request is None:
+        return jsonify(payload), status
+
+    try:
+        result = get_llm_router().ask(
+            question=llm_request["question"],
+            data_context=llm_request["data_context"],
+            user_meta=llm_request["user_meta"],
+            history=llm_request["history"],
+            scope=llm_request["scope"]
+        )
+    except Exception as e:
+        print(f"[AI] Error in ai_query: {e}")
+        result = {"success": False, "error": str(e)}
+    payload, status = _finish_ai_query(llm_request, result)
+    return jsonify(payload), status
+
+
+# Comment line sent while context is still loading so proxies keep the stream open
+AI_STREAM_KEEPALIVE_SECONDS = 15
+
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.route("/api/ai/query/stream", methods=["POST"])
+def ai_query_stream():
+    """
+    Server-Sent Events variant of /api/ai/query (same request body). The answer
+    comes from the LLM router too: the first provider to start answering wins.
+
+    Events:
+        progress - {"stage": "context", "source": <section>} as each context section loads
+        token    - {"text": <chunk>} as the model produces output
+        done     - the same payload /api/ai/query would return (answer, scope, automationState, ...)
+        error    - {"success": false, "error": ...} if the request fails
+    """
+    data = request.get_json(force=True, silent=True) or {}
+
+    def generate():
+        events = queue.Queue()
+        outcome = {}
+
+        def _prepare():
+            try:
+                outcome["value"] = _prepare_ai_query(
+                    data, progress=lambda source: events.put(("progress", {"stage": "context", "source": source}))
+                )
+            except Exception as e:
+                outcome["value"] = ({"success": False, "error": str(e)}, 500, None)
+            finally:
+                events.put(None)
+
+        yield _sse_event("progress", {"stage": "start"})
+        threading.Thread(target=_prepare, daemon=True).start()
+        while True:
+            try:
+                item = events.get(timeout=AI_STREAM_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is None:
+                break
+            yield _sse_event(*item)
+
+        payload, status, llm_request = outcome["value"]
+        if llm_request is None:
+            yield _sse_event("done" if status < 400 else "error", payload)
+            return
+
+        yield _sse_event("progress", {"stage": "generating"})
+        chunks = []
+        route = {}
+        result = {"success": True}
+        try:
+            for chunk in get_llm_router().stream(
+                question=llm_request["question"],
+                data_context=llm_request["data_context"],
+                user_meta=llm_request["user_meta"],
+                history=llm_request["history"],
+                scope=llm_request["scope"],
+                info=route,
+            ):
+                chunks.append(chunk)
+                yield _sse_event("token", {"text": chunk})
+        except AIStreamError as e:
+            result = {"success": False, "error": str(e)}
+        except Exception as e:
+            print(f"[AI] Error streaming ai_query: {e}")
+            result = {"success": False, "error": f"Error: {e}"}
+
+        if result["success"] or chunks:
+            # A stream cut short after some output still returns what was produced (but is not cached)
+            result = {"success": True, "answer": "".join(chunks), "prompt_stats": route.get("prompt_stats"),
+                      "provider": route.get("provider"), "hedged": route.get("hedged"),
+                      "truncated": not result["success"]}
+        payload, status = _finish_ai_query(llm_request, result)
+        yield _sse_event("done" if status < 400 else "error", payload)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.route("/api/ai/health", methods=["GET"])
 def ai_health():
     """Check if AI service is available."""
+    answer_cache = get_answer_cache()
     return jsonify({
         "status": "ok",
         "service": "AI Assistant",
         "model": "Gemini",
-        "backend_model_id": "gemini-2.0-flash"
+        "backend_model_id": "gemini-2.0-flash",
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "providers": get_llm_router().stats()
     })
 
 
@@ -15575,23 +15844,35 @@ def create_auth_event():
 def list_auth_events():
     try:
         employee_id = (request.args.get("employee_id") or "").strip().upper()
+        username = (request.args.get("username") or request.args.get("email") or "").strip().lower()
         event_type = (request.args.get("event_type") or "").strip().lower()
+        since = (request.args.get("since") or "").strip() or None
+        until = (request.args.get("until") or "").strip() or None
+        if until and len(until) == 10:
+            until += "T23:59:59.999999+00:00"          # date only: through the end of that day
         limit_raw = request.args.get("limit")
         try:
             limit = int(limit_raw) if limit_raw is not None else 200
         except Exception:
             limit = 200
         limit = max(1, min(limit, 1000))
+        cursor_raw = request.args.get("cursor")
+        try:
+            cursor = int(cursor_raw) if cursor_raw else None
+        except ValueError:
+            return jsonify({"success": False, "error": "cursor must be the next_cursor of a previous page"}), 400
 
-        rows = _read_auth_session_events()
-        if employee_id:
-            rows = [r for r in rows if str(r.get("employee_id") or "").strip().upper() == employee_id]
-        if event_type:
-            rows = [r for r in rows if str(r.get("event_type") or "").strip().lower() == event_type]
-
-        rows = rows[-limit:]
-        rows.reverse()
-        return jsonify({"success": True, "items": rows, "count": len(rows)})
+        rows, next_cursor = auth_event_log.query(
+            employee_id=employee_id, username=username, event_type=event_type,
+            since=since, until=until, before=cursor, limit=limit,
+        )
+        return jsonify({
+            "success": True,
+            "items": rows,
+            "count": len(rows),
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None,
+        })
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -15624,26 +15905,24 @@ def trigger_force_logout():
         actor = (data.get("requested_by") or "").strip() or "admin"
 
         now_iso = datetime.now(timezone.utc).isoformat()
-        policy = _get_auth_session_policy()
-        target_by_id = policy.get("target_force_logout_at") if isinstance(policy.get("target_force_logout_at"), dict) else {}
-        target_by_email = policy.get("target_force_logout_by_email") if isinstance(policy.get("target_force_logout_by_email"), dict) else {}
 
-        if employee_id or username:
+        def apply(policy):
             if employee_id:
-                target_by_id[employee_id] = now_iso
+                policy["target_force_logout_at"][employee_id] = now_iso
             if username:
-                target_by_email[username] = now_iso
+                policy["target_force_logout_by_email"][username] = now_iso
+            if not (employee_id or username):
+                policy["global_force_logout_at"] = now_iso
+            policy["updated_at"] = now_iso
+            policy["updated_by"] = actor
+
+        if employee_id or username:
             print(f"[FORCE-LOGOUT] Target: emp_id={employee_id}, username={username}")
         else:
-            policy["global_force_logout_at"] = now_iso
             print(f"[FORCE-LOGOUT] Global force-logout triggered")
 
-        policy["target_force_logout_at"] = target_by_id
-        policy["target_force_logout_by_email"] = target_by_email
-        policy["updated_at"] = now_iso
-        policy["updated_by"] = actor
-
-        if not _save_auth_session_policy(policy):
+        policy = _update_auth_session_policy(apply)
+        if policy is None:
             return jsonify({"success": False, "error": "Failed to persist force-logout policy"}), 500
 
         try:
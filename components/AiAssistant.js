@@ -399,7 +399,8 @@ async function sendMessage(question) {
     const loadingId = appendLoading();
     
     try {
-        const response = await fetch(`${API_BASE_URL}/api/ai/query`, {
+        // Streaming variant: progress + model tokens arrive as Server-Sent Events
+        const response = await fetch(`${API_BASE_URL}/api/ai/query/stream`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
@@ -414,14 +415,29 @@ async function sendMessage(question) {
             })
         });
         
-        const data = await response.json();
+        let streamDiv = null;
+        let streamed = '';
+        const data = await readAiStream(response, {
+            token: (chunk) => {
+                if (!streamDiv) {
+                    removeLoading(loadingId);
+                    streamDiv = appendMessage('assistant', '');
+                }
+                streamed += chunk.text || '';
+                updateMessageText(streamDiv, streamed);
+            },
+        });
         
         // Remove loading
         removeLoading(loadingId);
         
         if (data.success && data.answer) {
             messages.push({ role: 'assistant', text: data.answer });
-            appendMessage('assistant', data.answer);
+            if (streamDiv) {
+                updateMessageText(streamDiv, data.answer);
+            } else {
+                appendMessage('assistant', data.answer);
+            }
             
             // Update automation state for multi-step flows
             if (data.automationState) {
@@ -454,6 +470,41 @@ async function sendMessage(question) {
     }
 }
 
+// Parse an SSE response body; calls handlers[event](data) and resolves with the final payload
+async function readAiStream(response, handlers = {}) {
+    if (!response.body || !(response.headers.get('Content-Type') || '').includes('text/event-stream')) {
+        return response.json();
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const raw = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            let event = 'message';
+            let dataLines = [];
+            raw.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+            });
+            if (!dataLines.length) continue;
+            const payload = JSON.parse(dataLines.join('\n'));
+            if (event === 'done' || event === 'error') {
+                result = payload;
+            } else if (handlers[event]) {
+                handlers[event](payload);
+            }
+        }
+    }
+    return result || { success: false, error: 'AI response stream ended unexpectedly.' };
+}
+
 async function showActionSuccess(actionResult) {
     // Show a brief toast/notification for successful actions
     if (actionResult.employee_id) {
@@ -825,6 +876,15 @@ function appendMessage(role, text) {
     
     container.appendChild(msgDiv);
     container.scrollTop = container.scrollHeight;
+    return msgDiv;
+}
+
+function updateMessageText(msgDiv, text) {
+    const textEl = msgDiv?.querySelector('.ai-message-text');
+    if (!textEl) return;
+    textEl.innerHTML = formatAiText(text);
+    const container = document.getElementById('ai-messages');
+    if (container) container.scrollTop = container.scrollHeight;
 }
 
 function formatAiText(text) {
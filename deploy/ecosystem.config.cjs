@@ -7,7 +7,7 @@ module.exports = {
       name: "vtab-backend",
       cwd: "/var/www/vtab/backend",
       script: "/var/www/vtab/backend/venv/bin/gunicorn",
-      args: "unified_server:app --bind 127.0.0.1:5000 --workers 2 --timeout 120 --access-logfile - --error-logfile -",
+      args: "unified_server:app --bind 127.0.0.1:5000 --workers 2 --worker-class gthread --threads 8 --timeout 120 --access-logfile - --error-logfile -",
       interpreter: "none",
       env: {
         FLASK_ENV: "production",
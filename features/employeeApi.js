@@ -130,6 +130,7 @@ export async function deleteEmployee(employeeId) {
   return true;
 }
 
+// Queues an import job (202); poll /api/employees/bulk/<job_id> for progress
 export async function bulkCreateEmployees(employees) {
   const res = await timedFetch(`${BASE_URL}/api/employees/bulk`, {
     method: 'POST',
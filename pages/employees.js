@@ -1383,6 +1383,24 @@ export const handleBulkUpload = async (e) => {
     await submitBulkEmployees(parsedEmployees);
 };
 
+const waitForBulkImport = async (jobId) => {
+    // The server imports in the background; poll until every row has a result
+    for (;;) {
+        await new Promise((resolve) => setTimeout(resolve, 1500));
+        const res = await fetch(`${API_BASE_URL}/api/employees/bulk/${jobId}`);
+        const progress = await res.json();
+        if (!res.ok || !progress.success) {
+            throw new Error(progress.error || 'Could not read import progress');
+        }
+        const btn = document.getElementById('upload-csv-btn');
+        if (btn) btn.textContent = `Importing ${progress.processed}/${progress.total}...`;
+        if (progress.status === 'done' || progress.status === 'failed') {
+            const reportRes = await fetch(`${API_BASE_URL}/api/employees/bulk/${jobId}/report`);
+            return await reportRes.json();
+        }
+    }
+};
+
 const submitBulkEmployees = async (employees) => {
     try {
         const response = await fetch(`${API_BASE_URL}/api/employees/bulk`, {
@@ -1393,11 +1411,17 @@ const submitBulkEmployees = async (employees) => {
         const result = await response.json();
 
         if (response.ok && result.success) {
-            if (result.errors && result.errors.length > 0) {
-                const errorMsg = result.errors.slice(0, 3).join('\n');
-                const moreErrors = result.errors.length > 3 ? `\n... and ${result.errors.length - 3} more errors (check console)` : '';
+            const btn = document.getElementById('upload-csv-btn');
+            if (btn) btn.disabled = true;
+            const report = await waitForBulkImport(result.job_id);
+            const failedRows = (report.rows || []).filter(r => r.status === 'failed');
+            if (failedRows.length > 0 || report.status === 'failed') {
+                const errors = failedRows.map(r => `Row ${r.row} (${r.employee_id}): ${r.error}`);
+                const errorMsg = errors.slice(0, 3).join('\n');
+                const moreErrors = errors.length > 3 ? `\n... and ${errors.length - 3} more errors (check console)` : '';
+                console.warn('Bulk upload errors:', errors);
                 alert(`Partial Upload:
-${result.message}
+Uploaded ${report.created} out of ${report.total} employees. Some records failed.${report.error ? `\n${report.error}` : ''}
 
 First 3 Errors:
 ${errorMsg}${moreErrors}`);
@@ -1406,7 +1430,7 @@ ${errorMsg}${moreErrors}`);
             } else {
                 closeModal();
                 await renderEmployeesPage('', 1);
-                alert(`Successfully uploaded ${result.count || employees.length} employees to Dataverse!`);
+                alert(`Successfully uploaded ${report.created || employees.length} employees to Dataverse!`);
             }
         } else {
             // Check if it's a duplicate error
@@ -1421,6 +1445,12 @@ Duplicate IDs:
 ${dupList}${moreDups}
 
 Please remove or update these employees before uploading.`);
+            } else if (result.invalid && result.invalid.length > 0) {
+                const rows = result.invalid.slice(0, 5).map(r => `Row ${r.row}: ${r.errors.join('; ')}`).join('\n');
+                const more = result.invalid.length > 5 ? `\n... and ${result.invalid.length - 5} more` : '';
+                alert(`${result.message}
+
+${rows}${more}`);
             } else {
                 alert(`${result.error || 'Failed to upload employees'}`);
             }
@@ -153,7 +153,7 @@ const handleStage3Upload = async () => {
         });
         const uploadJson = await uploadRes.json().catch(() => ({ success: false }));
         if (!uploadRes.ok || !uploadJson.success) throw new Error(uploadJson.message || `HTTP ${uploadRes.status}`);
-        showToast('Documents uploaded successfully!', 'success');
+        showToast(uploadJson.upload?.skipped ? 'Documents unchanged, nothing to upload' : 'Documents uploaded successfully!', 'success');
         setTimeout(() => showOnboardingForm(currentOnboardingRecord.id, 3), 700);
     } catch (err) {
         console.error('Upload failed', err);
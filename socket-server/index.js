@@ -306,10 +306,12 @@ app.post('/emit', (req, res) => {
 
     // -----------------------------------------
     // MODE 2: Meet bridge (existing behaviour)
-    // expects: { admin_id, title, meet_url, participants[] }
+    // expects: { admin_id, title, meet_url, participants[] }, optional call_id
+    // (the backend picks it up front so the caller can cancel the call)
     // -----------------------------------------
-    const { admin_id, title, meet_url, participants } = body;
+    const { call_id, admin_id, title, meet_url, participants } = body;
     console.log('[SOCKET-SERVER] /emit (meet) called with:', {
+      call_id,
       admin_id,
       title,
       meet_url,
@@ -321,7 +323,7 @@ app.post('/emit', (req, res) => {
         error: 'admin_id, meet_url, and participants[] are required'
       });
     }
-    const call = createCall({ admin_id, title, meet_url, participants });
+    const call = createCall({ call_id, admin_id, title, meet_url, participants });
     console.log('[SOCKET-SERVER] created call:', {
       call_id: call.call_id,
       admin_id: call.admin_id,